@@ -5,6 +5,8 @@ import os
 import secrets
 from typing import Optional
 
+from cryptography.fernet import Fernet, MultiFernet
+
 
 PASSWORD_HASH_SCHEME = os.getenv("AUTH_PASSWORD_SCHEME", "pbkdf2_sha256")
 PASSWORD_HASH_ITERATIONS = int(os.getenv("AUTH_PBKDF2_ITERATIONS", "260000"))
@@ -54,3 +56,21 @@ def verify_password(password: str, encoded: Optional[str]) -> bool:
         return hmac.compare_digest(candidate, expected)
     except Exception:  # noqa: BLE001
         return False
+
+
+def token_cipher() -> Optional[MultiFernet]:
+    """
+    Cipher for third-party tokens stored at rest (Meta page/user tokens).
+
+    Keys come from META_TOKEN_KEYS (comma-separated Fernet keys; the first encrypts and the
+    others only decrypt, for rotation) or are derived from AUTH_SECRET_KEY. Returns None when
+    neither is set; raises ValueError for malformed keys.
+    """
+    keys = [key.strip() for key in (os.getenv("META_TOKEN_KEYS") or "").split(",") if key.strip()]
+    if not keys:
+        secret = os.getenv("AUTH_SECRET_KEY")
+        if not secret:
+            return None
+        digest = hashlib.sha256(f"meta-tokens:{secret}".encode()).digest()
+        keys = [base64.urlsafe_b64encode(digest).decode()]
+    return MultiFernet([Fernet(key.encode()) for key in keys])
@@ -1,15 +1,43 @@
 import copy
 import hashlib
+import heapq
 import json
 import logging
+import math
 import os
+import select
+import socket
+import struct
 import threading
+import time
+import zlib
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 from decimal import Decimal
-from typing import Any, Callable, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
 
+from psycopg2 import sql as pg_sql
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
 from psycopg2.extras import Json
 
+from db import dedicated_connection, execute, has_config
+
+from meta import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_INTERACTIVE,
+    MetaAPIError,
+    MetricHistogram,
+    current_graph_priority,
+    graph_budget_remaining,
+    graph_deadline,
+    graph_memo_bypass,
+    graph_priority,
+    graph_usage_scope,
+    render_metric_counter,
+    render_metric_gauge,
+    render_metric_histogram,
+    track_graph_revalidation,
+)
 from postgres_client import get_postgres_client
 
 PostgresClient = Any
@@ -43,6 +71,579 @@ PLATFORM_TABLES: Dict[str, str] = {
 _refresh_lock = threading.Lock()
 _refreshing_keys: set[str] = set()
 
+# Payload pré-serializado (JSON compacto) com hash de conteúdo e, para objetos grandes, um gzip
+# pré-comprimido do corpo sem o "}" final: campos como "cache" são emendados sem re-encode.
+BODY_GZIP_ENABLED = os.getenv("META_CACHE_GZIP", "1") != "0"
+BODY_GZIP_MIN_BYTES = int(os.getenv("META_CACHE_GZIP_MIN_BYTES", "1024") or "1024")
+BODY_GZIP_LEVEL = int(os.getenv("META_CACHE_GZIP_LEVEL", "6") or "6")
+_GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+
+class CachedBody(NamedTuple):
+    body: bytes  # JSON compacto em UTF-8
+    etag: str  # hash do conteúdo
+    # Deflate cru do body sem o "}" final, encerrado com sync flush, com o CRC32 desse trecho
+    gzip_prefix: Optional[bytes]
+    gzip_crc: int
+
+
+def _serialize_body(payload: Any) -> CachedBody:
+    body = json.dumps(_sanitize_json(payload), separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    etag = hashlib.sha256(body).hexdigest()[:32]
+    if not BODY_GZIP_ENABLED or len(body) < BODY_GZIP_MIN_BYTES or body[:1] != b"{":
+        return CachedBody(body, etag, None, 0)
+    prefix = memoryview(body)[:-1]
+    compressor = zlib.compressobj(BODY_GZIP_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    deflated = compressor.compress(prefix) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return CachedBody(body, etag, deflated, zlib.crc32(prefix))
+
+
+def render_cached_body(cached: CachedBody, fields: Dict[str, Any], compress: bool = False) -> Tuple[bytes, bool]:
+    """
+    Monta o JSON do payload com `fields` acrescentados ao objeto (ex.: o bloco "cache"), sem
+    re-serializar o payload. Payloads que não são objeto vão embrulhados em {"payload": ...}.
+    Retorna (bytes, comprimido); com compress=True e gzip disponível o resultado é um stream
+    gzip válido que reaproveita o prefixo já comprimido.
+    """
+    body, gzip_prefix = cached.body, cached.gzip_prefix
+    if body[:1] != b"{":
+        body, gzip_prefix = b'{"payload":' + body + b"}", None
+    encoded = json.dumps(_sanitize_json(fields), separators=(",", ":"), ensure_ascii=False, default=str).encode("utf-8")
+    suffix = encoded[1:] if not fields else (b"," if len(body) > 2 else b"") + encoded[1:]
+    if not compress or gzip_prefix is None:
+        return body[:-1] + suffix, False
+    compressor = zlib.compressobj(BODY_GZIP_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS)
+    tail = compressor.compress(suffix) + compressor.flush(zlib.Z_FINISH)
+    crc = zlib.crc32(suffix, cached.gzip_crc)
+    size = (len(body) - 1 + len(suffix)) & 0xFFFFFFFF
+    return b"".join((_GZIP_HEADER, gzip_prefix, tail, struct.pack("<II", crc, size))), True
+
+
+# L1 em memória (por processo) na frente das tabelas de cache: LRU por tamanho, válido até o
+# next_refresh_at da entrada e invalidado via LISTEN/NOTIFY quando outro processo grava a chave.
+# Só é consultado enquanto o listener está conectado; sem ele cada leitura volta ao Postgres.
+L1_ENABLED = os.getenv("META_CACHE_L1_ENABLED", "1") != "0"
+L1_MAX_BYTES = int(os.getenv("META_CACHE_L1_MAX_BYTES", str(64 * 1024 * 1024)) or str(64 * 1024 * 1024))
+L1_MAX_SECONDS = int(os.getenv("META_CACHE_L1_MAX_SECONDS", "900") or "900")  # teto caso um NOTIFY se perca
+L1_NOTIFY_CHANNEL = os.getenv("META_CACHE_NOTIFY_CHANNEL", "meta_cache_invalidate")
+L1_LISTEN_POLL_SECONDS = 30
+L1_LISTEN_RECONNECT_SECONDS = 5
+_L1_HOST = socket.gethostname()
+
+
+class _L1Entry(NamedTuple):
+    record: Dict[str, Any]  # linha da tabela sem o payload
+    cached: CachedBody
+    expires_at: float  # epoch
+    size: int
+
+
+_l1_lock = threading.Lock()
+_l1: "OrderedDict[str, _L1Entry]" = OrderedDict()
+_l1_bytes = 0
+# Incrementada a cada invalidação: linhas lidas do banco antes dela não entram no L1
+_l1_generation = 0
+_l1_stats: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "oversized": 0}
+_listener_lock = threading.Lock()
+_listener_pid: Optional[int] = None
+_listener_connected = False
+
+
+def _l1_origin() -> str:
+    return f"{_L1_HOST}:{os.getpid()}"
+
+
+def _l1_key(table_name: str, cache_key: str) -> str:
+    return f"{table_name}|{cache_key}"
+
+
+def _l1_active() -> bool:
+    return L1_ENABLED and _listener_connected and _listener_pid == os.getpid()
+
+
+def _stale_threshold(record: Dict[str, Any]) -> Optional[datetime]:
+    fetched_at = _parse_dt(record.get("fetched_at"))
+    ttl_hours = int(record.get("ttl_hours") or DEFAULT_TTL_HOURS)
+    return fetched_at + timedelta(hours=ttl_hours) if fetched_at else None
+
+
+def _l1_drop(key: str) -> None:
+    global _l1_bytes
+    entry = _l1.pop(key, None)
+    if entry is not None:
+        _l1_bytes -= entry.size
+
+
+def _l1_get(table_name: str, cache_key: str) -> Optional[_L1Entry]:
+    if not _l1_active():
+        return None
+    key = _l1_key(table_name, cache_key)
+    with _l1_lock:
+        entry = _l1.get(key)
+        if entry is not None and entry.expires_at <= time.time():
+            _l1_drop(key)
+            entry = None
+        if entry is None:
+            _l1_stats["misses"] += 1
+            return None
+        _l1.move_to_end(key)
+        _l1_stats["hits"] += 1
+        return entry
+
+
+def _l1_peek(table_name: str, cache_key: str) -> Optional[_L1Entry]:
+    """Consulta o L1 sem contar acerto/erro nem mexer na ordem do LRU."""
+    with _l1_lock:
+        entry = _l1.get(_l1_key(table_name, cache_key))
+    return entry if entry is not None and entry.expires_at > time.time() else None
+
+
+def _l1_put(table_name: str, record: Dict[str, Any], generation: int) -> None:
+    """Guarda a linha até o vencimento (next_refresh_at); entradas já vencidas não entram."""
+    global _l1_bytes
+    if not _l1_active():
+        return
+    deadlines = [
+        moment.timestamp()
+        for moment in (_stale_threshold(record), _parse_dt(record.get("next_refresh_at")))
+        if moment is not None
+    ]
+    now = time.time()
+    expires_at = min(deadlines + [now + L1_MAX_SECONDS])
+    if not deadlines or expires_at <= now:
+        return
+    try:
+        cached = _serialize_body(record.get("payload"))
+    except (TypeError, ValueError):
+        return
+    size = len(cached.body) + len(cached.gzip_prefix or b"")
+    key = _l1_key(table_name, record.get("cache_key") or "")
+    entry = _L1Entry({name: value for name, value in record.items() if name != "payload"}, cached, expires_at, size)
+    with _l1_lock:
+        if generation != _l1_generation:
+            return
+        if size > L1_MAX_BYTES // 4:
+            _l1_stats["oversized"] += 1
+            return
+        _l1_drop(key)
+        _l1[key] = entry
+        _l1_bytes += size
+        while _l1_bytes > L1_MAX_BYTES and _l1:
+            _l1_drop(next(iter(_l1)))
+            _l1_stats["evictions"] += 1
+
+
+def _l1_invalidate(table_name: Optional[str] = None, cache_key: Optional[str] = None) -> None:
+    """Remove a chave do L1 (ou tudo, sem chave) e invalida leituras do banco já em andamento."""
+    global _l1_generation, _l1_bytes
+    with _l1_lock:
+        _l1_generation += 1
+        if table_name is None or cache_key is None:
+            _l1.clear()
+            _l1_bytes = 0
+            return
+        _l1_drop(_l1_key(table_name, cache_key))
+        _l1_stats["invalidations"] += 1
+
+
+def _notify_cache_write(table_name: str, cache_key: str) -> None:
+    if not L1_ENABLED:
+        return
+    try:
+        execute(
+            "SELECT pg_notify(%(channel)s, %(payload)s)",
+            {"channel": L1_NOTIFY_CHANNEL, "payload": f"{_l1_origin()}|{table_name}|{cache_key}"},
+        )
+    except Exception as err:  # noqa: BLE001
+        logger.warning("Falha ao notificar escrita do cache %s: %s", cache_key, err)
+
+
+def _handle_cache_notify(payload: str) -> None:
+    origin, _, rest = payload.partition("|")
+    table_name, _, cache_key = rest.partition("|")
+    if cache_key:
+        # Quem espera o refresh desta chave (inclusive threads deste processo) relê a linha
+        _wake_refresh_watchers(table_name, cache_key)
+    if origin == _l1_origin() or not cache_key:
+        # Escritas deste processo já atualizaram o L1 diretamente
+        return
+    _l1_invalidate(table_name, cache_key)
+
+
+def _listen_cache_writes(pid: int) -> None:
+    global _listener_connected
+    while _listener_pid == pid:
+        conn = None
+        try:
+            conn = dedicated_connection()
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(pg_sql.SQL("LISTEN {}").format(pg_sql.Identifier(L1_NOTIFY_CHANNEL)))
+            # Leituras feitas antes do LISTEN podem ter perdido notificações
+            _l1_invalidate()
+            _listener_connected = True
+            while _listener_pid == pid:
+                if not select.select([conn], [], [], L1_LISTEN_POLL_SECONDS)[0]:
+                    # Sem notificações: confirma que a conexão segue viva
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT 1")
+                conn.poll()
+                while conn.notifies:
+                    _handle_cache_notify(conn.notifies.pop(0).payload)
+        except Exception as err:  # noqa: BLE001
+            logger.warning("Listener do cache L1 desconectado (%s); L1 desligado até reconectar.", err)
+        finally:
+            # Notificações podem ter se perdido: o L1 recomeça vazio na reconexão
+            _listener_connected = False
+            _l1_invalidate()
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:  # noqa: BLE001
+                    pass
+        time.sleep(L1_LISTEN_RECONNECT_SECONDS)
+
+
+def _ensure_cache_listener() -> None:
+    """Sobe (uma vez por processo, inclusive após fork) a thread que escuta as escritas dos demais."""
+    global _listener_pid, _listener_connected
+    pid = os.getpid()
+    if not L1_ENABLED or _listener_pid == pid or not has_config():
+        return
+    with _listener_lock:
+        if _listener_pid == pid:
+            return
+        _listener_pid = pid
+        _listener_connected = False
+        _l1_invalidate()
+        threading.Thread(target=_listen_cache_writes, args=(pid,), name="cache-l1-listener", daemon=True).start()
+
+
+def get_cache_l1_stats() -> Dict[str, Any]:
+    with _l1_lock:
+        stats: Dict[str, Any] = dict(_l1_stats)
+        stats["entries"] = len(_l1)
+        stats["bytes"] = _l1_bytes
+    stats["max_bytes"] = L1_MAX_BYTES
+    stats["enabled"] = L1_ENABLED
+    stats["listening"] = _l1_active()
+    return stats
+
+# Coordenação dos refreshes de uma mesma chave entre processos: pg_try_advisory_lock numa conexão
+# dedicada (liberado ao fechá-la, inclusive se o processo morrer). Quem não pega o lock serve o
+# stale (refresh em segundo plano) ou espera a gravação do vencedor (miss e refresh forçado).
+REFRESH_LOCK_ENABLED = os.getenv("META_CACHE_REFRESH_LOCK", "1") != "0"
+REFRESH_WAIT_SECONDS = float(os.getenv("META_CACHE_REFRESH_WAIT_SECONDS", "30") or "30")
+REFRESH_POLL_SECONDS = float(os.getenv("META_CACHE_REFRESH_POLL_SECONDS", "1") or "1")
+
+_refresh_watch_lock = threading.Lock()
+_refresh_watchers: Dict[str, List[threading.Event]] = {}
+_refresh_stats: Dict[str, float] = {
+    "won": 0,
+    "lost": 0,
+    "coalesced": 0,
+    "wait_seconds": 0.0,
+    "skipped": 0,
+    "uncoordinated": 0,
+}
+
+
+def _refresh_lock_id(table_name: str, cache_key: str) -> int:
+    digest = hashlib.sha256(f"{CACHE_NAMESPACE}|{table_name}|{cache_key}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big", signed=True)
+
+
+def _claim_refresh(table_name: str, cache_key: str) -> Tuple[bool, Any]:
+    """
+    Tenta o lock de refresh da chave. Retorna (True, conexão que o segura), (False, None) se outro
+    processo já o tem, ou (True, None) quando não há como coordenar (segue sem lock).
+    """
+    if not REFRESH_LOCK_ENABLED or not has_config():
+        return True, None
+    conn = None
+    try:
+        conn = dedicated_connection()
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (_refresh_lock_id(table_name, cache_key),))
+            acquired = bool(cur.fetchone()[0])
+    except Exception as err:  # noqa: BLE001
+        logger.warning("Lock de refresh indisponível para %s (%s); seguindo sem coordenação.", cache_key, err)
+        _release_refresh(conn)
+        with _refresh_watch_lock:
+            _refresh_stats["uncoordinated"] += 1
+        return True, None
+    with _refresh_watch_lock:
+        _refresh_stats["won" if acquired else "lost"] += 1
+    if not acquired:
+        _release_refresh(conn)
+        return False, None
+    return True, conn
+
+
+def _release_refresh(conn: Any) -> None:
+    if conn is None:
+        return
+    try:
+        conn.close()
+    except Exception:  # noqa: BLE001
+        pass
+
+
+def _wake_refresh_watchers(table_name: str, cache_key: str) -> None:
+    with _refresh_watch_lock:
+        for event in _refresh_watchers.get(_l1_key(table_name, cache_key), ()):
+            event.set()
+
+
+def _is_newer(row: Optional[Dict[str, Any]], stored: Optional[Dict[str, Any]]) -> bool:
+    if row is None:
+        return False
+    if stored is None:
+        return True
+    fetched_at, previous = _parse_dt(row.get("fetched_at")), _parse_dt(stored.get("fetched_at"))
+    return bool(fetched_at and (previous is None or fetched_at > previous))
+
+
+def _coordinated_refresh(
+    db_client: PostgresClient,
+    table_name: str,
+    cache_key: str,
+    stored: Optional[Dict[str, Any]],
+    refresh: Callable[[Optional[Dict[str, Any]]], Tuple[Any, Dict[str, Any]]],
+) -> Tuple[Any, Dict[str, Any]]:
+    """
+    Executa `refresh(linha_atual)` segurando o lock da chave. Se outro processo o detém, espera a
+    gravação dele (acordado pelo NOTIFY do L1 ou por consulta periódica) e devolve a linha nova;
+    se o lock vagar sem gravação (o vencedor falhou), assume o refresh.
+    """
+    won, conn = _claim_refresh(table_name, cache_key)
+    if not won:
+        key = _l1_key(table_name, cache_key)
+        event = threading.Event()
+        with _refresh_watch_lock:
+            _refresh_watchers.setdefault(key, []).append(event)
+        started = time.monotonic()
+        try:
+            while not won:
+                remaining = REFRESH_WAIT_SECONDS - (time.monotonic() - started)
+                budget = graph_budget_remaining()
+                if budget is not None:
+                    remaining = min(remaining, budget)
+                if remaining <= 0:
+                    raise MetaAPIError(
+                        status=504,
+                        message=f"Prazo esgotado aguardando o refresh de {cache_key} em outro processo",
+                        error_type="deadline_exceeded",
+                    )
+                event.wait(min(REFRESH_POLL_SECONDS, remaining))
+                event.clear()
+                generation = _l1_generation
+                row = _select_entry(db_client, table_name, cache_key)
+                if _is_newer(row, stored):
+                    with _refresh_watch_lock:
+                        _refresh_stats["coalesced"] += 1
+                    _l1_put(table_name, row, generation)
+                    return row.get("payload"), _build_metadata(row, stale=False, source="coalesced")
+                won, conn = _claim_refresh(table_name, cache_key)
+        finally:
+            with _refresh_watch_lock:
+                _refresh_stats["wait_seconds"] += time.monotonic() - started
+                watchers = _refresh_watchers.get(key, [])
+                if event in watchers:
+                    watchers.remove(event)
+                if not watchers:
+                    _refresh_watchers.pop(key, None)
+    try:
+        if conn is not None:
+            # A chave pode ter sido gravada entre a leitura e o lock
+            current = _select_entry(db_client, table_name, cache_key)
+            if _is_newer(current, stored):
+                with _refresh_watch_lock:
+                    _refresh_stats["coalesced"] += 1
+                _l1_put(table_name, current, _l1_generation)
+                return current.get("payload"), _build_metadata(current, stale=False, source="coalesced")
+        return refresh(stored)
+    finally:
+        _release_refresh(conn)
+
+
+def get_cache_refresh_stats() -> Dict[str, Any]:
+    with _refresh_watch_lock:
+        stats: Dict[str, Any] = dict(_refresh_stats)
+        stats["waiting"] = sum(len(events) for events in _refresh_watchers.values())
+    stats["wait_seconds"] = round(stats["wait_seconds"], 3)
+    stats["enabled"] = REFRESH_LOCK_ENABLED
+    return stats
+
+# Executor dos refreshes em segundo plano: poucas threads fixas consumindo uma fila de prioridade
+# limitada (origem interativa > scheduler, chaves mais acessadas e mais vencidas primeiro). Com a
+# fila cheia, a tarefa menos prioritária é descartada e a chave segue servida stale.
+REFRESH_WORKERS = int(os.getenv("META_CACHE_REFRESH_WORKERS", "3") or "3")
+REFRESH_QUEUE_MAX = int(os.getenv("META_CACHE_REFRESH_QUEUE_MAX", "256") or "256")
+REFRESH_INTERACTIVE_WEIGHT = 100.0
+REFRESH_STALENESS_CAP_HOURS = 48.0
+POPULARITY_HALF_LIFE = float(os.getenv("META_CACHE_POPULARITY_HALF_LIFE", "600") or "600")  # segundos
+POPULARITY_MAX_KEYS = 4096
+REFRESH_LATENCY_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)  # segundos
+
+_popularity_lock = threading.Lock()
+_popularity: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()  # chave -> (acessos com decaimento, monotônico)
+
+_refresh_cond = threading.Condition()
+_refresh_queue: List[tuple] = []  # heap de (-prioridade, seq, chave, origem, enfileirado_em, tarefa)
+_refresh_seq = 0
+_refresh_running = 0
+_refresh_workers_pid: Optional[int] = None
+_refresh_outcomes: Dict[tuple, int] = {}  # (resultado,)
+_refresh_durations: Dict[tuple, MetricHistogram] = {}  # (origem,)
+_refresh_waits: Dict[tuple, MetricHistogram] = {}  # (origem,)
+
+
+def _note_key_access(cache_key: str) -> float:
+    """Conta um acesso à chave (meia-vida POPULARITY_HALF_LIFE) e devolve a popularidade atual."""
+    now = time.monotonic()
+    with _popularity_lock:
+        score, seen_at = _popularity.pop(cache_key, (0.0, now))
+        score = score * 0.5 ** ((now - seen_at) / POPULARITY_HALF_LIFE) + 1.0
+        _popularity[cache_key] = (score, now)
+        while len(_popularity) > POPULARITY_MAX_KEYS:
+            _popularity.popitem(last=False)
+    return score
+
+
+def _key_popularity(cache_key: str) -> float:
+    with _popularity_lock:
+        score, seen_at = _popularity.get(cache_key, (0.0, time.monotonic()))
+    return score * 0.5 ** ((time.monotonic() - seen_at) / POPULARITY_HALF_LIFE)
+
+
+def _refresh_priority(cache_key: str, origin: str, stale_since: Optional[datetime]) -> float:
+    priority = REFRESH_INTERACTIVE_WEIGHT if origin == PRIORITY_INTERACTIVE else 0.0
+    priority += 10.0 * math.log2(1.0 + _key_popularity(cache_key))
+    if stale_since is not None:
+        hours = (datetime.now(timezone.utc) - stale_since).total_seconds() / 3600
+        priority += min(max(hours, 0.0), REFRESH_STALENESS_CAP_HOURS)
+    return priority
+
+
+def _count_refresh_outcome(outcome: str) -> None:
+    _refresh_outcomes[(outcome,)] = _refresh_outcomes.get((outcome,), 0) + 1
+
+
+def _ensure_refresh_workers() -> None:
+    """Sobe as threads do executor (uma vez por processo, inclusive após fork); chamar com _refresh_cond."""
+    global _refresh_workers_pid, _refresh_running
+    pid = os.getpid()
+    if _refresh_workers_pid == pid:
+        return
+    if _refresh_workers_pid is not None:
+        # Processo filho: a fila herdada não tem threads para consumi-la
+        for entry in _refresh_queue:
+            with _refresh_lock:
+                _refreshing_keys.discard(entry[2])
+        _refresh_queue.clear()
+        _refresh_running = 0
+    _refresh_workers_pid = pid
+    for index in range(max(1, REFRESH_WORKERS)):
+        threading.Thread(
+            target=_refresh_worker, args=(pid,), name=f"cache-refresh-{index}", daemon=True,
+        ).start()
+
+
+def _submit_refresh(cache_key: str, origin: str, priority: float, task: Callable[[], str]) -> bool:
+    """Enfileira a tarefa; com a fila cheia desloca a de menor prioridade ou recusa esta (False)."""
+    global _refresh_seq
+    with _refresh_cond:
+        _ensure_refresh_workers()
+        if len(_refresh_queue) >= REFRESH_QUEUE_MAX:
+            weakest = max(_refresh_queue)
+            if -weakest[0] >= priority:
+                _count_refresh_outcome("dropped")
+                return False
+            _refresh_queue.remove(weakest)
+            heapq.heapify(_refresh_queue)
+            with _refresh_lock:
+                _refreshing_keys.discard(weakest[2])
+            _count_refresh_outcome("evicted")
+        _refresh_seq += 1
+        heapq.heappush(_refresh_queue, (-priority, _refresh_seq, cache_key, origin, time.monotonic(), task))
+        _count_refresh_outcome("enqueued")
+        _refresh_cond.notify()
+    return True
+
+
+def _refresh_worker(pid: int) -> None:
+    global _refresh_running
+    while _refresh_workers_pid == pid:
+        with _refresh_cond:
+            while not _refresh_queue:
+                _refresh_cond.wait()
+            _, _, cache_key, origin, enqueued_at, task = heapq.heappop(_refresh_queue)
+            _refresh_running += 1
+        started = time.monotonic()
+        outcome = "failed"
+        try:
+            outcome = task()
+        except Exception as err:  # noqa: BLE001
+            logger.exception("Falha inesperada no refresh de %s: %s", cache_key, err)
+        finally:
+            elapsed = time.monotonic() - started
+            with _refresh_cond:
+                _refresh_running -= 1
+                _count_refresh_outcome(outcome)
+                for series, value in ((_refresh_waits, started - enqueued_at), (_refresh_durations, elapsed)):
+                    histogram = series.get((origin,))
+                    if histogram is None:
+                        histogram = series[(origin,)] = MetricHistogram(REFRESH_LATENCY_BUCKETS)
+                    histogram.observe(value)
+
+
+def _histogram_mean(histograms: Dict[tuple, MetricHistogram]) -> Optional[float]:
+    count = sum(histogram.count for histogram in histograms.values())
+    return round(sum(histogram.total for histogram in histograms.values()) / count, 3) if count else None
+
+
+def get_cache_refresh_queue_stats() -> Dict[str, Any]:
+    with _refresh_cond:
+        return {
+            "workers": max(1, REFRESH_WORKERS) if _refresh_workers_pid == os.getpid() else 0,
+            "running": _refresh_running,
+            "depth": len(_refresh_queue),
+            "max_depth": REFRESH_QUEUE_MAX,
+            "outcomes": {outcome: count for (outcome,), count in _refresh_outcomes.items()},
+            "avg_wait_seconds": _histogram_mean(_refresh_waits),
+            "avg_refresh_seconds": _histogram_mean(_refresh_durations),
+        }
+
+
+def render_cache_metrics() -> str:
+    """Fila de refresh do cache no formato texto do Prometheus (0.0.4)."""
+    with _refresh_cond:
+        depth, running = len(_refresh_queue), _refresh_running
+        outcomes = dict(_refresh_outcomes)
+        waits = {key: value.snapshot() for key, value in _refresh_waits.items()}
+        durations = {key: value.snapshot() for key, value in _refresh_durations.items()}
+    with _l1_lock:
+        l1_entries, l1_bytes = len(_l1), _l1_bytes
+        l1_hits, l1_misses = _l1_stats["hits"], _l1_stats["misses"]
+    lines: List[str] = []
+    render_metric_gauge(lines, "cache_refresh_queue_depth", "Background cache refreshes waiting for a worker.",
+                        (), {(): depth})
+    render_metric_gauge(lines, "cache_refresh_running", "Background cache refreshes in progress.", (), {(): running})
+    render_metric_counter(lines, "cache_refresh_tasks_total",
+                          "Background cache refresh tasks by outcome (enqueued, refreshed, skipped, failed, dropped, evicted).",
+                          ("outcome",), outcomes)
+    render_metric_histogram(lines, "cache_refresh_queue_wait_seconds",
+                            "Time background cache refreshes waited in the queue, by origin lane.", ("origin",), waits)
+    render_metric_histogram(lines, "cache_refresh_duration_seconds",
+                            "Duration of background cache refreshes, by origin lane.", ("origin",), durations)
+    render_metric_gauge(lines, "cache_l1_entries", "Entries in the in-memory cache tier.", (), {(): l1_entries})
+    render_metric_gauge(lines, "cache_l1_bytes", "Payload bytes held by the in-memory cache tier.", (), {(): l1_bytes})
+    render_metric_counter(lines, "cache_l1_lookups_total", "In-memory cache tier lookups by result.", ("result",),
+                          {("hit",): l1_hits, ("miss",): l1_misses})
+    return "\n".join(lines) + "\n"
+
 
 def get_table_name(platform: Optional[str] = "instagram") -> str:
     """
@@ -193,6 +794,26 @@ def _persist_entry(client: PostgresClient, table_name: str, record: Dict[str, An
         raise
 
 
+def _touch_entry(client: PostgresClient, table_name: str, cache_key: str, record: Dict[str, Any]) -> None:
+    fields = {
+        name: record.get(name)
+        for name in (
+            "fetched_at",
+            "next_refresh_at",
+            "ttl_hours",
+            "last_refresh_reason",
+            "last_refresh_status",
+            "last_refresh_error",
+            "updated_at",
+        )
+    }
+    try:
+        client.table(table_name).update(fields).eq("cache_key", cache_key).execute()
+    except Exception as err:  # noqa: BLE001
+        logger.error("Falha ao renovar cache no Postgres: %s", err)
+        raise
+
+
 def get_latest_cached_payload(
     resource: str,
     owner_id: Optional[str],
@@ -260,6 +881,29 @@ def _build_metadata(record: Dict[str, Any], stale: bool, source: str) -> Dict[st
     }
 
 
+def _ensure_within_deadline(deadline: Any, resource: str, owner_id: str) -> None:
+    """
+    Fetchers engolem falhas de métricas opcionais; se alguma leitura desistiu por falta de
+    prazo, o payload pode estar incompleto e não deve ser gravado nem servido como novo.
+    """
+    if deadline.exceeded:
+        raise MetaAPIError(
+            status=504,
+            message=f"Prazo esgotado ao atualizar {resource}/{owner_id}",
+            error_type="deadline_exceeded",
+        )
+
+
+def _ensure_within_budget(usage: Any, resource: str, owner_id: str) -> None:
+    """Idem para chamadas barradas pelo orçamento diário da conta no meio da busca."""
+    if usage.budget_exceeded:
+        raise MetaAPIError(
+            status=429,
+            message=f"Orçamento diário esgotado ao atualizar {resource}/{owner_id}",
+            error_type="account_budget_exceeded",
+        )
+
+
 def _refresh_cache_entry(
     db_client: PostgresClient,
     table_name: str,
@@ -275,7 +919,11 @@ def _refresh_cache_entry(
     refresh_reason: Optional[str],
     stored: Optional[Dict[str, Any]],
 ) -> Tuple[Any, Dict[str, Any]]:
-    payload = fetcher(owner_id, since_ts_requested, until_ts_requested, extra)
+    with track_graph_revalidation() as revalidation, graph_deadline() as deadline:
+        with graph_usage_scope(owner_id, resource) as usage:
+            payload = fetcher(owner_id, since_ts_requested, until_ts_requested, extra)
+    _ensure_within_deadline(deadline, resource, owner_id)
+    _ensure_within_budget(usage, resource, owner_id)
     now = datetime.now(timezone.utc)
     fetched_at_iso = now.isoformat()
     expires_at_iso = (now + timedelta(hours=DEFAULT_TTL_HOURS)).isoformat()
@@ -300,8 +948,17 @@ def _refresh_cache_entry(
         "updated_at": fetched_at_iso,
     }
 
-    _persist_entry(db_client, table_name, record)
-    metadata = _build_metadata(record, stale=False, source="refresh" if stored else "prime")
+    generation = _l1_generation
+    if stored is not None and revalidation.unchanged:
+        # Todas as leituras Graph voltaram 304: payload igual ao salvo, só renova os timestamps
+        _touch_entry(db_client, table_name, cache_key, record)
+        source = "revalidated"
+    else:
+        _persist_entry(db_client, table_name, record)
+        source = "refresh" if stored else "prime"
+    _l1_put(table_name, record, generation)
+    _notify_cache_write(table_name, cache_key)
+    metadata = _build_metadata(record, stale=False, source=source)
     return payload, metadata
 
 
@@ -317,28 +974,44 @@ def _schedule_background_refresh(
     cache_until_ts: Optional[int],
     extra: Optional[Dict[str, Any]],
     fetcher: Callable[[str, Optional[int], Optional[int], Optional[Dict[str, Any]]], Any],
+    stale_since: Optional[datetime] = None,
 ) -> None:
-    def run() -> None:
+    def run() -> str:
+        conn = None
         try:
-            _refresh_cache_entry(
-                db_client,
-                table_name,
-                cache_key,
-                resource,
-                owner_id,
-                since_ts_requested,
-                until_ts_requested,
-                cache_since_ts,
-                cache_until_ts,
-                extra,
-                fetcher,
-                refresh_reason="auto-stale",
-                stored=_select_entry(db_client, table_name, cache_key),
-            )
+            won, conn = _claim_refresh(table_name, cache_key)
+            stored = _select_entry(db_client, table_name, cache_key) if won else None
+            threshold = _stale_threshold(stored) if stored else None
+            if not won or (threshold and threshold > datetime.now(timezone.utc)):
+                # Outro processo está atualizando (ou acabou de atualizar) a chave
+                with _refresh_watch_lock:
+                    _refresh_stats["skipped"] += 1
+                logger.debug("Cache %s já atualizado por outro processo; refresh ignorado.", cache_key)
+                return "skipped"
+            # O usuário já recebeu a versão antiga: o refresh não disputa a Graph com as rotas
+            with graph_priority(PRIORITY_BACKGROUND):
+                _refresh_cache_entry(
+                    db_client,
+                    table_name,
+                    cache_key,
+                    resource,
+                    owner_id,
+                    since_ts_requested,
+                    until_ts_requested,
+                    cache_since_ts,
+                    cache_until_ts,
+                    extra,
+                    fetcher,
+                    refresh_reason="auto-stale",
+                    stored=stored,
+                )
             logger.info("Cache %s atualizado em segundo plano.", cache_key)
+            return "refreshed"
         except Exception as err:  # noqa: BLE001
             logger.exception("Falha ao atualizar cache %s em segundo plano: %s", cache_key, err)
+            return "failed"
         finally:
+            _release_refresh(conn)
             with _refresh_lock:
                 _refreshing_keys.discard(cache_key)
 
@@ -346,26 +1019,26 @@ def _schedule_background_refresh(
         if cache_key in _refreshing_keys:
             return
         _refreshing_keys.add(cache_key)
-    threading.Thread(target=run, daemon=True).start()
+    origin = current_graph_priority()
+    if not _submit_refresh(cache_key, origin, _refresh_priority(cache_key, origin, stale_since), run):
+        logger.debug("Fila de refresh cheia; %s segue stale.", cache_key)
+        with _refresh_lock:
+            _refreshing_keys.discard(cache_key)
 
 
-def get_cached_payload(
+def _lookup_cache(
     resource: str,
     owner_id: str,
-    since_ts: Optional[int] = None,
-    until_ts: Optional[int] = None,
-    extra: Optional[Dict[str, Any]] = None,
-    fetcher: Optional[
-        Callable[[str, Optional[int], Optional[int], Optional[Dict[str, Any]]], Any]
-    ] = None,
-    *,
-    force: bool = False,
-    refresh_reason: Optional[str] = None,
-    platform: str = "instagram",
-) -> Tuple[Any, Dict[str, Any]]:
-    """
-    Recupera dados do cache armazenado no Postgres, buscando na Graph API se necessário.
-    """
+    since_ts: Optional[int],
+    until_ts: Optional[int],
+    extra: Optional[Dict[str, Any]],
+    fetcher: Optional[Callable[[str, Optional[int], Optional[int], Optional[Dict[str, Any]]], Any]],
+    force: bool,
+    refresh_reason: Optional[str],
+    platform: str,
+    budget: Optional[float],
+) -> Tuple[Any, Optional[_L1Entry], Dict[str, Any]]:
+    """Retorna (payload, None, metadata), ou (None, entrada do L1, metadata) quando a chave está no L1."""
     db_client = _get_postgres_client()
     fetcher = fetcher or FETCHERS.get(resource)
 
@@ -374,7 +1047,9 @@ def get_cached_payload(
 
     # Caso o banco não esteja configurado, sempre buscar e retornar
     if db_client is None:
-        payload = fetcher(owner_id, since_ts, until_ts, extra)
+        with graph_memo_bypass(force), graph_deadline(budget) as deadline:
+            payload = fetcher(owner_id, since_ts, until_ts, extra)
+        _ensure_within_deadline(deadline, resource, owner_id)
         now = datetime.now(timezone.utc).isoformat()
         meta = {
             "cache_key": None,
@@ -388,7 +1063,7 @@ def get_cached_payload(
             "last_refresh_error": None,
             "platform": platform,
         }
-        return _clone_payload(payload), meta
+        return _clone_payload(payload), None, meta
 
     requested_since_ts = _normalize_ts(since_ts)
     requested_until_ts = _normalize_ts(until_ts)
@@ -398,13 +1073,21 @@ def get_cached_payload(
 
     table_name = get_table_name(platform)
     cache_key = _compute_cache_key(resource, owner_id, cache_since_ts, cache_until_ts, extra)
+    _ensure_cache_listener()
+    if not force:
+        _note_key_access(cache_key)
+        cached = _l1_get(table_name, cache_key)
+        if cached is not None:
+            metadata = _build_metadata(cached.record, stale=False, source="cache")
+            metadata["platform"] = platform
+            return None, cached, metadata
+
+    generation = _l1_generation
     stored = _select_entry(db_client, table_name, cache_key)
     now = datetime.now(timezone.utc)
 
     if stored and not force:
-        fetched_at = _parse_dt(stored.get("fetched_at"))
-        ttl_hours = int(stored.get("ttl_hours") or DEFAULT_TTL_HOURS)
-        stale_threshold = fetched_at + timedelta(hours=ttl_hours) if fetched_at else None
+        stale_threshold = _stale_threshold(stored)
         is_stale = bool(stale_threshold and stale_threshold <= now)
 
         if is_stale:
@@ -420,30 +1103,104 @@ def get_cached_payload(
                 cache_until_ts,
                 extra,
                 fetcher,
+                stale_since=stale_threshold,
             )
+        else:
+            _l1_put(table_name, stored, generation)
 
         source = "stale" if is_stale else "cache"
         metadata = _build_metadata(stored, stale=is_stale, source=source)
         metadata["platform"] = platform
-        return _clone_payload(stored.get("payload")), metadata
+        # A linha acabou de ser decodificada do banco e não é compartilhada: dispensa a cópia
+        return stored.get("payload"), None, metadata
+
+    # Refresh forçado não pode reaproveitar respostas Graph memorizadas
+    with graph_memo_bypass(force), graph_deadline(budget):
+        # Um processo por chave busca na Graph; os demais esperam a gravação dele
+        payload, metadata = _coordinated_refresh(
+            db_client,
+            table_name,
+            cache_key,
+            stored,
+            lambda current: _refresh_cache_entry(
+                db_client,
+                table_name,
+                cache_key,
+                resource,
+                owner_id,
+                requested_since_ts,
+                requested_until_ts,
+                cache_since_ts,
+                cache_until_ts,
+                extra,
+                fetcher,
+                refresh_reason,
+                current,
+            ),
+        )
+    metadata["platform"] = platform
+    return _clone_payload(payload), None, metadata
 
-    payload, metadata = _refresh_cache_entry(
-        db_client,
-        table_name,
-        cache_key,
-        resource,
-        owner_id,
-        requested_since_ts,
-        requested_until_ts,
-        cache_since_ts,
-        cache_until_ts,
-        extra,
-        fetcher,
-        refresh_reason,
-        stored,
+
+def get_cached_payload(
+    resource: str,
+    owner_id: str,
+    since_ts: Optional[int] = None,
+    until_ts: Optional[int] = None,
+    extra: Optional[Dict[str, Any]] = None,
+    fetcher: Optional[
+        Callable[[str, Optional[int], Optional[int], Optional[Dict[str, Any]]], Any]
+    ] = None,
+    *,
+    force: bool = False,
+    refresh_reason: Optional[str] = None,
+    platform: str = "instagram",
+    budget: Optional[float] = None,
+) -> Tuple[Any, Dict[str, Any]]:
+    """
+    Recupera dados do cache armazenado no Postgres, buscando na Graph API se necessário.
+
+    `budget` limita (em segundos) a busca na Graph, sem ultrapassar o prazo já ativo da
+    requisição/job; se esgotar, levanta MetaAPIError `deadline_exceeded` sem gravar nada.
+    """
+    payload, cached, metadata = _lookup_cache(
+        resource, owner_id, since_ts, until_ts, extra, fetcher, force, refresh_reason, platform, budget,
     )
-    metadata["platform"] = platform
-    return _clone_payload(payload), metadata
+    if cached is not None:
+        return json.loads(cached.cached.body), metadata
+    return payload, metadata
+
+
+def get_cached_body(
+    resource: str,
+    owner_id: str,
+    since_ts: Optional[int] = None,
+    until_ts: Optional[int] = None,
+    extra: Optional[Dict[str, Any]] = None,
+    fetcher: Optional[
+        Callable[[str, Optional[int], Optional[int], Optional[Dict[str, Any]]], Any]
+    ] = None,
+    *,
+    force: bool = False,
+    refresh_reason: Optional[str] = None,
+    platform: str = "instagram",
+    budget: Optional[float] = None,
+) -> Tuple[CachedBody, Dict[str, Any]]:
+    """
+    Igual ao get_cached_payload, mas devolve o payload já serializado (ver render_cached_body).
+    Acertos no L1 reaproveitam os bytes e o gzip guardados, sem decodificar o JSON.
+    """
+    payload, cached, metadata = _lookup_cache(
+        resource, owner_id, since_ts, until_ts, extra, fetcher, force, refresh_reason, platform, budget,
+    )
+    if cached is None and metadata.get("cache_key"):
+        # Leitura do banco ou refresh que acabou de popular o L1: reaproveita a serialização
+        cached = _l1_peek(get_table_name(platform), metadata["cache_key"])
+        if cached is not None and _format_timestamp(cached.record.get("fetched_at")) != metadata.get("fetched_at"):
+            cached = None
+    if cached is not None:
+        return cached.cached, metadata
+    return _serialize_body(payload), metadata
 
 
 def mark_cache_error(
@@ -480,6 +1237,22 @@ def mark_cache_error(
         ).eq("cache_key", cache_key).execute()
     except Exception as err:  # noqa: BLE001
         logger.error("Falha ao marcar erro de cache: %s", err)
+        return
+    _l1_invalidate(table_name, cache_key)
+    _notify_cache_write(table_name, cache_key)
+
+
+def postpone_cache_refresh(cache_key: str, next_refresh_at: datetime, platform: str = "instagram") -> None:
+    """Adia o próximo refresh agendado da entrada (ex.: conta sem orçamento até o dia seguinte)."""
+    db_client = _get_postgres_client()
+    if db_client is None or not cache_key:
+        return
+    try:
+        db_client.table(get_table_name(platform)).update(
+            {"next_refresh_at": next_refresh_at.isoformat()}
+        ).eq("cache_key", cache_key).execute()
+    except Exception as err:  # noqa: BLE001
+        logger.error("Falha ao adiar refresh do cache %s: %s", cache_key, err)
 
 
 def list_due_entries(limit: int = 10, platform: Optional[str] = None) -> List[Dict[str, Any]]:
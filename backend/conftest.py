@@ -0,0 +1,191 @@
+"""
+Fixtures compartilhadas dos testes do backend: uma Graph API falsa (servidor HTTP local) e a
+limpeza do estado em memória do meta.py entre um teste e outro.
+"""
+
+import json
+import os
+import threading
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+os.environ.setdefault("META_SYSTEM_USER_TOKEN", "test-token")
+os.environ.setdefault("META_HTTP_WARMUP", "0")
+os.environ.setdefault("META_SYNC_AUTOSTART", "0")
+
+import meta  # noqa: E402
+
+
+class FakeGraph:
+    """
+    Graph falsa: `handler(method, path, query, body)` devolve (status, json, headers). As chamadas
+    recebidas ficam em `calls` como (method, path, query); itens de batch entram como ("BATCH", ...).
+    """
+
+    def __init__(self):
+        self.handler = lambda method, path, query, body: (200, {"data": []}, {})
+        self.calls = []
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._request_handler())
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.base = f"http://127.0.0.1:{self._server.server_address[1]}/v23.0"
+
+    def _request_handler(self):
+        graph = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, method, body=None):
+                parts = urlsplit(self.path)
+                path = parts.path.split("/v23.0", 1)[-1] or "/"
+                query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+                form = {key: values[0] for key, values in parse_qs(body or "").items()}
+                if method == "POST" and "batch" in form:
+                    status, payload, headers = 200, graph._batch(json.loads(form["batch"])), {}
+                else:
+                    graph.calls.append((method, path, query))
+                    status, payload, headers = graph.handler(method, path, query, form)
+                # 304 não tem corpo: escrever um deixaria bytes sobrando na conexão keep-alive
+                data = b"" if status == 304 else json.dumps(payload).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    for name, value in (headers or {}).items():
+                        self.send_header(name, value)
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # Cliente desistiu antes da resposta (timeout encurtado pelo prazo)
+                    self.close_connection = True
+
+            def do_GET(self):
+                self._reply("GET")
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                self._reply("POST", self.rfile.read(length).decode())
+
+        return Handler
+
+    def _batch(self, items):
+        responses = []
+        for item in items:
+            parts = urlsplit("/" + item["relative_url"])
+            query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+            self.calls.append(("BATCH", parts.path, query))
+            status, payload, _ = self.handler("GET", parts.path, query, {})
+            responses.append({"code": status, "body": json.dumps(payload)})
+        return responses
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeCacheDB:
+    """
+    Cliente Postgres falso (mesma API encadeada do postgres_client) guardando as linhas em memória.
+    As operações executadas ficam em `ops` como (ação, tabela).
+    """
+
+    def __init__(self):
+        self.tables = {}
+        self.ops = []
+
+    def table(self, name):
+        return _FakeTableQuery(self, name)
+
+
+class _FakeTableQuery:
+    def __init__(self, db, name):
+        self._db = db
+        self._name = name
+        self._action = "select"
+        self._filters = []
+        self._orders = []
+        self._limit = None
+        self._rows = None
+        self._payload = None
+
+    def select(self, columns="*"):
+        self._action = "select"
+        return self
+
+    def eq(self, column, value):
+        self._filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def lte(self, column, value):
+        self._filters.append(lambda row: row.get(column) is not None and row.get(column) <= value)
+        return self
+
+    def order(self, column, desc=False):
+        self._orders.append((column, desc))
+        return self
+
+    def limit(self, count):
+        self._limit = int(count)
+        return self
+
+    def upsert(self, rows, *, on_conflict):
+        self._action = "upsert"
+        self._rows = [rows] if isinstance(rows, dict) else list(rows)
+        self._conflict = on_conflict
+        return self
+
+    def update(self, payload):
+        self._action = "update"
+        self._payload = dict(payload)
+        return self
+
+    def execute(self):
+        rows = self._db.tables.setdefault(self._name, [])
+        self._db.ops.append((self._action, self._name))
+        if self._action == "upsert":
+            for row in self._rows:
+                row = {name: getattr(value, "adapted", value) for name, value in row.items()}
+                existing = next((item for item in rows if item.get(self._conflict) == row.get(self._conflict)), None)
+                if existing is None:
+                    rows.append(row)
+                else:
+                    existing.update(row)
+            return SimpleNamespace(data=list(self._rows), error=None)
+        matched = [row for row in rows if all(check(row) for check in self._filters)]
+        if self._action == "update":
+            for row in matched:
+                row.update(self._payload)
+            return SimpleNamespace(data=[dict(row) for row in matched], error=None)
+        for column, desc in reversed(self._orders):
+            matched.sort(key=lambda row: row.get(column) or "", reverse=desc)
+        if self._limit is not None:
+            matched = matched[: self._limit]
+        return SimpleNamespace(data=[dict(row) for row in matched], error=None)
+
+
+def reset_meta_state():
+    meta.clear_graph_memo()
+    with meta._rate_lock:
+        meta._token_buckets.clear()
+        meta._object_buckets.clear()
+        meta._buc_owners.clear()
+    with meta._circuit_lock:
+        meta._circuits.clear()
+    with meta._capability_lock:
+        meta._unsupported_metrics.clear()
+
+
+@pytest.fixture
+def graph(monkeypatch):
+    fake = FakeGraph()
+    monkeypatch.setattr(meta, "BASE", fake.base)
+    reset_meta_state()
+    yield fake
+    fake.close()
+    reset_meta_state()
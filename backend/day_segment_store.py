@@ -0,0 +1,121 @@
+"""
+Guarda no Postgres os segmentos diários das janelas de métricas (ig_window, fb_page_window):
+as métricas aditivas de cada conta, dia a dia.
+
+O meta.py monta qualquer intervalo (e o período anterior das comparações) a partir destes dias
+e só busca na Graph os que faltam; 7 dias, 30 dias e intervalos personalizados compartilham os
+mesmos segmentos, e avançar a janela em um dia busca só o dia novo.
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+from psycopg2.extras import Json
+
+from db import execute, execute_many, fetch_all, has_config
+from meta import register_day_segment_store
+
+logger = logging.getLogger(__name__)
+
+DAY_SEGMENT_TABLE = os.getenv("META_DAY_SEGMENT_TABLE", "meta_day_segments")
+DAY_SEGMENT_STORE_ENABLED = os.getenv("META_DAY_SEGMENT_STORE", "1") != "0"
+DAY_SEGMENT_RETENTION_DAYS = int(os.getenv("META_DAY_SEGMENT_RETENTION_DAYS", "400") or "400")
+
+_table_lock = threading.Lock()
+_table_ready = False
+
+
+def _ensure_table() -> None:
+    global _table_ready
+    if _table_ready:
+        return
+    with _table_lock:
+        if _table_ready:
+            return
+        execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {DAY_SEGMENT_TABLE} (
+                resource TEXT NOT NULL,
+                owner_id TEXT NOT NULL,
+                day DATE NOT NULL,
+                segment JSONB NOT NULL,
+                fetched_at TIMESTAMPTZ NOT NULL,
+                PRIMARY KEY (resource, owner_id, day)
+            );
+            """
+        )
+        _table_ready = True
+
+
+def load_day_segments(resource: str, owner_id: str, first_day: str, last_day: str) -> Dict[str, tuple]:
+    """Retorna {dia ISO: (segmento, buscado_em_epoch)} dos dias salvos entre first_day e last_day."""
+    _ensure_table()
+    rows = fetch_all(
+        f"""
+        SELECT day, segment, fetched_at
+          FROM {DAY_SEGMENT_TABLE}
+         WHERE resource = %(resource)s
+           AND owner_id = %(owner_id)s
+           AND day BETWEEN %(first_day)s AND %(last_day)s
+        """,
+        {"resource": resource, "owner_id": owner_id, "first_day": first_day, "last_day": last_day},
+    )
+    return {
+        row["day"].isoformat(): (row["segment"] or {}, row["fetched_at"].timestamp())
+        for row in rows
+    }
+
+
+def save_day_segments(resource: str, owner_id: str, segments: Dict[str, Dict[str, Any]]) -> None:
+    """Grava (upsert) os segmentos recém-buscados, {dia ISO: segmento}."""
+    if not segments:
+        return
+    now = datetime.now(timezone.utc)
+    rows: List[Dict[str, Any]] = [
+        {
+            "resource": resource,
+            "owner_id": owner_id,
+            "day": day,
+            "segment": Json(segment),
+            "fetched_at": now,
+        }
+        for day, segment in segments.items()
+    ]
+    _ensure_table()
+    execute_many(
+        f"""
+        INSERT INTO {DAY_SEGMENT_TABLE} (resource, owner_id, day, segment, fetched_at)
+        VALUES (%(resource)s, %(owner_id)s, %(day)s, %(segment)s, %(fetched_at)s)
+        ON CONFLICT (resource, owner_id, day) DO UPDATE SET
+            segment = EXCLUDED.segment,
+            fetched_at = EXCLUDED.fetched_at
+        """,
+        rows,
+    )
+
+
+def prune_day_segments(retention_days: int = DAY_SEGMENT_RETENTION_DAYS) -> None:
+    if retention_days <= 0:
+        return
+    _ensure_table()
+    execute(
+        f"DELETE FROM {DAY_SEGMENT_TABLE} WHERE day < CURRENT_DATE - %(days)s::int",
+        {"days": retention_days},
+    )
+
+
+def install_day_segment_store() -> bool:
+    """
+    Liga o store aos fetchers de janela do meta.py quando há banco configurado. Idempotente.
+    """
+    if not DAY_SEGMENT_STORE_ENABLED or not has_config():
+        return False
+    try:
+        prune_day_segments()
+    except Exception as err:  # noqa: BLE001
+        logger.warning("Falha ao limpar segmentos diários antigos: %s", err)
+    register_day_segment_store(load_day_segments, save_day_segments)
+    return True
@@ -100,6 +100,19 @@ def is_configured() -> bool:
     return get_pool() is not None
 
 
+def has_config() -> bool:
+    """Indica se há credenciais de banco, sem abrir conexão."""
+    return _build_conninfo() is not None
+
+
+def dedicated_connection():
+    """Conexão própria, fora do pool (ex.: LISTEN de longa duração); o chamador é responsável por fechá-la."""
+    conninfo = _build_conninfo()
+    if not conninfo:
+        raise RuntimeError("Database connection is not configured.")
+    return psycopg2.connect(**conninfo)
+
+
 @contextmanager
 def connection():
     pool = get_pool()
@@ -0,0 +1,150 @@
+"""
+Guarda no Postgres, criptografados, os tokens de usuários que entraram com o Facebook e as contas
+(páginas, perfis IG, contas de anúncios) que cada um consegue ler. O pool de tokens do meta.py
+distribui as chamadas de cada conta entre esses tokens e o do System User.
+
+Tokens rejeitados pela Meta (erro 190) ficam marcados como inválidos até um novo login.
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import List, Optional, Sequence
+
+from cryptography.fernet import InvalidToken, MultiFernet
+
+from auth_utils import token_cipher
+from db import execute, fetch_all, has_config
+from meta import register_graph_token, register_graph_token_store
+
+logger = logging.getLogger(__name__)
+
+GRAPH_TOKEN_TABLE = os.getenv("META_GRAPH_TOKEN_TABLE", "meta_graph_tokens")
+GRAPH_TOKEN_STORE_ENABLED = os.getenv("META_GRAPH_TOKEN_STORE", "1") != "0"
+
+_table_lock = threading.Lock()
+_table_ready = False
+_cipher: Optional[MultiFernet] = None
+
+
+def _ensure_table() -> None:
+    global _table_ready
+    if _table_ready:
+        return
+    with _table_lock:
+        if _table_ready:
+            return
+        execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {GRAPH_TOKEN_TABLE} (
+                token_key TEXT PRIMARY KEY,
+                facebook_user_id TEXT,
+                label TEXT,
+                token_encrypted TEXT NOT NULL,
+                owners TEXT[] NOT NULL DEFAULT '{{}}',
+                expires_at TIMESTAMPTZ,
+                invalid_at TIMESTAMPTZ,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+            );
+            """
+        )
+        _table_ready = True
+
+
+def load_graph_tokens() -> List[tuple]:
+    """Retorna [(token, owners, rótulo, expira_em_epoch)] dos tokens válidos e ainda não vencidos."""
+    _ensure_table()
+    rows = fetch_all(
+        f"""
+        SELECT token_key, label, token_encrypted, owners, expires_at
+          FROM {GRAPH_TOKEN_TABLE}
+         WHERE invalid_at IS NULL
+           AND (expires_at IS NULL OR expires_at > NOW())
+        """
+    )
+    tokens: List[tuple] = []
+    for row in rows:
+        try:
+            token = _cipher.decrypt(row["token_encrypted"].encode()).decode()
+        except InvalidToken:
+            logger.warning("Token %s não decifra com as chaves atuais; ignorando.", row["token_key"])
+            continue
+        expires_at = row["expires_at"].timestamp() if row["expires_at"] else None
+        tokens.append((token, list(row["owners"] or []), row["label"], expires_at))
+    return tokens
+
+
+def save_graph_token(
+    token_key: str,
+    token: str,
+    owners: Sequence[str],
+    facebook_user_id: Optional[str] = None,
+    label: Optional[str] = None,
+    expires_at: Optional[float] = None,
+) -> None:
+    _ensure_table()
+    execute(
+        f"""
+        INSERT INTO {GRAPH_TOKEN_TABLE} (token_key, facebook_user_id, label, token_encrypted, owners, expires_at, invalid_at, updated_at)
+        VALUES (%(token_key)s, %(facebook_user_id)s, %(label)s, %(token)s, %(owners)s, %(expires_at)s, NULL, NOW())
+        ON CONFLICT (token_key) DO UPDATE SET
+            facebook_user_id = EXCLUDED.facebook_user_id,
+            label = EXCLUDED.label,
+            token_encrypted = EXCLUDED.token_encrypted,
+            owners = EXCLUDED.owners,
+            expires_at = EXCLUDED.expires_at,
+            invalid_at = NULL,
+            updated_at = NOW()
+        """,
+        {
+            "token_key": token_key,
+            "facebook_user_id": facebook_user_id,
+            "label": label,
+            "token": _cipher.encrypt(token.encode()).decode(),
+            "owners": list(owners),
+            "expires_at": datetime.fromtimestamp(expires_at, tz=timezone.utc) if expires_at else None,
+        },
+    )
+
+
+def invalidate_graph_token(token_key: str) -> None:
+    _ensure_table()
+    execute(
+        f"UPDATE {GRAPH_TOKEN_TABLE} SET invalid_at = NOW(), updated_at = NOW() WHERE token_key = %(token_key)s",
+        {"token_key": token_key},
+    )
+
+
+def enroll_graph_token(
+    token: str,
+    owners: Sequence[str],
+    facebook_user_id: Optional[str] = None,
+    label: Optional[str] = None,
+    expires_at: Optional[float] = None,
+) -> str:
+    """Coloca o token no pool deste processo e, com o store ligado, o persiste para os demais workers."""
+    token_key = register_graph_token(token, owners, label, expires_at)
+    if _cipher is not None:
+        save_graph_token(token_key, token, owners, facebook_user_id, label, expires_at)
+    return token_key
+
+
+def install_graph_token_store() -> bool:
+    """
+    Liga o store ao pool de tokens do meta.py quando há banco e chave configurados. Idempotente.
+    """
+    global _cipher
+    if not GRAPH_TOKEN_STORE_ENABLED or not has_config():
+        return False
+    if _cipher is None:
+        try:
+            _cipher = token_cipher()
+        except ValueError as err:
+            logger.warning("META_TOKEN_KEYS inválida (%s); pool de tokens fica só em memória.", err)
+            return False
+        if _cipher is None:
+            logger.warning("Sem META_TOKEN_KEYS/AUTH_SECRET_KEY; pool de tokens fica só em memória.")
+            return False
+    register_graph_token_store(load_graph_tokens, invalidate_graph_token)
+    return True
@@ -0,0 +1,125 @@
+"""
+Persiste o uso da Graph API por dia, conta (owner_id) e recurso chamador: chamadas, bytes,
+latência acumulada e erros.
+
+O meta.py acumula os deltas em memória e os grava aqui periodicamente; o total do dia por conta
+(somando todos os processos) alimenta o orçamento diário respeitado pelos jobs do scheduler.
+"""
+
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Sequence
+
+from db import execute, execute_many, fetch_all, has_config
+from meta import register_graph_usage_store
+
+logger = logging.getLogger(__name__)
+
+GRAPH_USAGE_TABLE = os.getenv("META_GRAPH_USAGE_TABLE", "graph_usage_daily")
+GRAPH_USAGE_ENABLED = os.getenv("META_GRAPH_USAGE_STORE", "1") != "0"
+GRAPH_USAGE_RETENTION_DAYS = int(os.getenv("META_GRAPH_USAGE_RETENTION_DAYS", "90") or "90")
+
+_table_lock = threading.Lock()
+_table_ready = False
+
+
+def _ensure_table() -> None:
+    global _table_ready
+    if _table_ready:
+        return
+    with _table_lock:
+        if _table_ready:
+            return
+        execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {GRAPH_USAGE_TABLE} (
+                day DATE NOT NULL,
+                owner_id TEXT NOT NULL,
+                resource TEXT NOT NULL,
+                calls BIGINT NOT NULL DEFAULT 0,
+                bytes BIGINT NOT NULL DEFAULT 0,
+                latency_ms BIGINT NOT NULL DEFAULT 0,
+                errors BIGINT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                PRIMARY KEY (day, owner_id, resource)
+            );
+            """
+        )
+        _table_ready = True
+
+
+def load_daily_calls(day: str) -> Dict[str, int]:
+    """Retorna {owner_id: chamadas} do dia informado (ISO), somando todos os recursos."""
+    _ensure_table()
+    rows = fetch_all(
+        f"""
+        SELECT owner_id, SUM(calls) AS calls
+          FROM {GRAPH_USAGE_TABLE}
+         WHERE day = %(day)s
+         GROUP BY owner_id
+        """,
+        {"day": day},
+    )
+    return {row["owner_id"]: int(row["calls"] or 0) for row in rows}
+
+
+def save_usage_deltas(rows: Sequence[Dict[str, Any]]) -> None:
+    """Soma os deltas (dia, owner_id, recurso, calls, bytes, latency_ms, errors) aos agregados."""
+    if not rows:
+        return
+    _ensure_table()
+    execute_many(
+        f"""
+        INSERT INTO {GRAPH_USAGE_TABLE} (day, owner_id, resource, calls, bytes, latency_ms, errors, updated_at)
+        VALUES (%(day)s, %(owner_id)s, %(resource)s, %(calls)s, %(bytes)s, %(latency_ms)s, %(errors)s, NOW())
+        ON CONFLICT (day, owner_id, resource) DO UPDATE SET
+            calls = {GRAPH_USAGE_TABLE}.calls + EXCLUDED.calls,
+            bytes = {GRAPH_USAGE_TABLE}.bytes + EXCLUDED.bytes,
+            latency_ms = {GRAPH_USAGE_TABLE}.latency_ms + EXCLUDED.latency_ms,
+            errors = {GRAPH_USAGE_TABLE}.errors + EXCLUDED.errors,
+            updated_at = NOW()
+        """,
+        list(rows),
+    )
+
+
+def list_usage(days: int = 7, limit: int = 100) -> List[Dict[str, Any]]:
+    """Agregados por conta e recurso nos últimos `days` dias, do maior consumo para o menor."""
+    _ensure_table()
+    return fetch_all(
+        f"""
+        SELECT owner_id, resource,
+               SUM(calls) AS calls, SUM(bytes) AS bytes, SUM(latency_ms) AS latency_ms, SUM(errors) AS errors
+          FROM {GRAPH_USAGE_TABLE}
+         WHERE day > CURRENT_DATE - %(days)s::int
+         GROUP BY owner_id, resource
+         ORDER BY SUM(calls) DESC
+         LIMIT %(limit)s
+        """,
+        {"days": max(1, days), "limit": max(1, limit)},
+    )
+
+
+def prune_usage(retention_days: int = GRAPH_USAGE_RETENTION_DAYS) -> None:
+    if retention_days <= 0:
+        return
+    _ensure_table()
+    execute(
+        f"DELETE FROM {GRAPH_USAGE_TABLE} WHERE day < CURRENT_DATE - %(days)s::int",
+        {"days": retention_days},
+    )
+
+
+def install_graph_usage_store() -> bool:
+    """
+    Liga o store à contabilidade em memória do meta.py quando há banco configurado. Idempotente.
+    """
+    if not GRAPH_USAGE_ENABLED or not has_config():
+        return False
+    try:
+        prune_usage()
+    except Exception as err:  # noqa: BLE001
+        logger.warning("Falha ao limpar uso antigo da Graph: %s", err)
+    register_graph_usage_store(load_daily_calls, save_usage_deltas)
+    return True
@@ -13,7 +13,7 @@ BACKEND_ROOT = os.path.dirname(CURRENT_DIR)
 if BACKEND_ROOT not in sys.path:
     sys.path.insert(0, BACKEND_ROOT)
 
-from meta import MetaAPIError, gget
+from meta import MetaAPIError, gget, paginate
 from postgres_client import get_postgres_client
 
 logger = logging.getLogger(__name__)
@@ -79,133 +79,76 @@ def iterate_media(ig_user_id: str, since_utc: datetime) -> Iterator[Dict[str, ob
     """
     Yield media objects newer than since_utc (inclusive).
     """
-    after: Optional[str] = None
-    while True:
-        params = {
-            "fields": "id,caption,timestamp,comments_count",
-            "limit": GRAPH_PAGE_LIMIT_MEDIA,
+    params = {
+        "fields": "id,caption,timestamp,comments_count",
+        "limit": GRAPH_PAGE_LIMIT_MEDIA,
+    }
+    for media in paginate(f"/{ig_user_id}/media", params, stop_before=since_utc, prefetch=True, fetch=graph_get):
+        timestamp_raw = str(media.get("timestamp") or "")
+        try:
+            timestamp = parse_timestamp(timestamp_raw)
+        except ValueError:
+            logger.debug("Skipping media without valid timestamp: %s", media)
+            continue
+        yield {
+            "id": str(media.get("id")),
+            "caption": media.get("caption") or "",
+            "timestamp": timestamp,
         }
-        if after:
-            params["after"] = after
-        payload = graph_get(f"/{ig_user_id}/media", params=params)
-        data = payload.get("data") or []
-        if not isinstance(data, list):
-            break
-
-        stop_paging = False
-        for media in data:
-            timestamp_raw = str(media.get("timestamp") or "")
-            try:
-                timestamp = parse_timestamp(timestamp_raw)
-            except ValueError:
-                logger.debug("Skipping media without valid timestamp: %s", media)
-                continue
-            if timestamp < since_utc:
-                stop_paging = True
-                continue
-            yield {
-                "id": str(media.get("id")),
-                "caption": media.get("caption") or "",
-                "timestamp": timestamp,
-            }
-
-        paging = payload.get("paging") or {}
-        cursors = paging.get("cursors") or {}
-        after = cursors.get("after")
-        if stop_paging or not after:
-            break
 
 
 def iterate_comments(media_id: str, since_utc: datetime) -> Iterator[Dict[str, object]]:
     """
     Yield comment payloads for a given media filtered by timestamp.
     """
-    after: Optional[str] = None
-    while True:
-        params = {
-            "fields": "id,text,username,timestamp,like_count,comment_count",
-            "limit": GRAPH_PAGE_LIMIT_COMMENTS,
+    params = {
+        "fields": "id,text,username,timestamp,like_count,comment_count",
+        "limit": GRAPH_PAGE_LIMIT_COMMENTS,
+    }
+    for comment in paginate(f"/{media_id}/comments", params, stop_before=since_utc, fetch=graph_get):
+        timestamp_raw = str(comment.get("timestamp") or "")
+        try:
+            timestamp = parse_timestamp(timestamp_raw)
+        except ValueError:
+            logger.debug("Skipping comment without valid timestamp: %s", comment)
+            continue
+        yield {
+            "id": str(comment.get("id")),
+            "text": comment.get("text") or "",
+            "username": comment.get("username") or "",
+            "timestamp": timestamp,
+            "like_count": int(comment.get("like_count") or 0),
+            "comment_count": int(
+                comment.get("comment_count")
+                or comment.get("replies_count")
+                or (((comment.get("replies") or {}).get("summary") or {}).get("total_count"))
+                or 0
+            ),
         }
-        if after:
-            params["after"] = after
-        payload = graph_get(f"/{media_id}/comments", params=params)
-        data = payload.get("data") or []
-        if not isinstance(data, list) or not data:
-            break
-
-        stop_paging = False
-        for comment in data:
-            timestamp_raw = str(comment.get("timestamp") or "")
-            try:
-                timestamp = parse_timestamp(timestamp_raw)
-            except ValueError:
-                logger.debug("Skipping comment without valid timestamp: %s", comment)
-                continue
-            if timestamp < since_utc:
-                stop_paging = True
-                continue
-            yield {
-                "id": str(comment.get("id")),
-                "text": comment.get("text") or "",
-                "username": comment.get("username") or "",
-                "timestamp": timestamp,
-                "like_count": int(comment.get("like_count") or 0),
-                "comment_count": int(
-                    comment.get("comment_count")
-                    or comment.get("replies_count")
-                    or (((comment.get("replies") or {}).get("summary") or {}).get("total_count"))
-                    or 0
-                ),
-            }
-
-        paging = payload.get("paging") or {}
-        cursors = paging.get("cursors") or {}
-        after = cursors.get("after")
-        if stop_paging or not after:
-            break
 
 
 def iterate_replies(comment_id: str, since_utc: datetime) -> Iterator[Dict[str, object]]:
     """
     Yield replies for a given comment filtered by timestamp.
     """
-    after: Optional[str] = None
-    while True:
-        params = {
-            "fields": "id,text,username,timestamp,like_count",
-            "limit": GRAPH_PAGE_LIMIT_REPLIES,
+    params = {
+        "fields": "id,text,username,timestamp,like_count",
+        "limit": GRAPH_PAGE_LIMIT_REPLIES,
+    }
+    for reply in paginate(f"/{comment_id}/replies", params, stop_before=since_utc, fetch=graph_get):
+        timestamp_raw = str(reply.get("timestamp") or "")
+        try:
+            timestamp = parse_timestamp(timestamp_raw)
+        except ValueError:
+            logger.debug("Skipping reply without valid timestamp: %s", reply)
+            continue
+        yield {
+            "id": str(reply.get("id")),
+            "text": reply.get("text") or "",
+            "username": reply.get("username") or "",
+            "timestamp": timestamp,
+            "like_count": int(reply.get("like_count") or 0),
         }
-        if after:
-            params["after"] = after
-        payload = graph_get(f"/{comment_id}/replies", params=params)
-        data = payload.get("data") or []
-        if not isinstance(data, list) or not data:
-            break
-
-        stop_paging = False
-        for reply in data:
-            timestamp_raw = str(reply.get("timestamp") or "")
-            try:
-                timestamp = parse_timestamp(timestamp_raw)
-            except ValueError:
-                logger.debug("Skipping reply without valid timestamp: %s", reply)
-                continue
-            if timestamp < since_utc:
-                stop_paging = True
-                continue
-            yield {
-                "id": str(reply.get("id")),
-                "text": reply.get("text") or "",
-                "username": reply.get("username") or "",
-                "timestamp": timestamp,
-                "like_count": int(reply.get("like_count") or 0),
-            }
-
-        paging = payload.get("paging") or {}
-        cursors = paging.get("cursors") or {}
-        after = cursors.get("after")
-        if stop_paging or not after:
-            break
 
 
 def normalize_comment_record(
@@ -6,7 +6,11 @@ from datetime import date, datetime, timedelta, timezone
 from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
 
 from cache import get_cached_payload, get_fetcher, register_fetcher
-from meta import MetaAPIError, ig_window, ig_recent_posts, gget
+from meta import MetaAPIError, ig_window, ig_recent_posts, gget, graph_usage_scope
+from graph_token_store import install_graph_token_store
+from graph_usage_store import install_graph_usage_store
+from media_insights_store import install_media_insights_store
+from metric_capability_store import install_metric_capability_store
 from postgres_client import get_postgres_client
 from psycopg2.extras import Json
 
@@ -20,6 +24,13 @@ ROLLUP_TABLE = "metrics_daily_rollup"
 INGEST_LOGS_TABLE = "ingest_logs"
 JOB_TYPE = "instagram_ingest"
 
+# Reaproveita insights por mídia e capacidades de métricas já persistidos entre execuções do ingest
+install_media_insights_store()
+install_metric_capability_store()
+install_graph_usage_store()
+# Tokens de usuários conectados somam cota às contas que eles leem
+install_graph_token_store()
+
 
 def _now_utc_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
@@ -463,16 +474,17 @@ def ingest_account_range(
     all_rows: List[Dict[str, object]] = []
     metric_keys_touched: defaultdict[str, set] = defaultdict(set)
 
-    for daily_date in daterange(since, until):
-        bounds = day_bounds(daily_date)
-        snapshot = ig_window(ig_id, bounds["since"], bounds["until"])
-        rows = snapshot_to_rows(ig_id, daily_date, snapshot)
-        if not rows:
-            logger.info("[%s] Nenhum dado para %s", ig_id, daily_date)
-            continue
-        all_rows.extend(rows)
-        for row in rows:
-            metric_keys_touched[daily_date.isoformat()].add(row["metric_key"])
+    with graph_usage_scope(ig_id, "instagram_ingest"):
+        for daily_date in daterange(since, until):
+            bounds = day_bounds(daily_date)
+            snapshot = ig_window(ig_id, bounds["since"], bounds["until"])
+            rows = snapshot_to_rows(ig_id, daily_date, snapshot)
+            if not rows:
+                logger.info("[%s] Nenhum dado para %s", ig_id, daily_date)
+                continue
+            all_rows.extend(rows)
+            for row in rows:
+                metric_keys_touched[daily_date.isoformat()].add(row["metric_key"])
 
     inserted_total = 0
     updated_total = 0
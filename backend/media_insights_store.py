@@ -0,0 +1,158 @@
+"""
+Armazena os insights lifetime de cada mídia do Instagram no Postgres.
+
+Os fetchers (ig_window / ig_organic_summary) continuam pedindo os insights por field expansion
+na listagem e gravam aqui o que veio da Graph (write-through). Quando a expansão falha numa
+página, esta tabela é consultada antes das chamadas individuais: só mídias novas ou com
+refresh vencido são buscadas de novo. O intervalo de refresh cresce com a idade do post, já
+que posts antigos quase não mudam.
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from psycopg2.extras import Json
+
+from db import execute, execute_many, fetch_all, has_config
+from meta import parse_graph_timestamp, register_media_insights_store
+
+logger = logging.getLogger(__name__)
+
+MEDIA_INSIGHTS_TABLE = os.getenv("IG_MEDIA_INSIGHTS_TABLE", "ig_media_insights")
+MEDIA_INSIGHTS_ENABLED = os.getenv("IG_MEDIA_INSIGHTS_STORE", "1") != "0"
+
+# (idade máxima do post, intervalo até o próximo refresh)
+REFRESH_SCHEDULE: Tuple[Tuple[timedelta, timedelta], ...] = (
+    (timedelta(days=1), timedelta(hours=1)),
+    (timedelta(days=3), timedelta(hours=4)),
+    (timedelta(days=7), timedelta(hours=12)),
+    (timedelta(days=30), timedelta(days=1)),
+    (timedelta(days=90), timedelta(days=7)),
+)
+OLD_POST_REFRESH = timedelta(days=30)
+
+_table_lock = threading.Lock()
+_table_ready = False
+
+
+def _ensure_table() -> None:
+    global _table_ready
+    if _table_ready:
+        return
+    with _table_lock:
+        if _table_ready:
+            return
+        execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {MEDIA_INSIGHTS_TABLE} (
+                media_id TEXT NOT NULL,
+                metrics TEXT NOT NULL,
+                account_id TEXT,
+                media_type TEXT,
+                posted_at TIMESTAMPTZ,
+                insights JSONB NOT NULL,
+                fetched_at TIMESTAMPTZ NOT NULL,
+                next_refresh_at TIMESTAMPTZ NOT NULL,
+                PRIMARY KEY (media_id, metrics)
+            );
+            """
+        )
+        execute(
+            f"CREATE INDEX IF NOT EXISTS {MEDIA_INSIGHTS_TABLE}_account_posted_idx "
+            f"ON {MEDIA_INSIGHTS_TABLE} (account_id, posted_at);"
+        )
+        _table_ready = True
+
+
+def refresh_interval(posted_at: Optional[datetime], now: Optional[datetime] = None) -> timedelta:
+    """Intervalo de refresh para um post com a idade informada (sem data = tratado como novo)."""
+    if posted_at is None:
+        return REFRESH_SCHEDULE[0][1]
+    now = now or datetime.now(timezone.utc)
+    age = now - posted_at
+    for max_age, interval in REFRESH_SCHEDULE:
+        if age <= max_age:
+            return interval
+    return OLD_POST_REFRESH
+
+
+def load_media_insights(media_ids: Sequence[str], metrics: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Retorna {media_id: {"data": [...]}} apenas para mídias com insights ainda válidos.
+    """
+    ids = [str(media_id) for media_id in media_ids if media_id]
+    if not ids:
+        return {}
+    _ensure_table()
+    rows = fetch_all(
+        f"""
+        SELECT media_id, insights
+          FROM {MEDIA_INSIGHTS_TABLE}
+         WHERE metrics = %(metrics)s
+           AND media_id = ANY(%(ids)s)
+           AND next_refresh_at > NOW()
+        """,
+        {"metrics": metrics, "ids": ids},
+    )
+    return {row["media_id"]: {"data": row["insights"] or []} for row in rows}
+
+
+def save_media_insights(
+    account_id: Optional[str],
+    entries: Sequence[Tuple[Dict[str, Any], Dict[str, Any]]],
+    metrics: str,
+) -> None:
+    """
+    Grava (upsert) os insights recém-buscados. `entries` contém pares (mídia, payload de insights).
+    """
+    now = datetime.now(timezone.utc)
+    rows: List[Dict[str, Any]] = []
+    for media, payload in entries:
+        media_id = str(media.get("id") or "").strip()
+        data = payload.get("data") if isinstance(payload, dict) else None
+        if not media_id or not isinstance(data, list):
+            continue
+        posted_at = parse_graph_timestamp(media.get("timestamp"))
+        rows.append({
+            "media_id": media_id,
+            "metrics": metrics,
+            "account_id": account_id,
+            "media_type": media.get("media_type"),
+            "posted_at": posted_at,
+            "insights": Json(data),
+            "fetched_at": now,
+            "next_refresh_at": now + refresh_interval(posted_at, now),
+        })
+    if not rows:
+        return
+    _ensure_table()
+    execute_many(
+        f"""
+        INSERT INTO {MEDIA_INSIGHTS_TABLE}
+            (media_id, metrics, account_id, media_type, posted_at, insights, fetched_at, next_refresh_at)
+        VALUES
+            (%(media_id)s, %(metrics)s, %(account_id)s, %(media_type)s, %(posted_at)s,
+             %(insights)s, %(fetched_at)s, %(next_refresh_at)s)
+        ON CONFLICT (media_id, metrics) DO UPDATE SET
+            account_id = COALESCE(EXCLUDED.account_id, {MEDIA_INSIGHTS_TABLE}.account_id),
+            media_type = COALESCE(EXCLUDED.media_type, {MEDIA_INSIGHTS_TABLE}.media_type),
+            posted_at = COALESCE(EXCLUDED.posted_at, {MEDIA_INSIGHTS_TABLE}.posted_at),
+            insights = EXCLUDED.insights,
+            fetched_at = EXCLUDED.fetched_at,
+            next_refresh_at = EXCLUDED.next_refresh_at
+        """,
+        rows,
+    )
+
+
+def install_media_insights_store() -> bool:
+    """
+    Liga o store aos fetchers do meta.py quando há banco configurado. Idempotente.
+    """
+    if not MEDIA_INSIGHTS_ENABLED or not has_config():
+        return False
+    register_media_insights_store(load_media_insights, save_media_insights)
+    return True
@@ -1,13 +1,27 @@
 # backend/meta.py
+import asyncio
+import atexit
 import os
 import time
 import hmac
 import hashlib
+import contextvars
+import json
 import logging
-from datetime import datetime
+import re
+import socket
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+import aiohttp
 import requests
-from typing import Optional, List, Dict, Any, Sequence
-from urllib.parse import urlencode
+from requests.adapters import HTTPAdapter
+from typing import Optional, List, Dict, Any, Callable, Iterable, Iterator, NamedTuple, Sequence
+from urllib.parse import parse_qsl, urlencode, urlsplit
+from urllib3.connection import HTTPConnection
+from yarl import URL
 
 from dotenv import load_dotenv
 
@@ -23,12 +37,20 @@ logger = logging.getLogger(__name__)
 VERSION = os.getenv("META_GRAPH_VERSION", "v23.0")
 TOKEN = os.getenv("META_SYSTEM_USER_TOKEN")
 SECRET = os.getenv("META_APP_SECRET")
-BASE = f"https://graph.facebook.com/{VERSION}"
+# META_GRAPH_BASE_URL permite apontar para um stand-in local (scripts/graph_standin.py)
+BASE = (os.getenv("META_GRAPH_BASE_URL") or f"https://graph.facebook.com/{VERSION}").rstrip("/")
 
 # Configurações
 REQUEST_TIMEOUT = 30  # segundos
 MAX_RETRIES = 3
 
+# Pool HTTP compartilhado (keep-alive) para todas as chamadas à Graph API
+HTTP_POOL_CONNECTIONS = int(os.getenv("META_HTTP_POOL_CONNECTIONS", "4") or "4")
+HTTP_POOL_MAXSIZE = int(os.getenv("META_HTTP_POOL_MAXSIZE", "32") or "32")
+HTTP_POOL_BLOCK = os.getenv("META_HTTP_POOL_BLOCK", "0") == "1"
+HTTP_KEEPALIVE_IDLE = int(os.getenv("META_HTTP_KEEPALIVE_IDLE", "60") or "60")  # segundos
+HTTP_WARMUP_CONNECTIONS = int(os.getenv("META_HTTP_WARMUP_CONNECTIONS", "4") or "4")
+
 
 class MetaAPIError(Exception):
     def __init__(self, status: int, message: str, code: Optional[int] = None, error_type: Optional[str] = None,
@@ -46,52 +68,242 @@ def appsecret_proof(token: Optional[str]) -> Optional[str]:
     return hmac.new(SECRET.encode(), token.encode(), hashlib.sha256).hexdigest()
 
 
-def gget(path: str, params: Optional[dict] = None, token: Optional[str] = None):
+class _KeepAliveAdapter(HTTPAdapter):
+    """HTTPAdapter com TCP keep-alive habilitado nos sockets do pool."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        options = list(HTTPConnection.default_socket_options)
+        options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            options.append((socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, HTTP_KEEPALIVE_IDLE))
+        if hasattr(socket, "TCP_KEEPINTVL"):
+            options.append((socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, HTTP_KEEPALIVE_IDLE // 4)))
+        kwargs["socket_options"] = options
+        super().init_poolmanager(*args, **kwargs)
+
+
+_session_lock = threading.Lock()
+_session: Optional[requests.Session] = None
+_http_stats_lock = threading.Lock()
+_http_stats: Dict[str, int] = {"requests": 0, "failures": 0}
+_pool_warmed = False
+
+
+def get_http_session() -> requests.Session:
     """
-    Faz requisição GET à Meta Graph API com retry exponencial e timeout configurável.
+    Retorna a sessão HTTP compartilhada (thread-safe) usada por todas as chamadas Graph.
+    As conexões ficam abertas no pool e são reutilizadas entre requisições e threads.
+    """
+    global _session
+    if _session is not None:
+        return _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = _KeepAliveAdapter(
+                pool_connections=HTTP_POOL_CONNECTIONS,
+                pool_maxsize=HTTP_POOL_MAXSIZE,
+                pool_block=HTTP_POOL_BLOCK,
+                max_retries=0,
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({"Connection": "keep-alive"})
+            _session = session
+    return _session
 
-    Args:
-        path: Caminho da API (ex: "/me")
-        params: Parâmetros da query string
-        token: Token de acesso (usa TOKEN global se não fornecido)
 
-    Returns:
-        dict: Resposta JSON da API
+def _http_request(method: str, url: str, timeout: float = REQUEST_TIMEOUT,
+                  data: Optional[dict] = None, headers: Optional[dict] = None) -> requests.Response:
+    with _http_stats_lock:
+        _http_stats["requests"] += 1
+    try:
+        return get_http_session().request(method, url, data=data, headers=headers, timeout=timeout)
+    except requests.exceptions.RequestException:
+        with _http_stats_lock:
+            _http_stats["failures"] += 1
+        raise
 
-    Raises:
-        MetaAPIError: Se a requisição falhar após todos os retries
+
+def warm_http_pool(connections: Optional[int] = None, blocking: bool = False) -> None:
     """
-    request_token = token or TOKEN
-    if not request_token:
-        raise RuntimeError("META_SYSTEM_USER_TOKEN is not configured")
+    Abre conexões TLS com a Graph API antes do primeiro request real (início do worker).
+    Chamadas repetidas no mesmo processo são ignoradas.
+    """
+    global _pool_warmed
+    with _session_lock:
+        if _pool_warmed:
+            return
+        _pool_warmed = True
+    total = HTTP_WARMUP_CONNECTIONS if connections is None else connections
+    total = max(0, min(total, HTTP_POOL_MAXSIZE))
+    if total <= 0:
+        return
+    parts = urlsplit(BASE)
+    warm_url = f"{parts.scheme}://{parts.netloc}/"
+
+    def _open() -> None:
+        try:
+            get_http_session().head(warm_url, timeout=REQUEST_TIMEOUT)
+        except requests.exceptions.RequestException as err:
+            logger.debug("HTTP pool warm-up failed: %s", err)
+
+    # Requisições simultâneas forçam conexões distintas no pool
+    workers = [threading.Thread(target=_open, daemon=True) for _ in range(total)]
+    for worker in workers:
+        worker.start()
+    if blocking:
+        for worker in workers:
+            worker.join()
+    logger.info("HTTP pool warm-up started with %s connection(s) to %s", total, parts.netloc)
+
+
+def get_http_pool_stats() -> Dict[str, Any]:
+    """Estatísticas de reutilização de conexões do pool HTTP compartilhado."""
+    with _http_stats_lock:
+        stats: Dict[str, Any] = dict(_http_stats)
+    hosts: List[Dict[str, Any]] = []
+    opened = 0
+    served = 0
+    session = _session
+    if session is not None:
+        adapter = session.get_adapter(BASE)
+        pools = getattr(adapter.poolmanager, "pools", None)
+        for key in list(pools.keys()) if pools is not None else []:
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            num_connections = int(getattr(pool, "num_connections", 0) or 0)
+            num_requests = int(getattr(pool, "num_requests", 0) or 0)
+            opened += num_connections
+            served += num_requests
+            hosts.append({
+                "host": getattr(pool, "host", None),
+                "connections_opened": num_connections,
+                "requests": num_requests,
+                "idle": sum(1 for conn in getattr(getattr(pool, "pool", None), "queue", []) if conn is not None),
+            })
+    stats.update({
+        "pool_maxsize": HTTP_POOL_MAXSIZE,
+        "pool_block": HTTP_POOL_BLOCK,
+        "connections_opened": opened,
+        "connections_reused": max(0, served - opened),
+        "reuse_ratio": round((served - opened) / served, 4) if served else None,
+        "hosts": hosts,
+    })
+    return stats
 
-    query = {"access_token": request_token}
-    proof = appsecret_proof(request_token)
-    if proof:
-        query["appsecret_proof"] = proof
-    if params:
-        query.update(params)
 
-    url = f"{BASE}{path}?{urlencode(query, doseq=True)}"
+class _GraphResponse(NamedTuple):
+    payload: Any
+    size: int
+    etag: Optional[str]
+    not_modified: bool
+
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+def _deadline_remaining(deadline: Optional["GraphDeadline"]) -> Optional[float]:
+    return deadline.remaining() if deadline is not None else None
+
+
+def _attempt_timeout(deadline: Optional["GraphDeadline"], path: str) -> float:
+    """Timeout da próxima tentativa: o que resta do prazo, limitado a REQUEST_TIMEOUT."""
+    remaining = _deadline_remaining(deadline)
+    if remaining is None:
+        return REQUEST_TIMEOUT
+    if remaining < DEADLINE_MIN_ATTEMPT_SECONDS:
+        raise _deadline_error(path)
+    return min(REQUEST_TIMEOUT, remaining)
+
 
+def _should_retry(attempt: int, wait_time: float, breaker: Optional["_CircuitBreaker"],
+                  deadline: Optional["GraphDeadline"]) -> bool:
+    if attempt >= MAX_RETRIES - 1 or (breaker is not None and breaker.is_open):
+        return False
+    remaining = _deadline_remaining(deadline)
+    return remaining is None or remaining >= wait_time + DEADLINE_MIN_ATTEMPT_SECONDS
+
+
+def _graph_error(status: int, payload: Any, text: str) -> MetaAPIError:
+    """Converte uma resposta de erro da Graph API em MetaAPIError."""
+    err = payload.get("error") if isinstance(payload, dict) else None
+    message = (err or {}).get("message") if isinstance(err, dict) else None
+
+    logger.error(f"Meta API error: {message or text}")
+
+    return MetaAPIError(
+        status=status,
+        message=message or text or "Meta Graph API request failed",
+        code=(err or {}).get("code") if isinstance(err, dict) else None,
+        error_type=(err or {}).get("type") if isinstance(err, dict) else None,
+        raw=payload if isinstance(payload, dict) else {"raw": text},
+    )
+
+
+def _send_with_retry(method: str, url: str, path: str, data: Optional[dict] = None,
+                     token: Optional[str] = None, cost: int = 1, detailed: bool = False,
+                     headers: Optional[dict] = None):
+    """
+    Executa a requisição HTTP no pool compartilhado com retry exponencial e
+    converte erros da Graph API em MetaAPIError. Com detailed=True devolve um
+    _GraphResponse (json, bytes, ETag e se a resposta foi 304 Not Modified).
+    Com um prazo ativo (graph_deadline), timeout e retries se limitam ao tempo restante.
+    """
+    breaker = _circuit_for(token, path)
+    deadline = _graph_deadline.get()
+    _usage_budget_enter(path)
     # Retry com exponential backoff
     for attempt in range(MAX_RETRIES):
+        timeout = REQUEST_TIMEOUT
         try:
-            logger.debug(f"Request attempt {attempt + 1}/{MAX_RETRIES}: {path}")
-            r = requests.get(url, timeout=REQUEST_TIMEOUT)
+            logger.debug(f"Request attempt {attempt + 1}/{MAX_RETRIES}: {method} {path}")
+            _attempt_timeout(deadline, path)
+            _circuit_enter(breaker, path)
+            try:
+                lane = _lane_enter(token, path, cost, deadline)
+                try:
+                    _rate_limit_acquire(token, path, cost, max_wait=_deadline_remaining(deadline))
+                    timeout = _attempt_timeout(deadline, path)
+                except BaseException:
+                    _lane_leave(lane)
+                    raise
+            except MetaAPIError:
+                if breaker is not None:
+                    breaker.release()
+                raise
+            try:
+                with _lane_token_slot(lane, token):
+                    started = time.monotonic()
+                    r = _http_request(method, url, timeout=timeout, data=data, headers=headers)
+            finally:
+                _lane_leave(lane)
+            elapsed = time.monotonic() - started
+            _record_graph_usage(cost, len(r.content), elapsed, not r.ok and r.status_code != 304)
+            _observe_graph_response(path, r.status_code, elapsed, len(r.content))
+            _rate_limit_observe(token, path, r.headers)
+            _circuit_observe(breaker, path, r.status_code, r.headers, r.content)
+
+            # Revalidação condicional (If-None-Match): conteúdo não mudou
+            if r.status_code == 304 and detailed:
+                return _GraphResponse(None, 0, r.headers.get("ETag"), True)
 
             # Se sucesso, retornar
             if r.ok:
+                if detailed:
+                    return _GraphResponse(r.json(), len(r.content), r.headers.get("ETag"), False)
                 return r.json()
 
             # Se for erro temporário e ainda temos tentativas, fazer retry
-            if r.status_code in (429, 500, 502, 503, 504) and attempt < MAX_RETRIES - 1:
+            if r.status_code in RETRYABLE_STATUSES and _should_retry(attempt, 2 ** attempt, breaker, deadline):
                 # Exponential backoff: 2^attempt segundos (1s, 2s, 4s, 8s...)
                 wait_time = 2 ** attempt
                 logger.warning(
                     f"Request failed with status {r.status_code}. "
                     f"Retrying in {wait_time}s... (attempt {attempt + 1}/{MAX_RETRIES})"
                 )
+                _observe_graph_retry(path, r.status_code)
                 time.sleep(wait_time)
                 continue
 
@@ -100,24 +312,24 @@ def gget(path: str, params: Optional[dict] = None, token: Optional[str] = None):
                 payload = r.json()
             except ValueError:
                 payload = {}
-
-            err = payload.get("error") if isinstance(payload, dict) else None
-            message = (err or {}).get("message") if isinstance(err, dict) else None
-
-            logger.error(f"Meta API error: {message or r.text}")
-
-            raise MetaAPIError(
-                status=r.status_code,
-                message=message or r.text or "Meta Graph API request failed",
-                code=(err or {}).get("code") if isinstance(err, dict) else None,
-                error_type=(err or {}).get("type") if isinstance(err, dict) else None,
-                raw=payload if isinstance(payload, dict) else {"raw": r.text},
-            )
+            error = _graph_error(r.status_code, payload, r.text)
+            _note_auth_error(token, error, path)
+            raise error
 
         except requests.exceptions.Timeout:
-            if attempt < MAX_RETRIES - 1:
+            elapsed = time.monotonic() - started
+            _record_graph_usage(cost, 0, elapsed, True)
+            _observe_graph_response(path, "timeout", elapsed, 0)
+            if timeout < REQUEST_TIMEOUT:
+                # Timeout encurtado pelo prazo: não diz nada sobre a saúde da Graph
+                if breaker is not None:
+                    breaker.release()
+                raise _deadline_error(path)
+            _circuit_record(breaker, path, "timeout")
+            if _should_retry(attempt, 2 ** attempt, breaker, deadline):
                 wait_time = 2 ** attempt
                 logger.warning(f"Request timeout. Retrying in {wait_time}s...")
+                _observe_graph_retry(path, "timeout")
                 time.sleep(wait_time)
                 continue
             logger.error(f"Request timeout after {MAX_RETRIES} attempts")
@@ -129,6 +341,8 @@ def gget(path: str, params: Optional[dict] = None, token: Optional[str] = None):
             )
 
         except requests.exceptions.RequestException as e:
+            _observe_graph_response(path, "error", None, 0)
+            _circuit_record(breaker, path, "request_exception")
             logger.error(f"Request exception: {e}")
             raise MetaAPIError(
                 status=500,
@@ -139,261 +353,3889 @@ def gget(path: str, params: Optional[dict] = None, token: Optional[str] = None):
 
     # Fallback (não deve chegar aqui)
     logger.warning("Max retries reached, returning empty data")
-    return {"data": []}
+    return _GraphResponse({"data": []}, 0, None, False) if detailed else {"data": []}
 
 
-# Cache simples para page tokens (System User token não expira)
-PAGE_TOKEN_CACHE: Dict[str, str] = {}
+# Memo de curta duração (por processo) para leituras Graph repetidas dentro de uma renderização
+MEMO_ENABLED = os.getenv("META_MEMO_ENABLED", "1") != "0"
+MEMO_MAX_BYTES = int(os.getenv("META_MEMO_MAX_BYTES", str(32 * 1024 * 1024)) or str(32 * 1024 * 1024))
+MEMO_DEFAULT_TTL = float(os.getenv("META_MEMO_DEFAULT_TTL", "30") or "30")  # segundos
+# Entradas vencidas com ETag ficam no LRU para revalidar com If-None-Match
+ETAG_ENABLED = os.getenv("META_ETAG_ENABLED", "1") != "0"
 
-def get_page_access_token(page_id: str) -> str:
+
+def _parse_memo_ttls(raw: Optional[str]) -> Dict[str, float]:
+    """Formato: "insights=60,media=30,node=300" (chave = último segmento do path, "node" para /{id})."""
+    ttls: Dict[str, float] = {}
+    for chunk in (raw or "").split(","):
+        name, _, value = chunk.partition("=")
+        try:
+            ttls[name.strip()] = float(value)
+        except ValueError:
+            continue
+    return ttls
+
+
+MEMO_PATH_TTLS: Dict[str, float] = {
+    "insights": 60.0,
+    "media": 30.0,
+    "stories": 15.0,
+    "comments": 15.0,
+    "node": 300.0,
+    "accounts": 300.0,
+    "adaccounts": 300.0,
+}
+MEMO_PATH_TTLS.update(_parse_memo_ttls(os.getenv("META_MEMO_TTLS")))
+
+_memo_lock = threading.Lock()
+_memo: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, payload, size, etag)
+_memo_bytes = 0
+_memo_stats: Dict[str, int] = {
+    "hits": 0,
+    "misses": 0,
+    "evictions": 0,
+    "bypassed": 0,
+    "revalidations": 0,
+    "not_modified": 0,
+}
+_memo_bypass: contextvars.ContextVar[bool] = contextvars.ContextVar("meta_memo_bypass", default=False)
+
+
+def _memo_ttl(path: str) -> float:
+    segments = [segment for segment in (path or "").split("?", 1)[0].strip("/").split("/") if segment]
+    if not segments:
+        return 0.0
+    edge = "node" if len(segments) == 1 else segments[-1]
+    return MEMO_PATH_TTLS.get(edge, MEMO_DEFAULT_TTL)
+
+
+def _memo_get(key: str) -> Any:
+    global _memo_bytes
+    with _memo_lock:
+        entry = _memo.get(key)
+        if entry is None:
+            _memo_stats["misses"] += 1
+            return None
+        expires_at, payload, size, etag = entry
+        if expires_at <= time.monotonic():
+            if not (ETAG_ENABLED and etag):
+                del _memo[key]
+                _memo_bytes -= size
+            _memo_stats["misses"] += 1
+            return None
+        _memo.move_to_end(key)
+        _memo_stats["hits"] += 1
+        return payload
+
+
+def _memo_validator(key: str) -> Optional[tuple]:
+    """(etag, payload, size) guardados para a chave, mesmo vencidos, para revalidação condicional."""
+    if not ETAG_ENABLED:
+        return None
+    with _memo_lock:
+        entry = _memo.get(key)
+    if entry is None or not entry[3]:
+        return None
+    return entry[3], entry[1], entry[2]
+
+
+def _memo_put(key: str, path: str, payload: Any, size: int, etag: Optional[str] = None) -> None:
+    global _memo_bytes
+    ttl = _memo_ttl(path)
+    if ttl <= 0 or size > MEMO_MAX_BYTES // 8:
+        return
+    if not MEMO_ENABLED:
+        # Só revalidação: a entrada nasce vencida e serve apenas de validador
+        if not (ETAG_ENABLED and etag):
+            return
+        ttl = 0.0
+    with _memo_lock:
+        previous = _memo.pop(key, None)
+        if previous is not None:
+            _memo_bytes -= previous[2]
+        _memo[key] = (time.monotonic() + ttl, payload, size, etag)
+        _memo_bytes += size
+        while _memo_bytes > MEMO_MAX_BYTES and _memo:
+            _, evicted = _memo.popitem(last=False)
+            _memo_bytes -= evicted[2]
+            _memo_stats["evictions"] += 1
+
+
+@contextmanager
+def graph_memo_bypass(enabled: bool = True):
+    """
+    Ignora o memo de leituras Graph no bloco (refresh forçado). As respostas novas
+    continuam sendo gravadas no memo. Vale também para o fan-out disparado no bloco.
+    """
+    if not enabled:
+        yield
+        return
+    marker = _memo_bypass.set(True)
+    try:
+        yield
+    finally:
+        _memo_bypass.reset(marker)
+
+
+def clear_graph_memo() -> None:
+    global _memo_bytes
+    with _memo_lock:
+        _memo.clear()
+        _memo_bytes = 0
+
+
+def get_memo_stats() -> Dict[str, Any]:
+    with _memo_lock:
+        stats: Dict[str, Any] = dict(_memo_stats)
+        stats["entries"] = len(_memo)
+        stats["bytes"] = _memo_bytes
+    stats["max_bytes"] = MEMO_MAX_BYTES
+    return stats
+
+
+class GraphRevalidation:
+    """Contabiliza, dentro de um refresh, quantas leituras Graph voltaram 304 (sem mudança)."""
+
+    def __init__(self):
+        self.requests = 0
+        self.not_modified = 0
+        self._lock = threading.Lock()
+
+    def record(self, not_modified: bool) -> None:
+        with self._lock:
+            self.requests += 1
+            if not_modified:
+                self.not_modified += 1
+
+    @property
+    def unchanged(self) -> bool:
+        """Verdadeiro quando todas as leituras do bloco foram revalidadas como inalteradas."""
+        with self._lock:
+            return self.requests > 0 and self.not_modified == self.requests
+
+
+_revalidation_tracker: contextvars.ContextVar[Optional[GraphRevalidation]] = contextvars.ContextVar(
+    "meta_revalidation_tracker", default=None
+)
+
+
+def _record_revalidation(not_modified: bool) -> None:
+    tracker = _revalidation_tracker.get()
+    if tracker is not None:
+        tracker.record(not_modified)
+
+
+@contextmanager
+def track_graph_revalidation():
+    """
+    Acompanha as leituras Graph feitas no bloco (inclusive no fan-out). Se todas voltarem
+    304, `tracker.unchanged` indica que o payload montado é igual ao anterior.
+    """
+    tracker = GraphRevalidation()
+    marker = _revalidation_tracker.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _revalidation_tracker.reset(marker)
+
+
+# Prazo (deadline) da requisição/job propagado até o gget: timeouts e retries encolhem ao que resta
+DEADLINE_MIN_ATTEMPT_SECONDS = float(os.getenv("META_DEADLINE_MIN_ATTEMPT_SECONDS", "1") or "1")
+
+
+class GraphDeadline:
+    """Prazo (monotônico) das chamadas Graph de um bloco; None = sem limite. Compartilhado pelo fan-out."""
+
+    __slots__ = ("expires_at", "exceeded", "parent")
+
+    def __init__(self, expires_at: Optional[float], parent: Optional["GraphDeadline"] = None):
+        self.expires_at = expires_at
+        self.exceeded = False
+        self.parent = parent
+
+    def remaining(self) -> Optional[float]:
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.monotonic()
+
+    def mark_exceeded(self) -> None:
+        deadline: Optional[GraphDeadline] = self
+        while deadline is not None:
+            deadline.exceeded = True
+            deadline = deadline.parent
+
+
+_graph_deadline: contextvars.ContextVar[Optional[GraphDeadline]] = contextvars.ContextVar(
+    "meta_graph_deadline", default=None
+)
+
+
+def _child_deadline(seconds: Optional[float]) -> GraphDeadline:
+    parent = _graph_deadline.get()
+    expires_at = parent.expires_at if parent is not None else None
+    if seconds is not None and seconds > 0:
+        candidate = time.monotonic() + seconds
+        expires_at = candidate if expires_at is None else min(expires_at, candidate)
+    return GraphDeadline(expires_at, parent)
+
+
+def start_graph_deadline(seconds: Optional[float]) -> contextvars.Token:
+    """Abre um prazo no contexto atual (ex.: before_request); devolver o marcador a reset_graph_deadline."""
+    return _graph_deadline.set(_child_deadline(seconds))
+
+
+def reset_graph_deadline(marker: contextvars.Token) -> None:
+    _graph_deadline.reset(marker)
+
+
+@contextmanager
+def graph_deadline(seconds: Optional[float] = None):
+    """
+    Limita as chamadas Graph do bloco a `seconds`. Prazos aninhados nunca passam do externo;
+    sem `seconds` herda o prazo atual. `deadline.exceeded` indica se alguma chamada do bloco
+    desistiu por falta de tempo (o resultado pode estar incompleto).
+    """
+    deadline = _child_deadline(seconds)
+    marker = _graph_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _graph_deadline.reset(marker)
+
+
+def graph_budget_remaining() -> Optional[float]:
+    """Segundos restantes do prazo atual (None quando não há prazo)."""
+    deadline = _graph_deadline.get()
+    return deadline.remaining() if deadline is not None else None
+
+
+def _deadline_error(path: str) -> MetaAPIError:
+    deadline = _graph_deadline.get()
+    if deadline is not None:
+        deadline.mark_exceeded()
+    logger.warning(f"Deadline exceeded before {path}")
+    return MetaAPIError(
+        status=504,
+        message="Meta Graph API request budget exhausted",
+        code=None,
+        error_type="deadline_exceeded",
+    )
+
+
+# Coalescência (singleflight) de GETs idênticos em andamento no processo
+SINGLEFLIGHT_ENABLED = os.getenv("META_SINGLEFLIGHT_ENABLED", "1") != "0"
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error", "waiters", "callbacks", "lane")
+
+    def __init__(self, lane: str):
+        self.lane = lane
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+        # Avisos para quem espera no loop assíncrono (não pode bloquear em done.wait)
+        self.callbacks: List[Callable[[], None]] = []
+
+
+_flights_lock = threading.Lock()
+_flights: Dict[str, _Flight] = {}
+_singleflight_stats: Dict[str, int] = {"leaders": 0, "deduplicated": 0}
+
+
+def _request_key(path: str, params: Optional[dict], token: Optional[str]) -> str:
+    """Chave estável de uma leitura Graph (path + params ordenados + token); o token entra só no hash."""
+    canonical = json.dumps(
+        sorted((str(key), str(value)) for key, value in (params or {}).items()),
+        separators=(",", ":"),
+    )
+    raw = f"{token or ''}\x00{path}\x00{canonical}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def _singleflight(key: str, func: Callable[[], Any]) -> Any:
+    """
+    Executa `func` uma única vez por chave entre threads concorrentes; as demais aguardam
+    e recebem o mesmo resultado (ou a mesma exceção). O payload é compartilhado: não mutar.
     """
-    Obtém page access token para uma página específica.
-    System User token não expira, então mantemos cache indefinidamente.
+    if not SINGLEFLIGHT_ENABLED:
+        return func()
+    flight, leader = _join_flight(key)
+    if not leader:
+        remaining = graph_budget_remaining()
+        if not flight.done.wait(timeout=None if remaining is None else max(0.0, remaining)):
+            raise _deadline_error("singleflight wait")
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+    try:
+        flight.result = func()
+        return flight.result
+    except BaseException as err:
+        flight.error = err
+        raise
+    finally:
+        _finish_flight(key, flight)
+
+
+def _join_flight(key: str) -> tuple:
+    """
+    (voo, é_líder): cria o voo da chave ou entra como espera de um já em andamento.
+    Chamadas interativas não esperam um líder em segundo plano (que pode estar cedendo a vez):
+    abrem o próprio voo, e quem chegar depois espera por ele.
+    """
+    lane = _graph_priority.get()
+    with _flights_lock:
+        flight = _flights.get(key)
+        if flight is None or (flight.lane == PRIORITY_BACKGROUND and lane != PRIORITY_BACKGROUND):
+            flight = _Flight(lane)
+            _flights[key] = flight
+            _singleflight_stats["leaders"] += 1
+            return flight, True
+        flight.waiters += 1
+        _singleflight_stats["deduplicated"] += 1
+        return flight, False
+
+
+def _finish_flight(key: str, flight: _Flight) -> None:
+    with _flights_lock:
+        if _flights.get(key) is flight:
+            del _flights[key]
+        flight.done.set()
+        callbacks = list(flight.callbacks)
+    for callback in callbacks:
+        callback()
+
+
+def get_singleflight_stats() -> Dict[str, Any]:
+    with _flights_lock:
+        stats: Dict[str, Any] = dict(_singleflight_stats)
+        stats["in_flight"] = len(_flights)
+    total = stats["leaders"] + stats["deduplicated"]
+    stats["dedup_ratio"] = round(stats["deduplicated"] / total, 4) if total else 0.0
+    return stats
+
+
+def gget(path: str, params: Optional[dict] = None, token: Optional[str] = None):
+    """
+    Faz requisição GET à Meta Graph API com retry exponencial e timeout configurável.
+    Chamadas concorrentes idênticas (path, params e token) são coalescidas em uma só e
+    o resultado fica alguns segundos no memo do processo (ver graph_memo_bypass). Depois
+    disso, a resposta guardada é revalidada com If-None-Match e um 304 a reaproveita.
 
     Args:
-        page_id: ID da página do Facebook
+        path: Caminho da API (ex: "/me")
+        params: Parâmetros da query string
+        token: Token de acesso (usa TOKEN global se não fornecido)
 
     Returns:
-        str: Page access token
+        dict: Resposta JSON da API
+
+    Raises:
+        MetaAPIError: Se a requisição falhar após todos os retries
     """
-    # Verificar cache primeiro
-    if page_id in PAGE_TOKEN_CACHE:
-        logger.debug(f"Using cached page token for {page_id}")
-        return PAGE_TOKEN_CACHE[page_id]
+    request_token, url, key = _prepare_get(path, params, token)
+    cached = _memo_lookup(key)
+    if cached is not None:
+        return cached
 
-    # Buscar token da API
-    logger.info(f"Fetching page access token for {page_id}")
-    data = gget(f"/{page_id}", {"fields": "access_token"})
-    token_value = data.get("access_token") if isinstance(data, dict) else None
+    def load():
+        validator = _memo_validator(key)
+        headers = {"If-None-Match": validator[0]} if validator else None
+        response = _send_with_retry("GET", url, path, token=request_token, detailed=True, headers=headers)
+        return _store_graph_response(key, path, validator, response)
 
-    if not token_value:
-        raise RuntimeError(f"Could not fetch page access token for {page_id}")
+    # Chamadas idênticas simultâneas compartilham a mesma requisição HTTP
+    return _singleflight(key, load)
 
-    # Armazenar em cache
-    PAGE_TOKEN_CACHE[page_id] = token_value
-    logger.info(f"Page token cached for {page_id}")
 
-    return token_value
+def _prepare_get(path: str, params: Optional[dict], token: Optional[str]) -> tuple:
+    """(token, URL assinada, chave de coalescência/memo) de uma leitura GET."""
+    request_token = _resolve_token(token, [path])
+    query = {"access_token": request_token}
+    proof = appsecret_proof(request_token)
+    if proof:
+        query["appsecret_proof"] = proof
+    if params:
+        query.update(params)
 
+    url = f"{BASE}{path}?{urlencode(query, doseq=True)}"
+    # Tokens do pool leem a mesma conta: memo e coalescência não dependem de qual foi escolhido
+    return request_token, url, _request_key(path, params, token or TOKEN or request_token)
 
-def sum_values(arr, key="value"):
-    return sum((x.get(key, 0) or 0) for x in arr if isinstance(x, dict))
 
+def _memo_lookup(key: str) -> Any:
+    if not MEMO_ENABLED:
+        return None
+    if _memo_bypass.get():
+        with _memo_lock:
+            _memo_stats["bypassed"] += 1
+        return None
+    cached = _memo_get(key)
+    if cached is not None:
+        _record_revalidation(False)
+    return cached
+
+
+def _store_graph_response(key: str, path: str, validator: Optional[tuple], response: _GraphResponse) -> Any:
+    """Grava a resposta no memo (um 304 reaproveita o payload do validador) e devolve o payload."""
+    if response.not_modified and validator:
+        etag, payload, size = validator
+        with _memo_lock:
+            _memo_stats["revalidations"] += 1
+            _memo_stats["not_modified"] += 1
+        _memo_put(key, path, payload, size, response.etag or etag)
+        _record_revalidation(True)
+        return payload
+    if validator:
+        with _memo_lock:
+            _memo_stats["revalidations"] += 1
+    _memo_put(key, path, response.payload, response.size, response.etag)
+    _record_revalidation(False)
+    return response.payload
+
+
+# Limite de sub-requisições por chamada batch da Graph API
+BATCH_MAX_SIZE = 50
+# Códigos de erro transitórios da Graph (rate limit / erro temporário)
+BATCH_RETRYABLE_ERROR_CODES = {1, 2, 4, 17, 32, 341, 613}
+
+
+def _batch_relative_url(path: str, params: Optional[dict]) -> str:
+    relative = path.lstrip("/")
+    if params:
+        relative = f"{relative}?{urlencode(params, doseq=True)}"
+    return relative
 
-def _coerce_number(value: Any) -> Optional[float]:
-    if isinstance(value, bool):
-        return float(value)
-    if isinstance(value, (int, float)):
-        return float(value)
-    if isinstance(value, str):
-        try:
-            return float(value.replace(',', '.'))
-        except ValueError:
-            return None
-    if isinstance(value, dict):
-        total = 0.0
-        has_value = False
-        for inner in value.values():
-            coerced = _coerce_number(inner)
-            if coerced is not None:
-                total += coerced
-                has_value = True
-        return total if has_value else None
-    return None
 
+def _decode_batch_entry(entry: Any) -> tuple:
+    """Converte um item da resposta batch em (resultado, deve_retentar)."""
+    if not isinstance(entry, dict):
+        # Item nulo: a Graph não concluiu a sub-requisição dentro do tempo do batch
+        return MetaAPIError(status=504, message="Batch item did not complete", error_type="batch_timeout"), True
 
-def extract_insight_values(payload: Dict[str, Any], name: str) -> List[float]:
-    if not isinstance(payload, dict):
-        return []
-    for item in payload.get('data', []):
-        if item.get('name') == name:
-            values: List[float] = []
-            for entry in item.get('values') or []:
-                if not isinstance(entry, dict):
-                    continue
-                coerced = _coerce_number(entry.get('value'))
-                if coerced is not None:
-                    values.append(coerced)
-            return values
-    return []
+    status = int(entry.get("code") or 0)
+    body_raw = entry.get("body")
+    try:
+        body = json.loads(body_raw) if isinstance(body_raw, str) else (body_raw or {})
+    except ValueError:
+        body = {"raw": body_raw}
+
+    if 200 <= status < 300:
+        return body, False
+
+    err = body.get("error") if isinstance(body, dict) else None
+    err = err if isinstance(err, dict) else {}
+    error = MetaAPIError(
+        status=status or 500,
+        message=err.get("message") or "Meta Graph API batch item failed",
+        code=err.get("code"),
+        error_type=err.get("type"),
+        raw=body if isinstance(body, dict) else {"raw": body_raw},
+    )
+    retryable = status in (429, 500, 502, 503, 504) or err.get("code") in BATCH_RETRYABLE_ERROR_CODES
+    return error, retryable
 
 
-def extract_insight_series(payload: Dict[str, Any], name: str) -> List[Dict[str, Any]]:
-    series: List[Dict[str, Any]] = []
-    if not isinstance(payload, dict):
-        return series
+def _batch_form(calls: Sequence[tuple], chunk: Sequence[int], token: str, proof: Optional[str]) -> Dict[str, str]:
+    batch = [
+        {"method": "GET", "relative_url": _batch_relative_url(*calls[index])}
+        for index in chunk
+    ]
+    form = {
+        "access_token": token,
+        "batch": json.dumps(batch, separators=(",", ":")),
+        "include_headers": "false",
+    }
+    if proof:
+        form["appsecret_proof"] = proof
+    return form
+
+
+def _apply_batch_entries(entries: Any, chunk: Sequence[int], results: List[Any], retry: List[int]) -> None:
+    if not isinstance(entries, list):
+        entries = []
+    for position, index in enumerate(chunk):
+        entry = entries[position] if position < len(entries) else None
+        result, retryable = _decode_batch_entry(entry)
+        results[index] = result
+        if retryable:
+            retry.append(index)
+
+
+def gbatch(
+    calls: Sequence[tuple],
+    token: Optional[str] = None,
+    max_retries: int = MAX_RETRIES,
+) -> List[Any]:
+    """
+    Executa várias leituras GET em chamadas batch da Graph API (até 50 por POST).
 
-    for item in payload.get('data', []):
-        if item.get('name') != name:
-            continue
-        for entry in item.get('values') or []:
-            if not isinstance(entry, dict):
-                continue
-            coerced = _coerce_number(entry.get('value'))
-            if coerced is None:
-                continue
-            end_time = entry.get('end_time') or entry.get('timestamp') or entry.get('time')
-            iso_date = None
-            if isinstance(end_time, str):
-                iso_date = end_time[:10]
-            elif isinstance(end_time, (int, float)):
-                iso_date = time.strftime("%Y-%m-%d", time.gmtime(int(end_time)))
-            if not iso_date:
+    Args:
+        calls: Sequência de tuplas (path, params), ex: ("/123/insights", {"metric": "reach"})
+        token: Token de acesso (usa TOKEN global se não fornecido)
+        max_retries: Tentativas para itens que falharem com erro transitório
+
+    Returns:
+        list: Um item por chamada, na mesma ordem: o JSON decodificado em caso de
+        sucesso ou a MetaAPIError correspondente em caso de falha do item.
+    """
+    request_token = _resolve_token(token, [path for path, _ in calls])
+    results: List[Any] = [None] * len(calls)
+    pending = list(range(len(calls)))
+    proof = appsecret_proof(request_token)
+    if calls:
+        # Batch não suporta If-None-Match: conta como conteúdo possivelmente alterado
+        _record_revalidation(False)
+
+    for attempt in range(max(1, max_retries)):
+        retry: List[int] = []
+        for offset in range(0, len(pending), BATCH_MAX_SIZE):
+            chunk = pending[offset:offset + BATCH_MAX_SIZE]
+            form = _batch_form(calls, chunk, request_token, proof)
+            try:
+                entries = _send_with_retry("POST", BASE, "/?batch", data=form, token=request_token,
+                                           cost=len(chunk))
+            except MetaAPIError as err:
+                # Falha do POST inteiro (já retentado): reportar em cada item do lote
+                for index in chunk:
+                    results[index] = err
                 continue
-            series.append({
-                "date": iso_date,
-                "value": coerced,
-            })
-    series.sort(key=lambda row: row["date"])
-    return series
+            _apply_batch_entries(entries, chunk, results, retry)
+
+        if not retry or attempt >= max_retries - 1:
+            break
+        wait_time = 2 ** attempt
+        logger.warning(
+            f"{len(retry)} batch item(s) failed. Retrying in {wait_time}s... "
+            f"(attempt {attempt + 1}/{max_retries})"
+        )
+        for index in retry:
+            _observe_graph_retry(calls[index][0], "batch_item")
+        time.sleep(wait_time)
+        pending = retry
+
+    return results
+
+
+# Fan-out concorrente para chamadas Graph independentes dentro dos fetchers
+FANOUT_MAX_WORKERS = int(os.getenv("META_FANOUT_MAX_WORKERS", "16") or "16")
+FANOUT_PER_TOKEN = int(os.getenv("META_FANOUT_PER_TOKEN", "8") or "8")
+# Pool separado para jobs em segundo plano: tarefas interativas nunca ficam na fila atrás deles
+FANOUT_BACKGROUND_WORKERS = int(os.getenv("META_FANOUT_BACKGROUND_WORKERS", "4") or "4")
+
+# Limite dos registros por token/objeto (semáforos, buckets, circuitos): os menos usados saem primeiro
+REGISTRY_MAX_KEYS = int(os.getenv("META_REGISTRY_MAX_KEYS", "4096") or "4096")
+
+_fanout_lock = threading.Lock()
+_fanout_executors: Dict[str, ThreadPoolExecutor] = {}
+_token_slots: "OrderedDict[str, threading.BoundedSemaphore]" = OrderedDict()
+
+
+def _lru_entry(
+    registry: "OrderedDict[Any, Any]",
+    lock: Any,
+    key: Any,
+    factory: Callable[[], Any],
+    evictable: Optional[Callable[[Any], bool]] = None,
+) -> Any:
+    """
+    Entrada `key` do registro (criada por `factory` se faltar), marcada como usada agora. Acima de
+    REGISTRY_MAX_KEYS as entradas menos usadas saem; `evictable` protege as que ainda guardam estado.
+    """
+    with lock:
+        entry = registry.get(key)
+        if entry is not None:
+            registry.move_to_end(key)
+            return entry
+        entry = registry[key] = factory()
+        excess = len(registry) - max(1, REGISTRY_MAX_KEYS)
+        if excess > 0:
+            for old_key in list(registry)[:-1]:
+                if excess <= 0:
+                    break
+                if evictable is None or evictable(registry[old_key]):
+                    del registry[old_key]
+                    excess -= 1
+        return entry
+
+
+def _token_key(token: Optional[str]) -> str:
+    if not token:
+        return "anonymous"
+    return hashlib.sha256(token.encode()).hexdigest()[:16]
+
+
+def _token_slot(token: Optional[str]) -> threading.BoundedSemaphore:
+    """Semáforo que limita as requisições HTTP simultâneas por token."""
+    return _lru_entry(
+        _token_slots, _fanout_lock, _token_key(token),
+        lambda: threading.BoundedSemaphore(max(1, FANOUT_PER_TOKEN)),
+    )
+
+
+def _get_fanout_executor() -> ThreadPoolExecutor:
+    """Pool da faixa de prioridade do contexto atual (graph_priority)."""
+    lane = _graph_priority.get()
+    executor = _fanout_executors.get(lane)
+    if executor is not None:
+        return executor
+    with _fanout_lock:
+        executor = _fanout_executors.get(lane)
+        if executor is None:
+            background = lane == PRIORITY_BACKGROUND
+            executor = ThreadPoolExecutor(
+                max_workers=max(1, FANOUT_BACKGROUND_WORKERS if background else FANOUT_MAX_WORKERS),
+                thread_name_prefix="meta-fanout-bg" if background else "meta-fanout",
+            )
+            _fanout_executors[lane] = executor
+    return executor
+
+
+class _FanoutTask:
+    """Tarefa que pode ser executada por um worker do pool ou pela própria thread chamadora."""
+
+    __slots__ = ("func", "context", "result", "done", "_claimed", "_lock")
+
+    def __init__(self, func: Callable[[], Any]):
+        self.func = func
+        # Propaga o contexto do chamador (ex.: graph_memo_bypass) para a thread do pool
+        self.context = contextvars.copy_context()
+        self.result: Any = None
+        self.done = threading.Event()
+        self._claimed = False
+        self._lock = threading.Lock()
+
+    def run(self) -> None:
+        with self._lock:
+            if self._claimed:
+                return
+            self._claimed = True
+        try:
+            self.result = self.context.run(self.func)
+        except Exception as err:  # noqa: BLE001
+            self.result = err
+        finally:
+            self.done.set()
+
+    def cancel(self) -> bool:
+        """Impede a execução se a tarefa ainda não foi iniciada."""
+        with self._lock:
+            if self._claimed:
+                return False
+            self._claimed = True
+        self.done.set()
+        return True
+
+
+def run_parallel(tasks: Sequence[Callable[[], Any]]) -> List[Any]:
+    """
+    Executa funções independentes (tipicamente chamadas Graph) em paralelo no pool compartilhado.
+
+    A thread chamadora também executa as tarefas que ainda não foram iniciadas, então
+    chamadas aninhadas (um fetcher paralelo dentro de outro) não travam o pool. O número
+    de requisições simultâneas por token é limitado em META_FANOUT_PER_TOKEN.
+
+    Returns:
+        list: Resultados na mesma ordem das tarefas; exceções são devolvidas como valor.
+    """
+    pending = [_FanoutTask(task) for task in tasks]
+    if len(pending) > 1 and FANOUT_MAX_WORKERS > 1:
+        executor = _get_fanout_executor()
+        for item in pending[1:]:
+            executor.submit(item.run)
+    for item in pending:
+        item.run()
+    for item in pending:
+        item.done.wait()
+    return [item.result for item in pending]
+
+
+def gget_many(calls: Sequence[tuple], token: Optional[str] = None) -> List[Any]:
+    """
+    Executa várias chamadas gget independentes em paralelo.
+
+    Args:
+        calls: Sequência de tuplas (path, params)
+        token: Token de acesso comum às chamadas
+
+    Returns:
+        list: JSON de cada chamada (ou a exceção levantada), na mesma ordem de `calls`.
+    """
+    return run_parallel([
+        (lambda path=path, params=params: gget(path, params, token=token))
+        for path, params in calls
+    ])
+
+
+# Limitador adaptativo guiado pelos headers de uso da Meta (X-App-Usage / X-Business-Use-Case-Usage)
+RATE_LIMIT_ENABLED = os.getenv("META_RATE_LIMIT_ENABLED", "1") != "0"
+RATE_LIMIT_TOKEN_RPS = float(os.getenv("META_RATE_LIMIT_TOKEN_RPS", "50") or "50")
+RATE_LIMIT_OBJECT_RPS = float(os.getenv("META_RATE_LIMIT_OBJECT_RPS", "20") or "20")
+RATE_LIMIT_BURST = float(os.getenv("META_RATE_LIMIT_BURST", "100") or "100")
+RATE_LIMIT_SLOWDOWN_PCT = float(os.getenv("META_RATE_LIMIT_SLOWDOWN_PCT", "60") or "60")
+RATE_LIMIT_MIN_FACTOR = float(os.getenv("META_RATE_LIMIT_MIN_FACTOR", "0.05") or "0.05")
+RATE_LIMIT_MAX_WAIT = float(os.getenv("META_RATE_LIMIT_MAX_WAIT", "30") or "30")  # segundos
+RATE_LIMIT_USAGE_TTL = float(os.getenv("META_RATE_LIMIT_USAGE_TTL", "300") or "300")  # segundos
+
+USAGE_HEADERS = ("x-app-usage", "x-ad-account-usage", "x-page-usage")
+BUC_USAGE_HEADER = "x-business-use-case-usage"
+
+
+class _TokenBucket:
+    """Token bucket com taxa ajustável e bloqueio temporário (quando a Meta pede para esperar)."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.base_rate = max(0.01, rate)
+        self.rate = self.base_rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.usage_pct = 0.0
+        self.usage_at = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, cost: float = 1.0) -> float:
+        """Reserva `cost` vagas e devolve quantos segundos o chamador deve esperar antes de usá-las."""
+        with self.lock:
+            now = time.monotonic()
+            if self.usage_at and now - self.usage_at > RATE_LIMIT_USAGE_TTL:
+                # Uso reportado ficou antigo: volta para a taxa base
+                self.rate = self.base_rate
+                self.usage_pct = 0.0
+                self.usage_at = 0.0
+            self._refill(now)
+            wait = max(0.0, self.blocked_until - now)
+            self.tokens -= cost
+            if self.tokens < 0:
+                wait = max(wait, -self.tokens / self.rate)
+            return wait
+
+    def headroom(self, cost: float, floor: float) -> float:
+        """Segundos até sobrarem `cost` vagas acima de `floor`, sem reservar nada."""
+        with self.lock:
+            self._refill(time.monotonic())
+            missing = cost + floor - self.tokens
+            return missing / self.rate if missing > 0 else 0.0
+
+    def release(self, cost: float = 1.0) -> None:
+        """Devolve vagas reservadas que não chegaram a ser usadas."""
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + cost)
+
+    def apply_usage(self, usage_pct: float, regain_seconds: float = 0.0) -> None:
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.usage_pct = usage_pct
+            self.usage_at = now
+            if usage_pct <= RATE_LIMIT_SLOWDOWN_PCT:
+                factor = 1.0
+            else:
+                remaining = max(0.0, 100.0 - usage_pct) / max(1.0, 100.0 - RATE_LIMIT_SLOWDOWN_PCT)
+                factor = max(RATE_LIMIT_MIN_FACTOR, remaining)
+            self.rate = self.base_rate * factor
+            if regain_seconds > 0:
+                self.blocked_until = max(self.blocked_until, now + regain_seconds)
+            elif usage_pct >= 100:
+                # Sem estimativa da Meta: pausa curta para o contador baixar
+                self.blocked_until = max(self.blocked_until, now + 60.0)
+
+    def load(self) -> float:
+        """Carga relativa (0 = ocioso): consumo recente do burst, uso reportado pela Meta e bloqueio."""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            load = 1.0 - self.tokens / self.capacity + self.usage_pct / 100.0
+            return load + 10.0 if self.blocked_until > now else load
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            now = time.monotonic()
+            return {
+                "rate": round(self.rate, 3),
+                "usage_pct": round(self.usage_pct, 1),
+                "blocked_for": round(max(0.0, self.blocked_until - now), 1),
+            }
+
+
+_rate_lock = threading.Lock()
+_token_buckets: "OrderedDict[str, _TokenBucket]" = OrderedDict()
+_object_buckets: "OrderedDict[str, _TokenBucket]" = OrderedDict()
+# Objeto do path (mídia, post...) -> objeto de negócio dono do uso BUC, conforme reportado pela Meta
+_buc_owners: "OrderedDict[str, str]" = OrderedDict()
+_rate_stats: Dict[str, float] = {"throttled": 0, "wait_seconds": 0.0, "rejected": 0}
+
+
+def _bucket_idle(bucket: _TokenBucket) -> bool:
+    # Bucket bloqueado pela Meta guarda a espera: não pode ser descartado
+    return bucket.blocked_until <= time.monotonic()
+
+
+def _bucket_for(registry: "OrderedDict[str, _TokenBucket]", key: str, rate: float) -> _TokenBucket:
+    return _lru_entry(registry, _rate_lock, key, lambda: _TokenBucket(rate, RATE_LIMIT_BURST), _bucket_idle)
+
+
+def _object_id_from_path(path: str) -> Optional[str]:
+    """Primeiro segmento do path Graph (/<id>/insights -> <id>); ignora /me e chamadas batch."""
+    segment = (path or "").strip("/").split("/", 1)[0].split("?", 1)[0]
+    if not segment or segment == "me":
+        return None
+    return segment
+
+
+def _buc_id(object_id: str) -> str:
+    """Id como aparece no header BUC (contas de anúncio vêm sem o prefixo act_)."""
+    return object_id[4:] if object_id.startswith("act_") else object_id
+
+
+def _rate_object_key(path: str) -> Optional[str]:
+    """
+    Chave do bucket de objeto: o dono BUC já visto para o objeto do path; senão a conta do escopo
+    de uso (graph_usage_scope); senão o próprio objeto.
+    """
+    object_id = _object_id_from_path(path)
+    if not object_id:
+        return None
+    object_id = _buc_id(object_id)
+    with _rate_lock:
+        owner = _buc_owners.get(object_id)
+        if owner is not None:
+            _buc_owners.move_to_end(object_id)
+            return owner
+    scope = _usage_scope.get()
+    if scope is not None and scope.owner_id != UNATTRIBUTED_OWNER:
+        return _buc_id(scope.owner_id)
+    return object_id
+
+
+def _remember_buc_owner(path: str, owner_id: str) -> None:
+    object_id = _object_id_from_path(path)
+    if not object_id or _buc_id(object_id) == owner_id:
+        return
+    _lru_entry(_buc_owners, _rate_lock, _buc_id(object_id), lambda: owner_id)
+
+
+def _usage_pct(entry: Any) -> float:
+    if not isinstance(entry, dict):
+        return 0.0
+    values = [
+        _coerce_number(entry.get(name)) or 0.0
+        for name in ("call_count", "total_cputime", "total_time", "acc_id_util_pct")
+    ]
+    return max(values) if values else 0.0
+
+
+def _parse_usage_header(raw: Optional[str]) -> Any:
+    if not raw:
+        return None
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return None
+
+
+def _rate_buckets(token: Optional[str], path: str) -> List[_TokenBucket]:
+    buckets = [_bucket_for(_token_buckets, _token_key(token), RATE_LIMIT_TOKEN_RPS)]
+    object_key = _rate_object_key(path)
+    if object_key:
+        buckets.append(_bucket_for(_object_buckets, object_key, RATE_LIMIT_OBJECT_RPS))
+    return buckets
+
+
+def _rate_limit_headroom(token: Optional[str], path: str, cost: int = 1) -> float:
+    """Espera até os buckets terem vaga sem invadir a reserva das chamadas interativas."""
+    if not RATE_LIMIT_ENABLED or PRIORITY_INTERACTIVE_RESERVE <= 0:
+        return 0.0
+    return max(
+        bucket.headroom(cost, bucket.capacity * PRIORITY_INTERACTIVE_RESERVE)
+        for bucket in _rate_buckets(token, path)
+    )
+
+
+def _rate_limit_acquire(token: Optional[str], path: str, cost: int = 1,
+                        max_wait: Optional[float] = None) -> None:
+    """
+    Aguarda vaga nos buckets do token e do objeto antes de enviar a requisição.
+    Se a espera passar de META_RATE_LIMIT_MAX_WAIT (ou de `max_wait`, o que restar do
+    prazo), falha como 429 sem chamar a Meta.
+    `cost` é o número de chamadas que a Meta contabiliza (itens de um batch).
+    """
+    wait = _rate_limit_reserve(token, path, cost, max_wait)
+    if wait > 0:
+        time.sleep(wait)
+
+
+def _rate_limit_reserve(token: Optional[str], path: str, cost: int = 1,
+                        max_wait: Optional[float] = None) -> float:
+    """Reserva as vagas e devolve a espera necessária (sem dormir); levanta 429 se passar do limite."""
+    if not RATE_LIMIT_ENABLED:
+        return 0.0
+    buckets = _rate_buckets(token, path)
+    waits = [bucket.reserve(cost) for bucket in buckets]
+    wait = max(waits)
+    if wait <= 0:
+        return 0.0
+    limit = RATE_LIMIT_MAX_WAIT if max_wait is None else min(RATE_LIMIT_MAX_WAIT, max_wait)
+    if wait > limit:
+        for bucket in buckets:
+            bucket.release(cost)
+        with _rate_lock:
+            _rate_stats["rejected"] += 1
+        logger.warning(f"Rate limiter rejected {path}: estimated wait {wait:.1f}s")
+        raise MetaAPIError(
+            status=429,
+            message=f"Local rate limit: Meta usage too high, retry in {int(wait)}s",
+            code=None,
+            error_type="rate_limited",
+        )
+    with _rate_lock:
+        _rate_stats["throttled"] += 1
+        _rate_stats["wait_seconds"] += wait
+    logger.debug(f"Rate limiter delaying {path} by {wait:.2f}s")
+    return wait
+
+
+def _rate_limit_observe(token: Optional[str], path: str, headers: Any) -> None:
+    """Atualiza os buckets com o uso reportado pela Meta na resposta."""
+    if not RATE_LIMIT_ENABLED or headers is None:
+        return
+    token_usage = 0.0
+    for name in USAGE_HEADERS:
+        parsed = _parse_usage_header(headers.get(name))
+        if parsed is not None:
+            token_usage = max(token_usage, _usage_pct(parsed))
+    buc = _parse_usage_header(headers.get(BUC_USAGE_HEADER))
+    if isinstance(buc, dict):
+        if len(buc) == 1:
+            # O uso desta chamada é contado no objeto de negócio: as próximas do mesmo objeto vão no bucket dele
+            _remember_buc_owner(path, str(next(iter(buc))))
+        # O limite BUC é da conta/página: só o bucket do objeto desacelera, o token segue livre
+        # para os demais clientes
+        for object_id, entries in buc.items():
+            object_usage = 0.0
+            regain = 0.0
+            for entry in entries if isinstance(entries, list) else [entries]:
+                object_usage = max(object_usage, _usage_pct(entry))
+                minutes = _coerce_number((entry or {}).get("estimated_time_to_regain_access")) if isinstance(entry, dict) else None
+                regain = max(regain, (minutes or 0.0) * 60)
+            _bucket_for(_object_buckets, str(object_id), RATE_LIMIT_OBJECT_RPS).apply_usage(object_usage, regain)
+    if token_usage <= 0:
+        return
+    _bucket_for(_token_buckets, _token_key(token), RATE_LIMIT_TOKEN_RPS).apply_usage(token_usage)
+
+
+def get_rate_limit_stats() -> Dict[str, Any]:
+    with _rate_lock:
+        stats: Dict[str, Any] = dict(_rate_stats)
+        token_items = list(_token_buckets.items())
+        object_items = list(_object_buckets.items())
+    stats["wait_seconds"] = round(stats["wait_seconds"], 2)
+    stats["tokens"] = {key: bucket.snapshot() for key, bucket in token_items}
+    stats["objects"] = {
+        key: snap for key, snap in ((k, b.snapshot()) for k, b in object_items)
+        if snap["usage_pct"] > 0 or snap["blocked_for"] > 0
+    }
+    return stats
+
+
+# Circuit breaker por família de endpoint e por token: com a Graph degradada, falha na hora
+CIRCUIT_ENABLED = os.getenv("META_CIRCUIT_ENABLED", "1") != "0"
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("META_CIRCUIT_FAILURE_THRESHOLD", "5") or "5")
+CIRCUIT_OPEN_SECONDS = float(os.getenv("META_CIRCUIT_OPEN_SECONDS", "30") or "30")
+CIRCUIT_MAX_OPEN_SECONDS = float(os.getenv("META_CIRCUIT_MAX_OPEN_SECONDS", "300") or "300")
+CIRCUIT_HALF_OPEN_PROBES = int(os.getenv("META_CIRCUIT_HALF_OPEN_PROBES", "1") or "1")
+CIRCUIT_FAILURE_STATUSES = {429, 500, 502, 503, 504}
+# Throttle de business use case: o limite é do objeto de negócio (conta/página), não da família
+BUC_THROTTLE_CODES = frozenset(range(80000, 80015))
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+
+class _CircuitBreaker:
+    """
+    closed -> open após N falhas seguidas; open -> half_open quando o prazo vence;
+    half_open deixa passar poucas sondas: sucesso fecha, falha reabre com prazo dobrado.
+    """
+
+    def __init__(self):
+        self.state = CIRCUIT_CLOSED
+        self.failures = 0
+        self.open_for = CIRCUIT_OPEN_SECONDS
+        self.opened_at = 0.0
+        self.probes = 0
+        self.opened = 0
+        self.rejected = 0
+        self.last_error: Optional[str] = None
+        self.lock = threading.Lock()
+
+    def _retry_after(self, now: float) -> float:
+        return max(0.0, self.opened_at + self.open_for - now)
+
+    def allow(self) -> float:
+        """0 libera a chamada; senão, segundos até a próxima sonda."""
+        with self.lock:
+            now = time.monotonic()
+            if self.state == CIRCUIT_OPEN:
+                if self._retry_after(now) > 0:
+                    self.rejected += 1
+                    return self._retry_after(now)
+                self.state = CIRCUIT_HALF_OPEN
+                self.probes = 0
+            if self.state == CIRCUIT_HALF_OPEN:
+                if self.probes >= max(1, CIRCUIT_HALF_OPEN_PROBES):
+                    self.rejected += 1
+                    return max(1.0, self._retry_after(now))
+                self.probes += 1
+            return 0.0
+
+    def release(self) -> None:
+        """Devolve a sonda de uma chamada que não chegou a ser enviada."""
+        with self.lock:
+            if self.state == CIRCUIT_HALF_OPEN and self.probes > 0:
+                self.probes -= 1
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.state = CIRCUIT_CLOSED
+            self.failures = 0
+            self.probes = 0
+            self.open_for = CIRCUIT_OPEN_SECONDS
+
+    def record_failure(self, reason: str) -> bool:
+        """Registra a falha e devolve True se o circuito abriu com ela."""
+        with self.lock:
+            self.last_error = reason
+            if self.state == CIRCUIT_HALF_OPEN:
+                self.open_for = min(CIRCUIT_MAX_OPEN_SECONDS, self.open_for * 2)
+            elif self.state == CIRCUIT_CLOSED:
+                self.failures += 1
+                if self.failures < max(1, CIRCUIT_FAILURE_THRESHOLD):
+                    return False
+            else:
+                return False
+            self.state = CIRCUIT_OPEN
+            self.opened_at = time.monotonic()
+            self.probes = 0
+            self.opened += 1
+            return True
+
+    @property
+    def is_open(self) -> bool:
+        with self.lock:
+            return self.state == CIRCUIT_OPEN and self._retry_after(time.monotonic()) > 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            now = time.monotonic()
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "retry_after": round(self._retry_after(now), 1) if self.state == CIRCUIT_OPEN else 0.0,
+                "opened": self.opened,
+                "rejected": self.rejected,
+                "last_error": self.last_error,
+            }
+
+
+_circuit_lock = threading.Lock()
+_circuits: "OrderedDict[tuple, _CircuitBreaker]" = OrderedDict()
+
+
+def endpoint_family(path: str) -> str:
+    """
+    Família do endpoint Graph: "ads" para /act_<id>/..., "batch" para o POST batch,
+    "node" para /<id> e a última aresta nos demais casos (/<id>/insights -> "insights").
+    """
+    raw = path or ""
+    if raw.startswith("/?batch"):
+        return "batch"
+    segments = [segment for segment in raw.split("?", 1)[0].strip("/").split("/") if segment]
+    if not segments:
+        return "node"
+    if segments[0].startswith("act_"):
+        return "ads"
+    return "node" if len(segments) == 1 else segments[-1]
+
+
+def _circuit_for(token: Optional[str], path: str) -> Optional[_CircuitBreaker]:
+    if not CIRCUIT_ENABLED:
+        return None
+    key = (endpoint_family(path), _token_key(token))
+    # Só circuitos fechados saem do registro quando ele passa do limite
+    return _lru_entry(_circuits, _circuit_lock, key, _CircuitBreaker, lambda breaker: breaker.state == CIRCUIT_CLOSED)
+
+
+def _circuit_enter(breaker: Optional[_CircuitBreaker], path: str) -> None:
+    """Falha como 503 `circuit_open` sem chamar a Meta enquanto o circuito estiver aberto."""
+    if breaker is None:
+        return
+    retry_after = breaker.allow()
+    if retry_after <= 0:
+        return
+    logger.debug(f"Circuit open for {path}: retry in {retry_after:.1f}s")
+    raise MetaAPIError(
+        status=503,
+        message=f"Meta Graph API circuit open for {endpoint_family(path)}, retry in {int(retry_after) or 1}s",
+        code=None,
+        error_type="circuit_open",
+        raw={"retry_after": round(retry_after, 1), "family": endpoint_family(path)},
+    )
+
+
+def _circuit_record(breaker: Optional[_CircuitBreaker], path: str, failure: Optional[str]) -> None:
+    if breaker is None:
+        return
+    if failure is None:
+        breaker.record_success()
+    elif breaker.record_failure(failure):
+        logger.warning(f"Circuit opened for {endpoint_family(path)} after failure: {failure}")
+
+
+def _buc_throttled(path: str, headers: Any, body: Any) -> bool:
+    """
+    429 de business use case (código 80000-80014 ou objeto a 100% no header BUC): pausa o bucket
+    do objeto, que só segura as chamadas daquela conta/página.
+    """
+    code = None
+    try:
+        payload = json.loads(body or b"{}")
+        code = (payload.get("error") or {}).get("code") if isinstance(payload, dict) else None
+    except (TypeError, ValueError, AttributeError):
+        pass
+    buc = _parse_usage_header(headers.get(BUC_USAGE_HEADER)) if headers is not None else None
+    saturated = isinstance(buc, dict) and any(
+        _usage_pct(entry) >= 100
+        for entries in buc.values()
+        for entry in (entries if isinstance(entries, list) else [entries])
+    )
+    object_key = _rate_object_key(path)
+    if object_key is None or (code not in BUC_THROTTLE_CODES and not saturated):
+        return False
+    # Sem estimativa no header, apply_usage(100) pausa o objeto por um minuto; uma estimativa já aplicada prevalece
+    _bucket_for(_object_buckets, object_key, RATE_LIMIT_OBJECT_RPS).apply_usage(100.0)
+    return True
+
+
+def _circuit_observe(breaker: Optional[_CircuitBreaker], path: str, status: int, headers: Any, body: Any) -> None:
+    """Registra a resposta no circuito da família; throttles de BUC contam só no objeto."""
+    if status == 429 and _buc_throttled(path, headers, body):
+        if breaker is not None:
+            breaker.release()
+        return
+    _circuit_record(breaker, path, f"HTTP {status}" if status in CIRCUIT_FAILURE_STATUSES else None)
+
+
+def _open_circuit(families: Sequence[str], token: Optional[str], page_id: Optional[str],
+                  owner_id: Optional[str] = None) -> Optional[tuple]:
+    if not CIRCUIT_ENABLED:
+        return None
+    if token is None:
+        # Page token em cache (chamadas da página) ou o que o pool escolheria para a conta
+        token = _peek_page_token(page_id) or select_graph_token(owner_id or page_id, route=False)
+    token_key = _token_key(token)
+    for family in families:
+        breaker = _circuits.get((family, token_key))
+        if breaker is not None and breaker.is_open:
+            return family, breaker
+    return None
+
+
+def graph_circuit_open(families: Sequence[str], token: Optional[str] = None,
+                       page_id: Optional[str] = None, owner_id: Optional[str] = None) -> bool:
+    """
+    Indica se algum circuito das famílias informadas está aberto para o token (por padrão o
+    que o pool escolheria para owner_id; com page_id, o page token já em cache, se houver).
+    """
+    return _open_circuit(families, token, page_id, owner_id) is not None
+
+
+def check_graph_circuit(families: Sequence[str], token: Optional[str] = None,
+                        page_id: Optional[str] = None, owner_id: Optional[str] = None) -> None:
+    """Levanta MetaAPIError `circuit_open` (503) se algum circuito das famílias estiver aberto."""
+    found = _open_circuit(families, token, page_id, owner_id)
+    if found is None:
+        return
+    family, breaker = found
+    retry_after = breaker.snapshot()["retry_after"]
+    raise MetaAPIError(
+        status=503,
+        message=f"Meta Graph API circuit open for {family}, retry in {int(retry_after) or 1}s",
+        code=None,
+        error_type="circuit_open",
+        raw={"retry_after": retry_after, "family": family},
+    )
+
+
+def get_circuit_stats() -> Dict[str, Any]:
+    with _circuit_lock:
+        items = list(_circuits.items())
+    circuits = {f"{family}:{token_key}": breaker.snapshot() for (family, token_key), breaker in items}
+    return {
+        "enabled": CIRCUIT_ENABLED,
+        "open": sum(1 for snap in circuits.values() if snap["state"] != CIRCUIT_CLOSED),
+        "circuits": circuits,
+    }
+
+
+# Contabilidade de uso da Graph por conta (owner_id) e recurso chamador, com orçamento diário suave
+USAGE_ENABLED = os.getenv("META_USAGE_ENABLED", "1") != "0"
+USAGE_FLUSH_SECONDS = float(os.getenv("META_USAGE_FLUSH_SECONDS", "60") or "60")
+# Chamadas por conta por dia (0 = sem limite); só vale para jobs em segundo plano
+ACCOUNT_DAILY_CALL_BUDGET = int(os.getenv("META_ACCOUNT_DAILY_CALL_BUDGET", "0") or "0")
+UNATTRIBUTED_OWNER = "-"
+UNATTRIBUTED_RESOURCE = "unscoped"
+
+
+def _parse_account_budgets(raw: Optional[str]) -> Dict[str, int]:
+    """Formato: "act_123=5000,17841400000=20000" (chamadas por dia, por owner_id)."""
+    budgets: Dict[str, int] = {}
+    for chunk in (raw or "").split(","):
+        owner_id, _, value = chunk.partition("=")
+        try:
+            budgets[owner_id.strip()] = int(value)
+        except ValueError:
+            continue
+    return budgets
+
+
+ACCOUNT_DAILY_BUDGETS = _parse_account_budgets(os.getenv("META_ACCOUNT_DAILY_BUDGETS"))
+
+
+class _UsageScope:
+    """Conta/recurso das chamadas do bloco. `budget_exceeded` indica que alguma foi barrada pelo orçamento."""
+
+    __slots__ = ("owner_id", "resource", "enforce_budget", "budget_exceeded", "parent")
+
+    def __init__(self, owner_id: str, resource: str, enforce_budget: bool,
+                 parent: Optional["_UsageScope"] = None):
+        self.owner_id = owner_id
+        self.resource = resource
+        self.enforce_budget = enforce_budget
+        self.budget_exceeded = False
+        self.parent = parent
+
+    def mark_budget_exceeded(self) -> None:
+        scope: Optional[_UsageScope] = self
+        while scope is not None:
+            scope.budget_exceeded = True
+            scope = scope.parent
+
+
+_usage_scope: contextvars.ContextVar[Optional[_UsageScope]] = contextvars.ContextVar("meta_usage_scope", default=None)
+_usage_lock = threading.Lock()
+_usage_flush_lock = threading.Lock()  # um flush por vez (worker, scheduler e atexit)
+_usage_pending: Dict[tuple, Dict[str, float]] = {}  # (dia, owner, recurso) -> deltas ainda não persistidos
+_usage_local: Dict[tuple, Dict[str, float]] = {}  # (dia, owner, recurso) -> totais do dia neste processo
+_usage_baseline: Dict[str, int] = {}  # owner -> chamadas do dia já persistidas (todos os processos)
+_usage_baseline_day: Optional[str] = None
+_usage_loader: Optional[Callable[[str], Dict[str, int]]] = None
+_usage_saver: Optional[Callable[[List[Dict[str, Any]]], None]] = None
+_usage_flushed_at = 0.0
+_usage_flushing = False
+_usage_stats: Dict[str, int] = {"budget_rejections": 0, "flushes": 0, "flush_failures": 0}
+
+
+def register_graph_usage_store(
+    loader: Callable[[str], Dict[str, int]],
+    saver: Callable[[List[Dict[str, Any]]], None],
+) -> None:
+    """
+    Registra o store persistente: `loader(dia_iso)` devolve {owner_id: chamadas} do dia somando
+    todos os processos e `saver(linhas)` acumula os deltas (dia, owner_id, recurso, calls, bytes,
+    latency_ms, errors).
+    """
+    global _usage_loader, _usage_saver, _usage_baseline_day
+    first = _usage_saver is None
+    _usage_loader = loader
+    _usage_saver = saver
+    _usage_baseline_day = None
+    if first:
+        atexit.register(flush_graph_usage, True)
+
+
+def _usage_day() -> str:
+    return datetime.now(timezone.utc).date().isoformat()
+
+
+@contextmanager
+def graph_usage_scope(owner_id: Optional[str], resource: Optional[str], enforce_budget: Optional[bool] = None):
+    """
+    Atribui as chamadas Graph do bloco a uma conta/recurso. Com enforce_budget=True (jobs em segundo
+    plano) as chamadas falham com account_budget_exceeded quando a conta estoura o orçamento diário;
+    None herda do escopo externo. `scope.budget_exceeded` indica se alguma chamada do bloco foi
+    barrada (fetchers engolem falhas de métricas opcionais, então o resultado pode estar incompleto).
+    """
+    parent = _usage_scope.get()
+    if enforce_budget is None:
+        enforce_budget = parent.enforce_budget if parent is not None else False
+    scope = _UsageScope(
+        str(owner_id or (parent.owner_id if parent else UNATTRIBUTED_OWNER)),
+        resource or (parent.resource if parent else UNATTRIBUTED_RESOURCE),
+        bool(enforce_budget),
+        parent,
+    )
+    marker = _usage_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _usage_scope.reset(marker)
+
+
+def _record_graph_usage(cost: int, size: int, elapsed: float, failed: bool) -> None:
+    if not USAGE_ENABLED:
+        return
+    scope = _usage_scope.get()
+    owner_id = scope.owner_id if scope is not None else UNATTRIBUTED_OWNER
+    resource = scope.resource if scope is not None else UNATTRIBUTED_RESOURCE
+    key = (_usage_day(), owner_id, resource)
+    with _usage_lock:
+        for registry in (_usage_pending, _usage_local):
+            entry = registry.setdefault(key, {"calls": 0, "bytes": 0, "latency_ms": 0.0, "errors": 0})
+            entry["calls"] += max(1, cost)
+            entry["bytes"] += size
+            entry["latency_ms"] += elapsed * 1000.0
+            if failed:
+                entry["errors"] += 1
+    _maybe_flush_usage()
+
+
+def _maybe_flush_usage() -> None:
+    global _usage_flushing
+    if time.time() - _usage_flushed_at < USAGE_FLUSH_SECONDS:
+        return
+    with _usage_lock:
+        if _usage_flushing:
+            return
+        _usage_flushing = True
+    # Persistência fora do caminho da chamada (e fora do loop assíncrono)
+    threading.Thread(target=_flush_usage_worker, name="meta-usage-flush", daemon=True).start()
+
+
+def _flush_usage_worker() -> None:
+    global _usage_flushing
+    try:
+        flush_graph_usage(force=True)
+    finally:
+        with _usage_lock:
+            _usage_flushing = False
+
+
+def _subtract_pending_usage(flushed: Dict[tuple, Dict[str, float]]) -> None:
+    """Tira dos pendentes o que já foi persistido; o que chegou depois do retrato continua pendente."""
+    for key, entry in flushed.items():
+        target = _usage_pending.get(key)
+        if target is None:
+            continue
+        for field, value in entry.items():
+            target[field] -= value
+        if target["calls"] <= 0:
+            del _usage_pending[key]
+
+
+def _add_to_usage_baseline(flushed: Dict[tuple, Dict[str, float]], today: str) -> None:
+    global _usage_baseline_day
+    if _usage_baseline_day != today:
+        _usage_baseline.clear()
+        _usage_baseline_day = today
+    for (day, owner_id, _resource), entry in flushed.items():
+        if day == today:
+            _usage_baseline[owner_id] = _usage_baseline.get(owner_id, 0) + int(entry["calls"])
+
+
+def flush_graph_usage(force: bool = False) -> None:
+    """
+    Persiste os deltas pendentes e recarrega o total do dia por conta (visão entre processos).
+    Os deltas só saem dos pendentes junto com a troca do total, sob o mesmo lock: em nenhum
+    momento o uso já gasto some da conta do orçamento.
+    """
+    global _usage_flushed_at, _usage_baseline_day
+    if not force and time.time() - _usage_flushed_at < USAGE_FLUSH_SECONDS:
+        return
+    with _usage_flush_lock:
+        _usage_flushed_at = time.time()
+        today = _usage_day()
+        with _usage_lock:
+            pending = {key: dict(entry) for key, entry in _usage_pending.items()}
+            for key in [key for key in _usage_local if key[0] != today]:
+                del _usage_local[key]
+
+        if _usage_saver is None:
+            # Sem store: o orçamento usa só o que este processo gastou
+            with _usage_lock:
+                _add_to_usage_baseline(pending, today)
+                _subtract_pending_usage(pending)
+            return
+
+        rows = [
+            {
+                "day": day,
+                "owner_id": owner_id,
+                "resource": resource,
+                "calls": int(entry["calls"]),
+                "bytes": int(entry["bytes"]),
+                "latency_ms": int(round(entry["latency_ms"])),
+                "errors": int(entry["errors"]),
+            }
+            for (day, owner_id, resource), entry in pending.items()
+        ]
+        try:
+            if rows:
+                _usage_saver(rows)
+        except Exception as err:  # noqa: BLE001
+            # Os deltas seguem pendentes para a próxima tentativa
+            logger.warning(f"Graph usage store flush failed: {err}")
+            with _usage_lock:
+                _usage_stats["flush_failures"] += 1
+            return
+        try:
+            totals = _usage_loader(today) if _usage_loader is not None else None
+        except Exception as err:  # noqa: BLE001
+            logger.warning(f"Graph usage store reload failed: {err}")
+            totals = None
+        with _usage_lock:
+            _usage_stats["flushes"] += 1
+            _subtract_pending_usage(pending)
+            if totals is None:
+                # Gravado, mas sem o total novo: o que saiu dos pendentes entra no total antigo
+                _add_to_usage_baseline(pending, today)
+                return
+            _usage_baseline.clear()
+            _usage_baseline.update({str(owner_id): int(calls or 0) for owner_id, calls in totals.items()})
+            _usage_baseline_day = today
+
+
+def account_daily_budget(owner_id: str) -> int:
+    """Orçamento diário de chamadas da conta (0 = sem limite)."""
+    return ACCOUNT_DAILY_BUDGETS.get(str(owner_id), ACCOUNT_DAILY_CALL_BUDGET)
+
+
+def account_calls_today(owner_id: str) -> int:
+    """Chamadas do dia da conta: total persistido no último flush + deltas pendentes deste processo."""
+    today = _usage_day()
+    owner_id = str(owner_id)
+    with _usage_lock:
+        used = _usage_baseline.get(owner_id, 0) if _usage_baseline_day == today else 0
+        for (day, pending_owner, _resource), entry in _usage_pending.items():
+            if day == today and pending_owner == owner_id:
+                used += int(entry["calls"])
+    return used
+
+
+def account_budget_status(owner_id: str) -> Dict[str, Any]:
+    limit = account_daily_budget(owner_id)
+    used = account_calls_today(owner_id)
+    return {
+        "owner_id": str(owner_id),
+        "used": used,
+        "limit": limit or None,
+        "remaining": max(0, limit - used) if limit else None,
+        "exceeded": bool(limit) and used >= limit,
+    }
+
+
+def account_over_budget(owner_id: str) -> bool:
+    limit = account_daily_budget(owner_id)
+    return bool(limit) and account_calls_today(owner_id) >= limit
+
+
+def _usage_budget_enter(path: str) -> None:
+    scope = _usage_scope.get()
+    if scope is None or not scope.enforce_budget or not USAGE_ENABLED:
+        return
+    status = account_budget_status(scope.owner_id)
+    if not status["exceeded"]:
+        return
+    scope.mark_budget_exceeded()
+    with _usage_lock:
+        _usage_stats["budget_rejections"] += 1
+    logger.info(f"Daily Graph budget exhausted for {scope.owner_id} ({status['used']}/{status['limit']}); skipping {path}")
+    raise MetaAPIError(
+        status=429,
+        message=f"Daily Graph call budget exhausted for {scope.owner_id}",
+        code=None,
+        error_type="account_budget_exceeded",
+        raw={"owner_id": scope.owner_id, "used": status["used"], "limit": status["limit"]},
+    )
+
+
+def get_graph_usage_stats(limit: int = 20) -> Dict[str, Any]:
+    """Uso do dia neste processo por conta e por recurso (chamadas, bytes, latência média, erros)."""
+    today = _usage_day()
+    by_owner: Dict[str, Dict[str, float]] = {}
+    by_resource: Dict[str, Dict[str, float]] = {}
+    with _usage_lock:
+        for (day, owner_id, resource), entry in _usage_local.items():
+            if day != today:
+                continue
+            for registry, name in ((by_owner, owner_id), (by_resource, resource)):
+                target = registry.setdefault(name, {"calls": 0, "bytes": 0, "latency_ms": 0.0, "errors": 0})
+                for field, value in entry.items():
+                    target[field] += value
+        stats = dict(_usage_stats)
+
+    def _summary(registry: Dict[str, Dict[str, float]], label: str) -> List[Dict[str, Any]]:
+        ordered = sorted(registry.items(), key=lambda item: item[1]["calls"], reverse=True)[:limit]
+        return [
+            {
+                label: name,
+                "calls": int(entry["calls"]),
+                "bytes": int(entry["bytes"]),
+                "avg_latency_ms": round(entry["latency_ms"] / entry["calls"], 1) if entry["calls"] else None,
+                "errors": int(entry["errors"]),
+            }
+            for name, entry in ordered
+        ]
+
+    owners = _summary(by_owner, "owner_id")
+    for entry in owners:
+        budget = account_daily_budget(entry["owner_id"])
+        entry["daily_budget"] = budget or None
+    return {
+        "enabled": USAGE_ENABLED,
+        "day": today,
+        "persistent": _usage_saver is not None,
+        "accounts": owners,
+        "resources": _summary(by_resource, "resource"),
+        **stats,
+    }
+
+
+# Faixas de prioridade das chamadas Graph: rotas interativas passam na frente de warm/ingest/refresh
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BACKGROUND = "background"
+PRIORITY_LANES = (PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND)
+# Chamadas em segundo plano simultâneas (no processo) sem demanda interativa; não usam as vagas por token
+PRIORITY_BACKGROUND_MAX_INFLIGHT = int(os.getenv("META_PRIORITY_BACKGROUND_MAX_INFLIGHT", "4") or "4")
+# ... e enquanto há demanda interativa (0 = cede totalmente)
+PRIORITY_BACKGROUND_YIELD_INFLIGHT = int(os.getenv("META_PRIORITY_BACKGROUND_YIELD_INFLIGHT", "0") or "0")
+# A demanda interativa segue "presente" por esse intervalo após a última chamada (rajadas de um dashboard)
+PRIORITY_INTERACTIVE_GRACE = float(os.getenv("META_PRIORITY_INTERACTIVE_GRACE", "1") or "1")
+# Após esperar isso, uma chamada em segundo plano passa mesmo com demanda (evita inanição)
+PRIORITY_BACKGROUND_MAX_YIELD = float(os.getenv("META_PRIORITY_BACKGROUND_MAX_YIELD", "15") or "15")
+# Fração do burst dos rate limiters que o segundo plano não consome (fica para as rotas)
+PRIORITY_INTERACTIVE_RESERVE = float(os.getenv("META_PRIORITY_INTERACTIVE_RESERVE", "0.3") or "0.3")
+PRIORITY_POLL_SECONDS = 0.05
+
+_graph_priority: contextvars.ContextVar[str] = contextvars.ContextVar("meta_graph_priority", default=PRIORITY_INTERACTIVE)
+_lane_lock = threading.Lock()
+_lane_inflight: Dict[str, int] = {lane: 0 for lane in PRIORITY_LANES}
+_lane_interactive_at = float("-inf")  # monotônico da última chamada interativa concluída
+_lane_stats: Dict[str, float] = {"interactive": 0, "background": 0, "background_waits": 0, "background_wait_seconds": 0.0, "forced": 0}
+
+
+@contextmanager
+def graph_priority(lane: str):
+    """
+    Define a faixa das chamadas Graph do bloco. PRIORITY_BACKGROUND (jobs, pré-aquecimento,
+    refresh em segundo plano) espera enquanto houver demanda interativa; sem bloco, vale interativa.
+    """
+    if lane not in PRIORITY_LANES:
+        raise ValueError(f"Unknown Graph priority lane: {lane}")
+    marker = _graph_priority.set(lane)
+    try:
+        yield lane
+    finally:
+        _graph_priority.reset(marker)
+
+
+def current_graph_priority() -> str:
+    """Faixa de prioridade em vigor no contexto atual."""
+    return _graph_priority.get()
+
+
+def _interactive_demand(now: float) -> bool:
+    return _lane_inflight[PRIORITY_INTERACTIVE] > 0 or now - _lane_interactive_at < PRIORITY_INTERACTIVE_GRACE
+
+
+def _lane_try_enter(lane: str, token: Optional[str], path: str, cost: int, waited: float) -> float:
+    """Admite a chamada na faixa (0.0) ou devolve quantos segundos esperar antes de tentar de novo."""
+    if lane != PRIORITY_BACKGROUND:
+        with _lane_lock:
+            _lane_inflight[lane] += 1
+            _lane_stats[lane] += 1
+        return 0.0
+    forced = waited >= PRIORITY_BACKGROUND_MAX_YIELD
+    if not forced:
+        headroom = _rate_limit_headroom(token, path, cost)
+        if headroom > 0:
+            return min(max(headroom, PRIORITY_POLL_SECONDS), 1.0)
+    with _lane_lock:
+        limit = PRIORITY_BACKGROUND_MAX_INFLIGHT
+        if _interactive_demand(time.monotonic()):
+            limit = max(1, PRIORITY_BACKGROUND_YIELD_INFLIGHT) if forced else PRIORITY_BACKGROUND_YIELD_INFLIGHT
+        if _lane_inflight[lane] >= max(0, limit):
+            return PRIORITY_POLL_SECONDS
+        _lane_inflight[lane] += 1
+        _lane_stats[lane] += 1
+        if waited > 0:
+            _lane_stats["background_waits"] += 1
+            _lane_stats["background_wait_seconds"] += waited
+            _lane_stats["forced"] += int(forced)
+    return 0.0
+
+
+def _lane_wait_check(deadline: Optional[GraphDeadline], path: str, pause: float) -> None:
+    remaining = _deadline_remaining(deadline)
+    if remaining is not None and remaining < pause + DEADLINE_MIN_ATTEMPT_SECONDS:
+        raise _deadline_error(path)
+
+
+def _lane_enter(token: Optional[str], path: str, cost: int, deadline: Optional[GraphDeadline]) -> str:
+    """Entra na faixa do contexto; em segundo plano cede a vez às chamadas interativas."""
+    lane = _graph_priority.get()
+    started = time.monotonic()
+    while True:
+        pause = _lane_try_enter(lane, token, path, cost, time.monotonic() - started)
+        if pause <= 0:
+            return lane
+        _lane_wait_check(deadline, path, pause)
+        time.sleep(pause)
+
+
+async def _alane_enter(token: Optional[str], path: str, cost: int, deadline: Optional[GraphDeadline]) -> str:
+    lane = _graph_priority.get()
+    started = time.monotonic()
+    while True:
+        pause = _lane_try_enter(lane, token, path, cost, time.monotonic() - started)
+        if pause <= 0:
+            return lane
+        _lane_wait_check(deadline, path, pause)
+        await asyncio.sleep(pause)
+
+
+def _lane_token_slot(lane: str, token: Optional[str], asynchronous: bool = False) -> Any:
+    """
+    Vaga por token só para a faixa interativa: o segundo plano já é limitado por
+    META_PRIORITY_BACKGROUND_MAX_INFLIGHT e não pode ocupar as vagas das rotas.
+    """
+    if lane == PRIORITY_BACKGROUND:
+        return nullcontext()
+    return _async_token_slot(token) if asynchronous else _token_slot(token)
+
+
+def _lane_leave(lane: str) -> None:
+    global _lane_interactive_at
+    with _lane_lock:
+        _lane_inflight[lane] -= 1
+        if lane == PRIORITY_INTERACTIVE:
+            _lane_interactive_at = time.monotonic()
+
+
+def get_priority_stats() -> Dict[str, Any]:
+    with _lane_lock:
+        stats: Dict[str, Any] = dict(_lane_stats)
+        stats["inflight"] = dict(_lane_inflight)
+        stats["interactive_demand"] = _interactive_demand(time.monotonic())
+    stats["background_wait_seconds"] = round(stats["background_wait_seconds"], 2)
+    stats["background_max_inflight"] = PRIORITY_BACKGROUND_MAX_INFLIGHT
+    return stats
+
+
+# Pool de tokens: cada conta (página, perfil IG, conta de anúncios) pode ser lida por vários tokens
+# (System User + usuários que entraram com o Facebook); cada chamada vai para o menos carregado
+TOKEN_POOL_ENABLED = os.getenv("META_TOKEN_POOL_ENABLED", "1") != "0"
+TOKEN_POOL_SYNC_SECONDS = float(os.getenv("META_TOKEN_POOL_SYNC_SECONDS", "300") or "300")
+# Tokens que vencem dentro desse intervalo deixam de receber chamadas
+TOKEN_POOL_EXPIRY_MARGIN = float(os.getenv("META_TOKEN_POOL_EXPIRY_MARGIN", "300") or "300")
+# Token sem permissão para a conta (erros 10/200-299) sai da rotação daquela conta por esse tempo
+TOKEN_POOL_DENIED_SECONDS = float(os.getenv("META_TOKEN_POOL_DENIED_SECONDS", "21600") or "21600")
+PERMISSION_ERROR_CODES = {10} | set(range(200, 300))
+
+
+class _PooledToken(NamedTuple):
+    token: str
+    owners: frozenset
+    label: str
+    expires_at: Optional[float]  # epoch; None = não expira
+
+
+_token_pool_lock = threading.Lock()
+_token_pool: Dict[str, _PooledToken] = {}  # chave do token -> token
+_owner_tokens: Dict[str, set] = {}  # owner_id -> chaves dos tokens que podem lê-lo
+_token_pool_stored: set = set()  # chaves vindas do store (a sincronização pode removê-las)
+_token_pool_routes: Dict[str, int] = {}  # chave do token -> chamadas roteadas
+_token_pool_denied: "OrderedDict[tuple, float]" = OrderedDict()  # (chave do token, owner) -> até (epoch)
+_token_pool_loader: Optional[Callable[[], List[tuple]]] = None
+_token_pool_invalidator: Optional[Callable[[str], None]] = None
+_token_pool_synced_at = 0.0
+_token_pool_syncing = False
+_token_pool_stats: Dict[str, int] = {"invalidated": 0, "denied": 0, "sync_failures": 0}
+
+
+def register_graph_token(token: str, owners: Sequence[str], label: Optional[str] = None,
+                         expires_at: Optional[float] = None) -> str:
+    """Adiciona (ou atualiza) um token no pool com as contas que ele pode ler; devolve a chave do token."""
+    key = _token_key(token)
+    entry = _PooledToken(token, frozenset(str(owner) for owner in owners if owner), label or key, expires_at)
+    with _token_pool_lock:
+        _drop_pooled_token(key)
+        _token_pool[key] = entry
+        for owner in entry.owners:
+            _owner_tokens.setdefault(owner, set()).add(key)
+    return key
+
+
+def unregister_graph_token(token_key: str) -> None:
+    with _token_pool_lock:
+        _drop_pooled_token(token_key)
+
+
+def _drop_pooled_token(key: str) -> None:
+    # Chamado com _token_pool_lock
+    entry = _token_pool.pop(key, None)
+    if entry is None:
+        return
+    for owner in entry.owners:
+        keys = _owner_tokens.get(owner)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del _owner_tokens[owner]
+
+
+def register_graph_token_store(
+    loader: Callable[[], List[tuple]],
+    invalidator: Callable[[str], None],
+) -> None:
+    """
+    Registra o store persistente do pool: `loader()` devolve [(token, owners, rótulo, expira_em_epoch)]
+    válidos e `invalidator(chave)` marca um token rejeitado pela Meta (erro 190).
+    """
+    global _token_pool_loader, _token_pool_invalidator, _token_pool_synced_at
+    _token_pool_loader = loader
+    _token_pool_invalidator = invalidator
+    _token_pool_synced_at = 0.0
+    sync_token_pool()
+
+
+def sync_token_pool() -> None:
+    """Recarrega os tokens do store (novos logins em outros workers, tokens invalidados)."""
+    global _token_pool_synced_at
+    if _token_pool_loader is None:
+        return
+    _token_pool_synced_at = time.time()
+    try:
+        rows = _token_pool_loader() or []
+    except Exception as err:  # noqa: BLE001
+        with _token_pool_lock:
+            _token_pool_stats["sync_failures"] += 1
+        logger.warning(f"Token pool store read failed: {err}")
+        return
+    loaded = {register_graph_token(*row) for row in rows}
+    with _token_pool_lock:
+        for key in _token_pool_stored - loaded:
+            _drop_pooled_token(key)
+        _token_pool_stored.clear()
+        _token_pool_stored.update(loaded)
+
+
+def _maybe_sync_token_pool() -> None:
+    global _token_pool_syncing
+    if _token_pool_loader is None or time.time() - _token_pool_synced_at < TOKEN_POOL_SYNC_SECONDS:
+        return
+    with _token_pool_lock:
+        if _token_pool_syncing:
+            return
+        _token_pool_syncing = True
+
+    def run() -> None:
+        global _token_pool_syncing
+        try:
+            sync_token_pool()
+        finally:
+            with _token_pool_lock:
+                _token_pool_syncing = False
+
+    # Leitura do store fora do caminho da chamada (e fora do loop assíncrono)
+    threading.Thread(target=run, name="meta-token-pool", daemon=True).start()
+
+
+def _token_load(token: str) -> float:
+    return _bucket_for(_token_buckets, _token_key(token), RATE_LIMIT_TOKEN_RPS).load()
+
+
+def select_graph_token(owner_id: Optional[str] = None, route: bool = True) -> Optional[str]:
+    """
+    Token menos carregado entre os que podem ler a conta; o System User sempre concorre.
+    Com route=False só consulta a escolha, sem contá-la como chamada roteada ao token.
+    """
+    if not TOKEN_POOL_ENABLED or owner_id is None:
+        return TOKEN
+    _maybe_sync_token_pool()
+    now = time.time()
+    limit = now + TOKEN_POOL_EXPIRY_MARGIN
+    owner_id = str(owner_id)
+    with _token_pool_lock:
+        candidates = [
+            entry.token
+            for key, entry in ((key, _token_pool.get(key)) for key in _owner_tokens.get(owner_id, ()))
+            if entry is not None
+            and (entry.expires_at is None or entry.expires_at > limit)
+            and _token_pool_denied.get((key, owner_id), 0.0) <= now
+        ]
+    if TOKEN:
+        candidates.insert(0, TOKEN)
+    if len(candidates) <= 1:
+        return candidates[0] if candidates else None
+    # Carga arredondada (~10 chamadas do burst); no empate, o token que recebeu menos chamadas
+    with _token_pool_lock:
+        routed = {token: _token_pool_routes.get(_token_key(token), 0) for token in candidates}
+    chosen = min(candidates, key=lambda token: (round(_token_load(token), 1), routed[token]))
+    if not route:
+        return chosen
+    key = _token_key(chosen)
+    with _token_pool_lock:
+        _token_pool_routes[key] = _token_pool_routes.get(key, 0) + 1
+    return chosen
+
+
+def _owner_for_call(paths: Sequence[str]) -> Optional[str]:
+    """Conta dona da chamada: a do escopo de uso ou o objeto do path; /me e afins ficam com o token padrão."""
+    objects = [_object_id_from_path(path) for path in paths]
+    if not objects or None in objects:
+        return None
+    scope = _usage_scope.get()
+    if scope is not None and scope.owner_id != UNATTRIBUTED_OWNER:
+        return scope.owner_id
+    return objects[0] if len(set(objects)) == 1 else None
+
+
+def _resolve_token(token: Optional[str], paths: Sequence[str]) -> str:
+    """Token explícito ou, sem ele, o escolhido pelo pool para a conta da chamada."""
+    request_token = token or select_graph_token(_owner_for_call(paths))
+    if not request_token:
+        raise RuntimeError("META_SYSTEM_USER_TOKEN is not configured")
+    return request_token
+
+
+def _pinned_token(token: Optional[str], path: str) -> str:
+    """Token de uma iteração paginada: escolhido uma vez, para todas as páginas seguirem no mesmo."""
+    return _resolve_token(token, [path])
+
+
+def _invalidate_pooled_token(token: str) -> bool:
+    key = _token_key(token)
+    with _token_pool_lock:
+        if key not in _token_pool:
+            return False
+        _drop_pooled_token(key)
+        _token_pool_stored.discard(key)
+        _token_pool_stats["invalidated"] += 1
+    if _token_pool_invalidator is not None:
+        try:
+            _token_pool_invalidator(key)
+        except Exception as err:  # noqa: BLE001
+            logger.warning(f"Token pool store update failed: {err}")
+    logger.warning(f"Pooled Graph token {key} rejected by Meta; removed from the pool")
+    return True
+
+
+def _deny_pooled_token(token: str, owner_id: Optional[str]) -> bool:
+    """
+    Erro de permissão (10/200-299): o token segue no pool para as outras contas, mas deixa de ser
+    escolhido para esta (a sincronização com o store não o devolve antes do prazo).
+    """
+    key = _token_key(token)
+    if owner_id is None:
+        return False
+    with _token_pool_lock:
+        if key not in _token_pool:
+            return False
+        _token_pool_denied[(key, str(owner_id))] = time.time() + TOKEN_POOL_DENIED_SECONDS
+        _token_pool_denied.move_to_end((key, str(owner_id)))
+        while len(_token_pool_denied) > max(1, REGISTRY_MAX_KEYS):
+            _token_pool_denied.popitem(last=False)
+        _token_pool_stats["denied"] += 1
+    logger.warning(f"Pooled Graph token {key} lacks permission for {owner_id}; skipped for that account")
+    return True
+
+
+def discover_token_owners(token: str) -> List[str]:
+    """Contas (páginas, perfis IG e contas de anúncios) que o token consegue ler."""
+    owners: List[str] = []
+    for page in paginate("/me/accounts", {"fields": "id,instagram_business_account{id}", "limit": 100}, token):
+        owners.append(str(page.get("id") or ""))
+        ig_account = page.get("instagram_business_account")
+        if isinstance(ig_account, dict):
+            owners.append(str(ig_account.get("id") or ""))
+    for ad in paginate("/me/adaccounts", {"fields": "id", "limit": 100}, token):
+        owners.append(str(ad.get("id") or ""))
+    return sorted({owner for owner in owners if owner})
+
+
+def get_token_pool_stats() -> Dict[str, Any]:
+    now = time.time()
+    with _token_pool_lock:
+        entries = list(_token_pool.items())
+        routes = dict(_token_pool_routes)
+        stats: Dict[str, Any] = dict(_token_pool_stats)
+        stats["owners"] = len(_owner_tokens)
+    stats["enabled"] = TOKEN_POOL_ENABLED
+    stats["persistent"] = _token_pool_loader is not None
+    stats["tokens"] = [
+        {
+            "key": key,
+            "label": entry.label,
+            "owners": len(entry.owners),
+            "expires_in": round(entry.expires_at - now) if entry.expires_at else None,
+            "routed": routes.get(key, 0),
+            "load": round(_token_load(entry.token), 3),
+        }
+        for key, entry in entries
+    ]
+    if TOKEN:
+        stats["system_routed"] = routes.get(_token_key(TOKEN), 0)
+    return stats
+
+
+# Métricas do cliente Graph (por processo) no formato texto do Prometheus, exportadas em /metrics:
+# latência por template de path e recurso chamador, respostas por classe, retries, bytes e profundidade da paginação
+METRICS_ENABLED = os.getenv("META_METRICS_ENABLED", "1") != "0"
+METRICS_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # segundos
+METRICS_PAGINATION_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)  # páginas
+_GRAPH_ID_SEGMENT = re.compile(r"^(act_)?\d+(_\d+)?$")
+
+
+class MetricHistogram:
+    __slots__ = ("bounds", "counts", "total", "count")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)  # por faixa (não cumulativo; acumulado na exportação)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for index, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+        self.total += value
+        self.count += 1
+
+    def snapshot(self) -> "MetricHistogram":
+        copy = MetricHistogram(self.bounds)
+        copy.counts = list(self.counts)
+        copy.total = self.total
+        copy.count = self.count
+        return copy
+
+
+_metrics_lock = threading.Lock()
+_latency_histograms: Dict[tuple, MetricHistogram] = {}  # (endpoint, resource)
+_pagination_histograms: Dict[tuple, MetricHistogram] = {}  # (endpoint,)
+_response_counters: Dict[tuple, int] = {}  # (endpoint, status)
+_retry_counters: Dict[tuple, int] = {}  # (endpoint, reason)
+_bytes_counters: Dict[tuple, int] = {}  # (endpoint,)
+
+
+def graph_path_template(path: str) -> str:
+    """Template do path Graph para rótulos: /17841400000/insights -> /{id}/insights, /?batch -> /batch."""
+    raw = (path or "").split("?", 1)[0]
+    if not raw.strip("/") and "batch" in (path or ""):
+        return "/batch"
+    segments = [segment for segment in raw.strip("/").split("/") if segment]
+    return "/" + "/".join("{id}" if _GRAPH_ID_SEGMENT.match(segment) else segment for segment in segments)
+
+
+def _status_class(status: Any) -> str:
+    if not isinstance(status, int):
+        return str(status)
+    if status in (304, 429):
+        return str(status)
+    return f"{status // 100}xx"
+
+
+def _observe_graph_response(path: str, status: Any, elapsed: Optional[float], size: int) -> None:
+    """Uma tentativa HTTP: status (código ou "timeout"/"error"), duração e bytes recebidos."""
+    if not METRICS_ENABLED:
+        return
+    endpoint = graph_path_template(path)
+    scope = _usage_scope.get()
+    resource = scope.resource if scope is not None else UNATTRIBUTED_RESOURCE
+    with _metrics_lock:
+        key = (endpoint, _status_class(status))
+        _response_counters[key] = _response_counters.get(key, 0) + 1
+        if size:
+            _bytes_counters[(endpoint,)] = _bytes_counters.get((endpoint,), 0) + size
+        if elapsed is not None:
+            histogram = _latency_histograms.get((endpoint, resource))
+            if histogram is None:
+                histogram = _latency_histograms[(endpoint, resource)] = MetricHistogram(METRICS_LATENCY_BUCKETS)
+            histogram.observe(elapsed)
+
+
+def _observe_graph_retry(path: str, reason: Any) -> None:
+    if not METRICS_ENABLED:
+        return
+    key = (graph_path_template(path), _status_class(reason))
+    with _metrics_lock:
+        _retry_counters[key] = _retry_counters.get(key, 0) + 1
+
+
+def _observe_pagination(path: str, pages: int) -> None:
+    if not METRICS_ENABLED or pages <= 0:
+        return
+    key = (graph_path_template(path),)
+    with _metrics_lock:
+        histogram = _pagination_histograms.get(key)
+        if histogram is None:
+            histogram = _pagination_histograms[key] = MetricHistogram(METRICS_PAGINATION_BUCKETS)
+        histogram.observe(pages)
+
+
+def _metric_labels(names: Sequence[str], values: Sequence[Any]) -> str:
+    if not names:
+        return ""
+    escaped = (
+        str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        for value in values
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+def render_metric_counter(lines: List[str], name: str, help_text: str, names: Sequence[str],
+                          samples: Dict[tuple, int]) -> None:
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} counter")
+    for labels, value in sorted(samples.items()):
+        lines.append(f"{name}{_metric_labels(names, labels)} {value}")
+
+
+def render_metric_gauge(lines: List[str], name: str, help_text: str, names: Sequence[str],
+                        samples: Dict[tuple, float]) -> None:
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} gauge")
+    for labels, value in sorted(samples.items()):
+        lines.append(f"{name}{_metric_labels(names, labels)} {value}")
+
+
+def render_metric_histogram(lines: List[str], name: str, help_text: str, names: Sequence[str],
+                            samples: Dict[tuple, MetricHistogram]) -> None:
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for labels, histogram in sorted(samples.items()):
+        cumulative = 0
+        for bound, count in zip(histogram.bounds, histogram.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_metric_labels([*names, 'le'], [*labels, bound])} {cumulative}")
+        lines.append(f"{name}_bucket{_metric_labels([*names, 'le'], [*labels, '+Inf'])} {histogram.count}")
+        lines.append(f"{name}_sum{_metric_labels(names, labels)} {histogram.total:.6f}")
+        lines.append(f"{name}_count{_metric_labels(names, labels)} {histogram.count}")
+
+
+def render_graph_metrics() -> str:
+    """Métricas do cliente Graph deste processo no formato texto do Prometheus (0.0.4)."""
+    with _metrics_lock:
+        latency = {key: value.snapshot() for key, value in _latency_histograms.items()}
+        pagination = {key: value.snapshot() for key, value in _pagination_histograms.items()}
+        responses = dict(_response_counters)
+        retries = dict(_retry_counters)
+        received = dict(_bytes_counters)
+    with _rate_lock:
+        rate = dict(_rate_stats)
+    lines: List[str] = []
+    render_metric_histogram(lines, "graph_request_duration_seconds",
+                      "Duration of Graph API HTTP attempts by path template and calling resource.",
+                      ("endpoint", "resource"), latency)
+    render_metric_counter(lines, "graph_responses_total",
+                    "Graph API HTTP attempts by path template and status class (2xx, 304, 4xx, 429, 5xx, timeout, error).",
+                    ("endpoint", "status"), responses)
+    render_metric_counter(lines, "graph_retries_total",
+                    "Graph API retries by path template and reason.", ("endpoint", "reason"), retries)
+    render_metric_counter(lines, "graph_response_bytes_total",
+                    "Bytes received from the Graph API by path template.", ("endpoint",), received)
+    render_metric_histogram(lines, "graph_pagination_depth",
+                      "Pages fetched per paginated Graph traversal.", ("endpoint",), pagination)
+    render_metric_counter(lines, "graph_rate_limit_throttled_total",
+                    "Graph calls delayed by the local rate limiter.", (), {(): int(rate["throttled"])})
+    render_metric_counter(lines, "graph_rate_limit_rejected_total",
+                    "Graph calls rejected by the local rate limiter.", (), {(): int(rate["rejected"])})
+    return "\n".join(lines) + "\n"
+
+
+# Paginação unificada (cursor/next) sobre gget, com retry por página e prefetch opcional
+PAGINATION_DROP_PARAMS = {"access_token", "appsecret_proof"}
+
+
+def _next_page_request(next_url: str) -> Optional[tuple]:
+    """Converte a URL `paging.next` em (path, params) para reenviar via gget (sem o token embutido)."""
+    parts = urlsplit(next_url)
+    path = parts.path or ""
+    base_path = urlsplit(BASE).path.rstrip("/")
+    if base_path and path.startswith(base_path + "/"):
+        path = path[len(base_path):]
+    else:
+        segments = path.lstrip("/").split("/", 1)
+        if len(segments) == 2 and segments[0][:1] == "v" and segments[0][1:2].isdigit():
+            path = "/" + segments[1]
+    if not path or path == "/":
+        return None
+    params = {
+        key: value
+        for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if key not in PAGINATION_DROP_PARAMS
+    }
+    return path, params
+
+
+def _follow_page(page: Any) -> Optional[tuple]:
+    next_url = (page.get("paging") or {}).get("next") if isinstance(page, dict) else None
+    return _next_page_request(next_url) if next_url else None
+
+
+def parse_graph_timestamp(value: Any) -> Optional[datetime]:
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        candidate = str(value).replace("Z", "+00:00")
+        if len(candidate) > 5 and candidate[-5] in {"+", "-"} and ":" not in candidate[-5:]:
+            candidate = f"{candidate[:-2]}:{candidate[-2:]}"
+        try:
+            parsed = datetime.fromisoformat(candidate)
+        except ValueError:
+            return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def iter_pages(
+    path: str,
+    params: Optional[dict] = None,
+    token: Optional[str] = None,
+    *,
+    prefetch: bool = False,
+    max_pages: Optional[int] = None,
+    fetch: Optional[Callable[[str, dict], Dict[str, Any]]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Gera as páginas (payload completo) de um edge paginado da Graph API.
+
+    Cada página passa por gget (retry, limitador de taxa), ou por `fetch(path, params)`
+    quando informado. Com prefetch=True a página N+1 é buscada no pool de fan-out
+    enquanto o chamador processa a página N.
+    """
+    def load(request: tuple) -> Dict[str, Any]:
+        req_path, req_params = request
+        if fetch is not None:
+            return fetch(req_path, req_params)
+        return gget(req_path, req_params, token=token)
+
+    pages = 0
+    if fetch is None:
+        token = _pinned_token(token, path)
+    try:
+        request: Optional[tuple] = (path, dict(params or {}))
+        page = load(request)
+        while True:
+            pages += 1
+            request = _follow_page(page)
+            if max_pages is not None and pages >= max_pages:
+                request = None
+            pending: Optional[_FanoutTask] = None
+            if request is not None and prefetch:
+                pending = _FanoutTask(lambda req=request: load(req))
+                _get_fanout_executor().submit(pending.run)
+            try:
+                yield page
+            except GeneratorExit:
+                # Consumidor encerrou cedo: descarta o prefetch se ainda não começou
+                if pending is not None:
+                    pending.cancel()
+                raise
+            if request is None:
+                return
+            if pending is not None:
+                pending.run()
+                pending.done.wait()
+                if isinstance(pending.result, Exception):
+                    raise pending.result
+                page = pending.result
+            else:
+                page = load(request)
+    finally:
+        # Profundidade efetivamente percorrida (inclui o encerramento antecipado pelo consumidor)
+        _observe_pagination(path, pages)
+
+
+def paginate(
+    path: str,
+    params: Optional[dict] = None,
+    token: Optional[str] = None,
+    *,
+    prefetch: bool = False,
+    stop_before: Optional[Any] = None,
+    timestamp_field: str = "timestamp",
+    max_pages: Optional[int] = None,
+    fetch: Optional[Callable[[str, dict], Dict[str, Any]]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Gera os itens de `data` de todas as páginas, sob demanda.
+
+    stop_before (datetime ou unix) pula itens mais antigos que o limite e encerra a
+    paginação ao fim da página em que eles aparecem (edges em ordem cronológica reversa).
+    """
+    cutoff: Optional[datetime] = None
+    if isinstance(stop_before, datetime):
+        cutoff = stop_before if stop_before.tzinfo else stop_before.replace(tzinfo=timezone.utc)
+    elif stop_before is not None:
+        cutoff = datetime.fromtimestamp(int(stop_before), tz=timezone.utc)
+
+    pages = iter_pages(path, params, token, prefetch=prefetch, max_pages=max_pages, fetch=fetch)
+    try:
+        for page in pages:
+            data = page.get("data") if isinstance(page, dict) else None
+            if not isinstance(data, list) or not data:
+                return
+            reached_cutoff = False
+            for item in data:
+                if not isinstance(item, dict):
+                    continue
+                if cutoff is not None:
+                    item_ts = parse_graph_timestamp(item.get(timestamp_field))
+                    if item_ts is not None and item_ts < cutoff:
+                        reached_cutoff = True
+                        continue
+                yield item
+            if reached_cutoff:
+                return
+    finally:
+        pages.close()
+
+
+# Page access tokens: LRU em memória na frente do store persistente (page_token_store, criptografado),
+# compartilhado entre workers. Invalidados no erro 190 e renovados em segundo plano ao envelhecer.
+PAGE_TOKEN_CACHE_SIZE = int(os.getenv("META_PAGE_TOKEN_CACHE_SIZE", "512") or "512")
+PAGE_TOKEN_REFRESH_SECONDS = float(os.getenv("META_PAGE_TOKEN_REFRESH_SECONDS", "43200") or "43200")
+AUTH_ERROR_CODES = {190}
+
+
+class _PageToken(NamedTuple):
+    token: str
+    fetched_at: float  # epoch
+
+
+_page_token_lock = threading.Lock()
+_page_tokens: "OrderedDict[str, _PageToken]" = OrderedDict()
+_page_token_refreshing: set = set()
+_page_token_loader: Optional[Callable[[str, str], Optional[tuple]]] = None
+_page_token_saver: Optional[Callable[[str, str, str, float], None]] = None
+_page_token_deleter: Optional[Callable[[str, str], None]] = None
+_page_token_stats: Dict[str, int] = {
+    "hits": 0,
+    "store_hits": 0,
+    "fetches": 0,
+    "refreshes": 0,
+    "invalidations": 0,
+    "evictions": 0,
+}
+
+
+def register_page_token_store(
+    loader: Callable[[str, str], Optional[tuple]],
+    saver: Callable[[str, str, str, float], None],
+    deleter: Callable[[str, str], None],
+) -> None:
+    """
+    Registra o store persistente de page tokens: `loader(page_id, origem)` devolve
+    (token, buscado_em_epoch) ou None, `saver(page_id, origem, token, buscado_em)` grava e
+    `deleter(page_id, origem)` remove. `origem` identifica o token do System User que gerou o page token.
+    """
+    global _page_token_loader, _page_token_saver, _page_token_deleter
+    _page_token_loader = loader
+    _page_token_saver = saver
+    _page_token_deleter = deleter
+
+
+def _page_token_source() -> str:
+    return _token_key(TOKEN)
+
+
+def _remember_page_token(page_id: str, entry: _PageToken) -> None:
+    with _page_token_lock:
+        _page_tokens[page_id] = entry
+        _page_tokens.move_to_end(page_id)
+        while len(_page_tokens) > max(1, PAGE_TOKEN_CACHE_SIZE):
+            _page_tokens.popitem(last=False)
+            _page_token_stats["evictions"] += 1
+
+
+def _peek_page_token(page_id: Optional[str]) -> Optional[str]:
+    """Page token já em memória (sem I/O nem renovação)."""
+    if not page_id:
+        return None
+    with _page_token_lock:
+        entry = _page_tokens.get(page_id)
+    return entry.token if entry is not None else None
+
+
+def _load_stored_page_token(page_id: str) -> Optional[_PageToken]:
+    if _page_token_loader is None:
+        return None
+    try:
+        stored = _page_token_loader(page_id, _page_token_source())
+    except Exception as err:  # noqa: BLE001
+        logger.warning(f"Page token store read failed: {err}")
+        return None
+    if not stored:
+        return None
+    entry = _PageToken(*stored)
+    _remember_page_token(page_id, entry)
+    with _page_token_lock:
+        _page_token_stats["store_hits"] += 1
+    return entry
+
+
+def _cached_page_token(page_id: str, load: bool = True) -> Optional[str]:
+    """LRU e depois o store (com load=True); agenda a renovação quando o token passou da idade."""
+    with _page_token_lock:
+        entry = _page_tokens.get(page_id)
+        if entry is not None:
+            _page_tokens.move_to_end(page_id)
+            _page_token_stats["hits"] += 1
+    if entry is None and load:
+        entry = _load_stored_page_token(page_id)
+    if entry is None:
+        return None
+    if time.time() - entry.fetched_at > PAGE_TOKEN_REFRESH_SECONDS:
+        _schedule_page_token_refresh(page_id)
+    return entry.token
+
+
+def _page_token_from_payload(page_id: str, data: Any) -> str:
+    token_value = data.get("access_token") if isinstance(data, dict) else None
+    if not token_value:
+        raise RuntimeError(f"Could not fetch page access token for {page_id}")
+    entry = _PageToken(token_value, time.time())
+    _remember_page_token(page_id, entry)
+    with _page_token_lock:
+        _page_token_stats["fetches"] += 1
+    if _page_token_saver is not None:
+        try:
+            _page_token_saver(page_id, _page_token_source(), entry.token, entry.fetched_at)
+        except Exception as err:  # noqa: BLE001
+            logger.warning(f"Page token store write failed: {err}")
+    logger.info(f"Page token cached for {page_id}")
+    return token_value
+
+
+def _schedule_page_token_refresh(page_id: str) -> None:
+    """Renova o page token numa thread em segundo plano; quem pediu segue com o token atual."""
+    with _page_token_lock:
+        if page_id in _page_token_refreshing:
+            return
+        _page_token_refreshing.add(page_id)
+
+    def run() -> None:
+        try:
+            with graph_priority(PRIORITY_BACKGROUND), graph_memo_bypass():
+                _page_token_from_payload(page_id, gget(f"/{page_id}", {"fields": "access_token"}))
+            with _page_token_lock:
+                _page_token_stats["refreshes"] += 1
+        except Exception as err:  # noqa: BLE001
+            logger.warning(f"Page token refresh failed for {page_id}: {err}")
+        finally:
+            with _page_token_lock:
+                _page_token_refreshing.discard(page_id)
+
+    threading.Thread(target=run, name="meta-page-token", daemon=True).start()
+
+
+def invalidate_page_token(page_id: str) -> None:
+    """Descarta o page token da página (memória e store); o próximo uso busca outro na Graph."""
+    with _page_token_lock:
+        _page_tokens.pop(page_id, None)
+        _page_token_stats["invalidations"] += 1
+    if _page_token_deleter is not None:
+        try:
+            _page_token_deleter(page_id, _page_token_source())
+        except Exception as err:  # noqa: BLE001
+            logger.warning(f"Page token store delete failed: {err}")
+    logger.warning(f"Page token invalidated for {page_id}")
+
+
+def _note_auth_error(token: Optional[str], err: MetaAPIError, path: str) -> None:
+    """
+    Erro 190: um token do pool ou um page token foi revogado/expirou e sai de circulação.
+    Erro de permissão: o token do pool deixa de ser escolhido para a conta da chamada.
+    """
+    if not token or token == TOKEN:
+        return
+    if err.code in PERMISSION_ERROR_CODES:
+        _deny_pooled_token(token, _owner_for_call([path]))
+        return
+    if err.code not in AUTH_ERROR_CODES:
+        return
+    if _invalidate_pooled_token(token):
+        return
+    with _page_token_lock:
+        page_ids = [page_id for page_id, entry in _page_tokens.items() if entry.token == token]
+    for page_id in page_ids:
+        invalidate_page_token(page_id)
+
+
+def get_page_token_stats() -> Dict[str, Any]:
+    with _page_token_lock:
+        stats: Dict[str, Any] = dict(_page_token_stats)
+        stats["cached"] = len(_page_tokens)
+        stats["refreshing"] = len(_page_token_refreshing)
+    stats["persistent"] = _page_token_saver is not None
+    return stats
+
+
+def get_page_access_token(page_id: str) -> str:
+    """
+    Obtém page access token para uma página específica: LRU em memória, depois o store
+    persistente (compartilhado entre workers) e, por fim, a Graph API.
+
+    Args:
+        page_id: ID da página do Facebook
+
+    Returns:
+        str: Page access token
+    """
+    cached = _cached_page_token(page_id)
+    if cached:
+        logger.debug(f"Using cached page token for {page_id}")
+        return cached
+
+    # Buscar token da API (sem memo: pode ter sido invalidado há pouco)
+    logger.info(f"Fetching page access token for {page_id}")
+    with graph_memo_bypass():
+        data = gget(f"/{page_id}", {"fields": "access_token"})
+    return _page_token_from_payload(page_id, data)
+
+
+def sum_values(arr, key="value"):
+    return sum((x.get(key, 0) or 0) for x in arr if isinstance(x, dict))
+
+
+def _coerce_number(value: Any) -> Optional[float]:
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value.replace(',', '.'))
+        except ValueError:
+            return None
+    if isinstance(value, dict):
+        total = 0.0
+        has_value = False
+        for inner in value.values():
+            coerced = _coerce_number(inner)
+            if coerced is not None:
+                total += coerced
+                has_value = True
+        return total if has_value else None
+    return None
+
+
+def extract_insight_values(payload: Dict[str, Any], name: str) -> List[float]:
+    if not isinstance(payload, dict):
+        return []
+    for item in payload.get('data', []):
+        if item.get('name') == name:
+            values: List[float] = []
+            for entry in item.get('values') or []:
+                if not isinstance(entry, dict):
+                    continue
+                coerced = _coerce_number(entry.get('value'))
+                if coerced is not None:
+                    values.append(coerced)
+            return values
+    return []
+
+
+def extract_insight_series(payload: Dict[str, Any], name: str) -> List[Dict[str, Any]]:
+    series: List[Dict[str, Any]] = []
+    if not isinstance(payload, dict):
+        return series
+
+    for item in payload.get('data', []):
+        if item.get('name') != name:
+            continue
+        for entry in item.get('values') or []:
+            if not isinstance(entry, dict):
+                continue
+            coerced = _coerce_number(entry.get('value'))
+            if coerced is None:
+                continue
+            end_time = entry.get('end_time') or entry.get('timestamp') or entry.get('time')
+            iso_date = None
+            if isinstance(end_time, str):
+                iso_date = end_time[:10]
+            elif isinstance(end_time, (int, float)):
+                iso_date = time.strftime("%Y-%m-%d", time.gmtime(int(end_time)))
+            if not iso_date:
+                continue
+            series.append({
+                "date": iso_date,
+                "value": coerced,
+            })
+    series.sort(key=lambda row: row["date"])
+    return series
+
+
+def insight_value_from_list(items: List[Dict[str, Any]], name: str) -> Optional[float]:
+    if not isinstance(items, list):
+        return None
+    for item in items:
+        if item.get('name') == name:
+            values = item.get('values') or []
+            if not values:
+                return None
+            first = values[0]
+            if isinstance(first, dict):
+                return _coerce_number(first.get('value'))
+            return _coerce_number(first)
+    return None
+
+
+def aggregate_dimension_values(payload: Dict[str, Any], target_name: str) -> Dict[str, float]:
+    """Agrupa valores de métricas com breakdown do Graph API."""
+    results: Dict[str, float] = {}
+    if not isinstance(payload, dict):
+        return results
+    for item in payload.get("data", []):
+        if item.get("name") != target_name:
+            continue
+        for entry in item.get("values") or []:
+            value = entry.get("value")
+            if isinstance(value, dict):
+                for key, raw in value.items():
+                    coerced = _coerce_number(raw)
+                    if coerced is None:
+                        continue
+                    results[key] = results.get(key, 0.0) + coerced
+            else:
+                coerced = _coerce_number(value)
+                if coerced is None:
+                    continue
+                results["total"] = results.get("total", 0.0) + coerced
+    return results
+
+
+def extract_time_series(payload: Dict[str, Any], target_name: str) -> List[Dict[str, Any]]:
+    """Extrai séries temporais ordenadas (ex.: follower_count)."""
+    series: List[Dict[str, Any]] = []
+    if not isinstance(payload, dict):
+        return series
+    for item in payload.get("data", []):
+        if item.get("name") != target_name:
+            continue
+        for entry in item.get("values") or []:
+            raw_val = entry.get("value")
+            coerced = None
+            if isinstance(raw_val, dict):
+                coerced = _coerce_number(raw_val.get("value"))
+            if coerced is None:
+                coerced = _coerce_number(raw_val)
+            if coerced is None:
+                continue
+            series.append({
+                "value": coerced,
+                "end_time": entry.get("end_time"),
+                "start_time": entry.get("start_time"),
+            })
+    series.sort(key=lambda row: (row.get("end_time") or row.get("start_time") or ""))
+    return series
+
+
+# Segmentos diários: as janelas de instagram_metrics e facebook_metrics guardam as métricas
+# aditivas por dia (UTC). Qualquer intervalo, e o período anterior usado nas comparações, é
+# montado a partir dos dias já salvos; só os dias que faltam vão à Graph, em trechos contíguos.
+# Dias recentes ainda mudam (alcance consolidando, likes chegando): são buscados de novo quando
+# a última busca tem mais de DAY_SEGMENT_RECENT_TTL segundos e foi feita antes de o dia assentar.
+DAY_SECONDS = 86_400
+DAY_SEGMENTS_ENABLED = os.getenv("META_DAY_SEGMENTS", "1") != "0"
+DAY_SEGMENT_SETTLE_DAYS = max(0, int(os.getenv("META_DAY_SEGMENT_SETTLE_DAYS", "3") or "3"))
+DAY_SEGMENT_RECENT_TTL = max(0, int(os.getenv("META_DAY_SEGMENT_RECENT_TTL", "3600") or "3600"))
+# Maior intervalo since/until aceito pela Graph em period=day: trechos maiores são divididos
+IG_SEGMENT_MAX_RUN_DAYS = 30
+FB_PAGE_SEGMENT_MAX_RUN_DAYS = 93
+
+# Store persistente (registrado por day_segment_store quando há banco)
+_day_segment_loader: Optional[Callable[[str, str, str, str], Dict[str, tuple]]] = None
+_day_segment_saver: Optional[Callable[[str, str, Dict[str, Dict[str, Any]]], None]] = None
+_day_segment_lock = threading.Lock()
+_day_segment_stats = {
+    "requests": 0,
+    "stored_days": 0,
+    "fetched_days": 0,
+    "recent_refetches": 0,
+    "runs": 0,
+    "incomplete_runs": 0,
+    "store_errors": 0,
+}
+
+
+class _SegmentFetch:
+    """Sub-chamadas que falharam (e foram ignoradas pelo fetcher) na busca de um trecho de segmentos."""
+
+    __slots__ = ("failures",)
+
+    def __init__(self):
+        self.failures = 0
+
+
+_segment_fetch: contextvars.ContextVar[Optional[_SegmentFetch]] = contextvars.ContextVar(
+    "meta_segment_fetch", default=None
+)
+
+
+def _note_segment_failure(err: BaseException) -> None:
+    """
+    Fetchers de segmentos chamam ao engolir a falha de uma sub-chamada: o trecho é servido, mas não
+    gravado (senão o dia assentado ficaria sem o dado para sempre). Rejeição da métrica não conta.
+    """
+    if isinstance(err, MetaAPIError) and _is_metric_rejection(err):
+        return
+    tracker = _segment_fetch.get()
+    if tracker is not None:
+        tracker.failures += 1
+
+
+def register_day_segment_store(
+    loader: Callable[[str, str, str, str], Dict[str, tuple]],
+    saver: Callable[[str, str, Dict[str, Dict[str, Any]]], None],
+) -> None:
+    """
+    Registra o store de segmentos diários: `loader(recurso, owner_id, primeiro_dia, último_dia)`
+    devolve {dia ISO: (segmento, buscado_em_epoch)} e `saver(recurso, owner_id, {dia: segmento})`
+    grava os dias recém-buscados.
+    """
+    global _day_segment_loader, _day_segment_saver
+    _day_segment_loader = loader
+    _day_segment_saver = saver
+
+
+def day_segments_enabled() -> bool:
+    return DAY_SEGMENTS_ENABLED and _day_segment_loader is not None and _day_segment_saver is not None
+
+
+def day_range(since: int, until: int) -> tuple:
+    """Alinha (since, until) a dias UTC inteiros: since para baixo e until para cima (dia parcial conta)."""
+    start = since - since % DAY_SECONDS
+    end = until if until % DAY_SECONDS == 0 else until - until % DAY_SECONDS + DAY_SECONDS
+    return start, max(end, start + DAY_SECONDS)
+
+
+def segment_day(ts: int) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).date().isoformat()
+
+
+def insight_day(entry: Dict[str, Any]) -> Optional[str]:
+    """Dia medido por um valor diário de insights: o end_time marca o fim do dia, então é o anterior."""
+    end_time = entry.get("end_time") if isinstance(entry, dict) else None
+    if not isinstance(end_time, str) or len(end_time) < 10:
+        return None
+    try:
+        measured = datetime.fromisoformat(end_time[:10])
+    except ValueError:
+        return None
+    return segment_day(int(measured.replace(tzinfo=timezone.utc).timestamp()) - DAY_SECONDS)
+
+
+def _segment_is_fresh(day_ts: int, fetched_at: float, now: float, refresh_recent: bool) -> bool:
+    # Buscado depois de o dia assentar: não muda mais
+    if fetched_at >= day_ts + (DAY_SEGMENT_SETTLE_DAYS + 1) * DAY_SECONDS:
+        return True
+    return not refresh_recent and now - fetched_at < DAY_SEGMENT_RECENT_TTL
+
+
+def _contiguous_runs(day_starts: Sequence[int], max_days: Optional[int] = None) -> List[tuple]:
+    runs: List[list] = []
+    for ts in day_starts:
+        if runs and runs[-1][1] == ts and (not max_days or ts - runs[-1][0] < max_days * DAY_SECONDS):
+            runs[-1][1] = ts + DAY_SECONDS
+        else:
+            runs.append([ts, ts + DAY_SECONDS])
+    return [tuple(run) for run in runs]
+
+
+def day_segments(
+    resource: str,
+    owner_id: str,
+    since: int,
+    until: int,
+    fetch_days: Callable[[str, int, int], Any],
+    max_run_days: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Segmentos de cada dia de [since, until) (alinhado por day_range), em ordem. Dias ausentes no
+    store ou vencidos vão à Graph via `fetch_days(owner_id, início, fim)`, uma corrotina por trecho
+    contíguo (de até `max_run_days` dias) que devolve {dia ISO: segmento}; dias sem dado na
+    resposta viram segmento vazio. Trechos com sub-chamadas que falharam (_note_segment_failure),
+    ou buscados com o prazo esgotado, são servidos mas não gravados. Refresh forçado
+    (graph_memo_bypass) rebusca os dias ainda não assentados. Sem store registrado, todos os dias
+    vão à Graph e nada é gravado.
+    """
+    start, end = day_range(since, until)
+    day_starts = list(range(start, end, DAY_SECONDS))
+    days = [segment_day(ts) for ts in day_starts]
+    now = time.time()
+    refresh_recent = _memo_bypass.get()
+    use_store = day_segments_enabled()
+
+    stored: Dict[str, tuple] = {}
+    store_failed = False
+    if use_store:
+        try:
+            stored = _day_segment_loader(resource, owner_id, days[0], days[-1]) or {}
+        except Exception as err:  # noqa: BLE001
+            store_failed = True
+            logger.warning(f"Day segment store read failed for {resource}/{owner_id}: {err}")
+
+    segments: Dict[str, Dict[str, Any]] = {}
+    missing: List[int] = []
+    recent_refetches = 0
+    for ts, day in zip(day_starts, days):
+        entry = stored.get(day)
+        if entry is not None:
+            segment, fetched_at = entry
+            if _segment_is_fresh(ts, fetched_at, now, refresh_recent):
+                segments[day] = segment
+                continue
+            recent_refetches += 1
+        missing.append(ts)
+
+    if len(missing) < len(days):
+        # Dias vindos do store não passam por revalidação: o payload montado pode ter mudado
+        _record_revalidation(False)
+
+    runs = _contiguous_runs(missing, max_run_days)
+    fetched: Dict[str, Dict[str, Any]] = {}
+    complete: Dict[str, Dict[str, Any]] = {}
+    incomplete_runs = 0
+    if runs:
+        async def fetch_run(run_start: int, run_end: int):
+            # Cada trecho roda numa task própria: o rastreador vale só para as chamadas dele
+            tracker = _SegmentFetch()
+            _segment_fetch.set(tracker)
+            result = await fetch_days(owner_id, run_start, run_end)
+            return result, tracker.failures
+
+        async def fetch_runs():
+            return await gather_graph(*(fetch_run(run_start, run_end) for run_start, run_end in runs))
+
+        for (run_start, run_end), result in zip(runs, run_graph_sync(fetch_runs())):
+            if isinstance(result, Exception):
+                raise result
+            result, failures = result
+            run_segments = {
+                segment_day(ts): result.get(segment_day(ts)) or {}
+                for ts in range(run_start, run_end, DAY_SECONDS)
+            }
+            fetched.update(run_segments)
+            if failures:
+                incomplete_runs += 1
+            else:
+                complete.update(run_segments)
+        segments.update(fetched)
+
+    deadline = _graph_deadline.get()
+    if deadline is not None and deadline.exceeded:
+        # Alguma leitura desistiu por falta de prazo: nada do que foi buscado é confiável
+        complete = {}
+    # Dias futuros não são gravados: só existiriam vazios
+    today = segment_day(int(now))
+    to_save = {day: segment for day, segment in complete.items() if day <= today}
+    if to_save and use_store:
+        try:
+            _day_segment_saver(resource, owner_id, to_save)
+        except Exception as err:  # noqa: BLE001
+            store_failed = True
+            logger.warning(f"Day segment store write failed for {resource}/{owner_id}: {err}")
+
+    with _day_segment_lock:
+        _day_segment_stats["requests"] += 1
+        _day_segment_stats["stored_days"] += len(days) - len(missing)
+        _day_segment_stats["fetched_days"] += len(missing)
+        _day_segment_stats["recent_refetches"] += recent_refetches
+        _day_segment_stats["runs"] += len(runs)
+        _day_segment_stats["incomplete_runs"] += incomplete_runs
+        if store_failed:
+            _day_segment_stats["store_errors"] += 1
+    return [segments[day] for day in days]
+
+
+def day_segment_windows(
+    resource: str,
+    owner_id: str,
+    since: int,
+    until: int,
+    fetch_days: Callable[[str, int, int], Any],
+    max_run_days: Optional[int] = None,
+) -> tuple:
+    """
+    Segmentos da janela atual e da anterior (mesmo número de dias), numa única leitura do store:
+    o período de comparação sai dos mesmos dias já guardados.
+    """
+    start, end = day_range(since, until)
+    segments = day_segments(resource, owner_id, start - (end - start), end, fetch_days, max_run_days)
+    count = (end - start) // DAY_SECONDS
+    return segments[count:], segments[:count]
+
+
+def _windows_without_segments(window_async: Callable[[str, int, int], Any], object_id: str,
+                              since: int, until: int) -> tuple:
+    """Sem o store de segmentos: janela atual e anterior (mesma duração) buscadas inteiras, em paralelo."""
+    previous_since = since - max(1, until - since)
+
+    async def fetch_windows():
+        return await gather_graph(
+            window_async(object_id, since, until),
+            window_async(object_id, previous_since, since),
+        )
+
+    current, previous = run_graph_sync(fetch_windows())
+    for result in (current, previous):
+        if isinstance(result, Exception):
+            raise result
+    return current, previous
+
+
+def get_day_segment_stats() -> Dict[str, Any]:
+    with _day_segment_lock:
+        stats: Dict[str, Any] = dict(_day_segment_stats)
+    served = stats["stored_days"] + stats["fetched_days"]
+    stats["hit_ratio"] = round(stats["stored_days"] / served, 4) if served else None
+    stats["enabled"] = day_segments_enabled()
+    stats["settle_days"] = DAY_SEGMENT_SETTLE_DAYS
+    stats["recent_ttl_seconds"] = DAY_SEGMENT_RECENT_TTL
+    return stats
+
+
+def _sum_segment_field(segments: Sequence[Dict[str, Any]], key: str) -> Optional[float]:
+    """Soma `key` nos segmentos; None quando nenhum dia trouxe o valor."""
+    values = [segment.get(key) for segment in segments if segment.get(key) is not None]
+    return sum(values) if values else None
+
+
+def _insight_day_values(payload: Any, name: str) -> Dict[str, float]:
+    """Valores diários (period=day) de uma métrica, por dia medido."""
+    values: Dict[str, float] = {}
+    if not isinstance(payload, dict):
+        return values
+    for item in payload.get("data", []):
+        if item.get("name") != name:
+            continue
+        for entry in item.get("values") or []:
+            day = insight_day(entry)
+            coerced = _coerce_number(entry.get("value")) if isinstance(entry, dict) else None
+            if day is None or coerced is None:
+                continue
+            values[day] = values.get(day, 0.0) + coerced
+    return values
+
+
+# ---- Facebook (organico) ----
+
+IG_MEDIA_INSIGHT_METRICS = "reach,shares,saved,likes,comments"
+IG_STORY_INSIGHT_METRICS = "reach,exits,taps_forward,taps_back,replies"
+
+
+def _with_insights_expansion(params: Dict[str, Any], metrics: str, period: Optional[str] = None) -> Dict[str, Any]:
+    expansion = f"insights.metric({metrics})"
+    if period:
+        expansion += f".period({period})"
+    expanded = dict(params)
+    expanded["fields"] = f"{params.get('fields') or 'id'},{expansion}"
+    return expanded
+
+
+_INSIGHTS_EXPANSION_RE = re.compile(r",?insights\.metric\([^)]*\)(?:\.period\([^)]*\))?")
+
+
+def _without_insights_expansion(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Parâmetros da listagem sem a expansão de insights (inclusive os de um `next` já expandido)."""
+    plain = dict(params)
+    plain["fields"] = _INSIGHTS_EXPANSION_RE.sub("", str(params.get("fields") or "")).strip(",") or "id"
+    return plain
+
+
+def _expanded_insights(item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Payload {"data": [...]} dos insights expandidos inline, ou None se a mídia veio sem eles."""
+    payload = item.get("insights")
+    if isinstance(payload, dict) and isinstance(payload.get("data"), list) and payload["data"]:
+        return payload
+    return None
+
+
+# Store persistente de insights por mídia (registrado por media_insights_store quando há banco)
+_media_insights_loader: Optional[Callable[[List[str], str], Dict[str, Dict[str, Any]]]] = None
+_media_insights_saver: Optional[Callable[[Optional[str], List[tuple], str], None]] = None
+
+
+def register_media_insights_store(
+    loader: Callable[[List[str], str], Dict[str, Dict[str, Any]]],
+    saver: Callable[[Optional[str], List[tuple], str], None],
+) -> None:
+    """
+    Registra o store de insights por mídia: `loader(ids, metrics)` devolve os payloads ainda
+    válidos e `saver(account_id, [(mídia, payload)], metrics)` grava os recém-buscados.
+    """
+    global _media_insights_loader, _media_insights_saver
+    _media_insights_loader = loader
+    _media_insights_saver = saver
+
+
+def _load_stored_insights(media_ids: List[str], metrics: str) -> Dict[str, Dict[str, Any]]:
+    if _media_insights_loader is None or _memo_bypass.get():
+        return {}
+    try:
+        return _media_insights_loader(media_ids, metrics) or {}
+    except Exception as err:  # noqa: BLE001
+        logger.warning(f"Media insights store read failed: {err}")
+        return {}
+
+
+def _save_fetched_insights(account_id: Optional[str], entries: List[tuple], metrics: str) -> None:
+    if _media_insights_saver is None or not entries:
+        return
+    try:
+        _media_insights_saver(account_id, entries, metrics)
+    except Exception as err:  # noqa: BLE001
+        logger.warning(f"Media insights store write failed: {err}")
+
+
+def _fill_stored_insights(items: List[Dict[str, Any]], insights: List[Any], stored: Dict[str, Any]) -> tuple:
+    """Completa pelo store os itens que vieram sem insights expandidos; devolve (insights, faltantes)."""
+    filled = [
+        payload if payload is not None else stored.get(str(item.get("id")))
+        for item, payload in zip(items, insights)
+    ]
+    return filled, [index for index, payload in enumerate(filled) if payload is None]
+
+
+def _insights_to_store(items: List[Dict[str, Any]], insights: List[Any], stored: Dict[str, Any]) -> List[tuple]:
+    """Pares (mídia, payload) vindos da Graph nesta página que o store ainda não tem válidos."""
+    return [
+        (item, payload)
+        for item, payload in zip(items, insights)
+        if isinstance(payload, dict) and str(item.get("id")) not in stored
+    ]
+
+
+def iter_media_with_insights(
+    path: str,
+    params: Dict[str, Any],
+    metrics: str,
+    token: Optional[str] = None,
+    *,
+    prefetch: bool = False,
+) -> Iterator[tuple]:
+    """
+    Gera (itens, insights) por página de um edge de mídias.
+
+    `insights[i]` é o payload {"data": [...]} do item i, ou MetaAPIError. Os insights são
+    pedidos por field expansion (`insights.metric(...)`) na própria listagem; se a Meta
+    rejeitar a expansão em qualquer página (ex.: uma mídia sem insights disponíveis), aquela
+    página e as seguintes vêm sem ela. As mídias que vierem sem insights são completadas
+    pelo store (quando registrado) e, por último, individualmente via gbatch. O que veio da
+    Graph e ainda não está válido no store é gravado nele (write-through), de modo que as
+    páginas sem expansão das próximas listagens não repetem as consultas individuais.
+    """
+    use_store = _media_insights_loader is not None
+    account_id = _object_id_from_path(path)
+    token = _pinned_token(token, path)
+    expanded = True
+    # Requisição da próxima página: se ela falhar com a expansão, é refeita sem ela
+    request: Optional[tuple] = (path, _with_insights_expansion(params, metrics))
+    pages = iter_pages(*request, token, prefetch=prefetch)
+    try:
+        while True:
+            try:
+                page = next(pages, None)
+            except MetaAPIError as err:
+                if not expanded:
+                    raise
+                expanded = False
+                logger.info(f"Insights expansion rejected for {path} ({err}); listing the rest without it")
+                pages.close()
+                pages = iter_pages(request[0], _without_insights_expansion(request[1]), token, prefetch=prefetch)
+                page = next(pages, None)
+            if page is None:
+                break
+            request = _follow_page(page)
+            items = [item for item in page.get("data", []) if isinstance(item, dict)]
+            insights: List[Any] = [_expanded_insights(item) for item in items]
+            stored = _load_stored_insights([str(item.get("id")) for item in items], metrics) if use_store else {}
+            insights, missing = _fill_stored_insights(items, insights, stored)
+            if missing:
+                fallback = gbatch(
+                    [(f"/{items[index].get('id')}/insights", {"metric": metrics}) for index in missing],
+                    token=token,
+                )
+                for index, payload in zip(missing, fallback):
+                    insights[index] = payload
+            if use_store:
+                _save_fetched_insights(account_id, _insights_to_store(items, insights, stored), metrics)
+            yield items, insights
+    finally:
+        pages.close()
+
+
+# Memória de métricas não suportadas por objeto/tipo de mídia (espelho em memória + store persistente)
+METRIC_CAPABILITY_TTL_HOURS = int(os.getenv("META_METRIC_CAPABILITY_TTL_HOURS", "168") or "168")
+METRIC_CAPABILITY_SYNC_SECONDS = int(os.getenv("META_METRIC_CAPABILITY_SYNC_SECONDS", "600") or "600")
+METRIC_REJECTION_CODES = {100}
+# O #100 também cobre erros de intervalo/período; só estas mensagens dizem que a métrica não existe
+# para o objeto. Subcódigo 2108006: mídia anterior à conversão para conta profissional.
+METRIC_UNSUPPORTED_MARKERS = (
+    "must be one of the following values",
+    "valid insights metric",
+    "invalid metric",
+    "incompatible metric",
+    "not supported for",
+    "not available for",
+    "does not support the",
+)
+METRIC_RANGE_MARKERS = (
+    "since", "until", "range", "period", "days", "date", "older than", "posted before", "conversion",
+)
+METRIC_RANGE_SUBCODES = {2108006}
+
+_capability_lock = threading.Lock()
+_unsupported_metrics: Dict[tuple, float] = {}  # (escopo, métrica) -> expira em (epoch)
+_capability_loader: Optional[Callable[[], List[tuple]]] = None
+_capability_saver: Optional[Callable[[str, str, Optional[str], float], None]] = None
+_capability_synced_at = 0.0
+_capability_syncing = False
+
+
+def register_metric_capability_store(
+    loader: Callable[[], List[tuple]],
+    saver: Callable[[str, str, Optional[str], float], None],
+) -> None:
+    """
+    Registra o store persistente: `loader()` devolve [(escopo, métrica, expira_em_epoch)] válidos
+    e `saver(escopo, métrica, motivo, expira_em_epoch)` grava uma nova rejeição.
+    """
+    global _capability_loader, _capability_saver, _capability_synced_at
+    _capability_loader = loader
+    _capability_saver = saver
+    _capability_synced_at = 0.0
+
+
+def metric_scope(kind: str, identifier: Any) -> str:
+    """Escopo de capacidade: ex. metric_scope("page", page_id), metric_scope("ig_media", f"{ig_user_id}:REELS")."""
+    return f"{kind}:{identifier}"
+
+
+def _sync_metric_capabilities() -> None:
+    loader = _capability_loader
+    if loader is None:
+        return
+    try:
+        rows = loader() or []
+    except Exception as err:  # noqa: BLE001
+        logger.warning(f"Metric capability store read failed: {err}")
+        return
+    with _capability_lock:
+        for scope, metric, expires_at in rows:
+            key = (scope, metric)
+            _unsupported_metrics[key] = max(_unsupported_metrics.get(key, 0.0), float(expires_at))
+
+
+def _maybe_sync_metric_capabilities() -> None:
+    global _capability_synced_at, _capability_syncing
+    if _capability_loader is None or time.time() - _capability_synced_at < METRIC_CAPABILITY_SYNC_SECONDS:
+        return
+    with _capability_lock:
+        if _capability_syncing:
+            return
+        _capability_syncing = True
+        _capability_synced_at = time.time()
+
+    def run() -> None:
+        global _capability_syncing
+        try:
+            _sync_metric_capabilities()
+        finally:
+            with _capability_lock:
+                _capability_syncing = False
+
+    # Leitura do store fora do caminho da chamada (e fora do loop assíncrono); até terminar,
+    # vale o retrato atual da memória
+    threading.Thread(target=run, name="meta-metric-capabilities", daemon=True).start()
+
+
+def is_metric_supported(scope: str, metric: str) -> bool:
+    _maybe_sync_metric_capabilities()
+    key = (scope, metric)
+    with _capability_lock:
+        expires_at = _unsupported_metrics.get(key)
+        if expires_at is None:
+            return True
+        if expires_at <= time.time():
+            del _unsupported_metrics[key]
+            return True
+    return False
+
+
+def supported_metrics(scope: str, metrics: Sequence[str]) -> List[str]:
+    return [metric for metric in metrics if is_metric_supported(scope, metric)]
+
+
+def mark_metric_unsupported(scope: str, metric: str, reason: Optional[str] = None) -> None:
+    expires_at = time.time() + METRIC_CAPABILITY_TTL_HOURS * 3600
+    with _capability_lock:
+        _unsupported_metrics[(scope, metric)] = expires_at
+    logger.info(f"Metric {metric} marked unsupported for {scope}: {reason}")
+    if _capability_saver is not None:
+        try:
+            _capability_saver(scope, metric, reason, expires_at)
+        except Exception as err:  # noqa: BLE001
+            logger.warning(f"Metric capability store write failed: {err}")
+
+
+def _is_metric_rejection(err: MetaAPIError) -> bool:
+    """Erro que diz que a métrica não existe para o objeto (não um intervalo/período inválido)."""
+    if err.status != 400 or err.code not in METRIC_REJECTION_CODES:
+        return False
+    detail = (err.raw or {}).get("error") if isinstance(err.raw, dict) else None
+    detail = detail if isinstance(detail, dict) else {}
+    if detail.get("error_subcode") in METRIC_RANGE_SUBCODES:
+        return False
+    message = " ".join(
+        str(part) for part in (str(err), detail.get("error_user_msg")) if part
+    ).lower()
+    # A lista de métricas válidas que acompanha a mensagem não entra na checagem de intervalo
+    head = message.split("one of the following values", 1)[0]
+    if any(marker in head for marker in METRIC_RANGE_MARKERS):
+        return False
+    return any(marker in message for marker in METRIC_UNSUPPORTED_MARKERS)
+
+
+def gget_metric(scope: str, metric: str, path: str, params: Optional[dict] = None,
+                token: Optional[str] = None):
+    """
+    gget para uma única métrica de insights. Métricas já rejeitadas para o escopo nem são
+    pedidas (MetaAPIError 400 local); uma rejeição nova (#100) fica memorizada com expiração.
+    """
+    _ensure_metric_supported(scope, metric)
+    try:
+        return gget(path, params, token=token)
+    except MetaAPIError as err:
+        if _is_metric_rejection(err):
+            mark_metric_unsupported(scope, metric, str(err))
+        raise
+
+
+def _ensure_metric_supported(scope: str, metric: str) -> None:
+    if not is_metric_supported(scope, metric):
+        raise MetaAPIError(
+            status=400,
+            message=f"Metric {metric} is not supported for {scope} (cached)",
+            code=100,
+            error_type="unsupported_metric_cached",
+        )
+
+
+def get_metric_capability_stats() -> Dict[str, Any]:
+    now = time.time()
+    with _capability_lock:
+        active = [key for key, expires_at in _unsupported_metrics.items() if expires_at > now]
+    by_scope: Dict[str, List[str]] = {}
+    for scope, metric in active:
+        by_scope.setdefault(scope, []).append(metric)
+    return {"unsupported": len(active), "scopes": {scope: sorted(metrics) for scope, metrics in by_scope.items()}}
+
+
+# Motor assíncrono (asyncio + aiohttp): centenas de chamadas Graph em voo numa única thread.
+# Reaproveita memo, coalescência, ETag, limitador, circuit breaker e prazo do motor síncrono.
+ASYNC_MAX_CONNECTIONS = int(os.getenv("META_ASYNC_MAX_CONNECTIONS", "100") or "100")
+ASYNC_PER_TOKEN = int(os.getenv("META_ASYNC_PER_TOKEN", "32") or "32")
+
+_async_lock = threading.Lock()
+_async_loop: Optional[asyncio.AbstractEventLoop] = None
+_async_thread: Optional[threading.Thread] = None
+_async_session: Optional[aiohttp.ClientSession] = None
+_async_token_slots: "OrderedDict[str, asyncio.Semaphore]" = OrderedDict()
+
+
+def _get_async_loop() -> asyncio.AbstractEventLoop:
+    """Loop compartilhado do processo, rodando numa thread daemon própria."""
+    global _async_loop, _async_thread
+    if _async_loop is not None:
+        return _async_loop
+    with _async_lock:
+        if _async_loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="meta-async", daemon=True)
+            thread.start()
+            _async_thread = thread
+            _async_loop = loop
+            atexit.register(close_async_engine)
+    return _async_loop
+
+
+def close_async_engine(timeout: float = 5.0) -> None:
+    """Fecha a sessão aiohttp e para o loop (registrado no atexit)."""
+    global _async_loop, _async_session
+    loop = _async_loop
+    if loop is None or not loop.is_running():
+        return
+
+    async def _close() -> None:
+        if _async_session is not None and not _async_session.closed:
+            await _async_session.close()
+
+    try:
+        asyncio.run_coroutine_threadsafe(_close(), loop).result(timeout)
+    except Exception as err:  # noqa: BLE001
+        logger.warning(f"Failed to close async Graph session: {err}")
+    loop.call_soon_threadsafe(loop.stop)
+    _async_token_slots.clear()
+    _async_session = None
+    _async_loop = None
+
+
+def _get_async_session() -> aiohttp.ClientSession:
+    # Só é chamado de dentro do loop: sessão e pool de conexões ficam presos a ele
+    global _async_session
+    if _async_session is None or _async_session.closed:
+        connector = aiohttp.TCPConnector(limit=ASYNC_MAX_CONNECTIONS, keepalive_timeout=HTTP_KEEPALIVE_IDLE)
+        _async_session = aiohttp.ClientSession(connector=connector)
+    return _async_session
+
+
+def _async_token_slot(token: Optional[str]) -> asyncio.Semaphore:
+    # Só o loop do motor usa o registro: o lock é apenas para o helper comum
+    return _lru_entry(
+        _async_token_slots, nullcontext(), _token_key(token),
+        lambda: asyncio.Semaphore(max(1, ASYNC_PER_TOKEN)),
+    )
+
+
+def run_graph_sync(coro: Any) -> Any:
+    """
+    Executa a corrotina no loop do motor assíncrono e bloqueia até o resultado.
+    O contexto do chamador (prazo, memo bypass, rastreio de revalidação) segue junto.
+    """
+    loop = _get_async_loop()
+    if threading.current_thread() is _async_thread:
+        coro.close()
+        raise RuntimeError("run_graph_sync called from the meta-async loop; await the coroutine instead")
+    context = contextvars.copy_context()
+    return asyncio.run_coroutine_threadsafe(_run_in_context(coro, context), loop).result()
+
+
+async def _run_in_context(coro: Any, context: contextvars.Context) -> Any:
+    return await asyncio.get_running_loop().create_task(coro, context=context)
+
+
+async def gather_graph(*aws: Any) -> List[Any]:
+    """Equivalente assíncrono do run_parallel: resultados na ordem, exceções devolvidas como valor."""
+    results = await asyncio.gather(*aws, return_exceptions=True)
+    for result in results:
+        if isinstance(result, BaseException) and not isinstance(result, Exception):
+            raise result
+    return results
+
+
+async def _asend_with_retry(method: str, url: str, path: str, data: Optional[dict] = None,
+                            token: Optional[str] = None, cost: int = 1,
+                            headers: Optional[dict] = None) -> _GraphResponse:
+    """Versão assíncrona do _send_with_retry (sempre devolve _GraphResponse)."""
+    breaker = _circuit_for(token, path)
+    deadline = _graph_deadline.get()
+    _usage_budget_enter(path)
+    for attempt in range(MAX_RETRIES):
+        timeout = REQUEST_TIMEOUT
+        try:
+            logger.debug(f"Async request attempt {attempt + 1}/{MAX_RETRIES}: {method} {path}")
+            _attempt_timeout(deadline, path)
+            _circuit_enter(breaker, path)
+            try:
+                lane = await _alane_enter(token, path, cost, deadline)
+                try:
+                    wait = _rate_limit_reserve(token, path, cost, max_wait=_deadline_remaining(deadline))
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    timeout = _attempt_timeout(deadline, path)
+                except BaseException:
+                    _lane_leave(lane)
+                    raise
+            except MetaAPIError:
+                if breaker is not None:
+                    breaker.release()
+                raise
+            with _http_stats_lock:
+                _http_stats["requests"] += 1
+            try:
+                async with _lane_token_slot(lane, token, asynchronous=True):
+                    started = time.monotonic()
+                    async with _get_async_session().request(
+                        method,
+                        URL(url, encoded=True),
+                        data=data,
+                        headers=headers,
+                        timeout=aiohttp.ClientTimeout(total=timeout),
+                    ) as response:
+                        status = response.status
+                        response_headers = response.headers
+                        body = await response.read()
+            finally:
+                _lane_leave(lane)
+            elapsed = time.monotonic() - started
+            _record_graph_usage(cost, len(body), elapsed, status >= 400)
+            _observe_graph_response(path, status, elapsed, len(body))
+            _rate_limit_observe(token, path, response_headers)
+            _circuit_observe(breaker, path, status, response_headers, body)
+
+            if status == 304:
+                return _GraphResponse(None, 0, response_headers.get("ETag"), True)
+
+            text = body.decode("utf-8", errors="replace")
+            if 200 <= status < 400:
+                try:
+                    payload = json.loads(text)
+                except ValueError as err:
+                    raise MetaAPIError(
+                        status=500,
+                        message=f"Request failed: invalid JSON ({err})",
+                        code=None,
+                        error_type="request_exception",
+                    )
+                return _GraphResponse(payload, len(body), response_headers.get("ETag"), False)
+
+            if status in RETRYABLE_STATUSES and _should_retry(attempt, 2 ** attempt, breaker, deadline):
+                wait_time = 2 ** attempt
+                logger.warning(
+                    f"Request failed with status {status}. "
+                    f"Retrying in {wait_time}s... (attempt {attempt + 1}/{MAX_RETRIES})"
+                )
+                _observe_graph_retry(path, status)
+                await asyncio.sleep(wait_time)
+                continue
+
+            try:
+                payload = json.loads(text)
+            except ValueError:
+                payload = {}
+            error = _graph_error(status, payload, text)
+            if error.code in AUTH_ERROR_CODES:
+                # Invalidar o token grava no store (Postgres): não bloqueia o loop
+                await asyncio.to_thread(_note_auth_error, token, error, path)
+            else:
+                _note_auth_error(token, error, path)
+            raise error
+
+        except asyncio.TimeoutError:
+            elapsed = time.monotonic() - started
+            _record_graph_usage(cost, 0, elapsed, True)
+            _observe_graph_response(path, "timeout", elapsed, 0)
+            if timeout < REQUEST_TIMEOUT:
+                if breaker is not None:
+                    breaker.release()
+                raise _deadline_error(path)
+            _circuit_record(breaker, path, "timeout")
+            if _should_retry(attempt, 2 ** attempt, breaker, deadline):
+                wait_time = 2 ** attempt
+                logger.warning(f"Request timeout. Retrying in {wait_time}s...")
+                _observe_graph_retry(path, "timeout")
+                await asyncio.sleep(wait_time)
+                continue
+            logger.error(f"Request timeout after {MAX_RETRIES} attempts")
+            raise MetaAPIError(
+                status=504,
+                message=f"Request timeout after {REQUEST_TIMEOUT}s",
+                code=None,
+                error_type="timeout"
+            )
+
+        except aiohttp.ClientError as e:
+            _observe_graph_response(path, "error", None, 0)
+            with _http_stats_lock:
+                _http_stats["failures"] += 1
+            _circuit_record(breaker, path, "request_exception")
+            logger.error(f"Request exception: {e}")
+            raise MetaAPIError(
+                status=500,
+                message=f"Request failed: {str(e)}",
+                code=None,
+                error_type="request_exception"
+            )
+
+    logger.warning("Max retries reached, returning empty data")
+    return _GraphResponse({"data": []}, 0, None, False)
+
+
+async def _await_flight(flight: _Flight) -> None:
+    """Espera o líder (de qualquer thread ou do próprio loop) sem bloquear o loop."""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def wake() -> None:
+        loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+    with _flights_lock:
+        if flight.done.is_set():
+            return
+        flight.callbacks.append(wake)
+    try:
+        await asyncio.wait_for(future, timeout=graph_budget_remaining())
+    except asyncio.TimeoutError:
+        raise _deadline_error("singleflight wait")
+
+
+async def _asingleflight(key: str, factory: Callable[[], Any]) -> Any:
+    if not SINGLEFLIGHT_ENABLED:
+        return await factory()
+    flight, leader = _join_flight(key)
+    if not leader:
+        await _await_flight(flight)
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+    try:
+        flight.result = await factory()
+        return flight.result
+    except BaseException as err:
+        flight.error = err
+        raise
+    finally:
+        _finish_flight(key, flight)
+
+
+async def agget(path: str, params: Optional[dict] = None, token: Optional[str] = None):
+    """Versão assíncrona do gget (mesmo memo, coalescência, ETag, limitador, circuito e prazo)."""
+    request_token, url, key = _prepare_get(path, params, token)
+    cached = _memo_lookup(key)
+    if cached is not None:
+        return cached
+
+    async def load():
+        validator = _memo_validator(key)
+        headers = {"If-None-Match": validator[0]} if validator else None
+        response = await _asend_with_retry("GET", url, path, token=request_token, headers=headers)
+        return _store_graph_response(key, path, validator, response)
+
+    return await _asingleflight(key, load)
+
+
+async def agbatch(calls: Sequence[tuple], token: Optional[str] = None,
+                  max_retries: int = MAX_RETRIES) -> List[Any]:
+    """Versão assíncrona do gbatch; os lotes de até 50 chamadas seguem em paralelo."""
+    request_token = _resolve_token(token, [path for path, _ in calls])
+    results: List[Any] = [None] * len(calls)
+    pending = list(range(len(calls)))
+    proof = appsecret_proof(request_token)
+    if calls:
+        _record_revalidation(False)
+
+    async def post(chunk: List[int]) -> Any:
+        form = _batch_form(calls, chunk, request_token, proof)
+        response = await _asend_with_retry("POST", BASE, "/?batch", data=form, token=request_token,
+                                           cost=len(chunk))
+        return response.payload
+
+    for attempt in range(max(1, max_retries)):
+        retry: List[int] = []
+        chunks = [pending[offset:offset + BATCH_MAX_SIZE] for offset in range(0, len(pending), BATCH_MAX_SIZE)]
+        responses = await gather_graph(*(post(chunk) for chunk in chunks))
+        for chunk, entries in zip(chunks, responses):
+            if isinstance(entries, MetaAPIError):
+                for index in chunk:
+                    results[index] = entries
+                continue
+            if isinstance(entries, Exception):
+                raise entries
+            _apply_batch_entries(entries, chunk, results, retry)
+
+        if not retry or attempt >= max_retries - 1:
+            break
+        wait_time = 2 ** attempt
+        logger.warning(
+            f"{len(retry)} batch item(s) failed. Retrying in {wait_time}s... "
+            f"(attempt {attempt + 1}/{max_retries})"
+        )
+        for index in retry:
+            _observe_graph_retry(calls[index][0], "batch_item")
+        await asyncio.sleep(wait_time)
+        pending = retry
+
+    return results
+
+
+async def agget_metric(scope: str, metric: str, path: str, params: Optional[dict] = None,
+                       token: Optional[str] = None):
+    """Versão assíncrona do gget_metric."""
+    _ensure_metric_supported(scope, metric)
+    try:
+        return await agget(path, params, token=token)
+    except MetaAPIError as err:
+        if _is_metric_rejection(err):
+            await asyncio.to_thread(mark_metric_unsupported, scope, metric, str(err))
+        raise
+
+
+async def aiter_pages(
+    path: str,
+    params: Optional[dict] = None,
+    token: Optional[str] = None,
+    *,
+    prefetch: bool = False,
+    max_pages: Optional[int] = None,
+):
+    """Versão assíncrona do iter_pages; com prefetch a próxima página já fica em voo."""
+    pages = 0
+    token = _pinned_token(token, path)
+    try:
+        request: Optional[tuple] = (path, dict(params or {}))
+        page = await agget(*request, token=token)
+        while True:
+            pages += 1
+            request = _follow_page(page)
+            if max_pages is not None and pages >= max_pages:
+                request = None
+            pending: Optional[asyncio.Task] = None
+            if request is not None and prefetch:
+                pending = asyncio.ensure_future(agget(*request, token=token))
+            try:
+                yield page
+            except GeneratorExit:
+                if pending is not None:
+                    pending.cancel()
+                raise
+            if request is None:
+                return
+            page = await pending if pending is not None else await agget(*request, token=token)
+    finally:
+        # Profundidade efetivamente percorrida (inclui o encerramento antecipado pelo consumidor)
+        _observe_pagination(path, pages)
+
+
+async def aget_page_access_token(page_id: str) -> str:
+    """Versão assíncrona do get_page_access_token (mesmo LRU e store; o I/O do store roda fora do loop)."""
+    cached = _cached_page_token(page_id, load=False) or await asyncio.to_thread(_cached_page_token, page_id)
+    if cached:
+        return cached
+    logger.info(f"Fetching page access token for {page_id}")
+    with graph_memo_bypass():
+        data = await agget(f"/{page_id}", {"fields": "access_token"})
+    return await asyncio.to_thread(_page_token_from_payload, page_id, data)
+
+
+async def aiter_media_with_insights(
+    path: str,
+    params: Dict[str, Any],
+    metrics: str,
+    token: Optional[str] = None,
+    *,
+    prefetch: bool = False,
+):
+    """Versão assíncrona do iter_media_with_insights (store consultado fora do loop)."""
+    use_store = _media_insights_loader is not None
+    account_id = _object_id_from_path(path)
+    token = _pinned_token(token, path)
+    expanded = True
+    # Requisição da próxima página: se ela falhar com a expansão, é refeita sem ela
+    request: Optional[tuple] = (path, _with_insights_expansion(params, metrics))
+    pages = aiter_pages(*request, token, prefetch=prefetch)
+    try:
+        while True:
+            try:
+                page = await anext(pages, None)
+            except MetaAPIError as err:
+                if not expanded:
+                    raise
+                expanded = False
+                logger.info(f"Insights expansion rejected for {path} ({err}); listing the rest without it")
+                await pages.aclose()
+                pages = aiter_pages(request[0], _without_insights_expansion(request[1]), token, prefetch=prefetch)
+                page = await anext(pages, None)
+            if page is None:
+                break
+            request = _follow_page(page)
+            items = [item for item in page.get("data", []) if isinstance(item, dict)]
+            insights: List[Any] = [_expanded_insights(item) for item in items]
+            stored = (
+                await asyncio.to_thread(_load_stored_insights, [str(item.get("id")) for item in items], metrics)
+                if use_store
+                else {}
+            )
+            insights, missing = _fill_stored_insights(items, insights, stored)
+            if missing:
+                fallback = await agbatch(
+                    [(f"/{items[index].get('id')}/insights", {"metric": metrics}) for index in missing],
+                    token=token,
+                )
+                for index, payload in zip(missing, fallback):
+                    insights[index] = payload
+            if use_store:
+                entries = _insights_to_store(items, insights, stored)
+                if entries:
+                    await asyncio.to_thread(_save_fetched_insights, account_id, entries, metrics)
+            yield items, insights
+    finally:
+        await pages.aclose()
+
+
+PAGE_POST_TOTAL_KEYS = (
+    "reactions", "comments", "shares", "clicks",
+    "video_reactions", "video_comments", "video_shares",
+    "impressions", "reach", "engaged",
+)
+
+
+def _sum_post_totals(day_totals: Iterable[Dict[str, int]]) -> Dict[str, int]:
+    totals = {key: 0 for key in PAGE_POST_TOTAL_KEYS}
+    for entry in day_totals:
+        for key in PAGE_POST_TOTAL_KEYS:
+            totals[key] += int(entry.get(key) or 0)
+    return totals
+
+
+async def _ascan_page_posts(page_id: str, page_token: str, since: int, until: int) -> Dict[str, Dict[str, int]]:
+    """
+    Varre os posts da página na janela e devolve os totais (reações, comentários, cliques, insights
+    por post...) agrupados pelo dia de publicação (created_time); "" agrupa posts sem data.
+    """
+    by_day: Dict[str, Dict[str, int]] = {}
+    url = f"/{page_id}/posts"
+    post_insight_metrics = ["post_impressions", "post_impressions_unique", "post_engaged_users", "post_clicks"]
+    base_post_params = {
+        "since": since,
+        "until": until,
+        "limit": 50,
+        "fields": (
+            "id,created_time,permalink_url,"
+            "status_type,attachments{media_type},"
+            "reactions.summary(true).limit(0),comments.summary(true).limit(0),shares"
+        ),
+    }
+    async for page in aiter_pages(url, base_post_params, token=page_token, prefetch=True):
+        post_items = [p_item for p_item in page.get("data", []) if isinstance(p_item, dict)]
+        post_insights_results = await agbatch(
+            [
+                (f"/{p_item.get('id')}/insights", {"metric": ",".join(post_insight_metrics)})
+                for p_item in post_items
+            ],
+            token=page_token,
+        )
+        for p_item, post_insights in zip(post_items, post_insights_results):
+            day = str(p_item.get("created_time") or "")[:10]
+            totals = by_day.setdefault(day, {key: 0 for key in PAGE_POST_TOTAL_KEYS})
+            reactions_count = int(((p_item.get("reactions") or {}).get("summary") or {}).get("total_count", 0) or 0)
+            comments_count = int(((p_item.get("comments") or {}).get("summary") or {}).get("total_count", 0) or 0)
+            shares_count = int((p_item.get("shares") or {}).get("count", 0) or 0)
 
+            totals["reactions"] += reactions_count
+            totals["comments"] += comments_count
+            totals["shares"] += shares_count
 
-def insight_value_from_list(items: List[Dict[str, Any]], name: str) -> Optional[float]:
-    if not isinstance(items, list):
-        return None
-    for item in items:
-        if item.get('name') == name:
-            values = item.get('values') or []
-            if not values:
-                return None
-            first = values[0]
-            if isinstance(first, dict):
-                return _coerce_number(first.get('value'))
-            return _coerce_number(first)
-    return None
+            attachments = ((p_item.get("attachments") or {}).get("data") or [])[:]
+            status_type = str(p_item.get("status_type") or "").lower()
+            is_video_post = any(
+                isinstance(att, dict) and str(att.get("media_type", "")).lower().startswith("video")
+                for att in attachments
+            ) or ("video" in status_type)
+            if is_video_post:
+                totals["video_reactions"] += reactions_count
+                totals["video_comments"] += comments_count
+                totals["video_shares"] += shares_count
+            if isinstance(post_insights, MetaAPIError) or not isinstance(post_insights, dict):
+                post_insights = {"data": []}
+            ins_values = post_insights.get("data", [])
+            clicks_value = insight_value_from_list(ins_values, "post_clicks")
+            impressions_value = insight_value_from_list(ins_values, "post_impressions")
+            reach_value = insight_value_from_list(ins_values, "post_impressions_unique")
+            engaged_value = insight_value_from_list(ins_values, "post_engaged_users")
+            if clicks_value:
+                totals["clicks"] += int(round(clicks_value))
+            if impressions_value:
+                totals["impressions"] += int(round(impressions_value))
+            if reach_value:
+                totals["reach"] += int(round(reach_value))
+            if engaged_value:
+                totals["engaged"] += int(round(engaged_value))
+    return by_day
 
 
-def aggregate_dimension_values(payload: Dict[str, Any], target_name: str) -> Dict[str, float]:
-    """Agrupa valores de métricas com breakdown do Graph API."""
-    results: Dict[str, float] = {}
-    if not isinstance(payload, dict):
-        return results
-    for item in payload.get("data", []):
-        if item.get("name") != target_name:
-            continue
-        for entry in item.get("values") or []:
-            value = entry.get("value")
-            if isinstance(value, dict):
-                for key, raw in value.items():
-                    coerced = _coerce_number(raw)
-                    if coerced is None:
-                        continue
-                    results[key] = results.get(key, 0.0) + coerced
-            else:
-                coerced = _coerce_number(value)
-                if coerced is None:
-                    continue
-                results["total"] = results.get("total", 0.0) + coerced
-    return results
+# Métricas básicas (pode não retornar todas dependendo da revisão do app)
+PAGE_BASIC_METRICS = (
+    "page_impressions",
+    "page_impressions_unique",
+    "page_post_engagements",
+    "page_fan_adds_unique",
+)
 
 
-def extract_time_series(payload: Dict[str, Any], target_name: str) -> List[Dict[str, Any]]:
-    """Extrai séries temporais ordenadas (ex.: follower_count)."""
-    series: List[Dict[str, Any]] = []
-    if not isinstance(payload, dict):
-        return series
-    for item in payload.get("data", []):
-        if item.get("name") != target_name:
-            continue
-        for entry in item.get("values") or []:
-            raw_val = entry.get("value")
-            coerced = None
-            if isinstance(raw_val, dict):
-                coerced = _coerce_number(raw_val.get("value"))
-            if coerced is None:
-                coerced = _coerce_number(raw_val)
-            if coerced is None:
-                continue
-            series.append({
-                "value": coerced,
-                "end_time": entry.get("end_time"),
-                "start_time": entry.get("start_time"),
-            })
-    series.sort(key=lambda row: (row.get("end_time") or row.get("start_time") or ""))
-    return series
+# Métricas opcionais de visão geral (somadas na janela; ausentes contam 0)
+PAGE_OPTIONAL_METRICS = (
+    "page_views_total",
+    "page_video_views",
+    "page_video_views_3s",
+    "page_video_views_60s",
+    "page_video_view_time",
+    "page_actions_post_reactions_total",
+    "page_consumptions",
+    "page_cta_clicks_logged_in_total",
+    "page_fan_adds",
+    "page_fan_removes",
+)
+# Opcionais cuja série diária alimenta net_followers_series
+PAGE_FAN_SERIES_METRICS = ("page_fan_adds", "page_fan_removes")
 
 
-# ---- Facebook (organico) ----
+def _apage_day_metric(page_id: str, page_token: str, metric_name: str, since: int, until: int):
+    return agget_metric(
+        metric_scope("page", page_id),
+        metric_name,
+        f"/{page_id}/insights",
+        {"metric": metric_name, "period": "day", "since": since, "until": until},
+        token=page_token,
+    )
 
-def fb_page_window(page_id: str, since: int, until: int):
-    page_token = get_page_access_token(page_id)
 
-    # Métricas básicas (pode não retornar todas dependendo da revisão do app)
-    basic_metrics = [
-        "page_impressions",
-        "page_impressions_unique",
-        "page_post_engagements",
-        "page_fan_adds_unique",
-    ]
+async def _afetch_page_basic_insights(page_id: str, page_token: str, since: int, until: int) -> Dict[str, Any]:
+    """Métricas básicas numa chamada; se ela falhar, uma a uma (as rejeitadas ficam de fora)."""
+    # Métricas já rejeitadas por esta página não são mais pedidas
+    basic_metrics = supported_metrics(metric_scope("page", page_id), PAGE_BASIC_METRICS)
+    if not basic_metrics:
+        return {"data": []}
     insight_params = {"metric": ",".join(basic_metrics), "period": "day", "since": since, "until": until}
-
     try:
-        ins = gget(
-            f"/{page_id}/insights",
-            insight_params,
-            token=page_token,
-        )
+        return await agget(f"/{page_id}/insights", insight_params, token=page_token)
     except MetaAPIError as err:
         logger.warning("Fallback fetching individual page metrics due to: %s", err)
-        ins = {"data": []}
-        for metric_name in basic_metrics:
-            try:
-                single = gget(
-                    f"/{page_id}/insights",
-                    {"metric": metric_name, "period": "day", "since": since, "until": until},
-                    token=page_token,
-                )
-            except MetaAPIError:
-                continue
-            data = single.get("data", [])
-            if data:
-                ins.setdefault("data", []).extend(data)
+    ins = {"data": []}
+    singles = await gather_graph(*(
+        _apage_day_metric(page_id, page_token, metric_name, since, until)
+        for metric_name in basic_metrics
+    ))
+    for single in singles:
+        if isinstance(single, MetaAPIError):
+            _note_segment_failure(single)
+            continue
+        if isinstance(single, Exception):
+            raise single
+        data = single.get("data", [])
+        if data:
+            ins.setdefault("data", []).extend(data)
+    return ins
 
-    def sum_series(name: str) -> int:
-        values = extract_insight_values(ins, name)
-        return int(round(sum(values))) if values else 0
 
-    impressions = sum_series("page_impressions")
-    reach = sum_series("page_impressions_unique")
-    engaged = sum_series("page_post_engagements")
-    likes_add = sum_series("page_fan_adds_unique")
+def fb_page_window(page_id: str, since: int, until: int):
+    """Versão síncrona de fb_page_window_async (executa no motor assíncrono)."""
+    return run_graph_sync(fb_page_window_async(page_id, since, until))
+
+
+async def fb_page_window_async(page_id: str, since: int, until: int):
+    page_token = await aget_page_access_token(page_id)
+
+    def single_metric(metric_name: str):
+        return _apage_day_metric(page_id, page_token, metric_name, since, until)
 
     # Função auxiliar para buscar métricas opcionais com fallback
-    def fetch_optional_metrics(metric_list, capture_series: Optional[List[str]] = None):
+    async def fetch_optional_metrics(metric_list, capture_series: Optional[List[str]] = None):
         results = {}
         series_map: Dict[str, List[Dict[str, Any]]] = {}
         capture_set = set(capture_series or [])
-        for metric_name in metric_list:
-            try:
-                payload = gget(
-                    f"/{page_id}/insights",
-                    {"metric": metric_name, "period": "day", "since": since, "until": until},
-                    token=page_token,
-                )
-                values = extract_insight_values(payload, metric_name)
-                results[metric_name] = int(round(sum(values))) if values else 0
-                if metric_name in capture_set:
-                    series_map[metric_name] = extract_insight_series(payload, metric_name)
-            except MetaAPIError:
+        payloads = await gather_graph(*(single_metric(metric_name) for metric_name in metric_list))
+        for metric_name, payload in zip(metric_list, payloads):
+            if isinstance(payload, MetaAPIError):
                 # Métrica não disponível, ignorar
                 results[metric_name] = 0
                 if metric_name in capture_set:
                     series_map[metric_name] = []
+                continue
+            if isinstance(payload, Exception):
+                raise payload
+            values = extract_insight_values(payload, metric_name)
+            results[metric_name] = int(round(sum(values))) if values else 0
+            if metric_name in capture_set:
+                series_map[metric_name] = extract_insight_series(payload, metric_name)
         return results, series_map
 
-    # Buscar métricas opcionais de visão geral
-    optional_metrics, optional_series = fetch_optional_metrics([
-        "page_views_total",
-        "page_video_views",
-        "page_video_views_3s",
-        "page_video_views_60s",
-        "page_video_view_time",
-        "page_actions_post_reactions_total",
-        "page_consumptions",
-        "page_cta_clicks_logged_in_total",
-        "page_fan_adds",
-        "page_fan_removes",
-    ], capture_series=["page_fan_adds", "page_fan_removes"])
+    async def fetch_followers_total():
+        fans_payload, fan_info = await gather_graph(
+            agget(
+                f"/{page_id}/insights",
+                {"metric": "page_fans", "period": "day", "since": since, "until": until},
+                token=page_token,
+            ),
+            # Fallback absoluto para total de seguidores independente do range (valor fixo da página)
+            agget(
+                f"/{page_id}",
+                {"fields": "fan_count,followers_count"},
+                token=page_token,
+            ),
+        )
+        followers_total = 0
+        if isinstance(fans_payload, Exception) and not isinstance(fans_payload, MetaAPIError):
+            raise fans_payload
+        if not isinstance(fans_payload, MetaAPIError):
+            fans_values = extract_insight_values(fans_payload, "page_fans")
+            if fans_values:
+                followers_total = int(round(fans_values[-1]))
+        if isinstance(fan_info, Exception) and not isinstance(fan_info, MetaAPIError):
+            raise fan_info
+        if not isinstance(fan_info, MetaAPIError):
+            fan_count_val = fan_info.get("fan_count") or fan_info.get("followers_count")
+            if fan_count_val is not None:
+                followers_total = int(fan_count_val)
+        return followers_total
+
+    # Insights da página, métricas opcionais, posts, vídeo e seguidores são independentes
+    ins, optional_result, post_totals, video_metrics, followers_total = await gather_graph(
+        _afetch_page_basic_insights(page_id, page_token, since, until),
+        # Buscar métricas opcionais de visão geral
+        fetch_optional_metrics(PAGE_OPTIONAL_METRICS, capture_series=PAGE_FAN_SERIES_METRICS),
+        _ascan_page_posts(page_id, page_token, since, until),
+        fetch_page_video_metrics_async(page_id, page_token, since, until),
+        fetch_followers_total(),
+    )
+    for result in (ins, optional_result, post_totals, video_metrics, followers_total):
+        if isinstance(result, Exception):
+            raise result
+    optional_metrics, optional_series = optional_result
+    post_totals = _sum_post_totals(post_totals.values())
+
+    def sum_series(name: str) -> int:
+        values = extract_insight_values(ins, name)
+        return int(round(sum(values))) if values else 0
+
+    basic_totals = {name: sum_series(name) for name in PAGE_BASIC_METRICS}
+    return _build_fb_page_window(
+        basic_totals, optional_metrics, optional_series, post_totals, video_metrics, followers_total,
+    )
+
+
+def _build_fb_page_window(
+    basic_totals: Dict[str, int],
+    optional_metrics: Dict[str, int],
+    optional_series: Dict[str, List[Dict[str, Any]]],
+    post_totals: Dict[str, int],
+    video_metrics: Dict[str, Any],
+    followers_total: int,
+) -> Dict[str, Any]:
+    """
+    Monta o resultado de fb_page_window a partir dos agregados da janela: somas das métricas
+    diárias da página, métricas opcionais (com as séries de fan adds/removes), totais dos posts,
+    métricas de vídeo e total de seguidores.
+    """
+    impressions = basic_totals.get("page_impressions", 0)
+    reach = basic_totals.get("page_impressions_unique", 0)
+    engaged = basic_totals.get("page_post_engagements", 0)
+    likes_add = basic_totals.get("page_fan_adds_unique", 0)
 
     page_views = optional_metrics.get("page_views_total", 0)
     video_views = optional_metrics.get("page_video_views", 0)
@@ -406,6 +4248,7 @@ def fb_page_window(page_id: str, since: int, until: int):
     followers_lost = optional_metrics.get("page_fan_removes", 0)
     net_followers = followers_gained - followers_lost
 
+
     def _series_to_map(metric_name: str) -> Dict[str, int]:
         mapping: Dict[str, int] = {}
         for entry in optional_series.get(metric_name, []):
@@ -444,77 +4287,16 @@ def fb_page_window(page_id: str, since: int, until: int):
     if video_views > 0 and video_view_time > 0:
         avg_watch_time = int(video_view_time / video_views)
 
-    total_reac = 0
-    total_com = 0
-    total_sha = 0
-    total_clicks = 0
-    video_reac = 0
-    video_com = 0
-    video_sha = 0
-    post_sum_impressions = 0
-    post_sum_reach = 0
-    post_sum_engaged = 0
-    url = f"/{page_id}/posts"
-    post_insight_metrics = ["post_impressions", "post_impressions_unique", "post_engaged_users", "post_clicks"]
-    base_post_params = {
-        "since": since,
-        "until": until,
-        "limit": 50,
-        "fields": (
-            "id,created_time,permalink_url,"
-            "status_type,attachments{media_type},"
-            "reactions.summary(true).limit(0),comments.summary(true).limit(0),shares"
-        ),
-    }
-    page = gget(url, base_post_params, token=page_token)
-    while True:
-        for p_item in page.get("data", []):
-            reactions_count = int(((p_item.get("reactions") or {}).get("summary") or {}).get("total_count", 0) or 0)
-            comments_count = int(((p_item.get("comments") or {}).get("summary") or {}).get("total_count", 0) or 0)
-            shares_count = int((p_item.get("shares") or {}).get("count", 0) or 0)
-
-            total_reac += reactions_count
-            total_com += comments_count
-            total_sha += shares_count
-
-            attachments = ((p_item.get("attachments") or {}).get("data") or [])[:]
-            status_type = str(p_item.get("status_type") or "").lower()
-            is_video_post = any(
-                isinstance(att, dict) and str(att.get("media_type", "")).lower().startswith("video")
-                for att in attachments
-            ) or ("video" in status_type)
-            if is_video_post:
-                video_reac += reactions_count
-                video_com += comments_count
-                video_sha += shares_count
-            try:
-                post_insights = gget(
-                    f"/{p_item.get('id')}/insights",
-                    {"metric": ",".join(post_insight_metrics)},
-                    token=page_token,
-                )
-            except MetaAPIError:
-                post_insights = {"data": []}
-            ins_values = post_insights.get("data", [])
-            clicks_value = insight_value_from_list(ins_values, "post_clicks")
-            impressions_value = insight_value_from_list(ins_values, "post_impressions")
-            reach_value = insight_value_from_list(ins_values, "post_impressions_unique")
-            engaged_value = insight_value_from_list(ins_values, "post_engaged_users")
-            if clicks_value:
-                total_clicks += int(round(clicks_value))
-            if impressions_value:
-                post_sum_impressions += int(round(impressions_value))
-            if reach_value:
-                post_sum_reach += int(round(reach_value))
-            if engaged_value:
-                post_sum_engaged += int(round(engaged_value))
-        paging = page.get("paging") or {}
-        cursor_after = (paging.get("cursors") or {}).get("after")
-        if not cursor_after:
-            break
-        next_params = dict(base_post_params)
-        next_params["after"] = cursor_after
-        page = gget(url, next_params, token=page_token)
+    total_reac = post_totals["reactions"]
+    total_com = post_totals["comments"]
+    total_sha = post_totals["shares"]
+    total_clicks = post_totals["clicks"]
+    video_reac = post_totals["video_reactions"]
+    video_com = post_totals["video_comments"]
+    video_sha = post_totals["video_shares"]
+    post_sum_impressions = post_totals["impressions"]
+    post_sum_reach = post_totals["reach"]
+    post_sum_engaged = post_totals["engaged"]
 
     if impressions <= 0 and post_sum_impressions > 0:
         impressions = post_sum_impressions
@@ -524,7 +4306,6 @@ def fb_page_window(page_id: str, since: int, until: int):
         engaged = post_sum_engaged
 
     engagement_total = total_reac + total_com + total_sha
-    video_metrics = fetch_page_video_metrics(page_id, page_token, since, until)
     if video_views_3s is not None:
         video_metrics.setdefault("views_3s", video_views_3s)
     video_engagement_total = video_reac + video_com + video_sha
@@ -535,32 +4316,6 @@ def fb_page_window(page_id: str, since: int, until: int):
         "shares": video_sha,
     }
 
-    followers_total = 0
-    try:
-        fans_payload = gget(
-            f"/{page_id}/insights",
-            {"metric": "page_fans", "period": "day", "since": since, "until": until},
-            token=page_token,
-        )
-        fans_values = extract_insight_values(fans_payload, "page_fans")
-        if fans_values:
-            followers_total = int(round(fans_values[-1]))
-    except MetaAPIError:
-        followers_total = 0
-
-    # Fallback absoluto para total de seguidores independente do range (valor fixo da página)
-    try:
-        fan_info = gget(
-            f"/{page_id}",
-            {"fields": "fan_count,followers_count"},
-            token=page_token,
-        )
-        fan_count_val = fan_info.get("fan_count") or fan_info.get("followers_count")
-        if fan_count_val is not None:
-            followers_total = int(fan_count_val)
-    except MetaAPIError:
-        pass
-
     return {
         "impressions": impressions,
         "reach": reach,
@@ -593,14 +4348,23 @@ def fb_page_window(page_id: str, since: int, until: int):
     }
 
 
+# Chave do resultado -> métricas candidatas, na ordem de fallback
+PAGE_VIDEO_METRIC_CANDIDATES = {
+    "views_30s": ["page_video_views_30s"],
+    "views_10s": ["page_video_views_10s"],
+    "views_1m": ["page_video_views_60s_exclusive", "page_video_views_60s"],
+    "avg_watch_time": ["page_video_avg_time_watched"],
+    "watch_time_total": ["page_video_view_time"],
+}
+
+
 def fetch_page_video_metrics(page_id: str, page_token: str, since: int, until: int) -> Dict[str, Optional[float]]:
-    metric_candidates = {
-        "views_30s": ["page_video_views_30s"],
-        "views_10s": ["page_video_views_10s"],
-        "views_1m": ["page_video_views_60s_exclusive", "page_video_views_60s"],
-        "avg_watch_time": ["page_video_avg_time_watched"],
-        "watch_time_total": ["page_video_view_time"],
-    }
+    """Versão síncrona de fetch_page_video_metrics_async."""
+    return run_graph_sync(fetch_page_video_metrics_async(page_id, page_token, since, until))
+
+
+async def fetch_page_video_metrics_async(page_id: str, page_token: str, since: int, until: int) -> Dict[str, Optional[float]]:
+    metric_candidates = PAGE_VIDEO_METRIC_CANDIDATES
     results: Dict[str, Optional[float]] = {
         "views_30s": None,
         "views_10s": None,
@@ -609,10 +4373,13 @@ def fetch_page_video_metrics(page_id: str, page_token: str, since: int, until: i
         "watch_time_total": None,
     }
 
-    for key, metric_names in metric_candidates.items():
+    async def fetch_candidate(key: str, metric_names: Sequence[str]) -> Optional[float]:
+        # Candidatas da mesma chave seguem em ordem (fallback); chaves distintas rodam em paralelo
         for metric_name in metric_names:
             try:
-                payload = gget(
+                payload = await agget_metric(
+                    metric_scope("page", page_id),
+                    metric_name,
                     f"/{page_id}/insights",
                     {
                         "metric": metric_name,
@@ -628,10 +4395,18 @@ def fetch_page_video_metrics(page_id: str, page_token: str, since: int, until: i
             if not values:
                 continue
             if key == "avg_watch_time":
-                results[key] = sum(values) / len(values) if values else None
-            else:
-                results[key] = sum(values)
-            break
+                return sum(values) / len(values) if values else None
+            return sum(values)
+        return None
+
+    fetched = await gather_graph(*(
+        fetch_candidate(key, metric_names)
+        for key, metric_names in metric_candidates.items()
+    ))
+    for key, value in zip(metric_candidates.keys(), fetched):
+        if isinstance(value, Exception):
+            raise value
+        results[key] = value
 
     if results["views_10s"] is not None:
         results["views_10s"] = int(round(results["views_10s"]))
@@ -644,64 +4419,183 @@ def fetch_page_video_metrics(page_id: str, page_token: str, since: int, until: i
 
 
 
-# ---- Instagram (orgânico) ----
+async def _afetch_page_followers_total(page_id: str, page_token: str) -> Optional[int]:
+    """Total atual de seguidores da página (fan_count); None quando a Graph não informa."""
+    try:
+        fan_info = await agget(f"/{page_id}", {"fields": "fan_count,followers_count"}, token=page_token)
+    except MetaAPIError:
+        return None
+    fan_count_val = fan_info.get("fan_count") or fan_info.get("followers_count")
+    return int(fan_count_val) if fan_count_val is not None else None
 
-def ig_window(ig_user_id: str, since: int, until: int):
+
+async def fb_page_day_segments_async(page_id: str, since: int, until: int) -> Dict[str, Dict[str, Any]]:
     """
-    Métricas de conta + agregados básicos de mídia (para likes/comments/shares/saves).
+    Segmentos diários de fb_page_window em [since, until) (dias UTC inteiros). As métricas da
+    página já vêm por dia (period=day) e são repartidas pelo dia medido; os posts são varridos
+    uma vez e agrupados pelo dia de publicação.
     """
-    metrics_query = "reach,profile_views,website_clicks,accounts_engaged,total_interactions"
-    ins = gget(
-        f"/{ig_user_id}/insights",
-        {
-            "metric": metrics_query,
-            "period": "day",
-            "metric_type": "total_value",
-            "since": since,
-            "until": until,
-        },
+    page_token = await aget_page_access_token(page_id)
+
+    async def fetch_video_days() -> Dict[str, Dict[str, float]]:
+        async def fetch_candidate(metric_names: Sequence[str]) -> Dict[str, float]:
+            for metric_name in metric_names:
+                try:
+                    payload = await _apage_day_metric(page_id, page_token, metric_name, since, until)
+                except MetaAPIError as err:
+                    _note_segment_failure(err)
+                    continue
+                values = _insight_day_values(payload, metric_name)
+                if values:
+                    return values
+            return {}
+
+        fetched = await gather_graph(*(
+            fetch_candidate(metric_names) for metric_names in PAGE_VIDEO_METRIC_CANDIDATES.values()
+        ))
+        for result in fetched:
+            if isinstance(result, Exception):
+                raise result
+        return dict(zip(PAGE_VIDEO_METRIC_CANDIDATES.keys(), fetched))
+
+    basic, optional_payloads, posts_by_day, video_days, fans_payload = await gather_graph(
+        _afetch_page_basic_insights(page_id, page_token, since, until),
+        gather_graph(*(
+            _apage_day_metric(page_id, page_token, metric_name, since, until)
+            for metric_name in PAGE_OPTIONAL_METRICS
+        )),
+        _ascan_page_posts(page_id, page_token, since, until),
+        fetch_video_days(),
+        agget(
+            f"/{page_id}/insights",
+            {"metric": "page_fans", "period": "day", "since": since, "until": until},
+            token=page_token,
+        ),
     )
-    try:
-        reach_payload = gget(
-            f"/{ig_user_id}/insights",
-            {
-                "metric": "reach",
-                "period": "day",
-                "since": since,
-                "until": until,
-            },
-        )
-    except MetaAPIError:
-        reach_payload = {}
+    for result in (basic, optional_payloads, posts_by_day, video_days):
+        if isinstance(result, Exception):
+            raise result
+    if isinstance(fans_payload, Exception) and not isinstance(fans_payload, MetaAPIError):
+        raise fans_payload
+    if isinstance(fans_payload, MetaAPIError):
+        _note_segment_failure(fans_payload)
+
+    segments: Dict[str, Dict[str, Any]] = {
+        segment_day(ts): {"basic": {}, "optional": {}, "fan_series": {}, "video": {}, "page_fans": None}
+        for ts in range(since, until, DAY_SECONDS)
+    }
+    first_day = segment_day(since)
+    for name in PAGE_BASIC_METRICS:
+        for day, value in _insight_day_values(basic, name).items():
+            if day in segments:
+                segments[day]["basic"][name] = value
+    for name, payload in zip(PAGE_OPTIONAL_METRICS, optional_payloads):
+        if isinstance(payload, MetaAPIError):
+            _note_segment_failure(payload)
+            continue
+        if isinstance(payload, Exception):
+            raise payload
+        for day, value in _insight_day_values(payload, name).items():
+            if day in segments:
+                segments[day]["optional"][name] = value
+        if name in PAGE_FAN_SERIES_METRICS:
+            # Mantém o rótulo de data original (fim do dia) usado em net_followers_series
+            for item in payload.get("data", []):
+                if item.get("name") != name:
+                    continue
+                for entry in item.get("values") or []:
+                    day = insight_day(entry)
+                    label = str(entry.get("end_time") or "")[:10]
+                    value = _coerce_number(entry.get("value"))
+                    if day in segments and label and value is not None:
+                        segments[day]["fan_series"][name] = {"date": label, "value": value}
+    for key, values in video_days.items():
+        for day, value in values.items():
+            if day in segments:
+                segments[day]["video"][key] = value
+    if not isinstance(fans_payload, MetaAPIError):
+        for day, value in _insight_day_values(fans_payload, "page_fans").items():
+            if day in segments:
+                segments[day]["page_fans"] = value
+    for day, totals in posts_by_day.items():
+        # Posts sem data (ou fora da grade) ficam no primeiro dia do trecho
+        target = segments.get(day) or segments[first_day]
+        target["posts"] = _sum_post_totals([target.get("posts") or {}, totals])
+    return segments
+
+
+def compose_fb_page_window(segments: Sequence[Dict[str, Any]], followers_total: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Resultado no formato de fb_page_window a partir de segmentos diários. Sem fan_count informado,
+    o total de seguidores é o último page_fans dos dias.
+    """
+    def sum_group(group: str, name: str) -> Optional[float]:
+        return _sum_segment_field([segment.get(group) or {} for segment in segments], name)
+
+    basic_totals = {name: int(round(sum_group("basic", name) or 0)) for name in PAGE_BASIC_METRICS}
+    optional_metrics = {name: int(round(sum_group("optional", name) or 0)) for name in PAGE_OPTIONAL_METRICS}
+    optional_series = {
+        name: [
+            (segment.get("fan_series") or {})[name]
+            for segment in segments
+            if name in (segment.get("fan_series") or {})
+        ]
+        for name in PAGE_FAN_SERIES_METRICS
+    }
+    post_totals = _sum_post_totals(segment.get("posts") or {} for segment in segments)
+
+    video_metrics: Dict[str, Any] = {}
+    for key in PAGE_VIDEO_METRIC_CANDIDATES:
+        values = [
+            (segment.get("video") or {})[key]
+            for segment in segments
+            if (segment.get("video") or {}).get(key) is not None
+        ]
+        if not values:
+            video_metrics[key] = None
+        elif key == "avg_watch_time":
+            video_metrics[key] = sum(values) / len(values)
+        elif key in ("views_10s", "views_30s", "views_1m"):
+            video_metrics[key] = int(round(sum(values)))
+        else:
+            video_metrics[key] = sum(values)
 
-    reach_timeseries = extract_time_series(reach_payload, "reach")
-    if not reach_timeseries:
-        reach_timeseries = extract_time_series(ins, "reach")
+    if followers_total is None:
+        fans = [segment["page_fans"] for segment in segments if segment.get("page_fans") is not None]
+        followers_total = int(round(fans[-1])) if fans else 0
+    return _build_fb_page_window(
+        basic_totals, optional_metrics, optional_series, post_totals, video_metrics, followers_total,
+    )
 
-    def by(name):
-        m = next((m for m in ins.get("data", []) if m.get("name") == name), {})
-        values = m.get("values") or []
-        if values:
-            return values
-        total_value = m.get("total_value")
-        if isinstance(total_value, dict):
-            scalar = _coerce_number(total_value.get("value"))
-            if scalar is not None:
-                return [{"value": scalar}]
-        return []
 
-    if reach_timeseries:
-        reach = sum((_coerce_number(entry.get("value")) or 0) for entry in reach_timeseries)
-    else:
-        reach = sum_values(by("reach"))
-    profile_views = sum_values(by("profile_views"))
-    website = sum_values(by("website_clicks"))
-    accounts_engaged = sum_values(by("accounts_engaged"))
-    total_interactions_metric = sum_values(by("total_interactions"))
+def fb_page_windows_from_segments(page_id: str, since: int, until: int) -> tuple:
+    """
+    (janela atual, janela anterior) de fb_page_window montadas a partir dos segmentos diários; sem
+    o store de segmentos, as duas janelas são buscadas inteiras.
+    """
+    if not day_segments_enabled():
+        return _windows_without_segments(fb_page_window_async, page_id, since, until)
+    current, previous = day_segment_windows(
+        "fb_page_window", page_id, since, until, fb_page_day_segments_async, FB_PAGE_SEGMENT_MAX_RUN_DAYS,
+    )
+
+    async def fetch_followers_total():
+        return await _afetch_page_followers_total(page_id, await aget_page_access_token(page_id))
+
+    # fan_count é o total de agora: vale para as duas janelas, como em fb_page_window
+    followers_total = run_graph_sync(fetch_followers_total())
+    return (
+        compose_fb_page_window(current, followers_total),
+        compose_fb_page_window(previous, followers_total),
+    )
+
+
+# ---- Instagram (orgânico) ----
 
-    # Agregar métricas por mídia (likes/comments/shares/saves)
-    sum_likes = sum_comments = sum_shares = sum_saves = 0
-    post_details: List[Dict[str, Any]] = []
+async def _ascan_ig_media(ig_user_id: str, since: int, until: int):
+    """Varre as mídias publicadas na janela: totais (likes/comments/shares/saves) e detalhes por post."""
+    totals = {"likes": 0, "comments": 0, "shares": 0, "saves": 0}
+    details: List[Dict[str, Any]] = []
 
     url = f"/{ig_user_id}/media"
     params = {
@@ -710,9 +4604,10 @@ def ig_window(ig_user_id: str, since: int, until: int):
         "limit": 100,
         "fields": "id,media_type,timestamp,like_count,comments_count,permalink",
     }
-    page = gget(url, params)
-    while True:
-        for media in page.get("data", []):
+    async for media_items, media_insights in aiter_media_with_insights(
+        url, params, IG_MEDIA_INSIGHT_METRICS, prefetch=True,
+    ):
+        for media, mi in zip(media_items, media_insights):
             timestamp_iso = media.get("timestamp")
             timestamp_unix = None
             if timestamp_iso:
@@ -724,19 +4619,18 @@ def ig_window(ig_user_id: str, since: int, until: int):
             else:
                 timestamp_dt = None
             try:
-                mi = gget(
-                    f"/{media['id']}/insights",
-                    {"metric": "reach,shares,saved,likes,comments"},
-                )
+                if isinstance(mi, Exception):
+                    _note_segment_failure(mi)
+                    raise mi
                 insights_map: Dict[str, Any] = {}
                 for k_item in mi.get("data", []):
                     v = (k_item.get("values") or [{}])[0].get("value", 0) or 0
                     name = (k_item.get("name") or "").lower()
                     insights_map[name] = v
                     if name == "shares":
-                        sum_shares += v
+                        totals["shares"] += v
                     elif name in ("saved", "saves"):
-                        sum_saves += v
+                        totals["saves"] += v
             except Exception:
                 insights_map = {}
                 pass
@@ -747,10 +4641,10 @@ def ig_window(ig_user_id: str, since: int, until: int):
             comments_base = media.get("comments_count", 0) or 0
             likes_value = int(insights_map.get("likes") or likes_base)
             comments_value = int(insights_map.get("comments") or comments_base)
-            sum_likes += likes_value
-            sum_comments += comments_value
+            totals["likes"] += likes_value
+            totals["comments"] += comments_value
             interactions_value = likes_value + comments_value + shares_value + saves_value
-            post_details.append({
+            details.append({
                 "id": media.get("id"),
                 "timestamp": timestamp_iso,
                 "timestamp_unix": timestamp_unix,
@@ -764,10 +4658,136 @@ def ig_window(ig_user_id: str, since: int, until: int):
                 "reach": reach_value,
                 "interactions": interactions_value,
             })
-        nextp = (page.get("paging") or {}).get("next")
-        if not nextp:
-            break
-        page = requests.get(nextp, timeout=15).json()
+    return totals, details
+
+
+def _visitor_breakdown_summary(source: Optional[str], breakdown: Dict[str, float]) -> Optional[Dict[str, Any]]:
+    """Agrupa o breakdown follow_type em seguidores / não seguidores / outros."""
+    visitors_breakdown = {"followers": 0.0, "non_followers": 0.0, "other": 0.0}
+    for key, value in breakdown.items():
+        norm = (key or "").strip().lower()
+        val = value or 0.0
+        if "non" in norm and "follow" in norm:
+            visitors_breakdown["non_followers"] += val
+        elif "follow" in norm:
+            visitors_breakdown["followers"] += val
+        else:
+            visitors_breakdown["other"] += val
+
+    visitors_total = (
+        visitors_breakdown["followers"]
+        + visitors_breakdown["non_followers"]
+        + visitors_breakdown["other"]
+    )
+    if not source and visitors_total <= 0:
+        return None
+    return {
+        "source": source,
+        "followers": int(round(visitors_breakdown["followers"])),
+        "non_followers": int(round(visitors_breakdown["non_followers"])),
+        "other": int(round(visitors_breakdown["other"])),
+        "total": int(round(visitors_total)),
+    }
+
+
+def ig_window(ig_user_id: str, since: int, until: int):
+    """Versão síncrona de ig_window_async (executa no motor assíncrono)."""
+    return run_graph_sync(ig_window_async(ig_user_id, since, until))
+
+
+async def ig_window_async(ig_user_id: str, since: int, until: int):
+    """
+    Métricas de conta + agregados básicos de mídia (para likes/comments/shares/saves).
+    """
+    insights_path = f"/{ig_user_id}/insights"
+    ig_scope = metric_scope("ig_user", ig_user_id)
+    metrics_query = "reach,profile_views,website_clicks,accounts_engaged,total_interactions"
+
+    async def fetch_visitor_breakdown():
+        for metric_name in ("profile_views", "accounts_engaged"):
+            try:
+                payload = await agget_metric(
+                    ig_scope,
+                    f"{metric_name}:follow_type",
+                    insights_path,
+                    {
+                        "metric": metric_name,
+                        "period": "day",
+                        "since": since,
+                        "until": until,
+                        "metric_type": "total_value",
+                        "breakdown": "follow_type",
+                    },
+                )
+            except MetaAPIError:
+                continue
+            breakdown = aggregate_dimension_values(payload, metric_name)
+            if breakdown:
+                return metric_name, breakdown
+        return None, {}
+
+    # As chamadas de conta e a varredura de mídias são independentes: rodam em paralelo.
+    day_params = {"period": "day", "since": since, "until": until}
+    (
+        ins,
+        reach_payload,
+        follower_payload,
+        follows_payload,
+        visitor_result,
+        media_result,
+    ) = await gather_graph(
+        agget(insights_path, {"metric": metrics_query, "metric_type": "total_value", **day_params}),
+        agget(insights_path, {"metric": "reach", **day_params}),
+        agget_metric(ig_scope, "follower_count", insights_path, {"metric": "follower_count", **day_params}),
+        agget_metric(
+            ig_scope,
+            "follows_and_unfollows",
+            insights_path,
+            {"metric": "follows_and_unfollows", "metric_type": "total_value", **day_params},
+        ),
+        fetch_visitor_breakdown(),
+        _ascan_ig_media(ig_user_id, since, until),
+    )
+    # Falhas obrigatórias (insights principais e mídias) continuam propagando como antes.
+    for result in (ins, media_result, visitor_result):
+        if isinstance(result, Exception):
+            raise result
+    for result in (reach_payload, follower_payload, follows_payload):
+        if isinstance(result, Exception) and not isinstance(result, MetaAPIError):
+            raise result
+    if isinstance(reach_payload, MetaAPIError):
+        reach_payload = {}
+
+    reach_timeseries = extract_time_series(reach_payload, "reach")
+    if not reach_timeseries:
+        reach_timeseries = extract_time_series(ins, "reach")
+
+    def by(name):
+        m = next((m for m in ins.get("data", []) if m.get("name") == name), {})
+        values = m.get("values") or []
+        if values:
+            return values
+        total_value = m.get("total_value")
+        if isinstance(total_value, dict):
+            scalar = _coerce_number(total_value.get("value"))
+            if scalar is not None:
+                return [{"value": scalar}]
+        return []
+
+    if reach_timeseries:
+        reach = sum((_coerce_number(entry.get("value")) or 0) for entry in reach_timeseries)
+    else:
+        reach = sum_values(by("reach"))
+    profile_views = sum_values(by("profile_views"))
+    website = sum_values(by("website_clicks"))
+    accounts_engaged = sum_values(by("accounts_engaged"))
+    total_interactions_metric = sum_values(by("total_interactions"))
+
+    media_totals, post_details = media_result
+    sum_likes = media_totals["likes"]
+    sum_comments = media_totals["comments"]
+    sum_shares = media_totals["shares"]
+    sum_saves = media_totals["saves"]
 
     interactions = total_interactions_metric or (sum_likes + sum_comments + sum_shares + sum_saves)
 
@@ -777,94 +4797,27 @@ def ig_window(ig_user_id: str, since: int, until: int):
     follower_end = None
     follows_total = None
     unfollows_total = None
-    try:
-        follower_payload = gget(
-            f"/{ig_user_id}/insights",
-            {
-                "metric": "follower_count",
-                "period": "day",
-                "since": since,
-                "until": until,
-            },
-        )
+    if not isinstance(follower_payload, MetaAPIError):
         follower_series = extract_time_series(follower_payload, "follower_count")
         if follower_series:
             follower_start = follower_series[0]["value"]
             follower_end = follower_series[-1]["value"]
             follower_growth = follower_end - follower_start
-    except MetaAPIError:
-        pass
 
-    try:
-        follows_payload = gget(
-            f"/{ig_user_id}/insights",
-            {
-                "metric": "follows_and_unfollows",
-                "period": "day",
-                "since": since,
-                "until": until,
-                "metric_type": "total_value",
-            },
-        )
+    if not isinstance(follows_payload, MetaAPIError):
         follows_map = aggregate_dimension_values(follows_payload, "follows_and_unfollows")
         if follows_map:
             follows_total = follows_map.get("follows")
             unfollows_total = follows_map.get("unfollows")
-    except MetaAPIError:
-        pass
 
-    visitor_breakdown_source = None
-    visitors_breakdown = {"followers": 0.0, "non_followers": 0.0, "other": 0.0}
-    for metric_name in ("profile_views", "accounts_engaged"):
-        try:
-            payload = gget(
-                f"/{ig_user_id}/insights",
-                {
-                    "metric": metric_name,
-                    "period": "day",
-                    "since": since,
-                    "until": until,
-                    "metric_type": "total_value",
-                    "breakdown": "follow_type",
-                },
-            )
-            breakdown = aggregate_dimension_values(payload, metric_name)
-            if breakdown:
-                visitor_breakdown_source = metric_name
-                for key, value in breakdown.items():
-                    norm = (key or "").strip().lower()
-                    val = value or 0.0
-                    if "non" in norm and "follow" in norm:
-                        visitors_breakdown["non_followers"] += val
-                    elif "follow" in norm:
-                        visitors_breakdown["followers"] += val
-                    else:
-                        visitors_breakdown["other"] += val
-                break
-        except MetaAPIError:
-            continue
+    visitor_breakdown_source, breakdown = visitor_result
+    profile_visitors_breakdown = _visitor_breakdown_summary(visitor_breakdown_source, breakdown)
 
     def _as_int(number):
         if number is None:
             return None
         return int(round(number))
 
-    visitors_total = (
-        visitors_breakdown["followers"]
-        + visitors_breakdown["non_followers"]
-        + visitors_breakdown["other"]
-    )
-
-    profile_visitors_breakdown = None
-    if visitor_breakdown_source or visitors_total > 0:
-        profile_visitors_breakdown = {
-            "source": visitor_breakdown_source,
-            "followers": _as_int(visitors_breakdown["followers"]),
-            "non_followers": _as_int(visitors_breakdown["non_followers"]),
-            "other": _as_int(visitors_breakdown["other"]),
-            "total": _as_int(visitors_total),
-        }
-
     return {
         "reach": reach,
         "interactions": interactions,
@@ -887,6 +4840,227 @@ def ig_window(ig_user_id: str, since: int, until: int):
     }
 
 
+# Métricas total_value pedidas dia a dia nos segmentos (accounts_engaged conta contas únicas: não soma)
+IG_DAY_TOTAL_METRICS = "reach,profile_views,website_clicks,total_interactions"
+
+
+def _insight_total(payload: Any, name: str) -> Optional[float]:
+    """Soma dos values, ou o total_value, de uma métrica; None quando a resposta não a traz."""
+    if not isinstance(payload, dict):
+        return None
+    for item in payload.get("data", []):
+        if item.get("name") != name:
+            continue
+        values = item.get("values") or []
+        if values:
+            return sum_values(values)
+        total_value = item.get("total_value")
+        if isinstance(total_value, dict):
+            return _coerce_number(total_value.get("value"))
+    return None
+
+
+async def ig_day_segments_async(ig_user_id: str, since: int, until: int) -> Dict[str, Dict[str, Any]]:
+    """
+    Segmentos diários de ig_window em [since, until) (dias UTC inteiros). As séries diárias
+    (alcance, seguidores) vêm numa chamada e são repartidas por dia; as métricas total_value
+    vão num batch com uma chamada por dia; as mídias são varridas uma vez e agrupadas pelo dia
+    da publicação. O breakdown de visitantes usa só profile_views, que é aditivo.
+    """
+    insights_path = f"/{ig_user_id}/insights"
+    ig_scope = metric_scope("ig_user", ig_user_id)
+    day_params = {"period": "day", "since": since, "until": until}
+    day_starts = list(range(since, until, DAY_SECONDS))
+
+    # (dia, tipo, métrica de capacidade, chamada)
+    planned: List[tuple] = []
+    for ts in day_starts:
+        params = {"period": "day", "since": ts, "until": ts + DAY_SECONDS}
+        planned.append((ts, "totals", None, (
+            insights_path, {"metric": IG_DAY_TOTAL_METRICS, "metric_type": "total_value", **params},
+        )))
+        if is_metric_supported(ig_scope, "follows_and_unfollows"):
+            planned.append((ts, "follows", "follows_and_unfollows", (
+                insights_path, {"metric": "follows_and_unfollows", "metric_type": "total_value", **params},
+            )))
+        if is_metric_supported(ig_scope, "profile_views:follow_type"):
+            planned.append((ts, "visitors", "profile_views:follow_type", (
+                insights_path,
+                {"metric": "profile_views", "metric_type": "total_value", "breakdown": "follow_type", **params},
+            )))
+
+    reach_payload, follower_payload, day_results, media_result = await gather_graph(
+        agget(insights_path, {"metric": "reach", **day_params}),
+        agget_metric(ig_scope, "follower_count", insights_path, {"metric": "follower_count", **day_params}),
+        agbatch([call for _, _, _, call in planned]),
+        _ascan_ig_media(ig_user_id, since, until),
+    )
+    for result in (day_results, media_result):
+        if isinstance(result, Exception):
+            raise result
+    for result in (reach_payload, follower_payload):
+        if isinstance(result, Exception) and not isinstance(result, MetaAPIError):
+            raise result
+        if isinstance(result, MetaAPIError):
+            _note_segment_failure(result)
+
+    segments: Dict[str, Dict[str, Any]] = {
+        segment_day(ts): {
+            "reach_entry": None, "reach_total": None, "interactions": None,
+            "profile_views": None, "website_clicks": None, "follower_entry": None,
+            "follows": None, "unfollows": None, "visitors": None,
+            "likes": 0, "comments": 0, "shares": 0, "saves": 0, "posts": [],
+        }
+        for ts in day_starts
+    }
+    for (ts, kind, capability, _), payload in zip(planned, day_results):
+        segment = segments[segment_day(ts)]
+        if isinstance(payload, MetaAPIError):
+            if kind == "totals":
+                # Um dia sem as métricas principais não pode ser guardado como zero
+                raise payload
+            if _is_metric_rejection(payload):
+                await asyncio.to_thread(mark_metric_unsupported, ig_scope, capability, str(payload))
+            else:
+                _note_segment_failure(payload)
+            continue
+        if kind == "totals":
+            segment["reach_total"] = _insight_total(payload, "reach")
+            segment["interactions"] = _insight_total(payload, "total_interactions")
+            segment["profile_views"] = _insight_total(payload, "profile_views")
+            segment["website_clicks"] = _insight_total(payload, "website_clicks")
+        elif kind == "follows":
+            follows_map = aggregate_dimension_values(payload, "follows_and_unfollows")
+            if follows_map:
+                segment["follows"] = follows_map.get("follows")
+                segment["unfollows"] = follows_map.get("unfollows")
+        else:
+            segment["visitors"] = aggregate_dimension_values(payload, "profile_views")
+
+    if not isinstance(reach_payload, MetaAPIError):
+        for entry in extract_time_series(reach_payload, "reach"):
+            day = insight_day(entry)
+            if day in segments:
+                segments[day]["reach_entry"] = entry
+    if not isinstance(follower_payload, MetaAPIError):
+        for entry in extract_time_series(follower_payload, "follower_count"):
+            day = insight_day(entry)
+            if day in segments:
+                segments[day]["follower_entry"] = entry
+
+    first_day = segment_day(since)
+    _, post_details = media_result
+    for post in post_details:
+        timestamp_unix = post.get("timestamp_unix")
+        day = segment_day(timestamp_unix) if timestamp_unix is not None else first_day
+        # Posts sem data (ou fora da grade) ficam no primeiro dia do trecho
+        segment = segments.get(day) or segments[first_day]
+        segment["posts"].append(post)
+        for key in ("likes", "comments", "shares", "saves"):
+            segment[key] += int(post.get(key) or 0)
+    return segments
+
+
+def compose_ig_window(segments: Sequence[Dict[str, Any]], accounts_engaged: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Resultado no formato de ig_window a partir de segmentos diários. accounts_engaged (contas
+    únicas) não se compõe por soma: vem de uma chamada total_value da janela inteira.
+    """
+    def _as_int(number):
+        if number is None:
+            return None
+        return int(round(number))
+
+    reach_timeseries = [segment["reach_entry"] for segment in segments if segment.get("reach_entry")]
+    reach = 0
+    for segment in segments:
+        # Dia sem o valor da série diária (ex.: a chamada falhou quando foi buscado): usa o total do dia
+        entry = segment.get("reach_entry")
+        value = _coerce_number(entry.get("value")) if entry else None
+        reach += (value if value is not None else segment.get("reach_total")) or 0
+
+    sum_likes = sum(int(segment.get("likes") or 0) for segment in segments)
+    sum_comments = sum(int(segment.get("comments") or 0) for segment in segments)
+    sum_shares = sum(int(segment.get("shares") or 0) for segment in segments)
+    sum_saves = sum(int(segment.get("saves") or 0) for segment in segments)
+    interactions = (_sum_segment_field(segments, "interactions") or 0) or (
+        sum_likes + sum_comments + sum_shares + sum_saves
+    )
+
+    follower_series = [segment["follower_entry"] for segment in segments if segment.get("follower_entry")]
+    follower_start = follower_series[0]["value"] if follower_series else None
+    follower_end = follower_series[-1]["value"] if follower_series else None
+    follower_growth = follower_end - follower_start if follower_series else None
+
+    visitor_source = None
+    breakdown: Dict[str, float] = {}
+    for segment in segments:
+        visitors = segment.get("visitors")
+        if not visitors:
+            continue
+        visitor_source = "profile_views"
+        for key, value in visitors.items():
+            breakdown[key] = breakdown.get(key, 0.0) + (value or 0.0)
+
+    return {
+        "reach": reach,
+        "interactions": interactions,
+        "accounts_engaged": accounts_engaged,
+        "profile_views": _sum_segment_field(segments, "profile_views") or 0,
+        "website_clicks": _sum_segment_field(segments, "website_clicks") or 0,
+        "likes": sum_likes,
+        "comments": sum_comments,
+        "shares": sum_shares,
+        "saves": sum_saves,
+        "follower_growth": _as_int(follower_growth),
+        "follower_count_start": _as_int(follower_start),
+        "follower_count_end": _as_int(follower_end),
+        "follows": _as_int(_sum_segment_field(segments, "follows")),
+        "unfollows": _as_int(_sum_segment_field(segments, "unfollows")),
+        "profile_visitors_breakdown": _visitor_breakdown_summary(visitor_source, breakdown),
+        "follower_series": follower_series,
+        "posts_detailed": [post for segment in segments for post in segment.get("posts") or []],
+        "reach_timeseries": reach_timeseries,
+    }
+
+
+async def _afetch_ig_accounts_engaged(ig_user_id: str, since: int, until: int) -> Optional[float]:
+    """accounts_engaged (contas únicas) da janela inteira, numa chamada total_value."""
+    try:
+        payload = await agget(
+            f"/{ig_user_id}/insights",
+            {"metric": "accounts_engaged", "metric_type": "total_value", "period": "day", "since": since, "until": until},
+        )
+    except MetaAPIError as err:
+        logger.info(f"accounts_engaged unavailable for {ig_user_id}: {err}")
+        return None
+    # Sem o valor na resposta, 0 como em ig_window
+    total = _insight_total(payload, "accounts_engaged")
+    return total if total is not None else 0
+
+
+def ig_windows_from_segments(ig_user_id: str, since: int, until: int) -> tuple:
+    """
+    (janela atual, janela anterior) de ig_window montadas a partir dos segmentos diários; sem o
+    store de segmentos, as duas janelas são buscadas inteiras.
+    """
+    if not day_segments_enabled():
+        return _windows_without_segments(ig_window_async, ig_user_id, since, until)
+    current, previous = day_segment_windows(
+        "ig_window", ig_user_id, since, until, ig_day_segments_async, IG_SEGMENT_MAX_RUN_DAYS,
+    )
+    start, end = day_range(since, until)
+
+    async def fetch_accounts_engaged():
+        return await gather_graph(
+            _afetch_ig_accounts_engaged(ig_user_id, start, end),
+            _afetch_ig_accounts_engaged(ig_user_id, start - (end - start), start),
+        )
+
+    engaged = [None if isinstance(value, Exception) else value for value in run_graph_sync(fetch_accounts_engaged())]
+    return compose_ig_window(current, engaged[0]), compose_ig_window(previous, engaged[1])
+
+
 def _safe(val, cast=float):
     try:
         return cast(val or 0)
@@ -920,7 +5094,16 @@ def ig_audience(ig_user_id: str) -> Dict[str, Any]:
             return 0.0
         return round((value / total) * 100.0, 2)
 
-    city_counts, _ = fetch_breakdown("city")
+    breakdown_results = run_parallel([
+        lambda: fetch_breakdown("city"),
+        lambda: fetch_breakdown("age"),
+        lambda: fetch_breakdown("gender"),
+    ])
+    for result in breakdown_results:
+        if isinstance(result, Exception):
+            raise result
+    (city_counts, _), (raw_age_counts, _), (raw_gender_counts, _) = breakdown_results
+
     top_cities = sorted(city_counts.items(), key=lambda kv: kv[1], reverse=True)[:8]
     total_city = sum(city_counts.values()) or 0.0
 
@@ -933,7 +5116,6 @@ def ig_audience(ig_user_id: str) -> Dict[str, Any]:
         for name, count in top_cities
     ]
 
-    raw_age_counts, _ = fetch_breakdown("age")
     age_buckets = {
         "18-24": 0.0,
         "25-34": 0.0,
@@ -963,7 +5145,6 @@ def ig_audience(ig_user_id: str) -> Dict[str, Any]:
         for label, amount in age_buckets.items()
     ]
 
-    raw_gender_counts, _ = fetch_breakdown("gender")
     gender_labels = {"female": "Feminino", "male": "Masculino", "unknown": "Nao informado"}
     gender_totals = {"female": 0.0, "male": 0.0, "unknown": 0.0}
 
@@ -1158,6 +5339,11 @@ def fb_audience(page_id: str) -> Dict[str, Any]:
 
 
 def ig_organic_summary(ig_user_id: str, since: int, until: int) -> Dict[str, Any]:
+    """Versão síncrona de ig_organic_summary_async (executa no motor assíncrono)."""
+    return run_graph_sync(ig_organic_summary_async(ig_user_id, since, until))
+
+
+async def ig_organic_summary_async(ig_user_id: str, since: int, until: int) -> Dict[str, Any]:
     """
     - varre mídias no intervalo para calcular:
       * tops: maior_engajamento, maior_alcance, maior_salvamentos
@@ -1166,9 +5352,11 @@ def ig_organic_summary(ig_user_id: str, since: int, until: int) -> Dict[str, Any
     """
     # ===== MÍDIAS DO FEED =====
     media_fields = "id,media_type,timestamp,like_count,comments_count,permalink,caption,media_url,thumbnail_url"
-    media_res = gget(
+    media_pages = aiter_media_with_insights(
         f"/{ig_user_id}/media",
         {"since": since, "until": until, "limit": 100, "fields": media_fields},
+        IG_MEDIA_INSIGHT_METRICS,
+        prefetch=True,
     )
 
     posts: List[Dict[str, Any]] = []
@@ -1183,45 +5371,82 @@ def ig_organic_summary(ig_user_id: str, since: int, until: int) -> Dict[str, Any
     def score_interactions(item):
         return _safe(item.get("likes")) + _safe(item.get("comments")) + _safe(item.get("shares")) + _safe(item.get("saves"))
 
-    paging = media_res
-    while True:
-        for it in paging.get("data", []):
-            mid = it.get("id")
-            # insights por mídia
-            insights = {}
-            try:
-                ins = gget(f"/{mid}/insights", {"metric": "reach,shares,saved,likes,comments"})
-                for row in ins.get("data", []):
-                    insights[row.get("name")] = (row.get("values") or [{}])[0].get("value")
-            except Exception:
-                pass
+    async def scan_feed():
+        async for page_items, page_insights in media_pages:
+            # insights por mídia expandidos na listagem (fallback individual em lote)
+            for it, ins in zip(page_items, page_insights):
+                mid = it.get("id")
+                insights = {}
+                try:
+                    if isinstance(ins, Exception):
+                        raise ins
+                    for row in ins.get("data", []):
+                        insights[row.get("name")] = (row.get("values") or [{}])[0].get("value")
+                except Exception:
+                    pass
+
+                likes = it.get("like_count") or insights.get("likes") or 0
+                comments = it.get("comments_count") or insights.get("comments") or 0
+                shares = insights.get("shares") or 0
+                saves = insights.get("saved") or insights.get("saves") or 0
+                reach = insights.get("reach") or 0
+                post_row = {
+                    "id": mid,
+                    "mediaType": it.get("media_type"),
+                    "timestamp": it.get("timestamp"),
+                    "permalink": it.get("permalink"),
+                    "caption": it.get("caption"),
+                    "previewUrl": it.get("media_url") or it.get("thumbnail_url"),
+                    "likes": _safe(likes, int),
+                    "comments": _safe(comments, int),
+                    "shares": _safe(shares, int),
+                    "saves": _safe(saves, int),
+                    "reach": _safe(reach, int),
+                    "total_interactions": _safe(likes, int) + _safe(comments, int) + _safe(shares, int) + _safe(saves, int),
+                }
+                posts.append(post_row)
+                aggr_fmt(post_row["mediaType"] or "OTHER", post_row["reach"], post_row["total_interactions"])
 
-            likes = it.get("like_count") or insights.get("likes") or 0
-            comments = it.get("comments_count") or insights.get("comments") or 0
-            shares = insights.get("shares") or 0
-            saves = insights.get("saved") or insights.get("saves") or 0
-            reach = insights.get("reach") or 0
-            post_row = {
-                "id": mid,
-                "mediaType": it.get("media_type"),
-                "timestamp": it.get("timestamp"),
-                "permalink": it.get("permalink"),
-                "caption": it.get("caption"),
-                "previewUrl": it.get("media_url") or it.get("thumbnail_url"),
-                "likes": _safe(likes, int),
-                "comments": _safe(comments, int),
-                "shares": _safe(shares, int),
-                "saves": _safe(saves, int),
-                "reach": _safe(reach, int),
-                "total_interactions": _safe(likes, int) + _safe(comments, int) + _safe(shares, int) + _safe(saves, int),
-            }
-            posts.append(post_row)
-            aggr_fmt(post_row["mediaType"] or "OTHER", post_row["reach"], post_row["total_interactions"])
+    # ===== STORIES =====
+    # Algumas contas podem não retornar; tratamos de forma resiliente
+    async def scan_stories():
+        try:
+            best = None
+            stories_params = {"since": since, "until": until, "limit": 100, "fields": "id,permalink,timestamp"}
+            async for stories, stories_insights in aiter_media_with_insights(
+                f"/{ig_user_id}/stories", stories_params, IG_STORY_INSIGHT_METRICS, prefetch=True,
+            ):
+                for st, sins in zip(stories, stories_insights):
+                    if isinstance(sins, Exception):
+                        continue
+                    vals = {row.get("name"): (row.get("values") or [{}])[0].get("value") for row in sins.get("data", [])}
+                    reach_val = _safe(vals.get("reach"), int)
+                    exits = _safe(vals.get("exits"), int)
+                    taps_back = _safe(vals.get("taps_back"), int)
+                    if reach_val <= 0:
+                        continue
+                    retention = 1.0 - (exits / reach_val)
+                    replay_rate = (taps_back / reach_val) if reach_val else 0
+                    row = {
+                        "id": st.get("id"),
+                        "permalink": st.get("permalink"),
+                        "timestamp": st.get("timestamp"),
+                        "reach": reach_val,
+                        "exits": exits,
+                        "retention": round(retention * 100.0, 2),
+                        "replay_rate": round(replay_rate * 100.0, 2),
+                    }
+                    if best is None or row["retention"] > best["retention"]:
+                        best = row
+            return best
+        except MetaAPIError:
+            return None
 
-        nextp = (paging.get("paging") or {}).get("next")
-        if not nextp:
-            break
-        paging = requests.get(nextp, timeout=15).json()
+    # Feed e stories são varridos em paralelo
+    feed_result, top_story = await gather_graph(scan_feed(), scan_stories())
+    for result in (feed_result, top_story):
+        if isinstance(result, Exception):
+            raise result
 
     # TOPS
     def top_by(key):
@@ -1251,49 +5476,6 @@ def ig_organic_summary(ig_user_id: str, since: int, until: int) -> Dict[str, Any
             "count": int(rec["count"]),
         })
 
-    # ===== STORIES =====
-    # Algumas contas podem não retornar; tratamos de forma resiliente
-    top_story = None
-    try:
-        stories_res = gget(f"/{ig_user_id}/stories", {"since": since, "until": until, "limit": 100, "fields": "id,permalink,timestamp"})
-        best = None
-        page_s = stories_res
-        while True:
-            for st in page_s.get("data", []):
-                try:
-                    sins = gget(
-                        f"/{st['id']}/insights",
-                        {"metric": "reach,exits,taps_forward,taps_back,replies"},
-                    )
-                except Exception:
-                    continue
-                vals = {row.get("name"): (row.get("values") or [{}])[0].get("value") for row in sins.get("data", [])}
-                reach_val = _safe(vals.get("reach"), int)
-                exits = _safe(vals.get("exits"), int)
-                taps_back = _safe(vals.get("taps_back"), int)
-                if reach_val <= 0:
-                    continue
-                retention = 1.0 - (exits / reach_val)
-                replay_rate = (taps_back / reach_val) if reach_val else 0
-                row = {
-                    "id": st.get("id"),
-                    "permalink": st.get("permalink"),
-                    "timestamp": st.get("timestamp"),
-                    "reach": reach_val,
-                    "exits": exits,
-                    "retention": round(retention * 100.0, 2),
-                    "replay_rate": round(replay_rate * 100.0, 2),
-                }
-                if best is None or row["retention"] > best["retention"]:
-                    best = row
-            nextp = (page_s.get("paging") or {}).get("next")
-            if not nextp:
-                break
-            page_s = requests.get(nextp, timeout=15).json()
-        top_story = best
-    except MetaAPIError:
-        top_story = None
-
     return {
         "tops": tops,
         "formats": by_format,
@@ -1312,17 +5494,22 @@ def ig_recent_posts(ig_user_id: str, limit: int = 6):
         "id,caption,media_type,media_url,thumbnail_url,permalink,timestamp,like_count,comments_count,"
         "children{media_type,media_url,thumbnail_url,permalink,caption}"
     )
-    media_res = gget(
-        f"/{ig_user_id}/media",
-        {
-            "limit": limit_sanitized,
-            "fields": media_fields,
-        },
-    )
+    media_params = {
+        "limit": limit_sanitized,
+        "fields": media_fields,
+    }
+    try:
+        # saves/shares vêm expandidos na listagem; evita uma chamada de insights por post
+        media_res = gget(
+            f"/{ig_user_id}/media",
+            _with_insights_expansion(media_params, "saved,shares", period="lifetime"),
+        )
+    except MetaAPIError as err:
+        logger.info("Expansão de insights rejeitada para %s (%s); usando chamadas por post", ig_user_id, err)
+        media_res = gget(f"/{ig_user_id}/media", media_params)
 
     posts = []
     VIDEO_TYPES = {"VIDEO", "REEL", "IGTV"}
-    unsupported_insight_metrics: set[str] = set()
 
     def _coerce_numeric(value: Optional[Any]) -> Optional[float]:
         if value is None:
@@ -1334,8 +5521,10 @@ def ig_recent_posts(ig_user_id: str, limit: int = 6):
         except (TypeError, ValueError):
             return None
 
-    def _fetch_media_insights(media_id: str, metrics: Sequence[str]) -> Dict[str, float]:
-        request_metrics = [metric for metric in metrics if metric not in unsupported_insight_metrics]
+    def _fetch_media_insights(media_id: str, media_type: Optional[str], metrics: Sequence[str]) -> Dict[str, float]:
+        # Capacidade por conta e tipo de mídia: métricas rejeitadas por REELS/CAROUSEL etc. não são repetidas
+        scope = metric_scope("ig_media", f"{ig_user_id}:{media_type or 'UNKNOWN'}")
+        request_metrics = supported_metrics(scope, metrics)
         if not request_metrics:
             return {}
         params = {
@@ -1343,21 +5532,24 @@ def ig_recent_posts(ig_user_id: str, limit: int = 6):
             "period": "lifetime",
         }
         try:
-            response = gget(f"/{media_id}/insights", params)
+            if len(request_metrics) == 1:
+                response = gget_metric(scope, request_metrics[0], f"/{media_id}/insights", params)
+            else:
+                response = gget(f"/{media_id}/insights", params)
         except MetaAPIError as err:
             if len(request_metrics) > 1:
                 combined: Dict[str, float] = {}
                 for metric in request_metrics:
-                    combined.update(_fetch_media_insights(media_id, [metric]))
+                    combined.update(_fetch_media_insights(media_id, media_type, [metric]))
                 return combined
-            metric_name = request_metrics[0]
-            logger.debug("Metric %s not supported for media %s: %s", metric_name, media_id, err)
-            unsupported_insight_metrics.add(metric_name)
+            logger.debug("Metric %s not supported for media %s: %s", request_metrics[0], media_id, err)
             return {}
         except Exception as err:  # noqa: BLE001
             logger.warning("Falha ao buscar insights do post %s: %s", media_id, err)
             return {}
+        return _parse_insight_values(response)
 
+    def _parse_insight_values(response: Dict[str, Any]) -> Dict[str, float]:
         insight_values: Dict[str, float] = {}
         for entry in response.get("data", []) or []:
             name = str(entry.get("name") or "").lower()
@@ -1433,6 +5625,7 @@ def ig_recent_posts(ig_user_id: str, limit: int = 6):
             "commentsCount": item.get("comments_count"),
             "previewUrl": preview,
             "children": children,
+            "_expanded_insights": _expanded_insights(item),
         })
 
     account_fields = "id,username,profile_picture_url,followers_count"
@@ -1449,10 +5642,14 @@ def ig_recent_posts(ig_user_id: str, limit: int = 6):
     }
 
     for post in posts:
+        expanded = post.pop("_expanded_insights", None)
         media_id = post.get("id")
         if not media_id:
             continue
-        insights = _fetch_media_insights(media_id, ("saved", "shares"))
+        if expanded is not None:
+            insights = _parse_insight_values(expanded)
+        else:
+            insights = _fetch_media_insights(media_id, post.get("mediaType"), ("saved", "shares"))
         if insights:
             formatted = {}
             for key, numeric in insights.items():
@@ -1599,19 +5796,50 @@ def fb_recent_posts(page_id: str, limit: int = 6):
 # ---- Ads (Marketing API) ----
 
 def ads_highlights(act_id: str, since_str: str, until_str: str):
+    """Versão síncrona de ads_highlights_async (executa no motor assíncrono)."""
+    return run_graph_sync(ads_highlights_async(act_id, since_str, until_str))
+
+
+async def ads_highlights_async(act_id: str, since_str: str, until_str: str):
     fields = (
         "campaign_id,campaign_name,objective,impressions,reach,clicks,spend,ctr,cpc,cpm,frequency,actions"
     )
-    res = gget(
-        f"/{act_id}/insights",
-        {
-            "fields": fields,
-            "time_range[since]": since_str,
-            "time_range[until]": until_str,
-            "level": "campaign",
-            "limit": 500,
-        },
+    time_range = {"time_range[since]": since_str, "time_range[until]": until_str}
+    # Campanhas, anúncios, série diária e demografia são consultas independentes: vão juntas
+    res, ads_res, series_res, demo_res = await gather_graph(
+        agget(
+            f"/{act_id}/insights",
+            {"fields": fields, **time_range, "level": "campaign", "limit": 500},
+        ),
+        # detalhes por anúncio (criativos)
+        agget(
+            f"/{act_id}/insights",
+            {
+                "fields": "ad_id,ad_name,impressions,reach,clicks,spend,ctr,cpc,actions",
+                **time_range,
+                "level": "ad",
+                "limit": 500,
+            },
+        ),
+        # série de gastos diários
+        agget(
+            f"/{act_id}/insights",
+            {"fields": "spend", **time_range, "level": "account", "time_increment": 1, "limit": 500},
+        ),
+        # Demografia
+        agget(
+            f"/{act_id}/insights",
+            {
+                "fields": "reach,impressions,spend",
+                **time_range,
+                "level": "account",
+                "breakdowns": "age,gender",
+                "limit": 500,
+            },
+        ),
     )
+    if isinstance(res, Exception):
+        raise res
     totals = {"spend": 0.0, "impressions": 0, "reach": 0, "clicks": 0}
     actions_totals: Dict[str, float] = {}
     campaigns: List[Dict[str, Any]] = []
@@ -1698,16 +5926,8 @@ def ads_highlights(act_id: str, since_str: str, until_str: str):
     # detalhes por anúncio (criativos)
     creatives: List[Dict[str, Any]] = []
     try:
-        ads_res = gget(
-            f"/{act_id}/insights",
-            {
-                "fields": "ad_id,ad_name,impressions,reach,clicks,spend,ctr,cpc,actions",
-                "time_range[since]": since_str,
-                "time_range[until]": until_str,
-                "level": "ad",
-                "limit": 500,
-            },
-        )
+        if isinstance(ads_res, Exception):
+            raise ads_res
         for row in ads_res.get("data", []):
             spend = float(row.get("spend", 0) or 0)
             impressions = int(row.get("impressions", 0) or 0)
@@ -1761,17 +5981,8 @@ def ads_highlights(act_id: str, since_str: str, until_str: str):
     # série de gastos diários
     spend_series: List[Dict[str, Any]] = []
     try:
-        series_res = gget(
-            f"/{act_id}/insights",
-            {
-                "fields": "spend",
-                "time_range[since]": since_str,
-                "time_range[until]": until_str,
-                "level": "account",
-                "time_increment": 1,
-                "limit": 500,
-            },
-        )
+        if isinstance(series_res, Exception):
+            raise series_res
         for row in series_res.get("data", []):
             spend_value = float(row.get("spend", 0) or 0)
             date_value = row.get("date_start") or row.get("date_stop") or row.get("date")
@@ -1793,20 +6004,10 @@ def ads_highlights(act_id: str, since_str: str, until_str: str):
         best_entry = None
 
     # Demografia (igual ao seu)
-    try:
-        demo_res = gget(
-            f"/{act_id}/insights",
-            {
-                "fields": "reach,impressions,spend",
-                "time_range[since]": since_str,
-                "time_range[until]": until_str,
-                "level": "account",
-                "breakdowns": "age,gender",
-                "limit": 500,
-            },
-        )
-    except MetaAPIError:
+    if isinstance(demo_res, MetaAPIError):
         demo_res = {"data": []}
+    elif isinstance(demo_res, Exception):
+        raise demo_res
 
     gender_totals = {}
     age_totals = {}
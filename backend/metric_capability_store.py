@@ -0,0 +1,84 @@
+"""
+Persiste as métricas de insights que cada objeto da Graph API rejeita (página, perfil IG,
+tipo de mídia), para que nenhum worker volte a pedi-las antes da expiração.
+
+O meta.py mantém o espelho em memória e sincroniza com esta tabela periodicamente.
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from db import execute, fetch_all, has_config
+from meta import register_metric_capability_store
+
+logger = logging.getLogger(__name__)
+
+METRIC_CAPABILITY_TABLE = os.getenv("META_METRIC_CAPABILITY_TABLE", "graph_metric_capabilities")
+METRIC_CAPABILITY_ENABLED = os.getenv("META_METRIC_CAPABILITY_STORE", "1") != "0"
+
+_table_lock = threading.Lock()
+_table_ready = False
+
+
+def _ensure_table() -> None:
+    global _table_ready
+    if _table_ready:
+        return
+    with _table_lock:
+        if _table_ready:
+            return
+        execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {METRIC_CAPABILITY_TABLE} (
+                scope TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                reason TEXT,
+                detected_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                expires_at TIMESTAMPTZ NOT NULL,
+                PRIMARY KEY (scope, metric)
+            );
+            """
+        )
+        _table_ready = True
+
+
+def load_unsupported_metrics() -> List[Tuple[str, str, float]]:
+    """Retorna [(escopo, métrica, expira_em_epoch)] ainda válidos."""
+    _ensure_table()
+    rows = fetch_all(
+        f"SELECT scope, metric, expires_at FROM {METRIC_CAPABILITY_TABLE} WHERE expires_at > NOW()"
+    )
+    return [(row["scope"], row["metric"], row["expires_at"].timestamp()) for row in rows]
+
+
+def save_unsupported_metric(scope: str, metric: str, reason: Optional[str], expires_at: float) -> None:
+    _ensure_table()
+    execute(
+        f"""
+        INSERT INTO {METRIC_CAPABILITY_TABLE} (scope, metric, reason, detected_at, expires_at)
+        VALUES (%(scope)s, %(metric)s, %(reason)s, NOW(), %(expires_at)s)
+        ON CONFLICT (scope, metric) DO UPDATE SET
+            reason = EXCLUDED.reason,
+            detected_at = EXCLUDED.detected_at,
+            expires_at = EXCLUDED.expires_at
+        """,
+        {
+            "scope": scope,
+            "metric": metric,
+            "reason": (reason or "")[:500] or None,
+            "expires_at": datetime.fromtimestamp(expires_at, tz=timezone.utc),
+        },
+    )
+
+
+def install_metric_capability_store() -> bool:
+    """
+    Liga o store ao espelho em memória do meta.py quando há banco configurado. Idempotente.
+    """
+    if not METRIC_CAPABILITY_ENABLED or not has_config():
+        return False
+    register_metric_capability_store(load_unsupported_metrics, save_unsupported_metric)
+    return True
@@ -0,0 +1,116 @@
+"""
+Guarda os page access tokens no Postgres, criptografados (Fernet), para que todos os workers
+e o processo do scheduler reaproveitem o mesmo token em vez de buscá-lo de novo a cada restart.
+
+A chave vem de auth_utils.token_cipher (META_TOKEN_KEYS ou derivada de AUTH_SECRET_KEY); sem
+chave o store não é ligado e os tokens ficam só na memória de cada processo.
+"""
+
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+from cryptography.fernet import InvalidToken, MultiFernet
+
+from auth_utils import token_cipher
+from db import execute, fetch_one, has_config
+from meta import register_page_token_store
+
+logger = logging.getLogger(__name__)
+
+PAGE_TOKEN_TABLE = os.getenv("META_PAGE_TOKEN_TABLE", "meta_page_tokens")
+PAGE_TOKEN_STORE_ENABLED = os.getenv("META_PAGE_TOKEN_STORE", "1") != "0"
+
+_table_lock = threading.Lock()
+_table_ready = False
+_cipher: Optional[MultiFernet] = None
+
+
+def _ensure_table() -> None:
+    global _table_ready
+    if _table_ready:
+        return
+    with _table_lock:
+        if _table_ready:
+            return
+        execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {PAGE_TOKEN_TABLE} (
+                page_id TEXT NOT NULL,
+                source_key TEXT NOT NULL,
+                token_encrypted TEXT NOT NULL,
+                fetched_at TIMESTAMPTZ NOT NULL,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+                PRIMARY KEY (page_id, source_key)
+            );
+            """
+        )
+        _table_ready = True
+
+
+def load_page_token(page_id: str, source_key: str) -> Optional[Tuple[str, float]]:
+    """Retorna (token, buscado_em_epoch) ou None; registros que não decifram mais são descartados."""
+    _ensure_table()
+    row = fetch_one(
+        f"SELECT token_encrypted, fetched_at FROM {PAGE_TOKEN_TABLE} WHERE page_id = %(page_id)s AND source_key = %(source_key)s",
+        {"page_id": page_id, "source_key": source_key},
+    )
+    if not row:
+        return None
+    try:
+        token = _cipher.decrypt(row["token_encrypted"].encode()).decode()
+    except InvalidToken:
+        logger.warning("Page token de %s não decifra com as chaves atuais; descartando.", page_id)
+        delete_page_token(page_id, source_key)
+        return None
+    return token, row["fetched_at"].timestamp()
+
+
+def save_page_token(page_id: str, source_key: str, token: str, fetched_at: float) -> None:
+    _ensure_table()
+    execute(
+        f"""
+        INSERT INTO {PAGE_TOKEN_TABLE} (page_id, source_key, token_encrypted, fetched_at, updated_at)
+        VALUES (%(page_id)s, %(source_key)s, %(token)s, %(fetched_at)s, NOW())
+        ON CONFLICT (page_id, source_key) DO UPDATE SET
+            token_encrypted = EXCLUDED.token_encrypted,
+            fetched_at = EXCLUDED.fetched_at,
+            updated_at = NOW()
+        """,
+        {
+            "page_id": page_id,
+            "source_key": source_key,
+            "token": _cipher.encrypt(token.encode()).decode(),
+            "fetched_at": datetime.fromtimestamp(fetched_at, tz=timezone.utc),
+        },
+    )
+
+
+def delete_page_token(page_id: str, source_key: str) -> None:
+    _ensure_table()
+    execute(
+        f"DELETE FROM {PAGE_TOKEN_TABLE} WHERE page_id = %(page_id)s AND source_key = %(source_key)s",
+        {"page_id": page_id, "source_key": source_key},
+    )
+
+
+def install_page_token_store() -> bool:
+    """
+    Liga o store ao cache de page tokens do meta.py quando há banco e chave configurados. Idempotente.
+    """
+    global _cipher
+    if not PAGE_TOKEN_STORE_ENABLED or not has_config():
+        return False
+    if _cipher is None:
+        try:
+            _cipher = token_cipher()
+        except ValueError as err:
+            logger.warning("META_TOKEN_KEYS inválida (%s); page tokens ficam só em memória.", err)
+            return False
+        if _cipher is None:
+            logger.warning("Sem META_TOKEN_KEYS/AUTH_SECRET_KEY; page tokens ficam só em memória.")
+            return False
+    register_page_token_store(load_page_token, save_page_token, delete_page_token)
+    return True
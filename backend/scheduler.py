@@ -6,10 +6,28 @@ from zoneinfo import ZoneInfo
 
 from apscheduler.schedulers.background import BackgroundScheduler
 
-from cache import PLATFORM_TABLES, get_cached_payload, get_table_name, list_due_entries, mark_cache_error
+from cache import (
+    PLATFORM_TABLES,
+    get_cached_payload,
+    get_table_name,
+    list_due_entries,
+    mark_cache_error,
+    postpone_cache_refresh,
+)
 from db import execute
 from jobs.instagram_ingest import ingest_account_range, resolve_ingest_accounts
-from meta import MetaAPIError, gget
+from meta import (
+    PRIORITY_BACKGROUND,
+    MetaAPIError,
+    account_calls_today,
+    account_over_budget,
+    flush_graph_usage,
+    graph_deadline,
+    graph_priority,
+    graph_usage_scope,
+    paginate,
+    warm_http_pool,
+)
 from postgres_client import get_postgres_client
 
 logger = logging.getLogger(__name__)
@@ -25,6 +43,20 @@ DEFAULT_WARM_ENABLED = os.getenv("CACHE_WARM_ENABLED", "1") != "0"
 DEFAULT_WARM_LOOKBACK_DAYS = int(os.getenv("CACHE_WARM_LOOKBACK_DAYS", "7") or "7")
 DEFAULT_WARM_MAX_ACCOUNTS = int(os.getenv("CACHE_WARM_MAX_ACCOUNTS", "50") or "50")
 DEFAULT_CACHE_RETENTION_DAYS = int(os.getenv("CACHE_RETENTION_DAYS", "365") or "365")
+# Prazos das chamadas Graph nos jobs (segundos): mais folgados que o das requisições HTTP
+DEFAULT_JOB_BUDGET_SECONDS = int(os.getenv("META_JOB_BUDGET_SECONDS", "600") or "600")
+DEFAULT_INGEST_BUDGET_SECONDS = int(os.getenv("INSTAGRAM_INGEST_BUDGET_SECONDS", "1800") or "1800")
+BUDGET_EXCEEDED_ERROR = "account_budget_exceeded"
+
+
+def _is_budget_error(err: Exception) -> bool:
+    return isinstance(err, MetaAPIError) and err.error_type == BUDGET_EXCEEDED_ERROR
+
+
+def _next_budget_day() -> datetime:
+    """Início do próximo dia UTC, quando o orçamento diário das contas recomeça."""
+    tomorrow = datetime.now(timezone.utc) + timedelta(days=1)
+    return tomorrow.replace(hour=0, minute=0, second=0, microsecond=0)
 
 
 def cleanup_old_cache_job() -> None:
@@ -70,6 +102,8 @@ class MetaSyncScheduler:
         self._warm_lookback = max(1, DEFAULT_WARM_LOOKBACK_DAYS)
         self._warm_max_accounts = max(1, DEFAULT_WARM_MAX_ACCOUNTS)
         self._cache_retention_days = DEFAULT_CACHE_RETENTION_DAYS
+        self._job_budget = max(1, DEFAULT_JOB_BUDGET_SECONDS)
+        self._ingest_budget = max(1, DEFAULT_INGEST_BUDGET_SECONDS)
 
     def start(self) -> None:
         if self._started:
@@ -79,6 +113,8 @@ class MetaSyncScheduler:
             logger.warning("Banco não configurado. Scheduler de sincronização não iniciado.")
             return
 
+        warm_http_pool()
+
         self._scheduler.add_job(
             self._run_cache_cycle,
             "interval",
@@ -159,6 +195,8 @@ class MetaSyncScheduler:
             return
 
         logger.info("Atualizando %s registro(s) expirados do cache Meta.", len(due_entries))
+        # Total do dia por conta atualizado antes de decidir quem ainda tem orçamento
+        flush_graph_usage(force=True)
 
         for entry in due_entries:
             resource = entry.get("resource")
@@ -169,25 +207,37 @@ class MetaSyncScheduler:
             cache_key = entry.get("cache_key")
             platform = (entry.get("platform") or "instagram").lower()
 
+            if account_over_budget(owner_id):
+                logger.info("Orçamento diário da conta %s esgotado; cache %s fica para amanhã.", owner_id, cache_key)
+                # Sem adiar, a entrada seguiria no topo da fila de vencidos e travaria as demais contas
+                postpone_cache_refresh(cache_key, _next_budget_day(), platform=platform)
+                continue
             try:
-                get_cached_payload(
-                    resource,
-                    owner_id,
-                    since_ts,
-                    until_ts,
-                    extra,
-                    force=True,
-                    refresh_reason="scheduler",
-                    platform=platform,
-                )
+                with graph_priority(PRIORITY_BACKGROUND), graph_usage_scope(owner_id, resource, enforce_budget=True):
+                    get_cached_payload(
+                        resource,
+                        owner_id,
+                        since_ts,
+                        until_ts,
+                        extra,
+                        force=True,
+                        refresh_reason="scheduler",
+                        platform=platform,
+                        budget=self._job_budget,
+                    )
                 logger.debug("Cache %s atualizado pelo scheduler.", cache_key)
             except Exception as err:  # noqa: BLE001
+                if _is_budget_error(err):
+                    logger.info("Orçamento diário da conta %s esgotado durante %s.", owner_id, cache_key)
+                    postpone_cache_refresh(cache_key, _next_budget_day(), platform=platform)
+                    continue
                 message = str(err)
                 logger.exception("Falha ao atualizar cache %s: %s", cache_key, message)
                 mark_cache_error(resource, owner_id, since_ts, until_ts, extra, message, platform=platform)
 
     def _resolve_ingest_accounts(self) -> List[str]:
-        accounts = resolve_ingest_accounts(auto_discover=self._ingest_auto_discover)
+        with graph_priority(PRIORITY_BACKGROUND):
+            accounts = resolve_ingest_accounts(auto_discover=self._ingest_auto_discover)
         return accounts
 
     def _discover_accounts(self) -> Dict[str, Set[str]]:
@@ -200,19 +250,18 @@ class MetaSyncScheduler:
         ad_accounts: Set[str] = set()
 
         try:
-            pages_response = gget(
+            pages_iter = paginate(
                 "/me/accounts",
-                params={
+                {
                     "fields": (
                         "id,name,"
                         "instagram_business_account{id,username,name},"
                         "ads_accounts{id,account_id,name}"
-                    )
+                    ),
+                    "limit": 100,
                 },
             )
-            for page in (pages_response or {}).get("data", []) or []:
-                if not isinstance(page, dict):
-                    continue
+            for page in pages_iter:
                 page_id = str(page.get("id") or "").strip()
                 if page_id:
                     pages.add(page_id)
@@ -233,13 +282,7 @@ class MetaSyncScheduler:
             logger.exception("Erro inesperado em _discover_accounts /me/accounts: %s", err)
 
         try:
-            adaccounts_response = gget(
-                "/me/adaccounts",
-                params={"fields": "id,name,account_id"},
-            )
-            for ad in (adaccounts_response or {}).get("data", []) or []:
-                if not isinstance(ad, dict):
-                    continue
+            for ad in paginate("/me/adaccounts", {"fields": "id,name,account_id", "limit": 100}):
                 ad_id = str(ad.get("id") or ad.get("account_id") or "").strip()
                 if ad_id:
                     ad_accounts.add(ad_id if ad_id.startswith("act_") else f"act_{ad_id}")
@@ -264,7 +307,8 @@ class MetaSyncScheduler:
         return int(since_dt.timestamp()), int(until_dt.timestamp())
 
     def _warm_all_accounts(self) -> None:
-        accounts = self._discover_accounts()
+        with graph_priority(PRIORITY_BACKGROUND):
+            accounts = self._discover_accounts()
         if not any(accounts.values()):
             logger.warning("Sem contas descobertas para pré-aquecimento de cache.")
             return
@@ -272,22 +316,32 @@ class MetaSyncScheduler:
         since_ts, until_ts = self._range_unix(self._warm_lookback)
         warmed = 0
         errors = 0
+        over_budget = 0
+        flush_graph_usage(force=True)
 
         def _warm(resource: str, owner_id: str, platform: str) -> None:
-            nonlocal warmed, errors
+            nonlocal warmed, errors, over_budget
+            if account_over_budget(owner_id):
+                over_budget += 1
+                return
             try:
-                get_cached_payload(
-                    resource,
-                    owner_id,
-                    since_ts,
-                    until_ts,
-                    extra=None,
-                    force=False,
-                    refresh_reason="prewarm_scheduler",
-                    platform=platform,
-                )
+                with graph_priority(PRIORITY_BACKGROUND), graph_usage_scope(owner_id, resource, enforce_budget=True):
+                    get_cached_payload(
+                        resource,
+                        owner_id,
+                        since_ts,
+                        until_ts,
+                        extra=None,
+                        force=False,
+                        refresh_reason="prewarm_scheduler",
+                        platform=platform,
+                        budget=self._job_budget,
+                    )
                 warmed += 1
             except Exception as err:  # noqa: BLE001
+                if _is_budget_error(err):
+                    over_budget += 1
+                    return
                 errors += 1
                 logger.warning("Falha ao pré-aquecer %s/%s: %s", resource, owner_id, err)
 
@@ -301,9 +355,10 @@ class MetaSyncScheduler:
             _warm("ads_highlights", ad_id, "ads")
 
         logger.info(
-            "Pré-aquecimento concluído: %s chamadas (erros: %s) | contas IG: %s, FB: %s, Ads: %s | range %s - %s",
+            "Pré-aquecimento concluído: %s chamadas (erros: %s, sem orçamento: %s) | contas IG: %s, FB: %s, Ads: %s | range %s - %s",
             warmed,
             errors,
+            over_budget,
             len(accounts["instagram"]),
             len(accounts["facebook"]),
             len(accounts["ads"]),
@@ -331,22 +386,44 @@ class MetaSyncScheduler:
 
         failures: List[tuple[str, str]] = []
         successes: List[str] = []
+        over_budget: List[str] = []
+
+        # Contas que menos gastaram hoje vão primeiro: uma conta barulhenta não atrasa as demais
+        flush_graph_usage(force=True)
+        account_ids = sorted(account_ids, key=account_calls_today)
 
         for ig_id in account_ids:
+            if account_over_budget(ig_id):
+                logger.warning("Orçamento diário da conta %s esgotado; ingestão adiada.", ig_id)
+                over_budget.append(ig_id)
+                continue
             try:
-                ingest_account_range(
-                    ig_id=ig_id,
-                    since=target_start,
-                    until=target_end,
-                    refresh_rollup=True,
-                    warm_posts=self._ingest_warm_posts,
-                )
+                with graph_priority(PRIORITY_BACKGROUND), graph_deadline(self._ingest_budget), \
+                        graph_usage_scope(ig_id, "instagram_ingest", enforce_budget=True):
+                    ingest_account_range(
+                        ig_id=ig_id,
+                        since=target_start,
+                        until=target_end,
+                        refresh_rollup=True,
+                        warm_posts=self._ingest_warm_posts,
+                    )
                 logger.info("Ingestão concluída para %s.", ig_id)
                 successes.append(ig_id)
             except Exception as err:  # noqa: BLE001
+                if _is_budget_error(err):
+                    logger.warning("Orçamento diário da conta %s esgotado durante a ingestão.", ig_id)
+                    over_budget.append(ig_id)
+                    continue
                 logger.exception("Falha na ingestão para %s: %s", ig_id, err)
                 failures.append((ig_id, str(err)))
 
+        if over_budget:
+            logger.warning(
+                "Ingestão adiada por orçamento diário em %s conta(s): %s",
+                len(over_budget),
+                ", ".join(over_budget),
+            )
+
         if failures:
             failed_accounts = ", ".join(item[0] for item in failures)
             logger.error(
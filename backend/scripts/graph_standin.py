@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+"""
+Servidor local que substitui a Graph API em benchmarks e testes sem rede.
+
+Modo record: funciona como proxy para a Graph real e grava cada resposta como fixture
+JSON, com tokens e appsecret_proof removidos. Modo replay: responde só com as fixtures,
+com latência configurável, injeção de 429/5xx e paginação sintética.
+
+Usage examples:
+  python scripts/graph_standin.py record --fixtures graph_fixtures --port 8787
+  python scripts/graph_standin.py replay --fixtures graph_fixtures --port 8787 \\
+      --latency-ms 80 --jitter-ms 30 --fail-rate 0.05 --fail-statuses 429,503 --page-size 25
+
+Aponte o backend para o servidor com:
+  META_GRAPH_BASE_URL=http://127.0.0.1:8787/v23.0
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+
+logger = logging.getLogger("graph_standin")
+
+DEFAULT_UPSTREAM = "https://graph.facebook.com"
+BASE_PLACEHOLDER = "{{GRAPH_BASE}}"
+SCRUBBED = "SCRUBBED"
+# Parâmetros que nunca entram na chave da fixture nem no disco
+SECRET_PARAMS = {"access_token", "appsecret_proof", "client_secret", "fb_exchange_token", "input_token"}
+SECRET_FIELDS = {"access_token", "appsecret_proof", "client_secret", "token"}
+# Headers da resposta que valem a pena reproduzir (uso de cota, ETag, tipo)
+KEPT_HEADERS = {
+    "content-type",
+    "etag",
+    "retry-after",
+    "x-app-usage",
+    "x-business-use-case-usage",
+    "x-ad-account-usage",
+}
+# Trocas literais só para valores com cara de token (evita mutilar nomes de métricas)
+MIN_SECRET_LENGTH = 16
+SYNTHETIC_CURSOR_PREFIX = "standin-"
+VERSION_PREFIX = re.compile(r"^/v\d+(\.\d+)?(?=/|$)")
+SECRET_IN_URL = re.compile(r"((?:%s)=)[^&\"'\s]+" % "|".join(sorted(SECRET_PARAMS)))
+
+ERROR_BODIES = {
+    429: {"message": "(#4) Application request limit reached", "type": "OAuthException", "code": 4},
+    500: {"message": "An unknown error has occurred.", "type": "OAuthException", "code": 1, "is_transient": True},
+    502: {"message": "Bad gateway", "type": "OAuthException", "code": 1, "is_transient": True},
+    503: {"message": "Service temporarily unavailable", "type": "OAuthException", "code": 2, "is_transient": True},
+    504: {"message": "Gateway timeout", "type": "OAuthException", "code": 2, "is_transient": True},
+}
+
+
+def _split_version(path: str) -> Tuple[str, str]:
+    """('/v23.0', '/123/insights') a partir do path completo da requisição."""
+    match = VERSION_PREFIX.match(path)
+    if not match:
+        return "", path or "/"
+    return match.group(0), path[match.end():] or "/"
+
+
+def _public_params(params: Dict[str, str]) -> Dict[str, str]:
+    return {key: value for key, value in sorted(params.items()) if key not in SECRET_PARAMS}
+
+
+def fixture_key(method: str, path: str, params: Dict[str, str]) -> str:
+    raw = json.dumps([method.upper(), path, _public_params(params)], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def scrub(value: Any, secrets: Sequence[str] = (), upstream: str = DEFAULT_UPSTREAM) -> Any:
+    """Remove tokens do corpo e troca a URL da Graph real por um marcador."""
+    if isinstance(value, dict):
+        return {
+            key: (SCRUBBED if key in SECRET_FIELDS and isinstance(item, str) else scrub(item, secrets, upstream))
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [scrub(item, secrets, upstream) for item in value]
+    if isinstance(value, str):
+        text = SECRET_IN_URL.sub(r"\1" + SCRUBBED, value)
+        for secret in secrets:
+            if secret and len(secret) >= MIN_SECRET_LENGTH:
+                text = text.replace(secret, SCRUBBED)
+        return text.replace(upstream.rstrip("/"), BASE_PLACEHOLDER)
+    return value
+
+
+def _rebase(value: Any, base: str, marker: str = BASE_PLACEHOLDER) -> Any:
+    """Troca `marker` (placeholder ou URL da Graph real) pela URL do stand-in."""
+    if isinstance(value, dict):
+        return {key: _rebase(item, base, marker) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_rebase(item, base, marker) for item in value]
+    if isinstance(value, str) and marker in value:
+        return value.replace(marker, base)
+    return value
+
+
+def _etag_for(body: Any) -> str:
+    raw = json.dumps(body, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return '"%s"' % hashlib.sha1(raw).hexdigest()
+
+
+class FixtureStore:
+    """Fixtures em disco (um JSON por requisição), com cópia em memória."""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._cache: Dict[str, Optional[Dict[str, Any]]] = {}
+
+    def _file(self, key: str) -> Path:
+        return self.root / f"{key}.json"
+
+    def load(self, method: str, path: str, params: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        key = fixture_key(method, path, params)
+        with self._lock:
+            if key in self._cache:
+                return self._cache[key]
+        target = self._file(key)
+        fixture = json.loads(target.read_text(encoding="utf-8")) if target.exists() else None
+        with self._lock:
+            self._cache[key] = fixture
+        return fixture
+
+    def save(self, method: str, path: str, params: Dict[str, str], status: int,
+             body: Any, headers: Dict[str, str]) -> None:
+        key = fixture_key(method, path, params)
+        fixture = {
+            "request": {"method": method.upper(), "path": path, "params": _public_params(params)},
+            "status": status,
+            "headers": headers,
+            "body": body,
+        }
+        target = self._file(key)
+        tmp = target.with_suffix(".tmp")
+        tmp.write_text(json.dumps(fixture, ensure_ascii=False, indent=2, sort_keys=True), encoding="utf-8")
+        tmp.replace(target)
+        with self._lock:
+            self._cache[key] = fixture
+
+
+class StandInConfig:
+    def __init__(
+        self,
+        mode: str,
+        fixtures: str,
+        upstream: str = DEFAULT_UPSTREAM,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        fail_rate: float = 0.0,
+        fail_statuses: Sequence[int] = (429, 500, 503),
+        page_size: int = 0,
+        seed: Optional[int] = None,
+    ):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown mode: {mode}")
+        self.mode = mode
+        self.store = FixtureStore(fixtures)
+        self.upstream = upstream.rstrip("/")
+        self.latency_ms = max(0.0, latency_ms)
+        self.jitter_ms = max(0.0, jitter_ms)
+        self.fail_rate = min(max(fail_rate, 0.0), 1.0)
+        self.fail_statuses = [int(status) for status in fail_statuses] or [503]
+        self.page_size = max(0, page_size)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.session = requests.Session()
+        self.stats: Dict[str, int] = {
+            "requests": 0,
+            "batch_items": 0,
+            "hits": 0,
+            "misses": 0,
+            "recorded": 0,
+            "injected": 0,
+            "not_modified": 0,
+        }
+
+    def count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.stats[name] = self.stats.get(name, 0) + amount
+
+    def delay(self) -> float:
+        if not self.latency_ms and not self.jitter_ms:
+            return 0.0
+        with self._lock:
+            jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        return max(0.0, self.latency_ms + jitter) / 1000.0
+
+    def injected_status(self) -> Optional[int]:
+        if self.fail_rate <= 0:
+            return None
+        with self._lock:
+            if self._random.random() >= self.fail_rate:
+                return None
+            status = self._random.choice(self.fail_statuses)
+        self.count("injected")
+        return status
+
+
+def _error_payload(status: int, message: Optional[str] = None) -> Dict[str, Any]:
+    error = dict(ERROR_BODIES.get(status) or {"message": "Graph stand-in error", "type": "OAuthException", "code": 1})
+    if message:
+        error["message"] = message
+    return {"error": error}
+
+
+def _miss_payload(method: str, path: str, params: Dict[str, str]) -> Dict[str, Any]:
+    logger.warning("No fixture for %s %s %s", method, path, _public_params(params))
+    return {
+        "error": {
+            "message": f"Graph stand-in has no fixture for {method} {path}",
+            "type": "GraphStandInMiss",
+            "code": 803,
+        }
+    }
+
+
+def _split_cursor(after: Optional[str]) -> Tuple[int, Optional[str]]:
+    """Cursor sintético `standin-<offset>:<cursor original>` -> (offset, cursor original)."""
+    if not after or not after.startswith(SYNTHETIC_CURSOR_PREFIX):
+        return 0, after
+    offset_raw, _, original = after[len(SYNTHETIC_CURSOR_PREFIX):].partition(":")
+    try:
+        offset = max(0, int(offset_raw))
+    except ValueError:
+        offset = 0
+    return offset, original or None
+
+
+def _paginate(body: Any, page_size: int, params: Dict[str, str], page_url: str) -> Any:
+    """
+    Fatia listagens de objetos (`data` com itens que têm `id`) em páginas de `page_size` com
+    cursores sintéticos. A última fatia mantém o `paging.next` original da gravação.
+    """
+    if not page_size or not isinstance(body, dict) or not isinstance(body.get("data"), list):
+        return body
+    items = body["data"]
+    if page_url.rstrip("/").endswith("/insights") or not all(isinstance(item, dict) and "id" in item for item in items):
+        return body
+    offset, original_after = _split_cursor(params.get("after"))
+    if offset == 0 and len(items) <= page_size:
+        return body
+    page = dict(body)
+    page["data"] = items[offset:offset + page_size]
+    paging: Dict[str, Any] = {"cursors": {"before": f"{SYNTHETIC_CURSOR_PREFIX}{offset}:{original_after or ''}"}}
+    next_offset = offset + page_size
+    if next_offset < len(items):
+        cursor = f"{SYNTHETIC_CURSOR_PREFIX}{next_offset}:{original_after or ''}"
+        paging["cursors"]["after"] = cursor
+        next_params = {key: value for key, value in params.items() if key not in SECRET_PARAMS}
+        next_params["after"] = cursor
+        paging["next"] = f"{page_url}?{urlencode(next_params)}"
+    else:
+        original = body.get("paging") if isinstance(body.get("paging"), dict) else {}
+        if original.get("next"):
+            paging["next"] = original["next"]
+            after_cursor = (original.get("cursors") or {}).get("after")
+            if after_cursor:
+                paging["cursors"]["after"] = after_cursor
+    page["paging"] = paging
+    return page
+
+
+def _lookup_params(params: Dict[str, str]) -> Dict[str, str]:
+    # Cursores sintéticos não fazem parte da fixture gravada: volta ao cursor original
+    after = params.get("after")
+    if not after or not after.startswith(SYNTHETIC_CURSOR_PREFIX):
+        return params
+    _, original = _split_cursor(after)
+    lookup = {key: value for key, value in params.items() if key != "after"}
+    if original:
+        lookup["after"] = original
+    return lookup
+
+
+class GraphStandInHandler(BaseHTTPRequestHandler):
+    server_version = "GraphStandIn/1.0"
+    protocol_version = "HTTP/1.1"
+    config: StandInConfig
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    # ---- I/O ----
+    def _read_params(self) -> Tuple[str, str, Dict[str, str]]:
+        parts = urlsplit(self.path)
+        version, path = _split_version(parts.path)
+        params = dict(parse_qsl(parts.query, keep_blank_values=True))
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            raw = self.rfile.read(length).decode("utf-8")
+            params.update(parse_qsl(raw, keep_blank_values=True))
+        return version, path, params
+
+    def _base_url(self, version: str) -> str:
+        host = self.headers.get("Host") or "%s:%s" % self.server.server_address[:2]
+        return f"http://{host}{version}"
+
+    def _send(self, status: int, body: Any, headers: Optional[Dict[str, str]] = None) -> None:
+        data = b"" if status == 304 else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        sent = {key.lower() for key in (headers or {})}
+        for key, value in (headers or {}).items():
+            if key.lower() == "content-length":
+                continue
+            self.send_header(key, value)
+        if "content-type" not in sent:
+            self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if data:
+            self.wfile.write(data)
+
+    def do_GET(self) -> None:  # noqa: N802
+        self._handle("GET")
+
+    def do_POST(self) -> None:  # noqa: N802
+        self._handle("POST")
+
+    def do_DELETE(self) -> None:  # noqa: N802
+        self._handle("DELETE")
+
+    def _handle(self, method: str) -> None:
+        config = self.config
+        version, path, params = self._read_params()
+        if path == "/__standin/stats":
+            with config._lock:
+                payload = dict(config.stats)
+            self._send(200, {"mode": config.mode, **payload})
+            return
+        config.count("requests")
+        try:
+            if config.mode == "record":
+                self._record(method, version, path, params)
+            else:
+                self._replay(method, version, path, params)
+        except requests.RequestException as err:
+            logger.warning("Upstream request failed for %s %s: %s", method, path, err)
+            self._send(502, _error_payload(502, f"Graph stand-in upstream error: {err}"))
+
+    # ---- record ----
+    def _record(self, method: str, version: str, path: str, params: Dict[str, str]) -> None:
+        config = self.config
+        url = f"{config.upstream}{version}{path}"
+        forward_headers = {}
+        if self.headers.get("If-None-Match"):
+            forward_headers["If-None-Match"] = self.headers["If-None-Match"]
+        if method == "GET":
+            response = config.session.get(url, params=params, headers=forward_headers, timeout=60)
+        else:
+            response = config.session.request(method, url, data=params, timeout=60)
+        secrets = [value for key, value in params.items() if key in SECRET_PARAMS]
+        headers = {key: value for key, value in response.headers.items() if key.lower() in KEPT_HEADERS}
+        if response.status_code == 304:
+            self._send(304, None, headers)
+            return
+        try:
+            body = response.json()
+        except ValueError:
+            body = {"raw": response.text}
+        scrubbed = scrub(body, secrets, config.upstream)
+        if path == "/" and "batch" in params:
+            # Cada item do batch vira uma fixture GET: o replay monta qualquer batch a partir delas
+            self._record_batch_items(params, scrubbed)
+        else:
+            config.store.save(method, path, params, response.status_code, scrubbed, headers)
+        config.count("recorded")
+        # O cliente recebe os tokens reais (page tokens seguem sendo usados na gravação)
+        self._send(response.status_code, _rebase(body, self._base_url(""), config.upstream), headers)
+
+    def _record_batch_items(self, params: Dict[str, str], entries: Any) -> None:
+        try:
+            batch = json.loads(params.get("batch") or "[]")
+        except ValueError:
+            return
+        if not isinstance(entries, list):
+            return
+        for item, entry in zip(batch, entries):
+            if not isinstance(item, dict) or not isinstance(entry, dict):
+                continue
+            item_path, item_params = _relative_request(item.get("relative_url") or "")
+            try:
+                item_body = json.loads(entry.get("body") or "null")
+            except ValueError:
+                item_body = {"raw": entry.get("body")}
+            self.config.store.save(
+                item.get("method") or "GET", item_path, item_params, int(entry.get("code") or 200), item_body, {},
+            )
+
+    # ---- replay ----
+    def _replay(self, method: str, version: str, path: str, params: Dict[str, str]) -> None:
+        config = self.config
+        pause = config.delay()
+        if pause:
+            time.sleep(pause)
+        injected = config.injected_status()
+        if injected:
+            headers = {"Retry-After": "1"} if injected == 429 else {}
+            self._send(injected, _error_payload(injected), headers)
+            return
+        host_url = self._base_url("")
+        if path == "/" and "batch" in params:
+            self._send(200, self._replay_batch(params, host_url, version))
+            return
+        fixture = config.store.load(method, path, _lookup_params(params))
+        if fixture is None:
+            config.count("misses")
+            self._send(404, _miss_payload(method, path, params))
+            return
+        config.count("hits")
+        body = _paginate(_rebase(fixture.get("body"), host_url), config.page_size, params, f"{host_url}{version}{path}")
+        headers = dict(fixture.get("headers") or {})
+        status = int(fixture.get("status") or 200)
+        if 200 <= status < 300:
+            etag = headers.get("ETag") or headers.get("etag") or _etag_for(body)
+            headers.pop("etag", None)
+            headers["ETag"] = etag
+            if self.headers.get("If-None-Match") == etag:
+                config.count("not_modified")
+                self._send(304, None, headers)
+                return
+        self._send(status, body, headers)
+
+    def _replay_batch(self, params: Dict[str, str], host_url: str, version: str) -> List[Dict[str, Any]]:
+        config = self.config
+        try:
+            batch = json.loads(params.get("batch") or "[]")
+        except ValueError:
+            return []
+        entries: List[Dict[str, Any]] = []
+        for item in batch if isinstance(batch, list) else []:
+            config.count("batch_items")
+            method = (item.get("method") or "GET") if isinstance(item, dict) else "GET"
+            item_path, item_params = _relative_request((item or {}).get("relative_url") or "")
+            injected = config.injected_status()
+            if injected:
+                entries.append({"code": injected, "headers": [], "body": json.dumps(_error_payload(injected))})
+                continue
+            fixture = config.store.load(method, item_path, _lookup_params(item_params))
+            if fixture is None:
+                config.count("misses")
+                entries.append({"code": 404, "headers": [], "body": json.dumps(_miss_payload(method, item_path, item_params))})
+                continue
+            config.count("hits")
+            body = _paginate(
+                _rebase(fixture.get("body"), host_url),
+                config.page_size,
+                item_params,
+                f"{host_url}{version}{item_path}",
+            )
+            entries.append({"code": int(fixture.get("status") or 200), "headers": [], "body": json.dumps(body)})
+        return entries
+
+
+def _relative_request(relative_url: str) -> Tuple[str, Dict[str, str]]:
+    parts = urlsplit("/" + relative_url.lstrip("/"))
+    _, path = _split_version(parts.path)
+    return path, dict(parse_qsl(parts.query, keep_blank_values=True))
+
+
+def start_server(config: StandInConfig, host: str = "127.0.0.1", port: int = 0,
+                 version: str = "v23.0") -> Tuple[ThreadingHTTPServer, str]:
+    """
+    Sobe o servidor numa thread daemon. Retorna (servidor, base) — `base` já inclui a versão
+    e pode ir direto para META_GRAPH_BASE_URL / meta.BASE.
+    """
+    handler = type("BoundGraphStandInHandler", (GraphStandInHandler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name="graph-standin", daemon=True)
+    thread.start()
+    bound_host, bound_port = server.server_address[:2]
+    return server, f"http://{bound_host}:{bound_port}/{version}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Stand-in local da Graph API (record/replay).")
+    parser.add_argument("mode", choices=("record", "replay"))
+    parser.add_argument("--fixtures", default="graph_fixtures", help="Diretório das fixtures JSON.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--version", default=os.getenv("META_GRAPH_VERSION", "v23.0"))
+    parser.add_argument("--upstream", default=DEFAULT_UPSTREAM, help="Graph real usada no modo record.")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Latência média por requisição (replay).")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="Variação uniforme da latência (replay).")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fração de respostas com erro injetado.")
+    parser.add_argument("--fail-statuses", default="429,500,503", help="Status sorteados na injeção de erro.")
+    parser.add_argument("--page-size", type=int, default=0, help="Fatia `data` em páginas deste tamanho (replay).")
+    parser.add_argument("--seed", type=int, default=None, help="Semente para latência/erros reproduzíveis.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    config = StandInConfig(
+        args.mode,
+        args.fixtures,
+        upstream=args.upstream,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        fail_rate=args.fail_rate,
+        fail_statuses=[int(item) for item in args.fail_statuses.split(",") if item.strip()],
+        page_size=args.page_size,
+        seed=args.seed,
+    )
+    server, base = start_server(config, args.host, args.port, args.version)
+    print(f"Graph stand-in ({args.mode}) listening on {base}")
+    print(f"Use META_GRAPH_BASE_URL={base}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,41 +5,81 @@ import time
 import logging
 import math
 import secrets
+import threading
 import unicodedata
 import uuid
 import json
+import zlib
 from collections import Counter, defaultdict
 from datetime import date, datetime, timedelta, timezone
 from typing import Any, Dict, List, Optional, Sequence, Union
 
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, g, jsonify, request, send_from_directory
 from flask_cors import CORS
 from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
 from psycopg2.extras import Json
-import requests
 
 from auth_utils import hash_password as _hash_password, verify_password as _verify_password
 from cache import (
+    CachedBody,
+    get_cache_l1_stats,
+    get_cache_refresh_queue_stats,
+    get_cache_refresh_stats,
+    get_cached_body,
     get_cached_payload,
     get_latest_cached_payload,
     mark_cache_error,
     register_fetcher,
+    render_cache_metrics,
+    render_cached_body,
 )
 from uuid import uuid4
 from meta import (
+    PRIORITY_BACKGROUND,
+    SECRET as META_APP_SECRET,
     MetaAPIError,
+    account_budget_status,
     ads_highlights,
+    get_http_pool_stats,
+    get_http_session,
+    get_memo_stats,
+    check_graph_circuit,
+    day_segments_enabled,
+    discover_token_owners,
+    get_circuit_stats,
+    get_day_segment_stats,
+    get_graph_usage_stats,
+    get_metric_capability_stats,
     get_page_access_token,
+    get_page_token_stats,
+    get_priority_stats,
+    get_rate_limit_stats,
+    get_singleflight_stats,
+    get_token_pool_stats,
     fb_audience,
     fb_page_window,
+    fb_page_windows_from_segments,
     fb_recent_posts,
     ig_audience,
     ig_organic_summary,
     ig_recent_posts,
     ig_window,
+    ig_windows_from_segments,
     gget,
+    render_graph_metrics,
+    graph_priority,
+    reset_graph_deadline,
+    run_parallel,
+    start_graph_deadline,
+    warm_http_pool,
 )
 from jobs.instagram_ingest import ingest_account_range, daterange
+from media_insights_store import install_media_insights_store
+from metric_capability_store import install_metric_capability_store
+from graph_usage_store import install_graph_usage_store, list_usage
+from graph_token_store import enroll_graph_token, install_graph_token_store
+from page_token_store import install_page_token_store
+from day_segment_store import install_day_segment_store
 from jobs.instagram_comments_ingest import ingest_account_comments
 from scheduler import MetaSyncScheduler
 from postgres_client import get_postgres_client
@@ -142,6 +182,32 @@ CORS(
 )
 LEGAL_DOCS_DIR = os.path.join(app.root_path, "static", "legal")
 
+# Prazo das chamadas Graph de cada requisição, abaixo do --timeout do gunicorn (120s):
+# ao esgotar, as rotas servem o último cache em vez de o worker ser morto
+REQUEST_GRAPH_BUDGET_SECONDS = float(os.getenv("META_REQUEST_BUDGET_SECONDS", "60") or "60")
+
+
+HTTP_WARMUP_ENABLED = os.getenv("META_HTTP_WARMUP", "1") != "0"
+
+
+@app.before_request
+def _warm_graph_pool():
+    # Na primeira requisição do worker (importar o módulo não abre conexões); depois é no-op
+    if HTTP_WARMUP_ENABLED:
+        warm_http_pool()
+
+
+@app.before_request
+def _open_graph_deadline():
+    g.graph_deadline = start_graph_deadline(REQUEST_GRAPH_BUDGET_SECONDS)
+
+
+@app.teardown_request
+def _close_graph_deadline(_exc):
+    marker = g.pop("graph_deadline", None)
+    if marker is not None:
+        reset_graph_deadline(marker)
+
 _ensure_connected_accounts_table()
 
 AUTH_SECRET_KEY = (
@@ -160,6 +226,8 @@ FACEBOOK_APP_ID = os.getenv("FACEBOOK_APP_ID")
 FACEBOOK_APP_SECRET = os.getenv("FACEBOOK_APP_SECRET")
 FACEBOOK_GRAPH_VERSION = os.getenv("FACEBOOK_GRAPH_VERSION", "v19.0")
 FACEBOOK_GRAPH_BASE = f"https://graph.facebook.com/{FACEBOOK_GRAPH_VERSION}"
+# Tokens de quem entra com o Facebook reforçam o pool de tokens da Graph (mais cota por conta)
+FACEBOOK_TOKEN_POOL_ENABLED = os.getenv("FACEBOOK_TOKEN_POOL_ENABLED", "1") != "0"
 
 PAGE_ID = os.getenv("META_PAGE_ID")
 IG_ID = os.getenv("META_IG_USER_ID")
@@ -306,6 +374,29 @@ def _duration(since_ts: int, until_ts: int) -> int:
     return max(1, until_ts - since_ts)
 
 
+def _fetch_current_and_previous(fetch, object_id: str, since_ts: int, until_ts: int):
+    """Busca a janela atual e a anterior (mesma duração) em paralelo."""
+    previous_since = since_ts - _duration(since_ts, until_ts)
+    results = run_parallel([
+        lambda: fetch(object_id, since_ts, until_ts),
+        lambda: fetch(object_id, previous_since, since_ts),
+    ])
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    return results[0], results[1]
+
+
+def _fetch_current_and_previous_days(fetch, from_segments, object_id: str, since_ts: int, until_ts: int):
+    """
+    Janela atual e anterior montadas dos segmentos diários (só os dias que faltam vão à Graph);
+    sem o store de segmentos, busca as duas janelas inteiras como antes.
+    """
+    if day_segments_enabled():
+        return from_segments(object_id, since_ts, until_ts)
+    return _fetch_current_and_previous(fetch, object_id, since_ts, until_ts)
+
+
 def strip_accents(text: str) -> str:
     normalized = unicodedata.normalize("NFD", text)
     return "".join(ch for ch in normalized if unicodedata.category(ch) != "Mn")
@@ -421,8 +512,9 @@ def fetch_facebook_metrics(
     if since_ts is None or until_ts is None:
         raise ValueError("since_ts e until_ts são obrigatórios para facebook_metrics")
 
-    cur = fb_page_window(page_id, since_ts, until_ts)
-    prev = fb_page_window(page_id, since_ts - _duration(since_ts, until_ts), since_ts)
+    cur, prev = _fetch_current_and_previous_days(
+        fb_page_window, fb_page_windows_from_segments, page_id, since_ts, until_ts,
+    )
 
     def pct(current, previous):
         return round(((current - previous) / previous) * 100, 2) if previous and previous > 0 and current is not None else None
@@ -660,8 +752,7 @@ def fetch_instagram_metrics(
     if since_ts is None or until_ts is None:
         raise ValueError("since_ts e until_ts são obrigatórios para instagram_metrics")
 
-    cur = ig_window(ig_id, since_ts, until_ts)
-    prev = ig_window(ig_id, since_ts - _duration(since_ts, until_ts), since_ts)
+    cur, prev = _fetch_current_and_previous_days(ig_window, ig_windows_from_segments, ig_id, since_ts, until_ts)
 
     def pct(current, previous):
         return round(((current - previous) / previous) * 100, 2) if previous and previous > 0 and current is not None else None
@@ -979,7 +1070,7 @@ def _validate_facebook_access_token(access_token: str) -> Dict[str, Any]:
 
     app_token = f"{FACEBOOK_APP_ID}|{FACEBOOK_APP_SECRET}"
     try:
-        debug_response = requests.get(
+        debug_response = get_http_session().get(
             _facebook_api_url("/debug_token"),
             params={"input_token": access_token, "access_token": app_token},
             timeout=10,
@@ -1005,7 +1096,7 @@ def _validate_facebook_access_token(access_token: str) -> Dict[str, Any]:
         raise ValueError("Token do Facebook expirado.")
 
     try:
-        profile_response = requests.get(
+        profile_response = get_http_session().get(
             _facebook_api_url("/me"),
             params={
                 "fields": "id,name,email",
@@ -1038,9 +1129,71 @@ def _validate_facebook_access_token(access_token: str) -> Dict[str, Any]:
         "email": email,
         "nome": profile_body.get("name"),
         "facebook_name": profile_body.get("name"),
+        "expires_at": int(expires_at) if expires_at else None,
     }
 
 
+def _exchange_long_lived_token(access_token: str) -> tuple:
+    """
+    Troca o token curto do login por um de longa duração (~60 dias).
+    Retorna (token, expira_em_epoch ou None).
+    """
+    response = get_http_session().get(
+        _facebook_api_url("/oauth/access_token"),
+        params={
+            "grant_type": "fb_exchange_token",
+            "client_id": FACEBOOK_APP_ID,
+            "client_secret": FACEBOOK_APP_SECRET,
+            "fb_exchange_token": access_token,
+        },
+        timeout=10,
+    )
+    body = _parse_facebook_response(response)
+    if not response.ok or not body.get("access_token"):
+        raise ValueError("Facebook não devolveu token de longa duração.")
+    expires_in = body.get("expires_in")
+    return body["access_token"], (time.time() + int(expires_in)) if expires_in else None
+
+
+def _enroll_facebook_token(access_token: str, profile: Dict[str, Any]) -> None:
+    """
+    Coloca o token do login no pool de tokens da Graph, com as contas que ele lê.
+    Roda numa thread em segundo plano: o login não espera a descoberta de contas.
+    """
+    if not FACEBOOK_TOKEN_POOL_ENABLED:
+        return
+    if META_APP_SECRET and FACEBOOK_APP_SECRET != META_APP_SECRET:
+        # O appsecret_proof das chamadas usa META_APP_SECRET: tokens de outro app seriam recusados
+        logger.debug("Login do Facebook usa outro app; token fora do pool da Graph.")
+        return
+
+    def run() -> None:
+        facebook_id = profile.get("facebook_id")
+        token, expires_at = access_token, profile.get("expires_at")
+        try:
+            token, expires_at = _exchange_long_lived_token(access_token)
+        except Exception as err:  # noqa: BLE001
+            logger.warning("Falha ao obter token de longa duração de %s: %s", facebook_id, err)
+        try:
+            with graph_priority(PRIORITY_BACKGROUND):
+                owners = discover_token_owners(token)
+            if not owners:
+                logger.info("Token do Facebook de %s não lê nenhuma conta; fora do pool.", facebook_id)
+                return
+            enroll_graph_token(
+                token,
+                owners,
+                facebook_user_id=facebook_id,
+                label=f"facebook:{facebook_id}",
+                expires_at=expires_at,
+            )
+            logger.info("Token do Facebook de %s adicionado ao pool (%s contas).", facebook_id, len(owners))
+        except Exception as err:  # noqa: BLE001
+            logger.warning("Falha ao adicionar token do Facebook de %s ao pool: %s", facebook_id, err)
+
+    threading.Thread(target=run, name="facebook-token-enroll", daemon=True).start()
+
+
 def _extract_bearer_token(req) -> Optional[str]:
     header = req.headers.get("Authorization", "").strip()
     if header.lower().startswith("bearer "):
@@ -1832,9 +1985,59 @@ def meta_error_response(err: MetaAPIError):
             "type": err.error_type,
         },
     }
+    if err.error_type == "circuit_open":
+        retry_after = max(1, int(math.ceil(err.raw.get("retry_after") or 1)))
+        return jsonify(payload), 503, {"Retry-After": str(retry_after)}
+    if err.error_type == "deadline_exceeded":
+        return jsonify(payload), 504
     return jsonify(payload), 502
 
 
+# Famílias de endpoint Graph (meta.endpoint_family) usadas pelos fetchers do Instagram
+IG_CIRCUIT_FAMILIES = ("insights", "media", "stories", "node")
+
+
+def _circuit_guarded(fetcher, families: Sequence[str], page_id: Optional[str] = None):
+    """
+    Envolve o fetcher do cache: com o circuito Graph de alguma das famílias aberto, falha na
+    hora com `circuit_open` em vez de esperar timeouts e a rota serve o último cache salvo.
+    """
+    def guarded(owner_id, since_ts, until_ts, extra):
+        check_graph_circuit(families, page_id=page_id, owner_id=owner_id)
+        return fetcher(owner_id, since_ts, until_ts, extra)
+    return guarded
+
+
+# Falhas decididas localmente (sem resposta da Graph): não marcam erro no cache
+LOCAL_META_ERROR_TYPES = ("circuit_open", "deadline_exceeded")
+
+
+def _meta_fallback_reason(err: MetaAPIError) -> str:
+    return err.error_type if err.error_type in LOCAL_META_ERROR_TYPES else "meta_api_error"
+
+
+def _cached_json_response(cached: CachedBody, meta: Dict[str, Any]):
+    """
+    Serve o payload do cache sem re-serializá-lo: o bloco "cache" é emendado ao JSON já pronto,
+    o gzip pré-comprimido é usado quando o cliente aceita e If-None-Match devolve 304.
+    """
+    # Conteúdo + fetched_at: uma revalidação que só renova os timestamps também muda o ETag
+    tag = f"{cached.etag}-{zlib.crc32(str(meta.get('fetched_at')).encode()):08x}"
+    if request.if_none_match.contains_weak(tag):
+        response = Response(status=304)
+    else:
+        body, compressed = render_cached_body(
+            cached, {"cache": meta}, compress=request.accept_encodings["gzip"] > 0,
+        )
+        response = Response(body, content_type="application/json")
+        if compressed:
+            response.headers["Content-Encoding"] = "gzip"
+    response.set_etag(tag, weak=True)
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.vary.add("Accept-Encoding")
+    return response
+
+
 def _serve_legal_document(filename: str):
     """
     Serve static legal documents without exigir autenticação.
@@ -1929,6 +2132,7 @@ def auth_facebook() -> Any:
         logger.exception("Falha ao criar/atualizar usuário do Facebook %s", profile)
         return jsonify({"error": "could not sign in with facebook"}), 500
 
+    _enroll_facebook_token(access_token, profile)
     token = _issue_auth_token(user_row["id"])
     return jsonify({"token": token, "user": _serialize_user_row(user_row)})
 
@@ -2242,12 +2446,22 @@ def facebook_metrics():
             page_id,
             since,
             until,
-            fetcher=fetch_facebook_metrics,
+            fetcher=_circuit_guarded(fetch_facebook_metrics, ("insights", "node"), page_id=page_id),
             platform="facebook",
         )
     except MetaAPIError as err:
-        mark_cache_error("facebook_metrics", page_id, since, until, None, err.args[0], platform="facebook")
-        return meta_error_response(err)
+        if err.error_type not in LOCAL_META_ERROR_TYPES:
+            mark_cache_error("facebook_metrics", page_id, since, until, None, err.args[0], platform="facebook")
+        fallback = get_latest_cached_payload("facebook_metrics", page_id, platform="facebook")
+        if fallback:
+            payload, meta = fallback
+            meta = dict(meta or {})
+            meta["fallback_error"] = err.args[0]
+            meta["fallback_reason"] = _meta_fallback_reason(err)
+            meta["requested_since"] = since
+            meta["requested_until"] = until
+        else:
+            return meta_error_response(err)
     except ValueError as err:
         return jsonify({"error": str(err)}), 400
 
@@ -2364,7 +2578,7 @@ def facebook_posts():
     except ValueError:
         limit = 6
     try:
-        payload, meta = get_cached_payload(
+        cached, meta = get_cached_body(
             "facebook_posts",
             page_id,
             None,
@@ -2374,11 +2588,19 @@ def facebook_posts():
             platform="facebook",
         )
     except MetaAPIError as err:
-        mark_cache_error("facebook_posts", page_id, None, None, {"limit": limit}, err.args[0], platform="facebook")
+        if err.error_type not in LOCAL_META_ERROR_TYPES:
+            mark_cache_error("facebook_posts", page_id, None, None, {"limit": limit}, err.args[0], platform="facebook")
+        fallback = get_latest_cached_payload("facebook_posts", page_id, {"limit": limit}, platform="facebook")
+        if fallback:
+            payload, meta = fallback
+            meta = dict(meta or {})
+            meta["fallback_error"] = err.args[0]
+            meta["fallback_reason"] = _meta_fallback_reason(err)
+            response = dict(payload) if isinstance(payload, dict) else {"payload": payload}
+            response["cache"] = meta
+            return jsonify(response)
         return meta_error_response(err)
-    response = dict(payload)
-    response["cache"] = meta
-    return jsonify(response)
+    return _cached_json_response(cached, meta)
 
 
 @app.get("/api/facebook/audience")
@@ -2392,23 +2614,24 @@ def facebook_audience():
         return jsonify({"error": "META_PAGE_ID is not configured"}), 500
 
     try:
-        payload, meta = get_cached_payload(
+        cached, meta = get_cached_body(
             "facebook_audience",
             page_id,
             None,
             None,
-            fetcher=fetch_facebook_audience,
+            fetcher=_circuit_guarded(fetch_facebook_audience, ("insights", "node"), page_id=page_id),
             platform="facebook",
         )
     except MetaAPIError as err:
-        mark_cache_error("facebook_audience", page_id, None, None, None, err.args[0], platform="facebook")
+        if err.error_type not in LOCAL_META_ERROR_TYPES:
+            mark_cache_error("facebook_audience", page_id, None, None, None, err.args[0], platform="facebook")
         # Tentar fallback com último cache disponível
         fallback = get_latest_cached_payload("facebook_audience", page_id, platform="facebook")
         if fallback:
             payload, meta = fallback
             meta = dict(meta or {})
             meta["fallback_error"] = err.args[0]
-            meta["fallback_reason"] = "meta_api_error"
+            meta["fallback_reason"] = _meta_fallback_reason(err)
             response = dict(payload) if isinstance(payload, dict) else {"payload": payload}
             response["cache"] = meta
             return jsonify(response)
@@ -2426,9 +2649,7 @@ def facebook_audience():
             return jsonify(response)
         return jsonify({"error": str(err)}), 500
 
-    response = dict(payload)
-    response["cache"] = meta
-    return jsonify(response)
+    return _cached_json_response(cached, meta)
 
 
 # ============== INSTAGRAM (ORGÂNICO) ==============
@@ -2452,22 +2673,23 @@ def instagram_metrics():
         return jsonify(db_payload)
 
     try:
-        payload, meta = get_cached_payload(
+        cached, meta = get_cached_body(
             "instagram_metrics",
             ig,
             since,
             until,
-            fetcher=fetch_instagram_metrics,
+            fetcher=_circuit_guarded(fetch_instagram_metrics, IG_CIRCUIT_FAMILIES),
             platform=DEFAULT_CACHE_PLATFORM,
         )
     except MetaAPIError as err:
-        mark_cache_error("instagram_metrics", ig, since, until, None, err.args[0], platform=DEFAULT_CACHE_PLATFORM)
+        if err.error_type not in LOCAL_META_ERROR_TYPES:
+            mark_cache_error("instagram_metrics", ig, since, until, None, err.args[0], platform=DEFAULT_CACHE_PLATFORM)
         fallback = get_latest_cached_payload("instagram_metrics", ig, platform=DEFAULT_CACHE_PLATFORM)
         if fallback:
             payload, meta = fallback
             meta = dict(meta or {})
             meta["fallback_error"] = err.args[0]
-            meta["fallback_reason"] = "meta_api_error"
+            meta["fallback_reason"] = _meta_fallback_reason(err)
             meta["requested_since"] = since
             meta["requested_until"] = until
             response = dict(payload) if isinstance(payload, dict) else {"payload": payload}
@@ -2502,9 +2724,7 @@ def instagram_metrics():
             return jsonify(response)
         return jsonify({"error": str(err)}), 500
 
-    response = dict(payload)
-    response["cache"] = meta
-    return jsonify(response)
+    return _cached_json_response(cached, meta)
 
 @app.get("/api/instagram/organic")
 def instagram_organic():
@@ -2516,22 +2736,23 @@ def instagram_organic():
         return jsonify({"error": "META_IG_USER_ID is not configured"}), 500
     since, until = unix_range(request.args)
     try:
-        payload, meta = get_cached_payload(
+        cached, meta = get_cached_body(
             "instagram_organic",
             ig,
             since,
             until,
-            fetcher=fetch_instagram_organic,
+            fetcher=_circuit_guarded(fetch_instagram_organic, IG_CIRCUIT_FAMILIES),
             platform=DEFAULT_CACHE_PLATFORM,
         )
     except MetaAPIError as err:
-        mark_cache_error("instagram_organic", ig, since, until, None, err.args[0], platform=DEFAULT_CACHE_PLATFORM)
+        if err.error_type not in LOCAL_META_ERROR_TYPES:
+            mark_cache_error("instagram_organic", ig, since, until, None, err.args[0], platform=DEFAULT_CACHE_PLATFORM)
         fallback = get_latest_cached_payload("instagram_organic", ig, platform=DEFAULT_CACHE_PLATFORM)
         if fallback:
             payload, meta = fallback
             meta = dict(meta or {})
             meta["fallback_error"] = err.args[0]
-            meta["fallback_reason"] = "meta_api_error"
+            meta["fallback_reason"] = _meta_fallback_reason(err)
             meta["requested_since"] = since
             meta["requested_until"] = until
             response = dict(payload) if isinstance(payload, dict) else {"payload": payload}
@@ -2566,9 +2787,7 @@ def instagram_organic():
             return jsonify(response)
         return jsonify({"error": str(err)}), 500
 
-    response = dict(payload)
-    response["cache"] = meta
-    return jsonify(response)
+    return _cached_json_response(cached, meta)
 
 @app.get("/api/instagram/audience")
 def instagram_audience():
@@ -2576,22 +2795,23 @@ def instagram_audience():
     if not ig:
         return jsonify({"error": "META_IG_USER_ID is not configured"}), 500
     try:
-        payload, meta = get_cached_payload(
+        cached, meta = get_cached_body(
             "instagram_audience",
             ig,
             None,
             None,
-            fetcher=fetch_instagram_audience,
+            fetcher=_circuit_guarded(fetch_instagram_audience, ("insights",)),
             platform=DEFAULT_CACHE_PLATFORM,
         )
     except MetaAPIError as err:
-        mark_cache_error("instagram_audience", ig, None, None, None, err.args[0], platform=DEFAULT_CACHE_PLATFORM)
+        if err.error_type not in LOCAL_META_ERROR_TYPES:
+            mark_cache_error("instagram_audience", ig, None, None, None, err.args[0], platform=DEFAULT_CACHE_PLATFORM)
         fallback = get_latest_cached_payload("instagram_audience", ig, platform=DEFAULT_CACHE_PLATFORM)
         if fallback:
             payload, meta = fallback
             meta = dict(meta or {})
             meta["fallback_error"] = err.args[0]
-            meta["fallback_reason"] = "meta_api_error"
+            meta["fallback_reason"] = _meta_fallback_reason(err)
             response = dict(payload) if isinstance(payload, dict) else {"payload": payload}
             response["cache"] = meta
             return jsonify(response)
@@ -2608,9 +2828,7 @@ def instagram_audience():
             response["cache"] = meta
             return jsonify(response)
         return jsonify({"error": str(err)}), 500
-    response = dict(payload)
-    response["cache"] = meta
-    return jsonify(response)
+    return _cached_json_response(cached, meta)
 
 @app.get("/api/instagram/posts")
 def instagram_posts():
@@ -2623,7 +2841,7 @@ def instagram_posts():
     except ValueError:
         limit = 6
     try:
-        payload, meta = get_cached_payload(
+        cached, meta = get_cached_body(
             "instagram_posts",
             ig,
             None,
@@ -2633,11 +2851,19 @@ def instagram_posts():
             platform=DEFAULT_CACHE_PLATFORM,
         )
     except MetaAPIError as err:
-        mark_cache_error("instagram_posts", ig, None, None, {"limit": limit}, err.args[0], platform=DEFAULT_CACHE_PLATFORM)
+        if err.error_type not in LOCAL_META_ERROR_TYPES:
+            mark_cache_error("instagram_posts", ig, None, None, {"limit": limit}, err.args[0], platform=DEFAULT_CACHE_PLATFORM)
+        fallback = get_latest_cached_payload("instagram_posts", ig, {"limit": limit}, platform=DEFAULT_CACHE_PLATFORM)
+        if fallback:
+            payload, meta = fallback
+            meta = dict(meta or {})
+            meta["fallback_error"] = err.args[0]
+            meta["fallback_reason"] = _meta_fallback_reason(err)
+            response = dict(payload) if isinstance(payload, dict) else {"payload": payload}
+            response["cache"] = meta
+            return jsonify(response)
         return meta_error_response(err)
-    response = dict(payload)
-    response["cache"] = meta
-    return jsonify(response)
+    return _cached_json_response(cached, meta)
 
 
 def _parse_date_param(value: Optional[str]) -> date:
@@ -2746,7 +2972,9 @@ def instagram_comments_ingest_http():
     days = max(1, min(WORDCLOUD_MAX_RANGE_DAYS, days))
 
     try:
-        medias_scanned, inserted, updated = ingest_account_comments(ig_user_id, days)
+        # Disparada por cron: cede a vez aos dashboards abertos
+        with graph_priority(PRIORITY_BACKGROUND):
+            medias_scanned, inserted, updated = ingest_account_comments(ig_user_id, days)
     except Exception as err:  # noqa: BLE001
         logger.exception("Failed to ingest comments for %s", ig_user_id)
         return jsonify({"error": str(err)}), 500
@@ -2782,7 +3010,7 @@ def ads_high():
             act,
             since_ts,
             until_ts,
-            fetcher=fetch_ads_highlights,
+            fetcher=_circuit_guarded(fetch_ads_highlights, ("ads",)),
             platform="ads",
         )
         if (
@@ -2794,19 +3022,20 @@ def ads_high():
                 act,
                 since_ts,
                 until_ts,
-                fetcher=fetch_ads_highlights,
+                fetcher=_circuit_guarded(fetch_ads_highlights, ("ads",)),
                 platform="ads",
                 force=True,
                 refresh_reason="backfill_spend_series_campaigns",
             )
     except MetaAPIError as err:
-        mark_cache_error("ads_highlights", act, since_ts, until_ts, None, err.args[0], platform="ads")
+        if err.error_type not in LOCAL_META_ERROR_TYPES:
+            mark_cache_error("ads_highlights", act, since_ts, until_ts, None, err.args[0], platform="ads")
         fallback = get_latest_cached_payload("ads_highlights", act, platform="ads")
         if fallback:
             payload, meta = fallback
             meta = dict(meta or {})
             meta["fallback_error"] = err.args[0]
-            meta["fallback_reason"] = "meta_api_error"
+            meta["fallback_reason"] = _meta_fallback_reason(err)
             meta["requested_since"] = since_ts
             meta["requested_until"] = until_ts
             response = dict(payload) if isinstance(payload, dict) else {"payload": payload}
@@ -3207,6 +3436,76 @@ def manual_refresh():
         "until": until_ts,
     }), status
 
+
+@app.get("/api/meta/stats")
+def meta_client_stats():
+    """
+    Estatísticas do cliente Graph deste worker (pool HTTP, limitador de taxa, coalescência, memo de chamadas,
+    circuit breakers, uso do dia por conta/recurso, faixas de prioridade, page tokens e pool de tokens), do
+    cache L1 em memória na frente das tabelas de cache, da coordenação de refreshes entre processos e da
+    fila de refresh em segundo plano.
+    """
+    return jsonify({
+        "http_pool": get_http_pool_stats(),
+        "rate_limit": get_rate_limit_stats(),
+        "singleflight": get_singleflight_stats(),
+        "memo": get_memo_stats(),
+        "metric_capabilities": get_metric_capability_stats(),
+        "circuits": get_circuit_stats(),
+        "usage": get_graph_usage_stats(),
+        "priority": get_priority_stats(),
+        "page_tokens": get_page_token_stats(),
+        "token_pool": get_token_pool_stats(),
+        "cache_l1": get_cache_l1_stats(),
+        "cache_refresh": get_cache_refresh_stats(),
+        "cache_refresh_queue": get_cache_refresh_queue_stats(),
+        "day_segments": get_day_segment_stats(),
+    })
+
+
+@app.get("/metrics")
+def meta_client_metrics():
+    """
+    Métricas do cliente Graph deste worker no formato texto do Prometheus (latência por endpoint e recurso,
+    respostas por classe de status, retries, bytes recebidos e profundidade da paginação), além da fila de
+    refresh e do L1 do cache.
+    """
+    return Response(render_graph_metrics() + render_cache_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/api/meta/usage")
+def meta_usage_history():
+    """
+    Uso persistido da Graph API por conta e recurso nos últimos `days` dias, com o orçamento diário de cada conta.
+    """
+    days_param = request.args.get("days")
+    try:
+        days = int(days_param) if days_param is not None else 7
+    except ValueError:
+        return jsonify({"error": "days must be an integer"}), 400
+    days = max(1, min(90, days))
+    if get_postgres_client() is None:
+        return jsonify({"days": days, "persistent": False, "usage": [], "today": get_graph_usage_stats()})
+    rows = list_usage(days=days)
+    owners = sorted({row["owner_id"] for row in rows})
+    return jsonify({
+        "days": days,
+        "persistent": True,
+        "usage": [
+            {
+                "owner_id": row["owner_id"],
+                "resource": row["resource"],
+                "calls": int(row["calls"] or 0),
+                "bytes": int(row["bytes"] or 0),
+                "avg_latency_ms": round(int(row["latency_ms"] or 0) / int(row["calls"]), 1) if row["calls"] else None,
+                "errors": int(row["errors"] or 0),
+            }
+            for row in rows
+        ],
+        "budgets": [account_budget_status(owner_id) for owner_id in owners],
+    })
+
+
 register_fetcher("facebook_metrics", fetch_facebook_metrics)
 register_fetcher("facebook_posts", fetch_facebook_posts)
 register_fetcher("facebook_audience", fetch_facebook_audience)
@@ -3215,6 +3514,12 @@ register_fetcher("instagram_organic", fetch_instagram_organic)
 register_fetcher("instagram_audience", fetch_instagram_audience)
 register_fetcher("instagram_posts", fetch_instagram_posts)
 register_fetcher("ads_highlights", fetch_ads_highlights)
+install_media_insights_store()
+install_metric_capability_store()
+install_graph_usage_store()
+install_page_token_store()
+install_graph_token_store()
+install_day_segment_store()
 
 _sync_scheduler: Optional[MetaSyncScheduler] = None
 if os.getenv("META_SYNC_AUTOSTART", "1") != "0":
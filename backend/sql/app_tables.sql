@@ -62,6 +62,32 @@ CREATE TABLE IF NOT EXISTS ig_cache (
 CREATE TABLE IF NOT EXISTS fb_cache (LIKE ig_cache INCLUDING ALL);
 CREATE TABLE IF NOT EXISTS ads_cache (LIKE ig_cache INCLUDING ALL);
 
+-- Insights lifetime por mídia do Instagram (refresh decai com a idade do post)
+CREATE TABLE IF NOT EXISTS ig_media_insights (
+    media_id TEXT NOT NULL,
+    metrics TEXT NOT NULL,
+    account_id TEXT,
+    media_type TEXT,
+    posted_at TIMESTAMPTZ,
+    insights JSONB NOT NULL,
+    fetched_at TIMESTAMPTZ NOT NULL,
+    next_refresh_at TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (media_id, metrics)
+);
+
+CREATE INDEX IF NOT EXISTS ig_media_insights_account_posted_idx
+    ON ig_media_insights (account_id, posted_at);
+
+-- Métricas de insights rejeitadas por objeto/tipo de mídia (expiram para nova tentativa)
+CREATE TABLE IF NOT EXISTS graph_metric_capabilities (
+    scope TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    reason TEXT,
+    detected_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    expires_at TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (scope, metric)
+);
+
 -- Índices de performance para métricas/Instagram
 CREATE INDEX IF NOT EXISTS metrics_daily_account_platform_date_idx
     ON metrics_daily (account_id, platform, metric_date);
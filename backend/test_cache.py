@@ -0,0 +1,443 @@
+"""
+Cache das métricas (cache.py) sobre um Postgres falso em memória: revalidação, L1, corpo
+serializado, coordenação de refresh entre processos e fila de refresh em segundo plano.
+"""
+
+import gzip
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import cache
+import meta
+from conftest import FakeCacheDB
+
+OWNER_ID = "17841400000000000"
+
+
+@pytest.fixture
+def cache_db(monkeypatch):
+    db = FakeCacheDB()
+    notifies = []
+    monkeypatch.setattr(cache, "_get_postgres_client", lambda: db)
+    monkeypatch.setattr(cache, "execute", lambda query, params=None: notifies.append(params["payload"]))
+    db.notifies = notifies
+    return db
+
+
+@pytest.fixture
+def l1(monkeypatch):
+    """L1 ligado como se o listener LISTEN/NOTIFY deste processo estivesse conectado."""
+    monkeypatch.setattr(cache, "L1_ENABLED", True)
+    monkeypatch.setattr(cache, "_listener_pid", os.getpid())
+    monkeypatch.setattr(cache, "_listener_connected", True)
+    cache._l1_invalidate()
+    yield
+    cache._l1_invalidate()
+
+
+def _record(cache_key, payload, fetched_ago=0.0, next_refresh_in=3600.0):
+    now = datetime.now(timezone.utc)
+    return {
+        "cache_key": cache_key,
+        "payload": payload,
+        "fetched_at": (now - timedelta(seconds=fetched_ago)).isoformat(),
+        "next_refresh_at": (now + timedelta(seconds=next_refresh_in)).isoformat(),
+        "ttl_hours": 24,
+    }
+
+
+def _refresh(db, fetcher, stored=None):
+    table_name = cache.get_table_name("instagram")
+    cache_key = cache._compute_cache_key("instagram_metrics", OWNER_ID, None, None, None)
+    return cache._refresh_cache_entry(
+        db, table_name, cache_key, "instagram_metrics", OWNER_ID,
+        None, None, None, None, None, fetcher, None, stored,
+    )
+
+
+def _stored_row(db):
+    rows = db.tables[cache.get_table_name("instagram")]
+    assert len(rows) == 1
+    return dict(rows[0])
+
+
+def test_refresh_revalidado_so_renova_timestamps(graph, cache_db, monkeypatch):
+    # Sem memo as respostas ficam só como validadores: toda leitura vai à Graph com If-None-Match
+    monkeypatch.setattr(meta, "MEMO_ENABLED", False)
+    versions = {f"/{OWNER_ID}": 10, f"/{OWNER_ID}/media": 3}
+    changed = set(versions)
+
+    def handler(method, path, query, body):
+        etag = f'"{path}:{versions[path]}"'
+        if path not in changed:
+            return 304, None, {"ETag": etag}
+        return 200, {"id": OWNER_ID, "count": versions[path]}, {"ETag": etag}
+
+    graph.handler = handler
+
+    def fetcher(owner_id, since_ts, until_ts, extra):
+        node = meta.gget(f"/{owner_id}", {"fields": "followers_count"})
+        media = meta.gget(f"/{owner_id}/media", {"fields": "id"})
+        return {"followers": node["count"], "media": media["count"]}
+
+    payload, metadata = _refresh(cache_db, fetcher)
+    assert metadata["source"] == "prime"
+    assert cache_db.ops[-1][0] == "upsert"
+
+    # Todas as leituras voltaram 304: a linha só tem os timestamps renovados
+    changed.clear()
+    payload, metadata = _refresh(cache_db, fetcher, stored=_stored_row(cache_db))
+    assert metadata["source"] == "revalidated"
+    assert cache_db.ops[-1][0] == "update"
+    assert payload == {"followers": 10, "media": 3}
+    assert _stored_row(cache_db)["payload"] == {"followers": 10, "media": 3}
+
+    # Basta uma leitura com conteúdo novo para regravar o payload inteiro
+    versions[f"/{OWNER_ID}/media"] = 4
+    changed.add(f"/{OWNER_ID}/media")
+    payload, metadata = _refresh(cache_db, fetcher, stored=_stored_row(cache_db))
+    assert metadata["source"] == "refresh"
+    assert cache_db.ops[-1][0] == "upsert"
+    assert _stored_row(cache_db)["payload"] == {"followers": 10, "media": 4}
+    assert len(graph.calls) == 6
+
+
+def test_l1_put_skips_rows_read_before_an_invalidation(l1):
+    generation = cache._l1_generation
+    # Outro processo grava a chave enquanto esta leitura do banco estava em andamento
+    cache._handle_cache_notify("outro-host:1|tabela|chave")
+    cache._l1_put("tabela", _record("chave", {"reach": 1}), generation)
+    assert cache._l1_peek("tabela", "chave") is None
+
+    cache._l1_put("tabela", _record("chave", {"reach": 2}), cache._l1_generation)
+    assert cache._l1_get("tabela", "chave").record["cache_key"] == "chave"
+
+
+def test_l1_entry_dropped_on_notify_from_another_process(l1):
+    cache._l1_put("tabela", _record("chave", {"reach": 1}), cache._l1_generation)
+
+    # Escrita deste mesmo processo: o L1 já foi atualizado por quem gravou
+    cache._handle_cache_notify(f"{cache._l1_origin()}|tabela|chave")
+    assert cache._l1_peek("tabela", "chave") is not None
+
+    cache._handle_cache_notify("outro-host:1|tabela|chave")
+    assert cache._l1_get("tabela", "chave") is None
+    assert cache.get_cache_l1_stats()["invalidations"] >= 1
+
+
+def test_l1_entry_expires_at_next_refresh_at(l1):
+    cache._l1_put("tabela", _record("curta", {"reach": 1}, next_refresh_in=0.3), cache._l1_generation)
+    cache._l1_put("tabela", _record("vencida", {"reach": 1}, next_refresh_in=-1), cache._l1_generation)
+
+    entry = cache._l1_get("tabela", "curta")
+    assert entry is not None
+    assert entry.expires_at <= time.time() + 0.3
+    assert cache._l1_get("tabela", "vencida") is None
+    time.sleep(0.35)
+    assert cache._l1_get("tabela", "curta") is None
+
+
+def _big_payload():
+    return {"posts": [{"id": str(index), "caption": "legenda ç" * 5} for index in range(40)]}
+
+
+def test_render_splices_fields_into_the_precompressed_gzip():
+    payload = _big_payload()
+    cached = cache._serialize_body(payload)
+    assert cached.gzip_prefix is not None
+    fields = {"cache": {"source": "cache", "stale": False}}
+
+    body, compressed = cache.render_cached_body(cached, fields, compress=True)
+    assert compressed
+    assert json.loads(gzip.decompress(body)) == {**payload, **fields}
+
+    plain, compressed = cache.render_cached_body(cached, fields)
+    assert not compressed
+    assert json.loads(plain) == {**payload, **fields}
+
+
+@pytest.mark.parametrize("payload", [{}, {"reach": 1}, [1, 2], None, "texto"])
+def test_render_small_and_non_object_payloads(payload):
+    cached = cache._serialize_body(payload)
+    assert cached.gzip_prefix is None
+
+    body, compressed = cache.render_cached_body(cached, {"cache": {"stale": True}}, compress=True)
+
+    assert not compressed
+    expected = dict(payload) if isinstance(payload, dict) else {"payload": payload}
+    assert json.loads(body) == {**expected, "cache": {"stale": True}}
+
+
+class _FakeLockConn:
+    def __init__(self, acquired=True):
+        self.acquired = acquired
+        self.closed = False
+
+    def set_isolation_level(self, level):
+        pass
+
+    def cursor(self):
+        conn = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, query, params=None):
+                pass
+
+            def fetchone(self):
+                return (conn.acquired,)
+
+        return Cursor()
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def refresh_lock(monkeypatch):
+    """Sequência de resultados do _claim_refresh e linhas devolvidas pelo _select_entry."""
+    state = {"claims": [], "rows": [], "refreshes": []}
+
+    def claim(table_name, cache_key):
+        return state["claims"].pop(0) if len(state["claims"]) > 1 else state["claims"][0]
+
+    monkeypatch.setattr(cache, "_claim_refresh", claim)
+    monkeypatch.setattr(cache, "_select_entry", lambda client, table_name, cache_key: state["rows"][-1] if state["rows"] else None)
+    monkeypatch.setattr(cache, "REFRESH_WAIT_SECONDS", 5.0)
+    monkeypatch.setattr(cache, "REFRESH_POLL_SECONDS", 5.0)
+    return state
+
+
+def _coordinated(state, stored=None):
+    def refresh(current):
+        state["refreshes"].append(current)
+        return {"reach": "novo"}, {"source": "refresh"}
+
+    return cache._coordinated_refresh(None, "tabela", "chave", stored, refresh)
+
+
+def test_claim_refresh_holds_the_connection_only_when_the_lock_is_won(monkeypatch):
+    monkeypatch.setattr(cache, "has_config", lambda: True)
+    monkeypatch.setattr(cache, "REFRESH_LOCK_ENABLED", True)
+    connections = []
+
+    def connect(acquired):
+        conn = _FakeLockConn(acquired)
+        connections.append(conn)
+        return conn
+
+    monkeypatch.setattr(cache, "dedicated_connection", lambda: connect(True))
+    won, conn = cache._claim_refresh("tabela", "chave")
+    assert won and conn is connections[-1] and not conn.closed
+
+    monkeypatch.setattr(cache, "dedicated_connection", lambda: connect(False))
+    assert cache._claim_refresh("tabela", "chave") == (False, None)
+    assert connections[-1].closed
+
+    def broken():
+        raise RuntimeError("sem conexão")
+
+    uncoordinated = cache.get_cache_refresh_stats()["uncoordinated"]
+    monkeypatch.setattr(cache, "dedicated_connection", broken)
+    # Sem como coordenar, segue sem lock em vez de travar o refresh
+    assert cache._claim_refresh("tabela", "chave") == (True, None)
+    assert cache.get_cache_refresh_stats()["uncoordinated"] == uncoordinated + 1
+
+
+def test_lock_winner_refreshes_and_releases(refresh_lock):
+    conn = _FakeLockConn()
+    refresh_lock["claims"] = [(True, conn)]
+
+    payload, metadata = _coordinated(refresh_lock)
+
+    assert payload == {"reach": "novo"}
+    assert refresh_lock["refreshes"] == [None]
+    assert conn.closed
+
+
+def test_waiter_is_woken_by_notify_and_reuses_the_winner_row(refresh_lock):
+    refresh_lock["claims"] = [(False, None)]
+    stored = _record("chave", {"reach": "antigo"}, fetched_ago=3600)
+
+    def winner():
+        time.sleep(0.1)
+        refresh_lock["rows"].append(_record("chave", {"reach": "do vencedor"}))
+        cache._handle_cache_notify("outro-host:1|tabela|chave")
+
+    threading.Thread(target=winner).start()
+    started = time.monotonic()
+    payload, metadata = _coordinated(refresh_lock, stored)
+
+    # Acordado pelo NOTIFY, bem antes da consulta periódica (5s)
+    assert time.monotonic() - started < 2
+    assert payload == {"reach": "do vencedor"}
+    assert metadata["source"] == "coalesced"
+    assert refresh_lock["refreshes"] == []
+    assert cache.get_cache_refresh_stats()["waiting"] == 0
+
+
+def test_next_waiter_takes_over_when_the_winner_fails(refresh_lock, monkeypatch):
+    monkeypatch.setattr(cache, "REFRESH_POLL_SECONDS", 0.05)
+    conn = _FakeLockConn()
+    # O vencedor falhou sem gravar: o lock vaga e este processo o assume
+    refresh_lock["claims"] = [(False, None), (False, None), (True, conn)]
+    stored = _record("chave", {"reach": "antigo"}, fetched_ago=3600)
+    refresh_lock["rows"].append(stored)
+
+    payload, metadata = _coordinated(refresh_lock, stored)
+
+    assert payload == {"reach": "novo"}
+    assert refresh_lock["refreshes"] == [stored]
+    assert conn.closed
+
+
+@pytest.mark.parametrize("wait_seconds, budget", [(0.2, None), (5.0, 0.2)])
+def test_wait_gives_up_with_deadline_exceeded(refresh_lock, monkeypatch, wait_seconds, budget):
+    monkeypatch.setattr(cache, "REFRESH_WAIT_SECONDS", wait_seconds)
+    monkeypatch.setattr(cache, "REFRESH_POLL_SECONDS", 0.05)
+    refresh_lock["claims"] = [(False, None)]
+
+    started = time.monotonic()
+    with meta.graph_deadline(budget):
+        with pytest.raises(meta.MetaAPIError) as err:
+            _coordinated(refresh_lock)
+
+    assert err.value.error_type == "deadline_exceeded"
+    assert time.monotonic() - started < 1
+    assert refresh_lock["refreshes"] == []
+
+
+@pytest.fixture
+def background_run(monkeypatch):
+    """Captura a tarefa enviada à fila de refresh e os refreshes que ela dispara."""
+    captured = {"tasks": [], "refreshes": []}
+
+    def submit(cache_key, origin, priority, task):
+        captured["tasks"].append(task)
+        return True
+
+    monkeypatch.setattr(cache, "_submit_refresh", submit)
+    monkeypatch.setattr(cache, "_refresh_cache_entry", lambda *args, **kwargs: captured["refreshes"].append(kwargs["stored"]))
+
+    def schedule():
+        cache._schedule_background_refresh(
+            "chave", None, "tabela", "instagram_metrics", OWNER_ID, None, None, None, None, None, lambda *args: {},
+        )
+        return captured["tasks"].pop()()
+
+    captured["schedule"] = schedule
+    return captured
+
+
+def test_background_refresh_skips_when_another_process_holds_the_lock(refresh_lock, background_run):
+    refresh_lock["claims"] = [(False, None)]
+    assert background_run["schedule"]() == "skipped"
+    assert background_run["refreshes"] == []
+
+
+def test_background_refresh_skips_a_row_refreshed_meanwhile(refresh_lock, background_run):
+    conn = _FakeLockConn()
+    refresh_lock["claims"] = [(True, conn)]
+    refresh_lock["rows"].append(_record("chave", {"reach": 1}))
+
+    assert background_run["schedule"]() == "skipped"
+    assert background_run["refreshes"] == []
+    assert conn.closed
+
+
+def test_background_refresh_runs_for_a_stale_row(refresh_lock, background_run):
+    conn = _FakeLockConn()
+    stale = _record("chave", {"reach": 1}, fetched_ago=2 * 86_400)
+    refresh_lock["claims"] = [(True, conn)]
+    refresh_lock["rows"].append(stale)
+
+    assert background_run["schedule"]() == "refreshed"
+    assert background_run["refreshes"] == [stale]
+    assert conn.closed
+    # A chave sai do conjunto em andamento: o próximo stale pode agendar de novo
+    assert "chave" not in cache._refreshing_keys
+
+
+@pytest.fixture
+def refresh_queue(monkeypatch):
+    """Fila de refresh sem as threads do executor (o teste roda o worker quando quiser)."""
+    monkeypatch.setattr(cache, "_refresh_workers_pid", os.getpid())
+    monkeypatch.setattr(cache, "REFRESH_QUEUE_MAX", 3)
+    with cache._refresh_cond:
+        cache._refresh_queue.clear()
+    yield
+    with cache._refresh_cond:
+        cache._refresh_queue.clear()
+    with cache._refresh_lock:
+        cache._refreshing_keys.clear()
+
+
+def _outcomes():
+    return dict(cache.get_cache_refresh_queue_stats()["outcomes"])
+
+
+def test_worker_runs_refreshes_by_priority(refresh_queue):
+    ran = []
+    pid = os.getpid()
+
+    def task(name, last=False):
+        def run():
+            ran.append(name)
+            if last:
+                # Encerra o worker depois da última tarefa
+                cache._refresh_workers_pid = None
+            return "refreshed"
+        return run
+
+    cache._submit_refresh("scheduler", "background", 1.0, task("scheduler", last=True))
+    cache._submit_refresh("interativa", "interactive", 100.0, task("interativa"))
+    cache._submit_refresh("popular", "background", 20.0, task("popular"))
+    worker = threading.Thread(target=cache._refresh_worker, args=(pid,), daemon=True)
+    worker.start()
+    worker.join(5)
+
+    assert not worker.is_alive()
+    assert ran == ["interativa", "popular", "scheduler"]
+    assert cache.get_cache_refresh_queue_stats()["running"] == 0
+
+
+def test_full_queue_evicts_the_weakest_task(refresh_queue):
+    before = _outcomes()
+    for key, priority in (("fraca", 1.0), ("media", 5.0), ("forte", 10.0)):
+        with cache._refresh_lock:
+            cache._refreshing_keys.add(key)
+        assert cache._submit_refresh(key, "background", priority, lambda: "refreshed")
+
+    assert cache._submit_refresh("nova", "interactive", 7.0, lambda: "refreshed")
+
+    assert sorted(entry[2] for entry in cache._refresh_queue) == ["forte", "media", "nova"]
+    # A chave deslocada pode ser agendada de novo no próximo acesso stale
+    assert "fraca" not in cache._refreshing_keys
+    assert _outcomes().get("evicted", 0) == before.get("evicted", 0) + 1
+
+
+def test_weaker_task_is_dropped_and_the_key_stays_stale(refresh_queue):
+    for key, priority in (("a", 50.0), ("b", 60.0), ("c", 70.0)):
+        cache._submit_refresh(key, "interactive", priority, lambda: "refreshed")
+    before = _outcomes()
+
+    assert not cache._submit_refresh("fraca", "background", 1.0, lambda: "refreshed")
+    with meta.graph_priority(meta.PRIORITY_BACKGROUND):
+        cache._schedule_background_refresh(
+            "tambem-fraca", None, "tabela", "instagram_metrics", OWNER_ID, None, None, None, None, None,
+            lambda *args: {},
+        )
+
+    assert sorted(entry[2] for entry in cache._refresh_queue) == ["a", "b", "c"]
+    assert _outcomes()["dropped"] == before.get("dropped", 0) + 2
+    assert "tambem-fraca" not in cache._refreshing_keys
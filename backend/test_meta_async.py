@@ -0,0 +1,121 @@
+"""
+Motor assíncrono (aiohttp): mesmo comportamento do cliente síncrono em erros e retries, e as
+janelas montadas por ele batem com as da interface síncrona.
+"""
+
+import asyncio
+
+import pytest
+
+import meta
+from conftest import reset_meta_state
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    sleeps = []
+    real_async_sleep = asyncio.sleep
+
+    async def async_sleep(delay, *args, **kwargs):
+        sleeps.append(delay)
+        return await real_async_sleep(0)
+
+    monkeypatch.setattr(meta.time, "sleep", sleeps.append)
+    monkeypatch.setattr(meta.asyncio, "sleep", async_sleep)
+    return sleeps
+
+
+def _outcome(call):
+    try:
+        return "ok", call()
+    except meta.MetaAPIError as err:
+        return "error", (err.status, err.code, err.error_type)
+
+
+SCENARIOS = {
+    "ok": [(200, {"id": "1", "name": "conta"})],
+    "graph_error": [(400, {"error": {"message": "(#100) Invalid metric", "type": "OAuthException", "code": 100}})],
+    "retry_then_ok": [(500, {"error": {"message": "boom", "code": 1}}), (200, {"data": [{"value": 3}]})],
+    "retries_exhausted": [(503, {"error": {"message": "indisponível", "code": 2}})],
+}
+
+
+@pytest.mark.parametrize("scenario", sorted(SCENARIOS))
+def test_async_client_matches_sync_on_errors_and_retries(graph, no_backoff, scenario):
+    outcomes = {}
+    for engine in ("sync", "async"):
+        reset_meta_state()
+        responses = list(SCENARIOS[scenario])
+        graph.handler = lambda method, path, query, body: (*(responses.pop(0) if len(responses) > 1 else responses[0]), {})
+        calls_before, sleeps_before = len(graph.calls), len(no_backoff)
+        if engine == "sync":
+            result = _outcome(lambda: meta.gget("/111/insights", {"metric": "reach"}))
+        else:
+            result = _outcome(lambda: meta.run_graph_sync(meta.agget("/111/insights", {"metric": "reach"})))
+        outcomes[engine] = (result, len(graph.calls) - calls_before, no_backoff[sleeps_before:])
+
+    assert outcomes["sync"] == outcomes["async"]
+
+
+def test_run_graph_sync_refuses_to_block_the_loop_thread(graph):
+    async def nested():
+        return meta.run_graph_sync(meta.agget("/111", {"fields": "id"}))
+
+    with pytest.raises(RuntimeError):
+        meta.run_graph_sync(nested())
+
+
+def _ig_handler(method, path, query, body):
+    if path.endswith("/media"):
+        items = []
+        for index in range(4):
+            item = {
+                "id": f"m{index}",
+                "like_count": index,
+                "comments_count": 1,
+                "timestamp": "2024-01-01T00:00:00+0000",
+                "media_type": "IMAGE" if index % 2 else "VIDEO",
+            }
+            if "insights" in query.get("fields", ""):
+                item["insights"] = {"data": [
+                    {"name": "saved", "values": [{"value": 2}]},
+                    {"name": "reach", "values": [{"value": 5 + index}]},
+                ]}
+            items.append(item)
+        return 200, {"data": items}, {}
+    if path.endswith("/insights"):
+        names = [name for name in query.get("metric", "").split(",") if name]
+        if "breakdown" in query:
+            return 200, {"data": [{"name": names[0], "total_value": {"breakdowns": [{"results": [
+                {"dimension_values": ["FOLLOWER"], "value": 4},
+                {"dimension_values": ["NON_FOLLOWER"], "value": 6},
+            ]}]}}]}, {}
+        return 200, {"data": [
+            {"name": name, "values": [
+                {"value": 3, "end_time": f"2024-01-0{day}T08:00:00+0000"} for day in (1, 2, 3)
+            ]}
+            for name in names
+        ]}, {}
+    return 200, {"data": []}, {}
+
+
+def test_ig_window_sync_and_async_build_the_same_window(graph):
+    graph.handler = _ig_handler
+
+    sync_window = meta.ig_window("ig", 0, 10)
+    sync_calls = sorted((path, tuple(sorted(query.items()))) for _, path, query in graph.calls)
+    meta.clear_graph_memo()
+    graph.calls.clear()
+
+    async def awaited():
+        return await meta.ig_window_async("ig", 0, 10)
+
+    async_window = meta.run_graph_sync(awaited())
+    async_calls = sorted((path, tuple(sorted(query.items()))) for _, path, query in graph.calls)
+
+    assert async_window == sync_window
+    assert async_calls == sync_calls
+    assert sync_window["likes"] == 6
+    assert sync_window["comments"] == 4
+    assert sync_window["reach"] == 9
+    assert [post["reach"] for post in sync_window["posts_detailed"]] == [5, 6, 7, 8]
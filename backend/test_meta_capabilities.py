@@ -0,0 +1,85 @@
+"""
+Memória de métricas não suportadas: o que conta como rejeição (#100) e a sincronização com o store.
+"""
+
+import threading
+
+import pytest
+
+import meta
+
+UNSUPPORTED = "(#100) The Media Insights API does not support the impressions metric for this media product type."
+RANGE_ERRORS = (
+    "(#100) follower_count metric only supports querying data for the last 30 days excluding the current day",
+    "(#100) There cannot be more than 30 days (2592000 s) between since and until",
+    "(#100) Param since must be a date after the account creation",
+)
+
+
+def _error(message, subcode=None):
+    error = {"message": message, "type": "OAuthException", "code": 100}
+    if subcode is not None:
+        error["error_subcode"] = subcode
+    return {"error": error}
+
+
+def test_unsupported_metric_is_remembered(graph):
+    graph.handler = lambda method, path, query, body: (400, _error(UNSUPPORTED), {})
+    scope = meta.metric_scope("ig_media", "1784:REELS")
+
+    with pytest.raises(meta.MetaAPIError):
+        meta.gget_metric(scope, "impressions", "/m1/insights", {"metric": "impressions"})
+    with pytest.raises(meta.MetaAPIError):
+        meta.gget_metric(scope, "impressions", "/m2/insights", {"metric": "impressions"})
+
+    assert not meta.is_metric_supported(scope, "impressions")
+    assert meta.is_metric_supported(meta.metric_scope("ig_media", "9999:REELS"), "impressions")
+    # A segunda chamada nem chega à Graph
+    assert len(graph.calls) == 1
+
+
+@pytest.mark.parametrize("message", RANGE_ERRORS)
+def test_range_errors_do_not_mark_the_metric(graph, message):
+    graph.handler = lambda method, path, query, body: (400, _error(message), {})
+    scope = meta.metric_scope("ig_user", "1784")
+
+    with pytest.raises(meta.MetaAPIError):
+        meta.run_graph_sync(meta.agget_metric(scope, "follower_count", "/1784/insights", {"metric": "follower_count"}))
+
+    assert meta.is_metric_supported(scope, "follower_count")
+
+
+def test_pre_conversion_media_does_not_mark_the_metric():
+    err = meta.MetaAPIError(400, UNSUPPORTED, code=100, raw=_error(UNSUPPORTED, subcode=2108006))
+    assert not meta._is_metric_rejection(err)
+    assert meta._is_metric_rejection(meta.MetaAPIError(400, UNSUPPORTED, code=100, raw=_error(UNSUPPORTED)))
+
+
+def test_capability_sync_runs_off_the_calling_thread(monkeypatch):
+    release = threading.Event()
+    loaded = threading.Event()
+    threads = []
+
+    def loader():
+        threads.append(threading.current_thread())
+        release.wait(5)
+        loaded.set()
+        return [("page:1", "page_fans", meta.time.time() + 60)]
+
+    monkeypatch.setattr(meta, "_capability_loader", loader)
+    monkeypatch.setattr(meta, "_capability_synced_at", 0.0)
+    try:
+        # Enquanto o store não responde, vale o retrato atual (sem bloquear quem chamou)
+        assert meta.is_metric_supported("page:1", "page_fans")
+        release.set()
+        assert loaded.wait(5)
+        for _ in range(50):
+            if not meta.is_metric_supported("page:1", "page_fans"):
+                break
+            meta.time.sleep(0.01)
+        assert not meta.is_metric_supported("page:1", "page_fans")
+        assert threads and threads[0] is not threading.current_thread()
+    finally:
+        release.set()
+        with meta._capability_lock:
+            meta._unsupported_metrics.clear()
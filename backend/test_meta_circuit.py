@@ -0,0 +1,94 @@
+"""
+Circuit breaker por família de endpoint: o que abre o circuito e o limite do registro.
+"""
+
+import json
+
+import pytest
+
+import meta
+
+
+@pytest.fixture(autouse=True)
+def _single_attempt(monkeypatch):
+    monkeypatch.setattr(meta, "MAX_RETRIES", 1)
+
+
+def _throttle(code, buc_owner=None):
+    headers = {}
+    if buc_owner is not None:
+        headers[meta.BUC_USAGE_HEADER] = json.dumps({
+            buc_owner: [{"type": "instagram", "call_count": 100, "estimated_time_to_regain_access": 0}],
+        })
+    return 429, {"error": {"message": "(#%d) Rate limited" % code, "type": "OAuthException", "code": code}}, headers
+
+
+def _insights_breaker():
+    return meta._circuits.get(("insights", meta._token_key(meta.TOKEN)))
+
+
+def test_buc_throttles_count_against_the_object_only(graph):
+    graph.handler = lambda method, path, query, body: _throttle(80002, buc_owner=path.split("/")[1])
+
+    for index in range(meta.CIRCUIT_FAILURE_THRESHOLD + 2):
+        with pytest.raises(meta.MetaAPIError):
+            meta.gget(f"/acct{index}/insights", {"metric": "reach"})
+
+    # Todas as chamadas chegaram à Graph; outras contas (de outros clientes) seguem chamando insights
+    assert len(graph.calls) == meta.CIRCUIT_FAILURE_THRESHOLD + 2
+    assert not _insights_breaker().is_open
+    assert meta._object_buckets["acct0"].snapshot()["blocked_for"] > 0
+
+
+def test_app_throttles_open_the_family_breaker(graph):
+    graph.handler = lambda method, path, query, body: _throttle(4)
+
+    for index in range(meta.CIRCUIT_FAILURE_THRESHOLD):
+        with pytest.raises(meta.MetaAPIError):
+            meta.gget(f"/acct{index}/insights", {"metric": "reach"})
+
+    assert _insights_breaker().is_open
+    with pytest.raises(meta.MetaAPIError) as err:
+        meta.gget("/other/insights", {"metric": "reach"})
+    assert err.value.error_type == "circuit_open"
+
+
+def test_circuit_registry_is_bounded(monkeypatch):
+    monkeypatch.setattr(meta, "REGISTRY_MAX_KEYS", 4)
+    with meta._circuit_lock:
+        meta._circuits.clear()
+    opened = meta._circuit_for("token-open", "/1/insights")
+    for _ in range(meta.CIRCUIT_FAILURE_THRESHOLD):
+        opened.record_failure("HTTP 500")
+    for index in range(20):
+        meta._circuit_for(f"token-{index}", "/1/insights")
+
+    assert len(meta._circuits) <= 4
+    # Circuito aberto não é descartado (senão o token voltaria a bater na Graph degradada)
+    assert meta._circuit_for("token-open", "/1/insights") is opened
+    with meta._circuit_lock:
+        meta._circuits.clear()
+
+
+def test_circuit_check_uses_the_token_the_pool_would_pick(graph, monkeypatch):
+    monkeypatch.setattr(meta, "_token_pool_loader", None)
+    key = meta.register_graph_token("user-token-pool", ["555"])
+    try:
+        with meta._token_pool_lock:
+            meta._token_pool_routes.clear()
+            # O System User já recebeu chamadas: o pool escolhe o token do usuário para a conta
+            meta._token_pool_routes[meta._token_key(meta.TOKEN)] = 5
+        breaker = meta._circuit_for("user-token-pool", "/555/insights")
+        for _ in range(meta.CIRCUIT_FAILURE_THRESHOLD):
+            breaker.record_failure("HTTP 500")
+
+        meta.check_graph_circuit(("insights",))
+        with pytest.raises(meta.MetaAPIError) as err:
+            meta.check_graph_circuit(("insights",), owner_id="555")
+        assert err.value.error_type == "circuit_open"
+        # A consulta não conta como chamada roteada ao token
+        assert meta._token_pool_routes.get(key, 0) == 0
+    finally:
+        meta.unregister_graph_token(key)
+        with meta._token_pool_lock:
+            meta._token_pool_routes.clear()
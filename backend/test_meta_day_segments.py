@@ -0,0 +1,214 @@
+"""
+Janelas de métricas montadas de segmentos diários: paridade com a busca da janela inteira e
+comportamento sem o store de segmentos.
+"""
+
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+import meta
+
+DAY = meta.DAY_SECONDS
+T0 = int(datetime(2024, 3, 1, tzinfo=timezone.utc).timestamp())
+SINCE = T0 + 14 * DAY
+UNTIL = T0 + 21 * DAY
+
+
+def _iso(ts):
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S+0000")
+
+
+def _day_values(since, until, base):
+    return [{"value": base + (ts - T0) // DAY, "end_time": _iso(ts + DAY)} for ts in range(since, until, DAY)]
+
+
+def _handler(method, path, query, body):
+    """Graph determinística: valores por dia e totais proporcionais ao número de dias pedidos."""
+    since = int(query.get("since", T0))
+    until = int(query.get("until", T0 + DAY))
+    days = (until - since) // DAY
+    metric = query.get("metric", "")
+    if path.endswith("/media") or path.endswith("/posts"):
+        items = [
+            {
+                "id": f"m{ts}", "timestamp": _iso(ts + 3600), "created_time": _iso(ts + 3600),
+                "like_count": 2, "comments_count": 1, "media_type": "IMAGE",
+                "reactions": {"summary": {"total_count": 2}}, "comments": {"summary": {"total_count": 1}},
+                "shares": {"count": 1},
+                "insights": {"data": [{"name": name, "values": [{"value": value}]}
+                                      for name, value in (("saved", 1), ("reach", 7), ("shares", 1))]},
+            }
+            for ts in range(since, until, DAY)
+        ]
+        return 200, {"data": items}, {}
+    if path == "/p":
+        if "access_token" in query.get("fields", ""):
+            return 200, {"id": "p", "access_token": "page-token"}, {}
+        return 200, {"id": "p", "fan_count": 99}, {}
+    if path.startswith("/m") and path.endswith("/insights"):
+        return 200, {"data": [{"name": "reach", "values": [{"value": 5}]}, {"name": "post_clicks", "values": [{"value": 2}]}]}, {}
+    if path.endswith("/insights"):
+        if "breakdown" in query:
+            results = [{"dimension_values": ["FOLLOWER"], "value": days}, {"dimension_values": ["NON_FOLLOWER"], "value": 2 * days}]
+            return 200, {"data": [{"name": metric, "total_value": {"breakdowns": [{"results": results}]}}]}, {}
+        if metric == "follows_and_unfollows":
+            return 200, {"data": [{"name": metric, "values": [{"value": {"follows": 3 * days, "unfollows": days}}]}]}, {}
+        if query.get("metric_type") == "total_value":
+            return 200, {"data": [{"name": name, "total_value": {"value": 10 * days}} for name in metric.split(",")]}, {}
+        return 200, {"data": [
+            {"name": name, "values": _day_values(since, until, 100 if name == "follower_count" else 4)}
+            for name in metric.split(",")
+        ]}, {}
+    return 200, {"data": []}, {}
+
+
+@pytest.fixture
+def segment_store(monkeypatch):
+    rows = {}
+
+    def load(resource, owner_id, first_day, last_day):
+        return {
+            day: (json.loads(json.dumps(segment)), fetched_at)
+            for (stored_resource, stored_owner, day), (segment, fetched_at) in rows.items()
+            if stored_resource == resource and stored_owner == owner_id and first_day <= day <= last_day
+        }
+
+    def save(resource, owner_id, segments):
+        for day, segment in segments.items():
+            rows[(resource, owner_id, day)] = (json.loads(json.dumps(segment)), meta.time.time())
+
+    monkeypatch.setattr(meta, "DAY_SEGMENTS_ENABLED", True)
+    monkeypatch.setattr(meta, "_day_segment_loader", load)
+    monkeypatch.setattr(meta, "_day_segment_saver", save)
+    return rows
+
+
+@pytest.fixture
+def no_segment_store(monkeypatch):
+    monkeypatch.setattr(meta, "_day_segment_loader", None)
+    monkeypatch.setattr(meta, "_day_segment_saver", None)
+
+
+def test_ig_segments_match_the_window_fetch(graph, segment_store):
+    graph.handler = _handler
+    window = meta.ig_window("ig", SINCE, UNTIL)
+    previous_window = meta.ig_window("ig", SINCE - 7 * DAY, SINCE)
+
+    current, previous = meta.ig_windows_from_segments("ig", SINCE, UNTIL)
+
+    assert current == window
+    assert previous["accounts_engaged"] == previous_window["accounts_engaged"]
+    for key in ("reach", "interactions", "likes", "follower_count_end", "follows"):
+        assert previous[key] == previous_window[key]
+    assert segment_store
+
+    # Um dia adiante: só o dia novo vai à Graph, e o resultado segue igual ao da janela inteira
+    meta.clear_graph_memo()
+    graph.calls.clear()
+    shifted, _ = meta.ig_windows_from_segments("ig", SINCE + DAY, UNTIL + DAY)
+    day_calls = [
+        query for _, path, query in graph.calls
+        if path == "/ig/insights" and query.get("metric") == meta.IG_DAY_TOTAL_METRICS
+    ]
+    assert {int(query["since"]) for query in day_calls} == {UNTIL}
+    meta.clear_graph_memo()
+    assert shifted == meta.ig_window("ig", SINCE + DAY, UNTIL + DAY)
+
+
+def test_fb_segments_match_the_window_fetch(graph, segment_store):
+    graph.handler = _handler
+
+    current, previous = meta.fb_page_windows_from_segments("p", SINCE, UNTIL)
+
+    assert current == meta.fb_page_window("p", SINCE, UNTIL)
+    assert previous == meta.fb_page_window("p", SINCE - 7 * DAY, SINCE)
+
+
+def test_windows_without_store_fall_back_to_the_window_fetch(graph, no_segment_store):
+    graph.handler = _handler
+    assert not meta.day_segments_enabled()
+
+    current, previous = meta.ig_windows_from_segments("ig", SINCE, UNTIL)
+    fb_current, _ = meta.fb_page_windows_from_segments("p", SINCE, UNTIL)
+
+    assert current == meta.ig_window("ig", SINCE, UNTIL)
+    assert previous == meta.ig_window("ig", SINCE - 7 * DAY, SINCE)
+    assert fb_current == meta.fb_page_window("p", SINCE, UNTIL)
+
+
+def test_day_segments_without_store_fetch_every_day(graph, no_segment_store):
+    graph.handler = _handler
+
+    segments = meta.day_segments("ig_window", "ig", SINCE, UNTIL, meta.ig_day_segments_async)
+
+    assert len(segments) == 7
+    assert sum(segment["likes"] for segment in segments) == 14
+
+
+def test_run_with_a_failed_sub_call_is_served_but_not_saved(graph, segment_store):
+    def failing_reach(method, path, query, body):
+        if path == "/ig/insights" and query.get("metric") == "reach" and "metric_type" not in query:
+            return 400, {"error": {"message": "Invalid parameter", "type": "OAuthException", "code": 100}}, {}
+        return _handler(method, path, query, body)
+
+    graph.handler = failing_reach
+    incomplete_before = meta._day_segment_stats["incomplete_runs"]
+
+    current, _ = meta.ig_windows_from_segments("ig", SINCE, UNTIL)
+
+    # Sem a série diária, o alcance de cada dia sai do total do dia (10 por dia no handler)
+    assert current["reach"] == 70
+    assert not segment_store
+    assert meta._day_segment_stats["incomplete_runs"] > incomplete_before
+
+    # Com a Graph de volta, a próxima montagem grava os dias
+    graph.handler = _handler
+    meta.clear_graph_memo()
+    current, _ = meta.ig_windows_from_segments("ig", SINCE, UNTIL)
+    assert current == meta.ig_window("ig", SINCE, UNTIL)
+    assert len(segment_store) == 14
+
+
+def test_store_served_days_are_not_reported_unchanged(segment_store):
+    async def fetch_days(owner_id, since, until):
+        # Leitura revalidada (304): sozinha deixaria o tracker como inalterado
+        meta._record_revalidation(True)
+        return {meta.segment_day(ts): {"likes": 1} for ts in range(since, until, DAY)}
+
+    meta.day_segments("ig_window", "ig", SINCE, UNTIL, fetch_days)
+
+    with meta.track_graph_revalidation() as tracker:
+        segments = meta.day_segments("ig_window", "ig", SINCE, UNTIL + DAY, fetch_days)
+
+    assert len(segments) == 8
+    assert not tracker.unchanged
+
+
+def _spans(calls, path, **match):
+    return [
+        (int(query["since"]), int(query["until"]))
+        for _, call_path, query in calls
+        if call_path == path and "since" in query and all(query.get(key) == value for key, value in match.items())
+    ]
+
+
+def test_long_windows_are_fetched_in_chunks_within_graph_limits(graph, segment_store):
+    graph.handler = _handler
+    until = T0 + 70 * DAY
+
+    ig_current, _ = meta.ig_windows_from_segments("ig", until - 35 * DAY, until)
+    fb_current, _ = meta.fb_page_windows_from_segments("p", T0 + 200 * DAY, T0 + 250 * DAY)
+
+    reach_spans = _spans(graph.calls, "/ig/insights", metric="reach")
+    media_spans = _spans(graph.calls, "/ig/media")
+    assert len(reach_spans) == 3
+    for spans in (reach_spans, media_spans):
+        assert spans and all(end - start <= meta.IG_SEGMENT_MAX_RUN_DAYS * DAY for start, end in spans)
+    assert min(start for start, _ in reach_spans) == until - 70 * DAY
+    assert max(end for _, end in reach_spans) == until
+
+    page_spans = _spans(graph.calls, "/p/insights")
+    assert page_spans and all(end - start <= meta.FB_PAGE_SEGMENT_MAX_RUN_DAYS * DAY for start, end in page_spans)
+    assert ig_current["reach"] and fb_current
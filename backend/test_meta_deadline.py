@@ -0,0 +1,91 @@
+"""
+Prazo das chamadas Graph (graph_deadline): timeouts encolhem ao que resta, retries que não cabem
+no prazo são pulados e a rota serve o último cache quando o prazo esgota.
+"""
+
+import time
+
+import pytest
+
+import cache
+import meta
+import server
+from conftest import FakeCacheDB
+
+
+@pytest.fixture
+def http_timeouts(monkeypatch):
+    timeouts = []
+    original = meta._http_request
+
+    def recording(method, url, timeout, **kwargs):
+        timeouts.append(timeout)
+        return original(method, url, timeout=timeout, **kwargs)
+
+    monkeypatch.setattr(meta, "_http_request", recording)
+    return timeouts
+
+
+def test_attempt_timeout_shrinks_to_the_remaining_budget(graph, http_timeouts):
+    meta.gget("/111", {"fields": "id"})
+    with meta.graph_deadline(5):
+        meta.gget("/222", {"fields": "id"})
+
+    assert http_timeouts[0] == meta.REQUEST_TIMEOUT
+    assert 4 < http_timeouts[1] <= 5
+
+
+def test_retry_is_skipped_when_the_backoff_does_not_fit_the_budget(graph, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(meta.time, "sleep", sleeps.append)
+    graph.handler = lambda method, path, query, body: (500, {"error": {"message": "boom", "code": 1}}, {})
+
+    with meta.graph_deadline(2.5):
+        with pytest.raises(meta.MetaAPIError) as err:
+            meta.gget("/111/insights", {"metric": "reach"})
+
+    # 1s de espera cabe (sobra 1s para a tentativa); 2s não caberia e o erro sobe na hora
+    assert err.value.status == 500
+    assert sleeps == [1]
+    assert len(graph.calls) == 2
+
+    with pytest.raises(meta.MetaAPIError):
+        meta.gget("/222/insights", {"metric": "reach"})
+    assert len(graph.calls) == 2 + meta.MAX_RETRIES
+
+
+def test_route_serves_the_last_cache_when_the_deadline_runs_out(graph, monkeypatch):
+    db = FakeCacheDB()
+    db.tables[cache.get_table_name("instagram")] = [{
+        "cache_key": "chave-anterior",
+        "resource": "instagram_posts",
+        "owner_id": "222",
+        "extra": {"limit": 3},
+        "payload": {"posts": [{"id": "salvo"}]},
+        "fetched_at": "2026-10-01T00:00:00+00:00",
+        "next_refresh_at": "2026-10-02T00:00:00+00:00",
+        "ttl_hours": 24,
+    }]
+    monkeypatch.setattr(cache, "_get_postgres_client", lambda: db)
+    monkeypatch.setattr(cache, "execute", lambda query, params=None: None)
+    monkeypatch.setattr(server, "REQUEST_GRAPH_BUDGET_SECONDS", 0.5)
+    monkeypatch.setattr(meta, "DEADLINE_MIN_ATTEMPT_SECONDS", 0.1)
+
+    def slow(method, path, query, body):
+        time.sleep(1)
+        return 200, {"data": []}, {}
+
+    graph.handler = slow
+    monkeypatch.setattr(server, "fetch_instagram_posts", lambda ig, since, until, extra: meta.gget(f"/{ig}/media"))
+
+    started = time.monotonic()
+    response = server.app.test_client().get("/api/instagram/posts", query_string={"igUserId": "222", "limit": 3})
+
+    assert time.monotonic() - started < 1
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["posts"] == [{"id": "salvo"}]
+    assert body["cache"]["fallback_reason"] == "deadline_exceeded"
+    assert body["cache"]["stale"] is True
+    # Nada do refresh abortado foi gravado
+    assert [op for op in db.ops if op[0] != "select"] == []
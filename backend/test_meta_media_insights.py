@@ -0,0 +1,92 @@
+"""
+Listagem de mídias com insights: field expansion, fallback por página e store de insights.
+"""
+
+from urllib.parse import urlencode
+
+import meta
+
+METRICS = "reach,likes"
+
+
+def _insights(value):
+    return {"data": [{"name": "reach", "values": [{"value": value}]}]}
+
+
+def _media_graph(graph, reject_expansion_on_page=2):
+    """Duas páginas de mídias; a expansão de insights é recusada na página indicada."""
+
+    def handler(method, path, query, body):
+        if path.endswith("/insights"):
+            return 200, _insights(7), {}
+        page = 2 if query.get("after") == "p2" else 1
+        expanded = "insights.metric" in query.get("fields", "")
+        if expanded and page == reject_expansion_on_page:
+            return 400, {"error": {"message": "(#10) Not enough viewers", "type": "OAuthException", "code": 10}}, {}
+        items = [{"id": f"m{page}{index}"} for index in range(2)]
+        if expanded:
+            for item in items:
+                item["insights"] = _insights(1)
+        payload = {"data": items}
+        if page == 1:
+            payload["paging"] = {"next": f"{graph.base}/1784/media?{urlencode({**query, 'after': 'p2'})}"}
+        return 200, payload, {}
+
+    graph.handler = handler
+
+
+def _collect(pages):
+    return [(item["id"], insight) for items, insights in pages for item, insight in zip(items, insights)]
+
+
+def test_expansion_failure_on_later_page_degrades_to_plain_listing(graph):
+    _media_graph(graph)
+
+    rows = _collect(meta.iter_media_with_insights("/1784/media", {"fields": "id"}, METRICS))
+
+    assert [media_id for media_id, _ in rows] == ["m10", "m11", "m20", "m21"]
+    # Página 1 veio expandida; a 2 foi refeita sem a expansão e completada por batch
+    assert [insight for _, insight in rows[:2]] == [_insights(1)] * 2
+    assert [insight for _, insight in rows[2:]] == [_insights(7)] * 2
+    retried = [query for method, path, query in graph.calls if method == "GET" and query.get("after") == "p2"]
+    assert [("insights.metric" in query["fields"]) for query in retried][-1] is False
+    assert {path for method, path, _ in graph.calls if method == "BATCH"} == {"/m20/insights", "/m21/insights"}
+
+
+def test_async_expansion_failure_on_later_page_degrades_to_plain_listing(graph):
+    _media_graph(graph)
+
+    async def collect():
+        return [
+            (item["id"], insight)
+            async for items, insights in meta.aiter_media_with_insights("/1784/media", {"fields": "id"}, METRICS)
+            for item, insight in zip(items, insights)
+        ]
+
+    rows = meta.run_graph_sync(collect())
+
+    assert [media_id for media_id, _ in rows] == ["m10", "m11", "m20", "m21"]
+    assert [insight for _, insight in rows[2:]] == [_insights(7)] * 2
+
+
+def test_without_insights_expansion_keeps_other_fields():
+    expanded = meta._with_insights_expansion({"fields": "id,caption", "limit": 50}, METRICS, "lifetime")
+    assert meta._without_insights_expansion(expanded) == {"fields": "id,caption", "limit": 50}
+
+
+def test_store_keeps_expansion_and_writes_through(graph, monkeypatch):
+    _media_graph(graph)
+    saved = []
+    monkeypatch.setattr(meta, "_media_insights_loader", lambda ids, metrics: {"m20": _insights(3)})
+    monkeypatch.setattr(meta, "_media_insights_saver", lambda account_id, entries, metrics: saved.extend(
+        (account_id, item["id"], payload) for item, payload in entries
+    ))
+
+    rows = _collect(meta.iter_media_with_insights("/1784/media", {"fields": "id"}, METRICS))
+
+    first = next(query for method, path, query in graph.calls if method == "GET")
+    assert "insights.metric" in first["fields"]
+    # m20 vem do store; só m21 precisa de chamada individual
+    assert dict(rows) == {"m10": _insights(1), "m11": _insights(1), "m20": _insights(3), "m21": _insights(7)}
+    assert {path for method, path, _ in graph.calls if method == "BATCH"} == {"/m21/insights"}
+    assert saved == [("1784", "m10", _insights(1)), ("1784", "m11", _insights(1)), ("1784", "m21", _insights(7))]
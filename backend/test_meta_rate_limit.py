@@ -0,0 +1,60 @@
+"""
+Limitador guiado pelos headers de uso da Meta: chave dos buckets de objeto e limite dos registros.
+"""
+
+import json
+
+import meta
+
+
+def _buc_header(owner_id, call_count):
+    return {
+        meta.BUC_USAGE_HEADER: json.dumps({
+            owner_id: [{"type": "instagram", "call_count": call_count, "estimated_time_to_regain_access": 0}],
+        })
+    }
+
+
+def test_media_calls_share_the_buc_owner_bucket(graph):
+    graph.handler = lambda method, path, query, body: (200, {"data": []}, _buc_header("1784", 90))
+
+    meta.gget("/m1/insights", {"metric": "reach"})
+
+    # A mídia m1 passa a usar o bucket do dono reportado, que já está desacelerado
+    assert meta._rate_object_key("/m1/insights") == "1784"
+    assert meta._object_buckets["1784"].usage_pct == 90
+    assert meta._rate_buckets(None, "/m1/comments")[1] is meta._object_buckets["1784"]
+
+
+def test_object_bucket_falls_back_to_usage_scope_owner():
+    meta._buc_owners.clear()
+    with meta.graph_usage_scope("act_55", "ads_highlights"):
+        assert meta._rate_object_key("/998877/insights") == "55"
+    assert meta._rate_object_key("/998877/insights") == "998877"
+
+
+def test_registries_are_bounded(monkeypatch):
+    monkeypatch.setattr(meta, "REGISTRY_MAX_KEYS", 8)
+    with meta._rate_lock:
+        meta._object_buckets.clear()
+    blocked = meta._bucket_for(meta._object_buckets, "blocked", 1.0)
+    blocked.apply_usage(100.0, 600.0)
+    for index in range(50):
+        meta._bucket_for(meta._object_buckets, f"obj{index}", 1.0)
+
+    assert len(meta._object_buckets) <= 8
+    # Bucket com espera pedida pela Meta não é descartado
+    assert meta._object_buckets.get("blocked") is blocked
+    with meta._rate_lock:
+        meta._object_buckets.clear()
+
+
+def test_buc_usage_does_not_slow_the_token(graph):
+    graph.handler = lambda method, path, query, body: (200, {"data": []}, _buc_header("1784", 100))
+
+    meta.gget("/1784/insights", {"metric": "reach"})
+
+    # Só a conta no limite espera; o token (compartilhado por todos os clientes) segue livre
+    assert meta._object_buckets["1784"].snapshot()["blocked_for"] > 0
+    token_bucket = meta._token_buckets.get(meta._token_key(meta.TOKEN))
+    assert token_bucket is None or token_bucket.snapshot()["blocked_for"] == 0
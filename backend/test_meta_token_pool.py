@@ -0,0 +1,91 @@
+"""
+Pool de tokens: rotação entre tokens que leem a mesma conta, permissão negada e paginação.
+"""
+
+import threading
+from urllib.parse import urlencode
+
+import pytest
+
+import meta
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(meta, "_token_pool_loader", None)
+    with meta._token_pool_lock:
+        meta._token_pool_denied.clear()
+        meta._token_pool_routes.clear()
+    keys = [meta.register_graph_token(f"user-token-{index}", ["555"]) for index in range(2)]
+    yield keys
+    for key in keys:
+        meta.unregister_graph_token(key)
+    with meta._token_pool_lock:
+        meta._token_pool_denied.clear()
+
+
+def test_permission_error_takes_token_out_of_the_account_rotation(graph, pool):
+    denied = "user-token-0"
+    graph.handler = lambda method, path, query, body: (
+        (403, {"error": {"message": "(#200) Requires pages_read_engagement", "code": 200}}, {})
+        if query.get("access_token") == denied
+        else (200, {"data": []}, {})
+    )
+
+    with pytest.raises(meta.MetaAPIError):
+        meta.gget("/555/insights", {"metric": "page_fans"}, token=denied)
+
+    chosen = {meta.select_graph_token("555") for _ in range(20)}
+    assert denied not in chosen
+    assert "user-token-1" in chosen
+    # O token segue no pool para as outras contas
+    assert meta._token_key(denied) in meta._token_pool
+
+
+def test_pagination_keeps_the_same_token(graph, pool):
+    def handler(method, path, query, body):
+        page = int(query.get("after") or 1)
+        payload = {"data": [{"id": f"p{page}"}]}
+        if page < 4:
+            next_query = {key: value for key, value in query.items() if key != "after"}
+            payload["paging"] = {"next": f"{graph.base}{path}?{urlencode({**next_query, 'after': page + 1})}"}
+        return 200, payload, {}
+
+    graph.handler = handler
+
+    items = list(meta.paginate("/555/posts", {"fields": "id"}))
+
+    assert [item["id"] for item in items] == ["p1", "p2", "p3", "p4"]
+    assert len({query["access_token"] for _, _, query in graph.calls}) == 1
+
+
+def test_async_pagination_keeps_the_same_token(graph, pool):
+    def handler(method, path, query, body):
+        page = int(query.get("after") or 1)
+        payload = {"data": [{"id": f"p{page}"}]}
+        if page < 4:
+            payload["paging"] = {"next": f"{graph.base}{path}?{urlencode({'fields': 'id', 'after': page + 1})}"}
+        return 200, payload, {}
+
+    graph.handler = handler
+
+    async def collect():
+        return [page async for page in meta.aiter_pages("/555/posts", {"fields": "id"}, prefetch=True)]
+
+    assert len(meta.run_graph_sync(collect())) == 4
+    assert len({query["access_token"] for _, _, query in graph.calls}) == 1
+
+
+def test_async_auth_error_updates_the_store_off_the_loop(graph, pool, monkeypatch):
+    threads = []
+    monkeypatch.setattr(meta, "_token_pool_invalidator", lambda key: threads.append(threading.current_thread()))
+    graph.handler = lambda method, path, query, body: (
+        401, {"error": {"message": "Error validating access token", "type": "OAuthException", "code": 190}}, {}
+    )
+
+    with pytest.raises(meta.MetaAPIError):
+        meta.run_graph_sync(meta.agget("/555/insights", {"metric": "reach"}, token="user-token-0"))
+
+    assert len(threads) == 1
+    assert threads[0] is not meta._async_thread
+    assert meta._token_key("user-token-0") not in meta._token_pool
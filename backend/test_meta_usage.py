@@ -0,0 +1,71 @@
+"""
+Contabilidade de chamadas Graph por conta: flush dos deltas pendentes para o store compartilhado.
+"""
+
+import pytest
+
+import meta
+
+
+@pytest.fixture
+def usage_store(monkeypatch):
+    store = {"rows": [], "totals": {}}
+
+    def saver(rows):
+        store["rows"].extend(rows)
+        for row in rows:
+            store["totals"][row["owner_id"]] = store["totals"].get(row["owner_id"], 0) + row["calls"]
+        if store.get("during_save"):
+            store.pop("during_save")()
+
+    monkeypatch.setattr(meta, "_usage_saver", saver)
+    monkeypatch.setattr(meta, "_usage_loader", lambda day: dict(store["totals"]))
+    monkeypatch.setattr(meta, "_usage_baseline_day", None)
+    with meta._usage_lock:
+        meta._usage_pending.clear()
+        meta._usage_baseline.clear()
+    yield store
+    with meta._usage_lock:
+        meta._usage_pending.clear()
+        meta._usage_baseline.clear()
+
+
+def _record(owner_id, calls=1):
+    with meta.graph_usage_scope(owner_id, "test"):
+        for _ in range(calls):
+            meta._record_graph_usage(1, 10, 0.01, False)
+
+
+def test_usage_recorded_during_flush_is_kept(usage_store, monkeypatch):
+    monkeypatch.setattr(meta, "_maybe_flush_usage", lambda: None)
+    _record("act_1", 3)
+    seen = []
+
+    def during_save():
+        # Chamadas feitas enquanto o flush grava: nada some da conta do orçamento
+        seen.append(meta.account_calls_today("act_1"))
+        _record("act_1", 2)
+
+    usage_store["during_save"] = during_save
+    meta.flush_graph_usage(force=True)
+
+    assert seen == [3]
+    assert meta.account_calls_today("act_1") == 5
+    assert sum(row["calls"] for row in usage_store["rows"]) == 3
+
+    meta.flush_graph_usage(force=True)
+    assert sum(row["calls"] for row in usage_store["rows"]) == 5
+    assert meta.account_calls_today("act_1") == 5
+
+
+def test_failed_flush_keeps_pending(usage_store, monkeypatch):
+    monkeypatch.setattr(meta, "_maybe_flush_usage", lambda: None)
+    _record("act_2", 4)
+
+    def failing_saver(rows):
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(meta, "_usage_saver", failing_saver)
+    meta.flush_graph_usage(force=True)
+
+    assert meta.account_calls_today("act_2") == 4
@@ -0,0 +1,84 @@
+"""
+Ciclo de refresh do scheduler: contas sem orçamento diário não travam a fila de entradas vencidas.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import cache
+import meta
+import scheduler
+from conftest import FakeCacheDB
+
+
+def _due_row(cache_key, owner_id, hours_ago):
+    due = (datetime.now(timezone.utc) - timedelta(hours=hours_ago)).isoformat()
+    return {
+        "cache_key": cache_key,
+        "resource": "instagram_metrics",
+        "owner_id": owner_id,
+        "since_ts": None,
+        "until_ts": None,
+        "extra": None,
+        "payload": {"reach": 1},
+        "fetched_at": due,
+        "next_refresh_at": due,
+        "ttl_hours": 24,
+    }
+
+
+@pytest.fixture
+def cache_db(monkeypatch):
+    db = FakeCacheDB()
+    monkeypatch.setattr(cache, "_get_postgres_client", lambda: db)
+    monkeypatch.setattr(cache, "PLATFORM_TABLES", {"instagram": cache.get_table_name("instagram")})
+    monkeypatch.setattr(scheduler, "flush_graph_usage", lambda force=False: None)
+    return db
+
+
+def test_over_budget_entries_are_pushed_to_the_next_budget_day(cache_db, monkeypatch):
+    table = cache.get_table_name("instagram")
+    cache_db.tables[table] = [_due_row("busy", "conta-sem-orcamento", 5), _due_row("ok", "outra-conta", 1)]
+    refreshed = []
+    monkeypatch.setattr(scheduler, "account_over_budget", lambda owner_id: owner_id == "conta-sem-orcamento")
+    monkeypatch.setattr(scheduler, "get_cached_payload", lambda resource, owner_id, *args, **kwargs: refreshed.append(owner_id))
+
+    scheduler.MetaSyncScheduler()._run_cache_cycle()
+
+    assert refreshed == ["outra-conta"]
+    rows = {row["cache_key"]: row for row in cache_db.tables[table]}
+    postponed = datetime.fromisoformat(rows["busy"]["next_refresh_at"])
+    assert postponed == scheduler._next_budget_day()
+    # A entrada adiada sai da fila de vencidos
+    assert [row["cache_key"] for row in cache.list_due_entries(limit=25)] == ["ok"]
+
+
+def test_budget_hit_inside_the_fetch_does_not_persist_a_partial_payload(graph, cache_db, monkeypatch):
+    table = cache.get_table_name("instagram")
+    cache_db.tables[table] = [_due_row("partial", "conta", 1)]
+    calls = {"count": 0}
+
+    def budget_status(owner_id):
+        # A primeira leitura passa; a métrica opcional seguinte estoura o orçamento
+        calls["count"] += 1
+        return {"owner_id": owner_id, "used": calls["count"], "limit": 1, "exceeded": calls["count"] > 1}
+
+    monkeypatch.setattr(meta, "account_budget_status", budget_status)
+
+    def fetcher(owner_id, since_ts, until_ts, extra):
+        payload = {"node": meta.gget(f"/{owner_id}", {"fields": "id"})}
+        try:
+            payload["optional"] = meta.gget(f"/{owner_id}/insights", {"metric": "reach"})
+        except meta.MetaAPIError:
+            payload["optional"] = None
+        return payload
+
+    with meta.graph_usage_scope("conta", "instagram_metrics", enforce_budget=True):
+        with pytest.raises(meta.MetaAPIError) as err:
+            cache.get_cached_payload("instagram_metrics", "conta", fetcher=fetcher, force=True)
+
+    assert err.value.error_type == "account_budget_exceeded"
+    assert scheduler._is_budget_error(err.value)
+    assert [op for op in cache_db.ops if op[0] != "select"] == []
+    assert len(graph.calls) == 1
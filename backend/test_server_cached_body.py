@@ -0,0 +1,62 @@
+"""
+Resposta das rotas a partir do corpo já serializado do cache: gzip emendado, ETag fraco e 304.
+"""
+
+import gzip
+import json
+
+import pytest
+
+import cache
+import server
+
+ROUTE = "/api/instagram/posts?igUserId=222"
+META = {"source": "cache", "stale": False, "fetched_at": "2026-10-17T10:00:00+00:00"}
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    def serve(payload, meta=META):
+        monkeypatch.setattr(server, "get_cached_body", lambda *args, **kwargs: (cache._serialize_body(payload), dict(meta)))
+    return serve
+
+
+def test_gzip_response_is_a_valid_stream_with_the_cache_block(serve):
+    payload = {"posts": [{"id": str(index), "caption": "legenda " * 10} for index in range(30)]}
+    serve(payload)
+
+    response = server.app.test_client().get(ROUTE, headers={"Accept-Encoding": "gzip"})
+
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    body = json.loads(gzip.decompress(response.get_data()))
+    assert body == {**payload, "cache": META}
+
+
+def test_if_none_match_returns_304_until_the_entry_changes(serve):
+    serve({"posts": []})
+    client = server.app.test_client()
+
+    first = client.get(ROUTE)
+    etag = first.headers["ETag"]
+    assert etag.startswith('W/"')
+
+    again = client.get(ROUTE, headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.get_data() == b""
+
+    # Revalidação que só renovou o fetched_at também troca o ETag
+    serve({"posts": []}, {**META, "fetched_at": "2026-10-17T11:00:00+00:00"})
+    renewed = client.get(ROUTE, headers={"If-None-Match": etag})
+    assert renewed.status_code == 200
+    assert renewed.headers["ETag"] != etag
+
+
+def test_non_object_payload_is_wrapped(serve):
+    serve([{"id": "1"}])
+
+    response = server.app.test_client().get(ROUTE)
+
+    assert response.status_code == 200
+    assert response.get_json() == {"payload": [{"id": "1"}], "cache": META}
@@ -0,0 +1,61 @@
+"""
+Rotas servidas pelo cache: com a Graph indisponível, devolvem o último payload salvo.
+"""
+
+import pytest
+
+import meta
+import server
+
+
+@pytest.fixture
+def client():
+    return server.app.test_client()
+
+
+@pytest.fixture
+def cache_calls(monkeypatch):
+    calls = {"marked": [], "fallback": []}
+
+    def latest(resource, owner_id, extra=None, platform="instagram"):
+        calls["fallback"].append((resource, owner_id, extra))
+        return {"posts": [{"id": "stale"}]}, {"stale": True, "source": "cache-fallback", "fallback": True}
+
+    monkeypatch.setattr(server, "mark_cache_error", lambda *args, **kwargs: calls["marked"].append(args[0]))
+    monkeypatch.setattr(server, "get_latest_cached_payload", latest)
+    return calls
+
+
+def _failing(error_type):
+    def get_cached_body(*args, **kwargs):
+        raise meta.MetaAPIError(status=503, message="Graph indisponível", error_type=error_type)
+    return get_cached_body
+
+
+@pytest.mark.parametrize("route, params, resource", [
+    ("/api/facebook/posts", {"pageId": "111", "limit": 3}, "facebook_posts"),
+    ("/api/instagram/posts", {"igUserId": "222", "limit": 3}, "instagram_posts"),
+])
+def test_posts_routes_serve_the_last_cache_when_the_circuit_is_open(client, cache_calls, monkeypatch,
+                                                                     route, params, resource):
+    monkeypatch.setattr(server, "get_cached_body", _failing("circuit_open"))
+
+    response = client.get(route, query_string=params)
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["posts"] == [{"id": "stale"}]
+    assert body["cache"]["fallback_reason"] == "circuit_open"
+    assert cache_calls["fallback"] == [(resource, params.get("pageId") or params.get("igUserId"), {"limit": 3})]
+    # Falha decidida localmente não marca a entrada como erro da Graph
+    assert cache_calls["marked"] == []
+
+
+def test_graph_errors_still_mark_the_cache_entry(client, cache_calls, monkeypatch):
+    monkeypatch.setattr(server, "get_cached_body", _failing(None))
+
+    response = client.get("/api/instagram/posts", query_string={"igUserId": "222"})
+
+    assert response.status_code == 200
+    assert response.get_json()["cache"]["fallback_reason"] == "meta_api_error"
+    assert cache_calls["marked"] == ["instagram_posts"]